@@ -20,6 +20,7 @@ __all__ = [
 ]
 
 # ── smartpos_daemon/config.py
+import os
 from dataclasses import dataclass
 
 @dataclass
@@ -28,6 +29,35 @@ class DaemonConfig:
     port: int = 7077  # Возвращаем порт 7077
     default_printer_name: str | None = None  # if None → system default
     request_timeout_sec: float = 8.0
+    job_workers: int = 2          # сколько плейбуков параллельно в async-режиме
+    job_queue_max: int = 16       # сколько заданий может ждать воркера (дальше → 503)
+    job_keep_sec: float = 600.0   # сколько хранить результат задания для /action/jobs/{id}
+    http_workers: int = 4         # воркеры основной полосы HTTP (action/faults/config)
+    http_queue_max: int = 16      # очередь основной полосы (дальше → 503 + Retry-After)
+    http_fast_workers: int = 2    # воркеры быстрой полосы (/health, /status/*)
+    http_fast_queue_max: int = 64
+    http_stream_workers: int = 4  # одновременные подписчики /events/stream и /events/poll
+    events_keepalive_sec: float = 15.0
+    spooler_backend: str = "pywin32"  # "sim" — in-memory симулятор спулера (Linux, CI, нагрузочные тесты)
+    print_small_bytes: int = 2048       # /print/raw: чек не больше этого можно склеить с соседями в один джоб
+    print_batch_max_count: int = 16     # сколько чеков максимум в одном джобе спулера
+    print_batch_max_bytes: int = 16384
+    print_linger_sec: float = 0.005     # сколько ждать продолжения пачки, если очередь опустела
+    print_queue_max: int = 256          # сколько чеков может ждать печати на одном принтере (дальше → 503)
+    idempotency_ttl_sec: float = 900.0  # повтор того же ticket_id + запроса получает сохранённый результат
+    idempotency_db: str | None = None   # путь к SQLite: результаты переживают рестарт (None — только в памяти)
+    fleet_workers: int = 8              # /action/run/batch: сколько принтеров обслуживается одновременно
+    fleet_max_devices: int = 32         # больше принтеров в одном запросе → 400
+    outcomes_db: str | None = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "outcomes.db")
+    outcomes_batch: int = 32            # журнал исходов: сколько запусков писать одной транзакцией
+    intent_kb: str | None = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "kb_core", "phrases_pr.json")
+    intent_cache_size: int = 1024       # /intent/classify: LRU по нормализованному запросу
+    intent_batch_max: int = 256         # больше фраз в одном запросе → 400
+    # Векторный режим классификатора (опечатки). None — как у клиентов: intent_vector_threshold /
+    # intent_vector_weight из client_config (его же читает smartpos_demo), иначе умолчания классификатора
+    intent_vector_threshold: float | None = None
+    intent_vector_weight: float | None = None
+    client_config: str | None = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config_smartpos.json")
 
 CONFIG = DaemonConfig()
 
@@ -56,7 +86,7 @@ logger = setup_logging()
 
 # ── Контроль роутера
 from smartpos_daemon import router
-logger.info("PLAYBOOK PR0018: %s", [fn.__name__ for fn in router.PLAYBOOKS["PR0018"]])
+logger.info("PLAYBOOK PR0018: %s", router.PLAYBOOKS.describe("PR0018"))
 
 # ── smartpos_daemon/config.py
 from dataclasses import dataclass
@@ -88,20 +118,22 @@ def cfg_update(**kw) -> dict:
 
 # ── smartpos_daemon/actions/printer.py
 import socket
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Tuple
 import time
 import os
 import glob
 
-try:
-    import win32print
-    import win32serviceutil
-    import win32service
-except Exception:  # pragma: no cover (non‑Windows)
-    win32print = None
-    win32serviceutil = None
-    win32service = None
+from smartpos_daemon.handles import get_pool as get_handle_pool
+from smartpos_daemon.singleflight import PrinterLanes
+from smartpos_daemon.spooler_jobs import get_table as get_job_table
+from smartpos_daemon.status_cache import get_cache as get_status_cache
+from smartpos_daemon.waits import DEADLINE_KEY, Deadline, WaitResult, clamp, deadline_of, wait_until
+
+# pywin32 или in-memory симулятор спулера (CONFIG.spooler_backend = "sim", см. serve_forever)
+from smartpos_daemon.winapi import backend_name as winapi_backend
+from smartpos_daemon.winapi import use_simulator, win32print, win32service, win32serviceutil
 
 # logger определен выше в этом же файле
 
@@ -113,56 +145,192 @@ class StepResult:
     evidence: Dict[str, Any] | None = None
     result: Optional[str] = None  # e.g., FIXED/NOT_FOUND/HARDWARE_FAULT
     terminal: bool = False
+    duration_s: Optional[float] = None        # время шага (заполняет run_playbook)
+    timing: Dict[str, float] | None = None    # разбивка: wait_s / win32_s / win32_calls / other_s
 
 
 # -------- Spooler controls --------
 
+# Эскалация удаления джоба: каждая следующая попытка — только если джоб ещё в очереди
+_DELETE_LADDER = (
+    ("JOB_CONTROL_DELETE",),
+    ("JOB_CONTROL_RESTART", "JOB_CONTROL_DELETE"),
+    ("JOB_CONTROL_PAUSE", "JOB_CONTROL_DELETE"),
+)
+
+
+def _deadline_at(req: Optional[dict]) -> Optional[float]:
+    dl = deadline_of(req)
+    return dl.at if dl else None
+
+
+def _delete_jobs_until_gone(h, printer_name: str, job_ids, timeout_per_try: float = 0.5,
+                            deadline: Optional[float] = None) -> Tuple[WaitResult, list]:
+    """SetJob(DELETE) сразу для всех джобов и ждать их исчезновения; оставшиеся — следующая
+    ступень лестницы. Проверка — одно перечисление на все джобы через таблицу джобов (она же
+    обновляется для /spooler/jobs). deadline — абсолютный дедлайн запроса (time.monotonic()).
+    Возвращает (ожидание, джобы, которые так и не ушли)."""
+    table = get_job_table()
+    remaining = set(job_ids)
+    waited = 0.0
+    polls = 0
+
+    def _gone() -> bool:
+        remaining.intersection_update(j["job_id"] for j in table.refresh(printer_name))
+        return not remaining
+
+    for controls in _DELETE_LADDER:
+        if not remaining or (deadline is not None and time.monotonic() >= deadline):
+            break
+        for job_id in sorted(remaining):
+            try:
+                for ctl in controls:
+                    win32print.SetJob(h, job_id, 0, None, getattr(win32print, ctl))
+            except Exception as e:  # noqa: BLE001 (джоб мог уже исчезнуть)
+                logger.debug("SetJob %s failed for job %d: %s", controls, job_id, e)
+        w = wait_until(_gone, timeout_per_try, deadline=deadline)
+        waited += w.waited
+        polls += w.polls
+    return WaitResult(not remaining, round(waited, 3), polls), sorted(remaining)
+
+
+def _wait_spooler_state(state: int, timeout: float, deadline: Optional[float] = None) -> WaitResult:
+    return wait_until(lambda: win32serviceutil.QueryServiceStatus("Spooler")[1] == state, timeout, deadline=deadline)
+
+
+def _wait_printer_ready(printer_name: str, timeout: float, deadline: Optional[float] = None) -> WaitResult:
+    """После старта спулера: ждём, пока принтер снова открывается (мониторы портов поднялись)."""
+    def _ready() -> bool:
+        with get_handle_pool().lease(printer_name):  # свежий хэндл останется в пуле для следующего шага
+            return True
+    return wait_until(_ready, timeout, deadline=deadline)
+
+
 def clear_spooler(req: dict) -> StepResult:
     """Delete all jobs from (default or given) printer queue with force."""
     if not win32print:
         return StepResult("print_queue_clear_skipped", {"reason": "win32print missing"})
     printer_name = _resolve_printer_name(req)
     try:
-        h = win32print.OpenPrinter(printer_name)
-        try:
-            jobs = win32print.EnumJobs(h, 0, 999, 1)
-            deleted = 0
-            for job in jobs:
-                try:
-                    # Первая попытка - обычное удаление
-                    win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                    deleted += 1
-                    time.sleep(0.05)  # Небольшая задержка
-                    
-                    # Вторая попытка - принудительное удаление для зависших джобов
-                    try:
-                        win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                    except Exception:
-                        # Третья попытка - сброс и удаление
-                        try:
-                            win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_RESTART)
-                            time.sleep(0.1)
-                            win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                        except Exception:
-                            pass
-                except Exception as e:  # noqa: BLE001
-                    logger.warning("SetJob delete failed for job %d: %s", job["JobId"], e)
-            return StepResult("print_queue_clear", {"deleted": deleted})
-        finally:
-            win32print.ClosePrinter(h)
+        jobs = get_job_table().job_ids(printer_name)  # из таблицы наблюдателя, без своего EnumJobs
+        with get_handle_pool().lease(printer_name) as h:
+            w, stuck = _delete_jobs_until_gone(h, printer_name, jobs, deadline=_deadline_at(req))
+        for job_id in stuck:
+            logger.warning("clear_spooler: job %d still in queue", job_id)
+        return StepResult("print_queue_clear", {"deleted": len(jobs) - len(stuck), "still_queued": stuck, "wait_s": w.waited})
     except Exception as e:  # noqa: BLE001
         logger.error("clear_spooler error: %s", e)
         return StepResult("print_queue_clear_error", {"error": str(e)})
 
 
+class _SpoolerGate:
+    """
+    Служба спулера одна на машину. Пока её останавливают/перезапускают, шаги
+    плейбуков других принтеров ждут у ворот (step), а рестарт ждёт, пока уже
+    идущие шаги закончатся (restart; новые шаги после него не пускаются).
+    restart(deadline) ждёт ворота не дольше дедлайна запроса и проверяет его ещё раз
+    уже у открытых ворот: рестарт после исчерпанного бюджета не начинается (GateTimeout).
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._active = 0
+        self._restarting = False
+
+    @contextmanager
+    def step(self) -> Iterator[None]:
+        with self._cond:
+            while self._restarting:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def restart(self, deadline: Optional[float] = None) -> Iterator[None]:
+        """deadline — time.monotonic() предела запроса (None — ждать сколько нужно)."""
+        def _left() -> Optional[float]:
+            return None if deadline is None else deadline - time.monotonic()
+
+        with self._cond:
+            while self._restarting:
+                if not self._wait_left(_left()):
+                    raise GateTimeout("spooler gate: budget spent waiting for another restart")
+            self._restarting = True
+            while self._active:
+                if not self._wait_left(_left()):
+                    self._restarting = False
+                    self._cond.notify_all()
+                    raise GateTimeout("spooler gate: budget spent waiting for running steps")
+            if deadline is not None and time.monotonic() >= deadline:
+                self._restarting = False  # ворота наши, но бюджета на рестарт уже нет
+                self._cond.notify_all()
+                raise GateTimeout("spooler gate: budget spent before restart")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._restarting = False
+                self._cond.notify_all()
+
+
+    def _wait_left(self, left: Optional[float]) -> bool:
+        """Одно ожидание условия; False — время вышло."""
+        if left is None:
+            self._cond.wait()
+            return True
+        if left <= 0:
+            return False
+        self._cond.wait(left)
+        return True
+
+
+class GateTimeout(TimeoutError):
+    """Рестарт спулера не начат: бюджет запроса кончился у ворот."""
+
+
+def _gate_timeout(action: str, e: GateTimeout) -> StepResult:
+    return StepResult(action + "_timeout", {"timeout": {action: {"reason": "budget", "skipped": True,
+                                                                 "stage": "gate", "detail": str(e)}}},
+                      result="TIMEOUT")
+
+
+_SPOOLER_GATE = _SpoolerGate()
+# Действия, которые сами останавливают службу: идут через _SPOOLER_GATE.restart(), а не step()
+_SPOOLER_WIDE_ACTIONS = ("restart_spooler", "force_purge_spooler")
+# Плейбуки разных принтеров (fleet), пришедшие к рестарту одновременно, получают
+# один общий рестарт, а не перезапускают службу друг у друга
+_SPOOLER_RESTARTS = PrinterLanes()
+
+
+def _restart_spooler_service(req: dict) -> WaitResult:
+    with _SPOOLER_GATE.restart(_deadline_at(req)):
+        win32serviceutil.RestartService("Spooler", waitSeconds=max(1, int(clamp(req, 30))))
+        get_handle_pool().invalidate()  # старые хэндлы умерли вместе со спулером
+        running = _wait_spooler_state(win32service.SERVICE_RUNNING, 10.0, deadline=_deadline_at(req))
+        get_status_cache().invalidate()  # хэндлы наблюдателей умерли вместе со спулером
+        get_job_table().invalidate()
+    return running
+
+
 def restart_spooler(req: dict) -> StepResult:
     if not win32serviceutil:
         return StepResult("spooler_restart_skipped", {"reason": "win32serviceutil missing"})
     try:
-        win32serviceutil.RestartService("Spooler")
-        # Give it a short time to settle (demo‑tuned)
-        time.sleep(1.0)
-        return StepResult("spooler_restart")
+        # Ждём RUNNING и готовность принтера вместо фиксированной паузы (в пределах бюджета запроса)
+        running, shared = _SPOOLER_RESTARTS.run("Spooler", "restart", lambda emit: _restart_spooler_service(req))
+        ready = _wait_printer_ready(_resolve_printer_name(req), 3.0, deadline=_deadline_at(req))
+        ev = {"running": running.ok, "printer_ready": ready.ok, "wait_s": round(running.waited + ready.waited, 3)}
+        if shared:
+            ev["restart_shared"] = True
+        return StepResult("spooler_restart", ev)
+    except GateTimeout as e:
+        logger.warning("restart_spooler skipped: %s", e)
+        return _gate_timeout("restart_spooler", e)
     except Exception as e:  # noqa: BLE001
         logger.error("restart_spooler error: %s", e)
         return StepResult("spooler_restart_error", {"error": str(e)})
@@ -172,46 +340,20 @@ def force_clear_stuck_jobs(req: dict) -> StepResult:
     """Принудительная очистка зависших джобов в состоянии 'Удаление'."""
     try:
         printer_name = _resolve_printer_name(req)
-        h = win32print.OpenPrinter(printer_name)
-        try:
-            jobs = win32print.EnumJobs(h, 0, 999, 1)
-            force_deleted = 0
-            
-            for job in jobs:
-                job_id = job["JobId"]
-                try:
-                    # Множественные попытки удаления с разными методами
-                    for attempt in range(5):  # 5 попыток
-                        try:
-                            # Попытка 1-2: Обычное удаление
-                            win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_DELETE)
-                            time.sleep(0.1)
-                            
-                            # Попытка 3: Сброс и удаление
-                            win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_RESTART)
-                            time.sleep(0.1)
-                            win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_DELETE)
-                            time.sleep(0.1)
-                            
-                            # Попытка 4: Приостановка и удаление
-                            win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_PAUSE)
-                            time.sleep(0.1)
-                            win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_DELETE)
-                            time.sleep(0.1)
-                            
-                            # Попытка 5: Последняя попытка
-                            win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_DELETE)
-                            
-                            force_deleted += 1
-                            break
-                        except Exception:
-                            continue
-                except Exception as e:
-                    logger.debug("faults: force delete failed for job %d: %s", job_id, e)
-            
-            return StepResult("force_clear_stuck", {"force_deleted": force_deleted})
-        finally:
-            win32print.ClosePrinter(h)
+        jobs = get_job_table().job_ids(printer_name)
+        remaining = list(jobs)
+        waited = 0.0
+        at = _deadline_at(req)
+        with get_handle_pool().lease(printer_name) as h:
+            # До 5 проходов лестницы удаления, короткое ожидание на каждой ступени
+            for attempt in range(5):
+                if not remaining:
+                    break
+                w, remaining = _delete_jobs_until_gone(h, printer_name, remaining, timeout_per_try=0.2, deadline=at)
+                waited += w.waited
+        for job_id in remaining:
+            logger.debug("faults: force delete failed for job %d", job_id)
+        return StepResult("force_clear_stuck", {"force_deleted": len(jobs) - len(remaining), "wait_s": round(waited, 3)})
     except Exception as e:
         logger.error("force_clear_stuck_jobs error: %s", e)
         return StepResult("force_clear_stuck_error", {"error": str(e)})
@@ -220,45 +362,30 @@ def force_clear_stuck_jobs(req: dict) -> StepResult:
 def cancel_demo_sticky(req: dict) -> StepResult:
     """Сигнал инжектору: отпустить дескрипторы залипающих джобов (EndPage/EndDoc)."""
     try:
-        # Используем конфигурацию для задержки перед отменой
-        delay = cfg_get().cancel_delay_sec
+        # Используем конфигурацию для задержки перед отменой (витринная пауза — намеренно фиксированная)
+        delay = clamp(req, cfg_get().cancel_delay_sec)
         if delay > 0:
             time.sleep(delay)
         
-        res = cancel_sticky_jobs(timeout_sec=5.0)  # Увеличиваем таймаут до 5 секунд
+        res = cancel_sticky_jobs(timeout_sec=clamp(req, 5.0))  # Увеличиваем таймаут до 5 секунд
         alive_count = res.get("still_alive", 0)
+        waited = 0.0
         
         # Если потоки все еще живы, принудительно очищаем очередь
         if alive_count > 0:
             logger.warning("faults: %d threads still alive, forcing queue clear", alive_count)
             try:
                 printer_name = _resolve_printer_name(req)
-                h = win32print.OpenPrinter(printer_name)
-                try:
-                    # Принудительно удаляем все джобы с несколькими попытками
-                    for job in win32print.EnumJobs(h, 0, 999, 1):
-                        try:
-                            # Первая попытка - обычное удаление
-                            win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                            time.sleep(0.1)  # Небольшая задержка
-                            
-                            # Вторая попытка - принудительное удаление
-                            win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                        except Exception as e:
-                            logger.debug("faults: failed to delete job %d: %s", job["JobId"], e)
-                            # Третья попытка - сброс джоба
-                            try:
-                                win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_RESTART)
-                                time.sleep(0.1)
-                                win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                            except Exception:
-                                pass
-                finally:
-                    win32print.ClosePrinter(h)
+                jobs = get_job_table().job_ids(printer_name)
+                with get_handle_pool().lease(printer_name) as h:
+                    w, stuck = _delete_jobs_until_gone(h, printer_name, jobs, timeout_per_try=0.3, deadline=_deadline_at(req))
+                waited += w.waited
+                for job_id in stuck:
+                    logger.debug("faults: failed to delete job %d", job_id)
             except Exception as e:
                 logger.error("faults: forced queue clear failed: %s", e)
         
-        return StepResult("sticky_cancel", {"alive_after_cancel": alive_count})
+        return StepResult("sticky_cancel", {"alive_after_cancel": alive_count, "wait_s": round(waited, 3)})
     except Exception as e:  # noqa: BLE001
         logger.error("cancel_demo_sticky error: %s", e)
         return StepResult("sticky_cancel_error", {"error": str(e)})
@@ -273,18 +400,11 @@ def usb_presence_check(req: dict) -> StepResult:
     if not win32print:
         return StepResult("usb_presence_skip", {"reason": "win32print missing"})
     target = _resolve_printer_name(req)
-    try:
-        h = win32print.OpenPrinter(target)
-        try:
-            info = win32print.GetPrinter(h, 2)
-            status = info["Status"]
-            detected = True
-        finally:
-            win32print.ClosePrinter(h)
-        return StepResult("usb_presence_ok", {"detected": detected, "status": int(status)})
-    except Exception as e:  # noqa: BLE001
-        logger.warning("usb_presence_check: %s", e)
-        return StepResult("usb_presence_fail", {"detected": False, "error": str(e)})
+    entry = get_status_cache().get(target)
+    if entry["detected"]:
+        return StepResult("usb_presence_ok", {"detected": True, "status": int(entry["status"]), "status_age_s": entry["age_s"]})
+    logger.warning("usb_presence_check: %s", entry["error"])
+    return StepResult("usb_presence_fail", {"detected": False, "error": entry["error"]})
 
 
 def tcp9100_probe(req: dict) -> StepResult:
@@ -293,7 +413,7 @@ def tcp9100_probe(req: dict) -> StepResult:
     if not ip:
         return StepResult("tcp9100_skip", {"reason": "no ip"})
     sock = socket.socket()
-    sock.settimeout(1.0)
+    sock.settimeout(max(0.05, clamp(req, 1.0)))
     try:
         sock.connect((ip, 9100))
         ok = True
@@ -305,7 +425,10 @@ def tcp9100_probe(req: dict) -> StepResult:
 
 
 # -------- ESC/POS and layout helpers --------
-DEFAULT_CODEPAGE = "cp866"
+# LayoutProfile / PROFILE_58 / PROFILE_80 и компиляция макетов — smartpos_daemon/layout.py
+from smartpos_daemon.layout import DEFAULT_CODEPAGE, PROFILE_58, PROFILE_80, LayoutProfile, Template, render
+# Профиль у каждого принтера свой (заданный / определённый / по умолчанию) — smartpos_daemon/profiles.py
+from smartpos_daemon.profiles import get_registry as get_profile_registry, profile_for_width
 
 
 def escpos_probe(req: dict) -> StepResult:
@@ -317,65 +440,58 @@ def escpos_probe(req: dict) -> StepResult:
     payload = b"\x1b@"  # Initialize
     try:
         printer_name = _resolve_printer_name(req)
-        h = win32print.OpenPrinter(printer_name)
-        try:
+        with get_handle_pool().lease(printer_name) as h:
             job_id = win32print.StartDocPrinter(h, 1, ("SMARTPOS_PROBE", None, "RAW"))
             win32print.StartPagePrinter(h)
             win32print.WritePrinter(h, payload)
             win32print.EndPagePrinter(h)
             win32print.EndDocPrinter(h)
             return StepResult("escpos_probe", {"job_id": job_id})
-        finally:
-            win32print.ClosePrinter(h)
     except Exception as e:  # noqa: BLE001
         logger.warning("escpos_probe failed: %s", e)
         return StepResult("escpos_probe_error", {"error": str(e)})
 
 
-# Layout profiles for 58/80mm demo
-class LayoutProfile:
-    def __init__(self, paper_mm: int, chars_per_line: int, codepage: str = DEFAULT_CODEPAGE):
-        self.paper_mm = paper_mm
-        self.chars_per_line = chars_per_line
-        self.codepage = codepage
+# Поля профиля ({paper_mm}, {rule}, {ruler}, {chars}) вшиваются при компиляции, {title} — при печати
+LAYOUT_TEST = Template("layout_test", [
+    "{title} ({paper_mm}mm)",
+    "{rule}",
+    "{ruler}",
+    "Ширина: {chars} символов",
+], feed=2)
 
 
-PROFILE_58 = LayoutProfile(58, 32)
-PROFILE_80 = LayoutProfile(80, 48)
-_current_profile = PROFILE_80
-
-
-def ensure_width_profile(req: dict) -> StepResult:
-    """Ensure width profile matches physical (80mm). Used to *fix* scenario 4."""
-    global _current_profile
-    _current_profile = PROFILE_80
-    return StepResult("width_profile_set", {"paper_mm": 80, "chars": 48})
+def ensure_width_profile(req: dict, paper_mm: Optional[int] = None) -> StepResult:
+    """Ensure width profile matches physical paper of *this* printer. Used to *fix* scenario 4.
+    Ширина: paper_mm из шага → автоопределение → профиль по умолчанию (80 мм).
+    """
+    name = _resolve_printer_name(req)
+    registry = get_profile_registry()
+    if paper_mm:
+        profile, via = profile_for_width(paper_mm), "args"
+    else:
+        profile, via = registry.detect(name), "detected"
+        if profile is None:
+            profile, via = registry.default, "default"
+    registry.set(name, profile, source="playbook", evidence={"via": via})
+    return StepResult("width_profile_set", {"printer": name, "paper_mm": profile.paper_mm,
+                                            "chars": profile.chars_per_line, "via": via})
 
 
 def test_print_layout(req: dict, title: str = "SMARTPOS LAYOUT TEST") -> StepResult:
     if not win32print:
         return StepResult("test_print_skip", {"reason": "win32print missing"})
-    profile = _current_profile
-    line = "1234567890" * (profile.chars_per_line // 10)
-    lines = [
-        f"{title} ({profile.paper_mm}mm)",
-        "-" * profile.chars_per_line,
-        line[: profile.chars_per_line],
-        f"Ширина: {profile.chars_per_line} символов",
-    ]
-    data = ("\n".join(lines) + "\n\n\n").encode(profile.codepage, errors="ignore")
+    printer_name = _resolve_printer_name(req)
+    profile = get_profile_registry().get(printer_name)
+    data = render(LAYOUT_TEST, profile, title=title)
     try:
-        printer_name = _resolve_printer_name(req)
-        h = win32print.OpenPrinter(printer_name)
-        try:
+        with get_handle_pool().lease(printer_name) as h:
             job_id = win32print.StartDocPrinter(h, 1, ("SMARTPOS_LAYOUT", None, "RAW"))
             win32print.StartPagePrinter(h)
-            win32print.WritePrinter(h, b"\x1b@" + data)
+            win32print.WritePrinter(h, data)
             win32print.EndPagePrinter(h)
             win32print.EndDocPrinter(h)
             return StepResult("test_print_layout", {"job_id": job_id, "chars": profile.chars_per_line})
-        finally:
-            win32print.ClosePrinter(h)
     except Exception as e:  # noqa: BLE001
         return StepResult("test_print_error", {"error": str(e)})
 
@@ -399,7 +515,16 @@ def force_purge_spooler(req: dict) -> StepResult:
     """
     if not (win32serviceutil and win32service):
         return StepResult("force_purge_skip", {"reason": "win32service unavailable"})
-    
+    try:
+        with _SPOOLER_GATE.restart(_deadline_at(req)):  # шаги других принтеров ждут, пока служба снова поднимется
+            return _force_purge_spooler(req)
+    except GateTimeout as e:
+        logger.warning("force_purge_spooler skipped: %s", e)
+        return _gate_timeout("force_purge_spooler", e)
+
+
+def _force_purge_spooler(req: dict) -> StepResult:
+
     # Папка очереди
     spool_dir = os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "System32", "spool", "PRINTERS")
     
@@ -410,13 +535,10 @@ def force_purge_spooler(req: dict) -> StepResult:
             win32serviceutil.StopService("Spooler")
         except Exception:
             pass
+        get_handle_pool().invalidate()
         # дождаться STOPPED
-        t_stop0 = time.time()
-        while time.time() - t_stop0 < 6.0:
-            st = win32serviceutil.QueryServiceStatus("Spooler")[1]
-            if st == win32service.SERVICE_STOPPED:
-                break
-            time.sleep(0.1)
+        at = _deadline_at(req)
+        stopped = _wait_spooler_state(win32service.SERVICE_STOPPED, 6.0, deadline=at)
         stopped_in = time.time() - t0
     except Exception as e:
         return StepResult("force_purge_error", {"stage": "stop", "error": str(e)}, terminal=True, result="ERROR")
@@ -439,20 +561,19 @@ def force_purge_spooler(req: dict) -> StepResult:
     t1 = time.time()
     try:
         win32serviceutil.StartService("Spooler")
-        t_start0 = time.time()
-        while time.time() - t_start0 < 6.0:
-            st = win32serviceutil.QueryServiceStatus("Spooler")[1]
-            if st == win32service.SERVICE_RUNNING:
-                break
-            time.sleep(0.1)
-        # небольшая пауза для «пробуждения» мониторов
-        time.sleep(0.4)
+        running = _wait_spooler_state(win32service.SERVICE_RUNNING, 6.0, deadline=at)
+        # вместо паузы на «пробуждение» мониторов — ждём, пока принтер снова открывается
+        ready = _wait_printer_ready(_resolve_printer_name(req), 2.0, deadline=at)
+        get_status_cache().invalidate()
+        get_job_table().invalidate()
     except Exception as e:
         return StepResult("force_purge_error", {"stage": "start", "error": str(e)}, terminal=True, result="ERROR")
     
     return StepResult(
         "force_purge_spooler",
-        {"spool_dir": spool_dir, "purged": purged, "stop_s": round(stopped_in, 3), "start_s": round(time.time()-t1, 3)}
+        {"spool_dir": spool_dir, "purged": purged, "stop_s": round(stopped_in, 3), "start_s": round(time.time()-t1, 3),
+         "stopped": stopped.ok, "running": running.ok, "printer_ready": ready.ok,
+         "wait_s": round(stopped.waited + running.waited + ready.waited, 3)}
     )
 
 
@@ -460,16 +581,15 @@ def force_purge_spooler(req: dict) -> StepResult:
 """Fault‑Injector helpers for demo stand."""
 import threading
 import time
-import pywintypes
 try:
     import winerror
     _ERR_INVALID_HANDLE = winerror.ERROR_INVALID_HANDLE
 except Exception:
     _ERR_INVALID_HANDLE = 6  # fallback
-try:
-    import win32print
-except Exception:  # pragma: no cover
-    win32print = None
+
+from smartpos_daemon.events import BUS, publish
+# Оверрайд статуса (paper_out/door_open с TTL) живёт в пакете: его же читает printer_status
+from smartpos_daemon.faults import status_override_clear, status_override_get, status_override_set
 
 # logger определен выше в этом же файле
 # PROFILE_58 и PROFILE_80 определены ниже в этом же файле
@@ -510,7 +630,11 @@ def make_sticky_job(printer_name: str | None = None, payload: bytes | None = Non
                     break
                 if time.time() >= deadline:
                     break
-                time.sleep(0.1)
+                # просыпаемся сразу по сигналу отмены, а не по таймеру
+                if cancel_evt is not None:
+                    cancel_evt.wait(min(0.5, max(0.0, deadline - time.time())))
+                else:
+                    time.sleep(0.1)
                 
         except Exception as e:
             logger.warning("sticky worker error: %s", e)
@@ -528,11 +652,14 @@ def make_sticky_job(printer_name: str | None = None, payload: bytes | None = Non
                     win32print.ClosePrinter(h)
                 except Exception:
                     pass
+            me = threading.current_thread()
+            publish("sticky", {"active": sum(1 for t in _STICKY_THREADS if t.is_alive() and t is not me), "ended": printer_name})
 
     t = threading.Thread(target=_sticky_worker, args=(name, _STICKY_CANCEL), daemon=True)
     t.start()
     _STICKY_THREADS.append(t)
     logger.info("faults: sticky job started on %s", name)
+    publish("sticky", sticky_status())
     return {"ok": True, "printer": name}
 
 
@@ -557,6 +684,7 @@ def cancel_sticky_jobs(timeout_sec: float = 2.0) -> dict:
     # _STICKY_CANCEL.clear()  # УБРАНО!
     ok = alive == 0
     logger.info("faults: sticky cancel %s (alive=%d)", "OK" if ok else "PARTIAL", alive)
+    publish("sticky", sticky_status())
     return {"ok": ok, "still_alive": alive}
 
 
@@ -571,63 +699,82 @@ def reset_sticky_state() -> dict:
     global _STICKY_CANCEL, _STICKY_THREADS
     _STICKY_CANCEL.clear()  # Сбрасываем событие отмены
     _STICKY_THREADS.clear()  # Очищаем список потоков
+    publish("sticky", sticky_status())
     return {"ok": True, "message": "Sticky state reset"}
 
 
-def set_wrong_width_profile() -> dict:
-    """Switch demo layout to 58mm and APPLY it to actions.printer profile too."""
+def set_wrong_width_profile(printer_name: str | None = None) -> dict:
+    """Switch demo printer to 58mm profile in the registry (only this printer is affected)."""
     global _current_profile_for_demo
     _current_profile_for_demo = PROFILE_58
-    try:
-        # Apply to runtime printing module - все функции в одном файле
-        global _current_profile
-        _current_profile = PROFILE_58  # noqa: SLF001 (intentional for demo)
-    except Exception:
-        pass
-    return {"ok": True, "paper_mm": 58}
+    name = printer_name or _resolve_printer_name({})
+    get_profile_registry().set(name, PROFILE_58, source="fault")
+    return {"ok": True, "paper_mm": 58, "printer": name}
 
 
-def set_correct_width_profile() -> dict:
-    """Switch demo layout to 80mm and APPLY it to actions.printer profile too."""
+def set_correct_width_profile(printer_name: str | None = None) -> dict:
+    """Switch demo printer back to 80mm profile in the registry.
+    Pinned as "manual": never expires and detection does not override it;
+    POST /profiles/set {"reset": true} hands the printer back to auto-detection."""
     global _current_profile_for_demo
     _current_profile_for_demo = PROFILE_80
-    try:
-        # Apply to runtime printing module - все функции в одном файле
-        global _current_profile
-        _current_profile = PROFILE_80  # noqa: SLF001
-    except Exception:
-        pass
-    return {"ok": True, "paper_mm": 80}
+    name = printer_name or _resolve_printer_name({})
+    get_profile_registry().set(name, PROFILE_80, source="manual")
+    return {"ok": True, "paper_mm": 80, "printer": name}
 
 
 # ── smartpos_daemon/router.py
 """Playbook router: maps problem_code → sequence of actions."""
-from typing import Any, Dict, List
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+from smartpos_daemon.actions.printer import soft_purge_printer
+from smartpos_daemon.idempotency import AttachTimeout, IdempotencyGuard, SqliteResultStore
+from smartpos_daemon.metrics import get_metrics, step_timing
+from smartpos_daemon.outcomes import OutcomeStore, get_outcomes, set_outcomes
+from smartpos_daemon.actions.printer_status import read_printer_status
+from smartpos_daemon.playbooks import PlaybookStore, Step, execute
+from smartpos_daemon.singleflight import PrinterLanes, request_key
 # logger определен выше в этом же файле
 
-PLAYBOOKS: dict[str, list] = {
-    # PR0022: printer disappeared (USB/power)
-    "PR0022": [usb_presence_check, clear_spooler, escpos_probe, test_print_layout],
-    # PR0018: queue stuck / spooler jam (мягкая очистка по умолчанию)
-    "PR0018": [cancel_demo_sticky, clear_spooler, restart_spooler, test_print_layout],
-    # PR0001/PR0015: no paper / cover open → human steps then probe
-    "PR0001": [escpos_probe, test_print_layout],
-    "PR0015": [escpos_probe, test_print_layout],
-    # PR0006/PR0017: wrong width / driver profile
-    "PR0006": [ensure_width_profile, test_print_layout],
-    "PR0017": [ensure_width_profile, test_print_layout],
+# Действия, на которые могут ссылаться шаги config/playbooks.json
+ACTIONS: Dict[str, Callable[..., StepResult]] = {
+    fn.__name__: fn
+    for fn in (
+        usb_presence_check, tcp9100_probe, read_printer_status,
+        clear_spooler, restart_spooler, force_clear_stuck_jobs, cancel_demo_sticky,
+        soft_purge_printer, force_purge_spooler,
+        escpos_probe, test_print_layout, ensure_width_profile,
+    )
 }
 
+# Те же плейбуки, что и у smartpos_daemon.router; перечитываются при изменении файла
+PLAYBOOKS = PlaybookStore(ACTIONS)
+
 
-def run_playbook(req: Dict[str, Any]) -> Dict[str, Any]:
+def _with_deadline(req: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия запроса с дедлайном: budget_sec плейбука или request_timeout_sec демона."""
+    if deadline_of(req) is not None:
+        return req
+    return {**req, DEADLINE_KEY: Deadline(PLAYBOOKS.budget_for(req, CONFIG.request_timeout_sec))}
+
+
+def _timeout_result(step: Step, info: Dict[str, Any]) -> StepResult:
+    """Шаг не уложился в свой timeout_sec или в бюджет запроса."""
+    return StepResult(name=step.action + "_timeout", evidence={"timeout": {step.id: info}}, result="TIMEOUT")
+
+
+def run_playbook(req: Dict[str, Any], on_step: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Выполнить плейбук. on_step (если задан) получает события plan/start/done по шагам.
+    Все ожидания шагов ограничены дедлайном запроса (req["_deadline"])."""
+    req = _with_deadline(req)
+    deadline = deadline_of(req)
     code = req.get("problem_code", "")
-    steps = PLAYBOOKS.get(code, [])
-    
-    # Витринный флаг: добить «хвосты» в статусе «Удаление», если нужно красиво
-    if code == "PR0018" and req.get("context", {}).get("beautify") is True:
-        # Вставляем force_purge перед тест-печатью
-        steps = [cancel_demo_sticky, clear_spooler, restart_spooler, force_purge_spooler, test_print_layout]
-    
+    # Вариант PR0018 (context.purge / витринный context.beautify) выбирает PlaybookStore
+    steps = PLAYBOOKS.steps_for(req)
+    # метка метрик — только известные коды: произвольный problem_code из запроса не плодит серии
+    label = code if code in PLAYBOOKS.codes() else "other"
+
     result: Dict[str, Any] = {
         "ticket_id": req.get("ticket_id"),
         "problem_code": code,
@@ -635,17 +782,48 @@ def run_playbook(req: Dict[str, Any]) -> Dict[str, Any]:
         "evidence": {},
         "result_code": None,
     }
-    for fn in steps:
-        try:
-            out: StepResult = fn(req) if fn is not test_print_layout else fn(req, title=f"DEMO {code}")
-        except Exception as e:  # noqa: BLE001
-            out = StepResult(name=fn.__name__ + "_error", evidence={"error": str(e)})
+    def _notify(ev: Dict[str, Any]) -> None:
+        if ev.get("event") == "done":
+            publish("playbook_step", {"ticket_id": req.get("ticket_id"), "problem_code": code, **ev})
+        if on_step:
+            on_step(ev)
+
+    def _run_step(step: Step) -> StepResult:
+        gate = nullcontext() if step.action in _SPOOLER_WIDE_ACTIONS else _SPOOLER_GATE.step()
+        with step_timing() as clock, gate:
+            try:
+                out = ACTIONS[step.action](req, **step.kwargs(req))
+            except Exception as e:  # noqa: BLE001
+                out = StepResult(name=step.action + "_error", evidence={"error": str(e)})
+        out.duration_s = round(clock.duration_s, 4)
+        out.timing = clock.breakdown()
+        labels = {"playbook": label, "step": step.action}
+        metrics = get_metrics()
+        metrics.observe("smartpos_step_duration_seconds", clock.duration_s, labels)
+        metrics.inc("smartpos_step_wait_seconds_total", labels, clock.wait_s)
+        metrics.inc("smartpos_step_win32_seconds_total", labels, clock.win32_s)
+        return out
+
+    _notify({"event": "plan", "steps": [s.action for s in steps]})
+    timeouts: Dict[str, Any] = {}
+    result["timings"] = []
+    for step, out in execute(steps, _run_step, _notify, deadline=deadline, on_timeout=_timeout_result):
         result["actions_done"].append(out.name)
+        result["timings"].append({"id": step.id, "step": step.action, "duration_s": out.duration_s,
+                                  **(out.timing or {})})
+        if out.result == "TIMEOUT":
+            timeouts.update(out.evidence["timeout"])
+            continue
         if out.evidence:
             result["evidence"].update(out.evidence)
-        if out.terminal and out.result:
+        if out.terminal and out.result and result["result_code"] is None:
             result["result_code"] = out.result
-            break
+    result["elapsed_s"] = round(deadline.elapsed(), 3)
+    result["budget_s"] = deadline.budget
+    if timeouts:
+        # не уложились в бюджет — честный TIMEOUT вместо «FIXED» по неполным данным
+        result["evidence"]["timeout"] = timeouts
+        result["result_code"] = "TIMEOUT"
     # heuristics: set result_code based on evidence
     if result["result_code"] is None:
         if result["evidence"].get("detected") is False:
@@ -654,13 +832,64 @@ def run_playbook(req: Dict[str, Any]) -> Dict[str, Any]:
             result["result_code"] = "FIXED"
     # humanized summaries (cashier/tech)
     result["human"] = _make_human(result)
+    metrics = get_metrics()
+    metrics.observe("smartpos_playbook_duration_seconds", deadline.elapsed(), {"playbook": label})
+    metrics.inc("smartpos_playbook_results_total", {"playbook": label, "result_code": result["result_code"]})
+    outcomes = get_outcomes()
+    if outcomes is not None:
+        outcomes.record(result, _resolve_printer_name(req))
     return result
 
 
+PRINTER_LANES = PrinterLanes()
+IDEMPOTENCY = IdempotencyGuard(ttl=CONFIG.idempotency_ttl_sec)
+
+
+def run_playbook_serialized(req: Dict[str, Any], on_step: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """run_playbook через очередь принтера: один принтер — один плейбук за раз,
+    одинаковые запросы в полёте получают общий результат (coalesced=True).
+    Повтор того же ticket_id с тем же запросом не выполняется заново: отдаётся
+    сохранённый результат (replayed=True) или результат идущего запуска (attached=True).
+    Присоединившийся повтор ждёт не дольше бюджета плейбука, дальше — TIMEOUT."""
+    budget = PLAYBOOKS.budget_for(req, CONFIG.request_timeout_sec)
+    try:
+        return IDEMPOTENCY.run(req, lambda emit: _run_in_lane(req, emit), on_event=on_step, wait_timeout=budget)
+    except AttachTimeout:
+        res: Dict[str, Any] = {
+            "ticket_id": req.get("ticket_id"),
+            "problem_code": req.get("problem_code", ""),
+            "actions_done": [],
+            "evidence": {"timeout": {"attached": {"budget_s": budget}}},
+            "result_code": "TIMEOUT",
+            "elapsed_s": budget,
+            "budget_s": budget,
+            "attached": True,
+        }
+        res["human"] = _make_human(res)
+        return res
+
+
+def _run_in_lane(req: Dict[str, Any], on_step: Optional[Callable[[Dict[str, Any]], None]]) -> Dict[str, Any]:
+    printer = _resolve_printer_name(req)
+    req = _with_deadline(req)  # бюджет включает ожидание в очереди принтера
+    res, shared = PRINTER_LANES.run(
+        printer, request_key(req), lambda emit: run_playbook(req, on_step=emit), on_event=on_step,
+    )
+    if shared:
+        res = dict(res)
+        res["shared_from"] = res.get("ticket_id")
+        res["ticket_id"] = req.get("ticket_id")
+        res["coalesced"] = True
+    return res
+
+
 def _make_human(res: Dict[str, Any]) -> Dict[str, str]:
     code = res.get("problem_code")
     ev = res.get("evidence", {})
-    if code == "PR0022":
+    if res.get("result_code") == "TIMEOUT":
+        cashier = "Проверка не уложилась во время. Повторите попытку или позовите техника."
+        tech = f"timeout after {res.get('elapsed_s')}s (budget {res.get('budget_s')}s): {sorted(ev.get('timeout', {}))}"
+    elif code == "PR0022":
         if ev.get("detected") is False:
             cashier = "Принтер не найден. Проверьте USB/питание и нажмите ‘Проверить снова’."
         else:
@@ -673,7 +902,7 @@ def _make_human(res: Dict[str, Any]) -> Dict[str, str]:
         cashier = "Если лента вставлена и крышка закрыта — печать должна пойти. Я сделал тест."
         tech = "escpos probe + test layout"
     elif code in ("PR0006", "PR0017"):
-        cashier = "Вернул ширину 80 мм и кодировку. Распечатал шаблон макета."
+        cashier = f"Вернул ширину {ev.get('paper_mm', 80)} мм и кодировку. Распечатал шаблон макета."
         tech = f"width_profile_set chars={ev.get('chars')}"
     else:
         cashier = "Выполнил проверку и печать теста."
@@ -684,34 +913,377 @@ def _make_human(res: Dict[str, Any]) -> Dict[str, str]:
 # ── smartpos_daemon/server.py
 """Minimal HTTP JSON server for local GUI/LLM ↔ Action Daemon.
 Endpoints:
-  POST /action/run        → run playbook (expects JSON)
+  POST /action/run        → run playbook (expects JSON); a repeat of the same ticket_id + request within
+                            idempotency_ttl_sec returns the stored result (replayed) or joins the running one (attached)
+  POST /action/run?async=1 → queue playbook, returns job_id at once (202)
+  POST /action/run/batch  → same playbook on many printers at once: {"devices": ["A", {"name": "B"}], ...}
+                            → per-printer results + summary; ?stream=1 → NDJSON line per printer as it finishes
+  GET  /action/jobs/{id}  → async job state with per-step progress
+  GET  /events/stream     → Server-Sent Events (printer_status, status_override, sticky, playbook_step, spooler_job);
+                            resume with Last-Event-ID or ?cursor=N
+  GET  /events/poll       → long-poll variant: ?cursor=N&timeout=25 → {"cursor", "events", "reset"}
+  GET  /spooler/jobs      → job table of the watched queue (?printer=NAME): age, status, bytes, stuck
+  GET  /spooler/jobs/delta → job table changes: ?cursor=N&timeout=25 → {"cursor", "deltas", "reset"}
+  POST /print/raw         → print ESC/POS receipts: {"printer", "receipts": [{"id", "data_b64", "logo_b64"}], "batch", "timeout"}
+                            (logo_b64 — PGM/PPM/PBM or any Pillow format, printed centered as GS v 0 raster)
+                            → per-receipt acks in order; small consecutive receipts share one spooler job
+  GET  /print/raw/{id}    → ack of a recently queued receipt
+  GET  /profiles          → per-printer layout profiles (width, chars, codepage, source, age)
+  POST /profiles/set      → {"printer", "paper_mm", "chars_per_line", "codepage", "substitutions"} or
+                            {"printer", "detect": true} (re-detect now) or {"printer", "reset": true}
   POST /faults/create     → create demo fault (sticky_queue | wrong_width)
+  GET  /outcomes/mttr     → time-to-repair per problem_code from the outcome journal (?hours=168&problem_code=&printer=)
+  GET  /outcomes/steps    → per-step success rate, avg/max duration, wait and Win32 share (same filters)
+  GET  /outcomes/printers → per-printer failure frequency by result_code (?hours=&problem_code=)
+  GET  /metrics           → Prometheus text: playbook/step latency (p50/p95/p99), result codes, Win32 calls
   GET  /health            → basic health check
 
-No external web frameworks (BaseHTTPRequestHandler + ThreadingHTTPServer).
+No external web frameworks (BaseHTTPRequestHandler + PooledHTTPServer):
+fixed worker pools with bounded queues, 503 + Retry-After when saturated.
 """
+import base64
+import binascii
 import json
+import sqlite3
+import sys
 from http.server import BaseHTTPRequestHandler
-from socketserver import ThreadingTCPServer
 from typing import Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from smartpos_daemon.http_pool import PooledHTTPServer
+from smartpos_daemon.fleet import FleetRunner
+from smartpos_daemon.intents import IntentService, get_intents, set_intents
+from smartpos_daemon.jobs import JobManager, JobQueueFull
+from smartpos_daemon.print_queue import PrintQueue, PrintQueueFull
+from smartpos_daemon.raster import raster_image
 
 # CONFIG определен выше в этом же файле
 # logger определен выше в этом же файле
 # run_playbook и функции faults определены в этом же файле
 
+JOBS = JobManager(
+    run_playbook_serialized,
+    max_workers=CONFIG.job_workers,
+    max_pending=CONFIG.job_queue_max,
+    keep_sec=CONFIG.job_keep_sec,
+)
+
+FLEET = FleetRunner(
+    run_playbook_serialized,
+    max_workers=CONFIG.fleet_workers,
+    max_devices=CONFIG.fleet_max_devices,
+    budget=lambda req: PLAYBOOKS.budget_for(req, CONFIG.request_timeout_sec),  # один бюджет на весь батч
+)
+
+PRINTS = PrintQueue(
+    small_bytes=CONFIG.print_small_bytes,
+    batch_max_count=CONFIG.print_batch_max_count,
+    batch_max_bytes=CONFIG.print_batch_max_bytes,
+    linger_sec=CONFIG.print_linger_sec,
+    queue_max=CONFIG.print_queue_max,
+    gate=_SPOOLER_GATE.step,  # рестарт/очистка спулера не рвут недописанный чек
+)
+
+# Изменения статуса и очереди из фоновых наблюдателей → подписчикам /events/*
+get_status_cache().subscribe(lambda name, entry: publish("printer_status", entry))
+get_job_table().subscribe(lambda name, delta: publish("spooler_job", delta))
+
+
+
+def _logo_bytes(logo_b64: Optional[str], printer: str) -> bytes:
+    """Логотип чека: растр GS v 0 по центру (дизеринг кэшируется на диске по хэшу картинки)."""
+    if not logo_b64:
+        return b""
+    image = base64.b64decode(logo_b64, validate=True)
+    return b"\x1ba\x01" + raster_image(image, get_profile_registry().get(printer)) + b"\x1ba\x00"
+
+
+def print_raw(payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """POST /print/raw → (HTTP-код, тело). Чеки печатаются по порядку, ответ — подтверждение на каждый."""
+    items = payload.get("receipts")
+    if items is None and "data_b64" in payload:
+        items = [{"id": payload.get("id"), "data_b64": payload["data_b64"]}]
+    if not isinstance(items, list) or not items:
+        return 400, {"error": "bad payload", "detail": "receipts[] with data_b64 expected"}
+    batch = bool(payload.get("batch", True))
+    printer = payload.get("printer") or _resolve_printer_name(payload)
+    try:
+        parsed = [(_logo_bytes(it.get("logo_b64"), printer) + base64.b64decode(it["data_b64"], validate=True),
+                   it.get("id"), bool(it.get("batch", batch)))
+                  for it in items]
+    except (KeyError, TypeError, binascii.Error) as e:
+        return 400, {"error": "bad payload", "detail": f"data_b64: {e}"}
+    except ValueError as e:
+        return 400, {"error": "bad payload", "detail": f"logo_b64: {e}"}
+    try:
+        receipts = PRINTS.submit(printer, parsed)
+    except PrintQueueFull as e:
+        return 503, {"error": "busy", "detail": str(e)}
+    try:
+        timeout = float(payload.get("timeout", CONFIG.request_timeout_sec))
+    except (TypeError, ValueError):
+        timeout = CONFIG.request_timeout_sec
+    acks = PRINTS.wait(receipts, min(60.0, max(0.0, timeout)))
+    return 200, {"ok": all(a["ok"] for a in acks), "printer": printer, "acks": acks}
+
+
+def profiles_set(payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """POST /profiles/set → (HTTP-код, тело): задать / переопределить / сбросить профиль принтера."""
+    registry = get_profile_registry()
+    name = payload.get("printer") or _resolve_printer_name(payload)
+    if payload.get("reset"):
+        registry.reset(name)
+    elif payload.get("detect"):
+        if registry.detect(name, force=True) is None:
+            return 409, {"ok": False, "error": "detection failed", "printer": name}
+    else:
+        try:
+            paper_mm = int(payload["paper_mm"])
+            base = profile_for_width(paper_mm, str(payload.get("codepage") or DEFAULT_CODEPAGE))
+            profile = LayoutProfile(
+                paper_mm, int(payload.get("chars_per_line") or base.chars_per_line), base.codepage,
+                tuple((str(a), str(b)) for a, b in (payload.get("substitutions") or {}).items()),
+            )
+        except (KeyError, TypeError, ValueError, LookupError) as e:
+            return 400, {"ok": False, "error": "bad profile", "detail": str(e)}
+        registry.set(name, profile, source="manual")
+    return 200, {"ok": True, **registry.entry(name)}
+
+
+def open_outcomes() -> Optional[OutcomeStore]:
+    """Открыть журнал исходов (CONFIG.outcomes_db); не открылся — демон работает без журнала, /outcomes/* → 503."""
+    if not CONFIG.outcomes_db:
+        return None
+    try:
+        os.makedirs(os.path.dirname(CONFIG.outcomes_db) or ".", exist_ok=True)
+        store = OutcomeStore(CONFIG.outcomes_db, batch_size=CONFIG.outcomes_batch)
+    except (OSError, sqlite3.Error) as e:  # каталог установки только для чтения, файл занят/битый
+        logger.error("outcomes: journal not opened at %s: %s", CONFIG.outcomes_db, e)
+        return None
+    set_outcomes(store)
+    return store
+
+
+def outcomes_query(path: str, query: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+    """GET /outcomes/{mttr|steps|printers} → (HTTP-код, тело). Окно — ?hours= (по умолчанию неделя)."""
+    store = get_outcomes()
+    if store is None:
+        return 503, {"error": "outcome journal disabled (outcomes_db is not set or not writable)"}
+    try:
+        since = time.time() - float(query.get("hours", 168)) * 3600.0
+    except ValueError:
+        return 400, {"error": "bad hours"}
+    code, printer = query.get("problem_code"), query.get("printer")
+    kind = path.rstrip("/").rsplit("/", 1)[-1]
+    if kind == "mttr":
+        return 200, store.mttr(since, code, printer)
+    if kind == "steps":
+        return 200, store.step_success(since, code, printer)
+    if kind == "printers":
+        return 200, store.printer_failures(since, code)
+    return 404, {"error": "not found"}
+
+
+def _client_config() -> Dict[str, Any]:
+    """config_smartpos.json клиентов (демо/GUI): общие с ними настройки классификатора. Нет файла — {}."""
+    if not CONFIG.client_config:
+        return {}
+    try:
+        with open(CONFIG.client_config, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("client config %s not read: %s", CONFIG.client_config, e)
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def load_intents() -> Optional[IntentService]:
+    """Загрузить классификатор намерений один раз на процесс (src/python/smartpos); ошибка — эндпоинт отвечает 503."""
+    if not CONFIG.intent_kb:
+        return None
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "python")
+    if src not in sys.path:
+        sys.path.append(src)
+    try:
+        from smartpos.intent_classifier import VECTOR_THRESHOLD, VECTOR_WEIGHT, IntentClassifier
+
+        shared = _client_config()
+        threshold = CONFIG.intent_vector_threshold
+        weight = CONFIG.intent_vector_weight
+        threshold = float(shared.get("intent_vector_threshold", VECTOR_THRESHOLD)) if threshold is None else threshold
+        weight = float(shared.get("intent_vector_weight", VECTOR_WEIGHT)) if weight is None else weight
+        t0 = time.perf_counter()
+        classifier = IntentClassifier(CONFIG.intent_kb, vector_threshold=threshold, vector_weight=weight)
+        service = IntentService(classifier, cache_size=CONFIG.intent_cache_size,
+                                max_batch=CONFIG.intent_batch_max, load_s=round(time.perf_counter() - t0, 4))
+    except (ImportError, OSError, ValueError) as e:
+        logger.error("intents: classifier not loaded from %s: %s", CONFIG.intent_kb, e)
+        return None
+    logger.info("intents: %d phrases loaded in %.3fs", len(classifier.index), service.load_s)
+    set_intents(service)
+    return service
+
+
+def intent_classify(payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """POST /intent/classify → (HTTP-код, тело): {"text": ...} → IntentResult, {"texts": [...]} → {"results": [...]}."""
+    service = get_intents()
+    if service is None:
+        return 503, {"error": "intent classifier not loaded"}
+    texts = payload.get("texts")
+    if texts is not None:
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            return 400, {"error": "bad payload", "detail": "texts[] of strings expected"}
+        try:
+            return 200, {"results": service.classify_many(texts)}
+        except ValueError as e:
+            return 400, {"error": "bad payload", "detail": str(e)}
+    text = payload.get("text")
+    if not isinstance(text, str):
+        return 400, {"error": "bad payload", "detail": "text (string) or texts[] expected"}
+    return 200, service.classify(text)
+
 
 class JsonHandler(BaseHTTPRequestHandler):
     server_version = "SmartPOSDaemon/0.1"
+    timeout = 15  # медленный клиент не должен занимать воркер пула бесконечно
 
     def _set_headers(self, code: int = 200):
         self.send_response(code)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.end_headers()
 
+    def _query(self) -> Dict[str, str]:
+        return {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items() if v}
+
+    def _poll_timeout(self) -> float:
+        try:
+            return min(60.0, max(0.0, float(self._query().get("timeout", 25))))
+        except ValueError:
+            return 25.0
+
+    def _events_cursor(self) -> int:
+        raw = self.headers.get("Last-Event-ID") or self._query().get("cursor") or "0"
+        try:
+            return max(0, int(raw))
+        except ValueError:
+            return 0
+
+    def _events_stream(self) -> None:
+        """SSE: держим соединение, отдаём события по мере появления, keepalive-комментарии в паузах."""
+        cursor = self._events_cursor()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while not BUS.closed:
+                events, reset = BUS.wait(cursor, CONFIG.events_keepalive_sec)
+                if reset:
+                    self.wfile.write(f"event: reset\ndata: {json.dumps({'cursor': cursor})}\n\n".encode("utf-8"))
+                    # продолжаем с того места, откуда wait() отдал события: курсор от прошлого
+                    # запуска демона при пустой шине — это 0, иначе следующий wait снова дал бы reset
+                    cursor = events[0]["id"] - 1 if events else 0
+                if not events:
+                    self.wfile.write(b": keepalive\n\n")
+                for ev in events:
+                    data = json.dumps(ev, ensure_ascii=False)
+                    self.wfile.write(f"id: {ev['id']}\nevent: {ev['kind']}\ndata: {data}\n\n".encode("utf-8"))
+                    cursor = ev["id"]
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError, OSError):
+            logger.debug("events: subscriber %s gone at cursor %d", self.client_address[0], cursor)
+
+    def _run_batch(self, payload: Dict[str, Any]) -> None:
+        """POST /action/run/batch: сводка JSON или (?stream=1) NDJSON — строка на принтер по готовности."""
+        if (self._query().get("stream") or "0").lower() not in ("1", "true", "yes"):
+            try:
+                res = FLEET.run(payload)
+            except ValueError as e:  # FleetTooLarge тоже
+                self._set_headers(400)
+                self.wfile.write(json.dumps({"error": "bad devices", "detail": str(e)}).encode("utf-8"))
+                return
+            self._set_headers(200)
+            self.wfile.write(json.dumps(res, ensure_ascii=False).encode("utf-8"))
+            return
+
+        started = False
+
+        def send(item: Dict[str, Any]) -> None:
+            nonlocal started
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                started = True
+            self.wfile.write((json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            res = FLEET.run(payload, on_result=lambda item: send({"type": "result", **item}))
+        except ValueError as e:
+            self._set_headers(400)
+            self.wfile.write(json.dumps({"error": "bad devices", "detail": str(e)}).encode("utf-8"))
+            return
+        try:
+            send({"type": "summary", **{k: v for k, v in res.items() if k != "results"}})
+        except OSError:
+            logger.debug("fleet: stream client %s gone", self.client_address[0])
+
     def do_GET(self):  # noqa: N802
+        if self.path.startswith("/events/stream"):
+            self._events_stream()
+            return
+        if self.path.startswith("/events/poll"):
+            events, reset = BUS.wait(self._events_cursor(), self._poll_timeout())
+            body = {"cursor": events[-1]["id"] if events else BUS.last_id, "events": events, "reset": reset}
+            self._set_headers(200)
+            self.wfile.write(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            return
+        if self.path.startswith("/metrics"):
+            data = get_metrics().render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.path.startswith("/outcomes/"):
+            code, body = outcomes_query(self.path.split("?", 1)[0], self._query())
+            self._set_headers(code)
+            self.wfile.write(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            return
+        if self.path.startswith("/spooler/jobs/delta"):
+            table = get_job_table()
+            deltas, reset = table.deltas(self._events_cursor(), self._poll_timeout())
+            body = {"cursor": deltas[-1]["id"] if deltas else table.feed.last_id, "deltas": deltas, "reset": reset}
+            self._set_headers(200)
+            self.wfile.write(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            return
+        if self.path.startswith("/spooler/jobs"):
+            name = self._query().get("printer") or _resolve_printer_name({})
+            self._set_headers(200)
+            self.wfile.write(json.dumps(get_job_table().snapshot(name), ensure_ascii=False).encode("utf-8"))
+            return
         if self.path.startswith("/health"):
+            body = {"ok": True, "version": self.server_version}
+            if hasattr(self.server, "stats"):
+                body["pool"] = self.server.stats()
+            body["spooler_backend"] = winapi_backend()
+            try:
+                body["printer_handles"] = get_handle_pool().stats()
+            except Exception:  # noqa: BLE001 (win32print недоступен)
+                pass
+            body["print_queue"] = PRINTS.stats()
+            body["idempotency"] = IDEMPOTENCY.stats()
+            if get_outcomes() is not None:
+                body["outcomes"] = get_outcomes().stats()
+            if get_intents() is not None:
+                body["intents"] = get_intents().stats()
             self._set_headers(200)
-            self.wfile.write(json.dumps({"ok": True, "version": self.server_version}).encode("utf-8"))
+            self.wfile.write(json.dumps(body).encode("utf-8"))
         elif self.path.startswith("/status/receipt"):
             # Текущий *эффективный* статус (учитывая оверрайд/TTL)
             try:
@@ -724,7 +1296,7 @@ class JsonHandler(BaseHTTPRequestHandler):
                 except Exception:
                     ov = {"active": False}
                 self._set_headers(200)
-                self.wfile.write(json.dumps({"printer": name, "status": st, "override": ov}, ensure_ascii=False).encode("utf-8"))
+                self.wfile.write(json.dumps({"printer": name, "status": st, "override": ov, "age_s": st.pop("age_s", None)}, ensure_ascii=False).encode("utf-8"))
             except Exception as e:
                 self._set_headers(500)
                 self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
@@ -740,6 +1312,25 @@ class JsonHandler(BaseHTTPRequestHandler):
         elif self.path.startswith("/config/get"):
             self._set_headers(200)
             self.wfile.write(json.dumps({"ok": True, "config": cfg_get().__dict__}).encode("utf-8"))
+        elif self.path.startswith("/profiles"):
+            self._set_headers(200)
+            self.wfile.write(json.dumps(get_profile_registry().snapshot(), ensure_ascii=False).encode("utf-8"))
+        elif self.path.startswith("/print/raw/"):
+            receipt_id = urlsplit(self.path).path[len("/print/raw/"):].strip("/")
+            ack = PRINTS.get(receipt_id)
+            self._set_headers(200 if ack else 404)
+            body = ack if ack else {"error": "receipt not found", "receipt_id": receipt_id}
+            self.wfile.write(json.dumps(body, ensure_ascii=False).encode("utf-8"))
+        elif self.path.startswith("/action/jobs"):
+            job_id = urlsplit(self.path).path[len("/action/jobs"):].strip("/")
+            if not job_id:
+                self._set_headers(200)
+                self.wfile.write(json.dumps({"jobs": JOBS.list(), "stats": JOBS.stats()}).encode("utf-8"))
+                return
+            job = JOBS.get(job_id)
+            self._set_headers(200 if job else 404)
+            body = job if job else {"error": "job not found", "job_id": job_id}
+            self.wfile.write(json.dumps(body, ensure_ascii=False).encode("utf-8"))
         else:
             self._set_headers(404)
             self.wfile.write(json.dumps({"error": "not found"}).encode("utf-8"))
@@ -755,20 +1346,67 @@ class JsonHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": "bad json", "detail": str(e)}).encode("utf-8"))
             return
 
+        if self.path.startswith("/action/run/batch"):
+            self._run_batch(payload)
+            return
+
         if self.path.startswith("/action/run"):
-            res = run_playbook(payload)
+            query = parse_qs(urlsplit(self.path).query)
+            if (query.get("async") or ["0"])[0].lower() in ("1", "true", "yes"):
+                try:
+                    job = JOBS.submit(payload)
+                except JobQueueFull as e:
+                    self.send_response(503)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Retry-After", "2")
+                    self.end_headers()
+                    self.wfile.write(json.dumps({"error": "busy", "detail": str(e)}).encode("utf-8"))
+                    return
+                self._set_headers(202)
+                self.wfile.write(json.dumps({
+                    "ok": True,
+                    "job_id": job.job_id,
+                    "ticket_id": job.ticket_id,
+                    "status_url": f"/action/jobs/{job.job_id}",
+                }).encode("utf-8"))
+                return
+            res = run_playbook_serialized(payload)
             self._set_headers(200)
             self.wfile.write(json.dumps(res, ensure_ascii=False).encode("utf-8"))
             return
 
+        if self.path.startswith("/print/raw"):
+            code, res = print_raw(payload)
+            if code == 503:
+                self.send_response(503)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Retry-After", "1")
+                self.end_headers()
+            else:
+                self._set_headers(code)
+            self.wfile.write(json.dumps(res, ensure_ascii=False).encode("utf-8"))
+            return
+
+        if self.path.startswith("/intent/classify"):
+            code, res = intent_classify(payload)
+            self._set_headers(code)
+            self.wfile.write(json.dumps(res, ensure_ascii=False).encode("utf-8"))
+            return
+
+        if self.path.startswith("/profiles/set"):
+            code, res = profiles_set(payload)
+            self._set_headers(code)
+            self.wfile.write(json.dumps(res, ensure_ascii=False).encode("utf-8"))
+            return
+
         if self.path.startswith("/faults/create"):
             kind = (payload.get("kind") or "").lower()
             if kind == "sticky_queue":
                 res = make_sticky_job(payload.get("printer_name"))
             elif kind == "wrong_width":
-                res = set_wrong_width_profile()
+                res = set_wrong_width_profile(payload.get("printer_name"))
             elif kind == "fix_width":
-                res = set_correct_width_profile()
+                res = set_correct_width_profile(payload.get("printer_name"))
             elif kind == "paper_out":
                 ttl = float(payload.get("ttl", 60))
                 res = status_override_set(paper_out=True, ttl_sec=ttl)
@@ -794,19 +1432,31 @@ class JsonHandler(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps({"error": "not found"}).encode("utf-8"))
 
 
-class ThreadingHTTPServer(ThreadingTCPServer):
-    allow_reuse_address = True
-
-
 def serve_forever() -> Tuple[str, int]:
     addr = (CONFIG.host, CONFIG.port)
-    httpd = ThreadingHTTPServer(addr, JsonHandler)
+    if CONFIG.spooler_backend == "sim":
+        use_simulator()
+        logger.warning("spooler backend: in-memory simulator (no real printing)")
+    get_job_table().watch(_resolve_printer_name({}), pinned=True)  # таблица очереди живёт с момента старта
+    if CONFIG.idempotency_db:
+        IDEMPOTENCY.store = SqliteResultStore(CONFIG.idempotency_db)
+    open_outcomes()
+    load_intents()  # модель — одна на процесс, до приёма запросов
+    httpd = PooledHTTPServer(addr, JsonHandler, lanes={
+        "main": (CONFIG.http_workers, CONFIG.http_queue_max),
+        "fast": (CONFIG.http_fast_workers, CONFIG.http_fast_queue_max),
+        "stream": (CONFIG.http_stream_workers, CONFIG.http_stream_workers),
+    })
     logger.info("Action Daemon listening on http://%s:%d", *addr)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:  # pragma: no cover
         logger.info("KeyboardInterrupt: shutting down")
     finally:
+        PRINTS.close()
+        if get_outcomes() is not None:
+            get_outcomes().close()
+        BUS.close()
         httpd.server_close()
     return addr
 
@@ -816,34 +1466,38 @@ if __name__ == "__main__":
     # setup_logging и serve_forever определены в этом же файле
 
     setup_logging()
+    if "--sim" in sys.argv[1:] or os.environ.get("SMARTPOS_SPOOLER") == "sim":
+        CONFIG.spooler_backend = "sim"
     serve_forever()
 
 # ── smartpos_daemon/service.py (optional Windows Service wrapper)
 # Note: for the expo we can run console via run_daemon.py. Service wrapper provided for completeness.
+# Обёртка службы — всегда настоящий pywin32 (имена с «_», чтобы не перекрыть
+# прокси win32serviceutil/win32service, через которые работают действия)
 try:
-    import win32serviceutil
-    import win32service
+    import win32serviceutil as _svcutil
+    import win32service as _svc
     import win32event
 except Exception:  # pragma: no cover
-    win32serviceutil = None
-    win32service = None
+    _svcutil = None
+    _svc = None
     win32event = None
 
 
-class SmartPOSService(win32serviceutil.ServiceFramework if win32serviceutil else object):
+class SmartPOSService(_svcutil.ServiceFramework if _svcutil else object):
     _svc_name_ = "SmartPOSActionDaemon"
     _svc_display_name_ = "SmartPOS Action Daemon"
 
     def __init__(self, args):  # type: ignore[no-redef]
-        if not win32serviceutil:
+        if not _svcutil:
             return
-        win32serviceutil.ServiceFramework.__init__(self, args)
+        _svcutil.ServiceFramework.__init__(self, args)
         self.stop_event = win32event.CreateEvent(None, 0, 0, None)
 
     def SvcStop(self):  # noqa: N802
-        if not win32service:
+        if not _svc:
             return
-        self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
+        self.ReportServiceStatus(_svc.SERVICE_STOP_PENDING)
         win32event.SetEvent(self.stop_event)
 
     def SvcDoRun(self):  # noqa: N802
@@ -10,5 +10,6 @@ from .printer import (
     ensure_width_profile,
     cancel_demo_sticky,   # ← добавить
     soft_purge_printer,
+    force_purge_spooler,
 )
 from .printer_status import read_printer_status
@@ -1,11 +1,17 @@
 # smartpos_daemon/actions/printer.py
-import win32print, win32serviceutil
 import time
-import win32service
 import socket
 import logging
 import os, glob
 
+from smartpos_daemon.handles import get_pool as get_handle_pool
+from smartpos_daemon.layout import DEFAULT_CODEPAGE, PROFILE_58, PROFILE_80, LayoutProfile, Template, render
+from smartpos_daemon.profiles import get_registry as get_profile_registry, profile_for_width
+from smartpos_daemon.winapi import win32print, win32service, win32serviceutil
+from smartpos_daemon.spooler_jobs import get_table as get_job_table
+from smartpos_daemon.status_cache import get_cache as get_status_cache
+from smartpos_daemon.waits import clamp, deadline_of, wait_until
+
 logger = logging.getLogger(__name__)
 
 class StepResult:
@@ -13,89 +19,80 @@ class StepResult:
         self.name = name; self.evidence = evidence or {}; self.result = result; self.terminal = terminal
 
 
+def _delete_jobs(printer_name):
+    # список джобов — из таблицы наблюдателя, без своего EnumJobs
+    table = get_job_table()
+    deleted = []
+    with get_handle_pool().lease(printer_name) as h:
+        for job_id in table.job_ids(printer_name):
+            try:
+                win32print.SetJob(h, job_id, 0, None, win32print.JOB_CONTROL_DELETE)
+                deleted.append(job_id)
+            except Exception as e:
+                logger.debug("SetJob(%s, DELETE) failed: %s", job_id, e)
+    table.invalidate(printer_name)  # следующее чтение увидит результат удаления
+    return len(deleted)
+
 def clear_spooler(req):
     """Delete all jobs from default printer queue (returns deleted count)."""
-    h = win32print.OpenPrinter(win32print.GetDefaultPrinter())
-    deleted = 0
-    try:
-        for job in win32print.EnumJobs(h, 0, 999, 1):
-            try:
-                win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                deleted += 1
-            except Exception:
-                pass
-    finally:
-        win32print.ClosePrinter(h)
-    return StepResult("print_queue_clear", {"deleted": deleted})
+    return StepResult("print_queue_clear", {"deleted": _delete_jobs(win32print.GetDefaultPrinter())})
 
 def clear_queue_fast(printer_name=None):
-    h = win32print.OpenPrinter(printer_name or win32print.GetDefaultPrinter())
-    deleted = 0
-    try:
-        for job in win32print.EnumJobs(h, 0, 999, 1):
-            try:
-                win32print.SetJob(h, job["JobId"], 0, None, win32print.JOB_CONTROL_DELETE)
-                deleted += 1
-            except Exception as e:
-                # логируй e, но продолжай
-                pass
-    finally:
-        win32print.ClosePrinter(h)
-    return {"deleted": deleted}
+    return {"deleted": _delete_jobs(printer_name or win32print.GetDefaultPrinter())}
 
 def has_long_running_jobs(printer_name=None, threshold_sec=3.0):
-    h = win32print.OpenPrinter(printer_name or win32print.GetDefaultPrinter())
-    try:
-        snapshot = {j["JobId"]: time.time() for j in win32print.EnumJobs(h, 0, 999, 1)}
-    finally:
-        win32print.ClosePrinter(h)
-    time.sleep(threshold_sec)
-    h = win32print.OpenPrinter(printer_name or win32print.GetDefaultPrinter())
-    try:
-        stuck = []
-        for j in win32print.EnumJobs(h, 0, 999, 1):
-            if j["JobId"] in snapshot:
-                stuck.append(j["JobId"])
-        return {"stuck_jobs": stuck}
-    finally:
-        win32print.ClosePrinter(h)
+    name = printer_name or win32print.GetDefaultPrinter()
+    table = get_job_table()
+    snap = table.snapshot(name)
+    # возраст джобов считается с начала наблюдения: если наблюдаем меньше порога — доберём ожиданием
+    short = threshold_sec - snap["watched_s"]
+    if short > 0:
+        time.sleep(short)
+    return {"stuck_jobs": [j["job_id"] for j in table.jobs(name) if j["age_s"] >= threshold_sec]}
+
+
+def _printer_opens(printer_name):
+    with get_handle_pool().lease(printer_name):  # свежий хэндл останется в пуле для следующего шага
+        return True
 
 
-def restart_spooler_sync(timeout_stop=5.0, timeout_start=5.0):
+def _deadline_at(req):
+    dl = deadline_of(req)
+    return dl.at if dl else None
+
+
+def restart_spooler_sync(timeout_stop=5.0, timeout_start=5.0, deadline=None):
     svc = "Spooler"
     # stop
     try:
         win32serviceutil.StopService(svc)
     except Exception:
         pass  # может уже быть остановлен
+    get_handle_pool().invalidate()  # старые хэндлы умирают вместе со спулером
     t0 = time.time()
-    while time.time() - t0 < timeout_stop:
-        try:
-            status = win32serviceutil.QueryServiceStatus(svc)[1]
-            if status == win32service.SERVICE_STOPPED:
-                break
-        except Exception:
-            break
-        time.sleep(0.1)
+    stopped = wait_until(lambda: win32serviceutil.QueryServiceStatus(svc)[1] == win32service.SERVICE_STOPPED, timeout_stop, deadline=deadline)
     # start
     win32serviceutil.StartService(svc)
     t1 = time.time()
-    while time.time() - t1 < timeout_start:
-        status = win32serviceutil.QueryServiceStatus(svc)[1]
-        if status == win32service.SERVICE_RUNNING:
-            break
-        time.sleep(0.1)
-    time.sleep(0.5)  # демо-пауза, чтобы мониторы портов «проснулись»
+    running = wait_until(lambda: win32serviceutil.QueryServiceStatus(svc)[1] == win32service.SERVICE_RUNNING, timeout_start, deadline=deadline)
+    # вместо демо-паузы: ждём, пока мониторы портов «проснутся» и принтер снова открывается
+    ready = wait_until(lambda: _printer_opens(win32print.GetDefaultPrinter()), 2.0, deadline=deadline)
     return {
         "stopped_in": round(t1 - t0, 3),
         "running_in": round(time.time() - t1, 3),
+        "stopped": stopped.ok,
+        "running": running.ok,
+        "printer_ready": ready.ok,
+        "wait_s": round(stopped.waited + running.waited + ready.waited, 3),
     }
 
 
 def restart_spooler(req):
     """Playbook wrapper: restart spooler and return StepResult with timings."""
     try:
-        metrics = restart_spooler_sync()
+        metrics = restart_spooler_sync(deadline=_deadline_at(req))
+        get_status_cache().invalidate()
+        get_job_table().invalidate()
         return StepResult("spooler_restart", metrics)
     except Exception as e:  # noqa: BLE001
         need_admin = ("OpenSCManager" in str(e)) or ("Access is denied" in str(e))
@@ -129,16 +126,61 @@ def soft_purge_printer(req: dict) -> StepResult:
         return StepResult("printer_soft_purge_skip", {"reason": "win32print missing"})
     name = _resolve_printer_name(req)
     try:
-        h = win32print.OpenPrinter(name)
-        try:
+        with get_handle_pool().lease(name) as h:
             win32print.SetPrinter(h, 0, None, win32print.PRINTER_CONTROL_PURGE)
             return StepResult("printer_soft_purge", {"purge": "ok", "printer": name})
-        finally:
-            win32print.ClosePrinter(h)
     except Exception as e:  # noqa: BLE001
         return StepResult("printer_soft_purge_error", {"error": str(e)})
 
 
+# --- ЖЁСТКАЯ зачистка: Stop Spooler → удалить *.SPL/*.SHD → Start Spooler ---
+def force_purge_spooler(req: dict) -> StepResult:
+    """
+    Полная очистка очереди печати. Нужны права администратора. Без shell=True.
+    """
+    if not (win32serviceutil and win32service):
+        return StepResult("force_purge_skip", {"reason": "win32service unavailable"})
+    spool_dir = os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "System32", "spool", "PRINTERS")
+    svc = "Spooler"
+    at = _deadline_at(req)
+    t0 = time.time()
+    try:
+        try:
+            win32serviceutil.StopService(svc)
+        except Exception:
+            pass  # может уже быть остановлен
+        get_handle_pool().invalidate()
+        stopped = wait_until(lambda: win32serviceutil.QueryServiceStatus(svc)[1] == win32service.SERVICE_STOPPED, 6.0, deadline=at)
+    except Exception as e:  # noqa: BLE001
+        return StepResult("force_purge_error", {"stage": "stop", "error": str(e)}, terminal=True, result="ERROR")
+    stopped_in = time.time() - t0
+
+    purged = 0
+    for pattern in ("*.SPL", "*.SHD"):
+        for p in glob.glob(os.path.join(spool_dir, pattern)):
+            try:
+                os.remove(p)
+                purged += 1
+            except Exception:
+                pass
+
+    t1 = time.time()
+    try:
+        win32serviceutil.StartService(svc)
+        running = wait_until(lambda: win32serviceutil.QueryServiceStatus(svc)[1] == win32service.SERVICE_RUNNING, 6.0, deadline=at)
+        ready = wait_until(lambda: _printer_opens(_resolve_printer_name(req)), 2.0, deadline=at)
+        get_status_cache().invalidate()
+        get_job_table().invalidate()
+    except Exception as e:  # noqa: BLE001
+        return StepResult("force_purge_error", {"stage": "start", "error": str(e)}, terminal=True, result="ERROR")
+    return StepResult("force_purge_spooler", {
+        "spool_dir": spool_dir, "purged": purged,
+        "stop_s": round(stopped_in, 3), "start_s": round(time.time() - t1, 3),
+        "stopped": stopped.ok, "running": running.ok, "printer_ready": ready.ok,
+        "wait_s": round(stopped.waited + running.waited + ready.waited, 3),
+    })
+
+
 # -------- Device/port probes --------
 
 def usb_presence_check(req: dict) -> StepResult:
@@ -148,18 +190,11 @@ def usb_presence_check(req: dict) -> StepResult:
     if not win32print:
         return StepResult("usb_presence_skip", {"reason": "win32print missing"})
     target = _resolve_printer_name(req)
-    try:
-        h = win32print.OpenPrinter(target)
-        try:
-            info = win32print.GetPrinter(h, 2)
-            status = info["Status"]
-            detected = True
-        finally:
-            win32print.ClosePrinter(h)
-        return StepResult("usb_presence_ok", {"detected": detected, "status": int(status)})
-    except Exception as e:  # noqa: BLE001
-        logger.warning("usb_presence_check: %s", e)
-        return StepResult("usb_presence_fail", {"detected": False, "error": str(e)})
+    entry = get_status_cache().get(target)
+    if entry["detected"]:
+        return StepResult("usb_presence_ok", {"detected": True, "status": int(entry["status"]), "status_age_s": entry["age_s"]})
+    logger.warning("usb_presence_check: %s", entry["error"])
+    return StepResult("usb_presence_fail", {"detected": False, "error": entry["error"]})
 
 
 def tcp9100_probe(req: dict) -> StepResult:
@@ -168,7 +203,7 @@ def tcp9100_probe(req: dict) -> StepResult:
     if not ip:
         return StepResult("tcp9100_skip", {"reason": "no ip"})
     sock = socket.socket()
-    sock.settimeout(1.0)
+    sock.settimeout(max(0.05, clamp(req, 1.0)))
     try:
         sock.connect((ip, 9100))
         ok = True
@@ -180,7 +215,6 @@ def tcp9100_probe(req: dict) -> StepResult:
 
 
 # -------- ESC/POS and layout helpers --------
-DEFAULT_CODEPAGE = "cp866"
 
 
 def escpos_probe(req: dict) -> StepResult:
@@ -192,67 +226,52 @@ def escpos_probe(req: dict) -> StepResult:
     payload = b"\x1b@"  # Initialize
     try:
         printer_name = _resolve_printer_name(req)
-        h = win32print.OpenPrinter(printer_name)
-        try:
+        with get_handle_pool().lease(printer_name) as h:
             job_id = win32print.StartDocPrinter(h, 1, ("SMARTPOS_PROBE", None, "RAW"))
             win32print.StartPagePrinter(h)
             win32print.WritePrinter(h, payload)
             win32print.EndPagePrinter(h)
             win32print.EndDocPrinter(h)
             return StepResult("escpos_probe", {"job_id": job_id})
-        finally:
-            win32print.ClosePrinter(h)
     except Exception as e:  # noqa: BLE001
         logger.warning("escpos_probe failed: %s", e)
         return StepResult("escpos_probe_error", {"error": str(e)})
 
 
-# Layout profiles for 58/80mm demo
-class LayoutProfile:
-    def __init__(self, paper_mm: int, chars_per_line: int, codepage: str = DEFAULT_CODEPAGE):
-        self.paper_mm = paper_mm
-        self.chars_per_line = chars_per_line
-        self.codepage = codepage
-
-
-PROFILE_58 = LayoutProfile(58, 32)
-PROFILE_80 = LayoutProfile(80, 48)
-_current_profile = PROFILE_80
+# Layout profiles for 58/80mm: у каждого принтера свой, см. smartpos_daemon/profiles.py
+LAYOUT_TEST = Template("layout_test_pkg", [
+    "{title} ({paper_mm}mm)",
+    "{rule}",
+    "{ruler}",
+    "Chars per line: {chars}",
+    "{rule}",
+    "END TEST",
+], init=False, feed=0)
 
 
 def ensure_width_profile(req: dict) -> StepResult:
     """Ensure width profile matches physical (80mm). Used to *fix* scenario 4."""
-    global _current_profile
-    _current_profile = PROFILE_80
-    return StepResult("width_profile_set", {"paper_mm": 80, "chars": 48})
+    name = _resolve_printer_name(req)
+    registry = get_profile_registry()
+    profile = registry.detect(name) or registry.default
+    registry.set(name, profile, source="playbook")
+    return StepResult("width_profile_set", {"printer": name, "paper_mm": profile.paper_mm, "chars": profile.chars_per_line})
 
 
 def test_print_layout(req: dict, title: str = "SMARTPOS LAYOUT TEST") -> StepResult:
     if not win32print:
         return StepResult("test_print_skip", {"reason": "win32print missing"})
-    profile = _current_profile
-    line = "1234567890" * (profile.chars_per_line // 10)
-    lines = [
-        f"{title} ({profile.paper_mm}mm)",
-        "-" * profile.chars_per_line,
-        line,
-        f"Chars per line: {profile.chars_per_line}",
-        "-" * profile.chars_per_line,
-        "END TEST",
-    ]
     try:
         printer_name = _resolve_printer_name(req)
-        h = win32print.OpenPrinter(printer_name)
-        try:
+        profile = get_profile_registry().get(printer_name)
+        data = render(LAYOUT_TEST, profile, title=title)
+        with get_handle_pool().lease(printer_name) as h:
             job_id = win32print.StartDocPrinter(h, 1, (title, None, "RAW"))
             win32print.StartPagePrinter(h)
-            for line_text in lines:
-                win32print.WritePrinter(h, (line_text + "\n").encode(profile.codepage))
+            win32print.WritePrinter(h, data)
             win32print.EndPagePrinter(h)
             win32print.EndDocPrinter(h)
             return StepResult("test_print_layout", {"job_id": job_id, "chars": profile.chars_per_line})
-        finally:
-            win32print.ClosePrinter(h)
     except Exception as e:  # noqa: BLE001
         logger.warning("test_print_layout failed: %s", e)
         return StepResult("test_print_error", {"error": str(e)})
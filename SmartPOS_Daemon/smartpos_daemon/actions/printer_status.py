@@ -1,28 +1,28 @@
 # actions/printer_status.py
 import time
-import win32print
 try:
     from smartpos_daemon import faults as _faults
 except Exception:
     _faults = None
 from smartpos_daemon.actions.printer import StepResult  # единый формат шага
 from smartpos_daemon.actions.printer import _resolve_printer_name  # используем ваш резолвер
-
-PRINTER_STATUS_PAPER_OUT = 0x00000020
-PRINTER_STATUS_DOOR_OPEN = 0x00400000
+from smartpos_daemon.status_cache import (  # noqa: F401 (константы реэкспортируются)
+    PRINTER_STATUS_DOOR_OPEN,
+    PRINTER_STATUS_PAPER_OUT,
+    get_cache,
+)
 
 
 def get_printer_status(printer_name: str) -> dict:
-    h = win32print.OpenPrinter(printer_name)
-    try:
-        info = win32print.GetPrinter(h, 2)
-        st = info["Status"]
-        return {
-            "paper_out": bool(st & PRINTER_STATUS_PAPER_OUT),
-            "door_open": bool(st & PRINTER_STATUS_DOOR_OPEN),
-        }
-    finally:
-        win32print.ClosePrinter(h)
+    """Статус из общего кэша (фоновый наблюдатель держит его свежим). age_s — возраст записи."""
+    entry = get_cache().get(printer_name)
+    if not entry["detected"]:
+        raise RuntimeError(entry["error"] or f"printer not found: {printer_name}")
+    return {
+        "paper_out": entry["paper_out"],
+        "door_open": entry["door_open"],
+        "age_s": entry["age_s"],
+    }
 
 
 def _apply_override(status: dict) -> tuple[dict, bool]:
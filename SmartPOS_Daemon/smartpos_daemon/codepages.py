@@ -0,0 +1,109 @@
+# smartpos_daemon/codepages.py
+"""
+Табличная перекодировка текста чека в однобайтовую кодовую страницу принтера.
+
+- Таблицы строятся один раз на (кодовая страница, замены). Основной путь —
+  codecs.charmap_encode с EncodingMap из charmap_build (на порядок быстрее
+  штатного кодека cp866, у которого таблица — обычный dict); символы, которых
+  нет в кодовой странице, находит один скомпилированный класс символов re и
+  подставляет замену из таблицы
+- Символы, которых нет в кодовой странице, не теряются молча:
+  1) явные замены (« → ", № → N, € → EUR, — → -, …),
+  2) разложение NFKD без диакритики (é → e, ﬁ → fi),
+  3) replacement ("?"); такие символы копятся в Transcoder.lost для диагностики
+- Текст в разложенной форме (е + U+0308) сначала нормализуется в NFC, чтобы «ё» печаталась
+"""
+
+from __future__ import annotations
+
+import codecs
+import re
+import threading
+import unicodedata
+from typing import Dict, Mapping, Optional, Set, Tuple
+
+__all__ = [
+    "DEFAULT_SUBSTITUTIONS",
+    "Transcoder",
+    "get_transcoder",
+]
+
+# Замены для символов, которых нет в кодовой странице. Символ, который в ней есть
+# (например, № в cp866), печатается как есть — если не задан в substitutions явно.
+DEFAULT_SUBSTITUTIONS: Dict[str, str] = {
+    "«": '"', "»": '"', "„": '"', "“": '"', "”": '"', "″": '"',
+    "‘": "'", "’": "'", "‚": "'", "′": "'",
+    "–": "-", "—": "-", "‒": "-", "−": "-", "‐": "-",
+    "…": "...", "•": "*", "№": "N", "€": "EUR", "₽": "р.", "\u00a0": " ", "\u202f": " ",
+    "×": "x", "©": "(c)", "®": "(R)", "™": "TM",
+    "Є": "Е", "є": "е", "І": "I", "і": "i", "Ї": "I", "ї": "i", "Ґ": "Г", "ґ": "г",
+}
+
+
+class Transcoder:
+    """Перекодировщик под одну кодовую страницу с заменами."""
+
+    def __init__(self, codepage: str = "cp866", substitutions: Optional[Mapping[str, str]] = None,
+                 replacement: str = "?"):
+        self.codepage = codepage
+        self.replacement = replacement
+        self.lost: Set[str] = set()
+        decoding = []
+        for b in range(256):
+            ch = bytes([b]).decode(codepage, errors="ignore")
+            decoding.append(ch if len(ch) == 1 and ch not in decoding else "\ufffe")  # \ufffe — байт без символа
+        self._native = frozenset(decoding) - {"\ufffe"}
+        self._map = codecs.charmap_build("".join(decoding))
+        # замены: символ → текст из символов кодовой страницы; дополняется по мере встречи новых
+        self._subst: Dict[str, str] = {}
+        for ch, rep in DEFAULT_SUBSTITUTIONS.items():
+            if ch not in self._native:
+                self._subst[ch] = self._nativize(rep)
+        for ch, rep in (substitutions or {}).items():
+            self._subst[ch] = self._nativize(rep)
+        overridden = "".join(re.escape(c) for c in self._subst if c in self._native)
+        native = "".join(re.escape(c) for c in sorted(self._native - set(self._subst)))
+        self._foreign = re.compile(f"[{overridden}]|[^{native}]" if overridden else f"[^{native}]")
+
+    def encode(self, text: str) -> bytes:
+        if not text.isascii() and not unicodedata.is_normalized("NFC", text):
+            text = unicodedata.normalize("NFC", text)
+        if not self._subst.keys() & self._native:
+            try:
+                return codecs.charmap_encode(text, "strict", self._map)[0]
+            except UnicodeEncodeError:
+                pass
+        return codecs.charmap_encode(self._foreign.sub(self._replace, text), "strict", self._map)[0]
+
+    def _replace(self, m: "re.Match[str]") -> str:
+        ch = m.group()
+        rep = self._subst.get(ch)
+        if rep is None:
+            rep = self._subst[ch] = self._fallback(ch)
+        return rep
+
+    def _nativize(self, text: str) -> str:
+        return "".join(c if c in self._native else self.replacement for c in text)
+
+    def _fallback(self, ch: str) -> str:
+        if unicodedata.combining(ch):
+            return ""  # одиночная диакритика после NFC — без неё буква читается
+        base = "".join(c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c))
+        if base and base != ch and all(c in self._native for c in base):
+            return base
+        self.lost.add(ch)
+        return self.replacement
+
+
+_CACHE: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Transcoder] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def get_transcoder(codepage: str = "cp866", substitutions: Optional[Mapping[str, str]] = None) -> Transcoder:
+    """Общий перекодировщик на (кодовая страница, замены); таблица строится один раз."""
+    key = (codepage, tuple(sorted((substitutions or {}).items())))
+    with _CACHE_LOCK:
+        tc = _CACHE.get(key)
+        if tc is None:
+            tc = _CACHE[key] = Transcoder(codepage, substitutions)
+        return tc
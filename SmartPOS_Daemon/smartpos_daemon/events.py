@@ -0,0 +1,77 @@
+# smartpos_daemon/events.py
+"""
+Шина событий демона для GET /events/stream (SSE) и GET /events/poll (long-poll).
+
+- Каждое событие получает возрастающий id; хранится последние capacity событий
+- Подписчик держит свой курсор (последний полученный id) и после переподключения
+  продолжает с него (SSE: заголовок Last-Event-ID или ?cursor=N)
+- Если курсор «вывалился» из буфера (или демон перезапущен) — reset=True,
+  клиенту стоит перечитать состояние целиком
+
+Виды событий: printer_status, status_override, sticky, playbook_step, spooler_job.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+__all__ = ["EventBus", "BUS", "publish"]
+
+
+class EventBus:
+    """Кольцевой буфер событий + ожидание новых событий по курсору."""
+
+    def __init__(self, capacity: int = 1024):
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=max(1, int(capacity)))
+        self._cond = threading.Condition()
+        self._last_id = 0
+        self._closed = False
+
+    @property
+    def last_id(self) -> int:
+        with self._cond:
+            return self._last_id
+
+    def publish(self, kind: str, data: Dict[str, Any]) -> int:
+        with self._cond:
+            self._last_id += 1
+            self._events.append({"id": self._last_id, "kind": kind, "ts": round(time.time(), 3), "data": data})
+            self._cond.notify_all()
+            return self._last_id
+
+    def wait(self, cursor: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        События с id > cursor; если их нет — ждать до timeout секунд.
+        Возвращает (события, reset). reset=True — часть событий после cursor потеряна.
+        """
+        with self._cond:
+            if cursor > self._last_id:  # курсор от прошлого запуска демона
+                cursor = 0
+                stale = True
+            else:
+                stale = False
+                self._cond.wait_for(lambda: self._last_id > cursor or self._closed, timeout)
+            oldest = self._events[0]["id"] if self._events else self._last_id + 1
+            reset = stale or (cursor + 1 < oldest and cursor < self._last_id)
+            return [e for e in self._events if e["id"] > cursor], reset
+
+    def close(self) -> None:
+        """Разбудить всех ожидающих (остановка сервера)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+
+BUS = EventBus()
+
+
+def publish(kind: str, data: Dict[str, Any]) -> int:
+    """Опубликовать событие в общую шину процесса."""
+    return BUS.publish(kind, data)
@@ -11,17 +11,19 @@
 
 from __future__ import annotations
 
+import logging
 import time
 import threading
 from typing import Optional, Dict, List
 
-try:
-    import win32print
-except Exception:  # pragma: no cover (не Windows-среда)
-    win32print = None  # type: ignore[assignment]
+from smartpos_daemon.winapi import win32print  # pywin32 или симулятор спулера
 
-from run_daemon import logger
 from smartpos_daemon.actions.printer import PROFILE_58, PROFILE_80
+from smartpos_daemon.profiles import get_registry as get_profile_registry
+from smartpos_daemon.events import publish
+
+# тот же логгер, что настраивает run_daemon.setup_logging (без импорта run_daemon → без циклов)
+logger = logging.getLogger("smartpos_daemon")
 
 __all__ = [
     "make_sticky_job",
@@ -39,6 +41,7 @@ _fault_threads: List[threading.Thread] = []
 _sticky_ctxs: List[Dict] = []  # [{thread, cancel: threading.Event, printer}]
 _current_profile_for_demo = PROFILE_80
 _status_override = {"until": 0.0, "paper_out": None, "door_open": None}  # TTL-оверрайд статуса
+_override_timer: Optional[threading.Timer] = None  # публикует событие истечения TTL
 
 
 # ---------- вспомогательные функции ----------
@@ -78,9 +81,8 @@ def make_sticky_job(printer_name: Optional[str] = None, payload: Optional[bytes]
             # НЕ вызываем WritePrinter - тогда джоб будет висеть в очереди без данных
             # НЕ вызываем EndPagePrinter и EndDocPrinter - это заставит джоб "залипнуть"
             # Ждём сигнал отмены (≤ 180 с как предохранитель)
-            end = time.time() + 180.0
-            while time.time() < end and not cancel.is_set():
-                time.sleep(0.1)
+            # Event.wait: отмена срабатывает сразу, без опроса по таймеру
+            cancel.wait(180.0)
         except Exception as e:  # noqa: BLE001
             logger.warning("sticky job worker error: %s", e)
         finally:
@@ -97,12 +99,14 @@ def make_sticky_job(printer_name: Optional[str] = None, payload: Optional[bytes]
                     win32print.ClosePrinter(h)
                 except Exception:
                     pass
+            publish("sticky", {"active": _active_sticky(exclude=threading.current_thread()), "ended": pname})
 
     t = threading.Thread(target=_worker, args=(name, cancel_evt), daemon=True)
     t.start()
     _fault_threads.append(t)
     _sticky_ctxs.append({"thread": t, "cancel": cancel_evt, "printer": name})
     logger.info("faults: sticky job started on %s", name)
+    publish("sticky", sticky_status())
     return {"ok": True, "printer": name}
 
 
@@ -138,12 +142,17 @@ def cancel_sticky_jobs(timeout_sec: float = 2.0) -> dict:
 
     ok = alive == 0
     logger.info("faults: sticky cancel %s (alive=%d)", "OK" if ok else "PARTIAL", alive)
+    publish("sticky", sticky_status())
     return {"ok": ok, "still_alive": alive}
 
 
 def sticky_status() -> dict:
     """Небольшая телеметрия для отладки демо: количество активных «залипших» потоков."""
-    return {"active": sum(1 for c in _sticky_ctxs if c.get("thread") and c["thread"].is_alive())}
+    return {"active": _active_sticky()}
+
+
+def _active_sticky(exclude: Optional[threading.Thread] = None) -> int:
+    return sum(1 for c in _sticky_ctxs if c.get("thread") and c["thread"].is_alive() and c["thread"] is not exclude)
 
 
 # ---------- Эмуляция статуса принтера (paper_out / door_open) ----------
@@ -157,6 +166,8 @@ def status_override_set(paper_out: bool | None = None, door_open: bool | None =
         "door_open": bool(door_open) if door_open is not None else _status_override["door_open"],
         "until": now + float(ttl_sec),
     })
+    _schedule_override_expiry(float(ttl_sec))
+    publish("status_override", {"active": True, **_status_override})
     return {"ok": True, "override": _status_override.copy()}
 
 def status_override_get() -> dict:
@@ -171,38 +182,69 @@ def status_override_get() -> dict:
 def status_override_clear() -> dict:
     """Полностью отключить эмуляцию статуса принтера."""
     _status_override.update({"until": 0.0, "paper_out": None, "door_open": None})
+    if _override_timer is not None:
+        _override_timer.cancel()
+    publish("status_override", {"active": False, "reason": "cleared", **_status_override})
     return {"ok": True}
 
 
+def _schedule_override_expiry(ttl_sec: float) -> None:
+    """Таймер на момент истечения TTL: оверрайд истекает «лениво», а подписчикам нужно событие."""
+    global _override_timer
+    if _override_timer is not None:
+        _override_timer.cancel()
+    _override_timer = threading.Timer(max(0.0, ttl_sec) + 0.05, _override_expired)
+    _override_timer.daemon = True
+    _override_timer.start()
+
+
+def _override_expired() -> None:
+    st = status_override_get()
+    if not st["active"]:
+        publish("status_override", {**st, "reason": "expired"})
+
+
 # ---------- Переключение профиля ширины (58 ↔ 80 мм) ----------
 
-def set_wrong_width_profile() -> dict:
+def _profile_printer(printer_name: Optional[str]) -> str:
+    if printer_name:
+        return printer_name
+    from smartpos_daemon.actions.printer import _resolve_printer_name  # локальный импорт во избежание циклов
+    return _resolve_printer_name({})
+
+
+def set_wrong_width_profile(printer_name: Optional[str] = None) -> dict:
     """
-    Переключить демо-профиль на 58 мм И применить его к активному модулю печати,
-    чтобы следующая тест-печать сразу использовала 58 мм (эффект «обрезанного» текста).
+    Переключить профиль принтера в реестре на 58 мм, чтобы следующая тест-печать
+    сразу использовала 58 мм (эффект «обрезанного» текста). Другие принтеры не затрагиваются.
     """
     global _current_profile_for_demo
     _current_profile_for_demo = PROFILE_58
     try:
-        # Применить к живому модулю печати (локальный импорт, чтобы избежать циклов при импорте)
-        from smartpos_daemon.actions import printer as _ap  # локальный импорт во избежание циклических зависимостей
-        _ap._current_profile = PROFILE_58  # noqa: SLF001 (намеренно для демо)
+        name = _profile_printer(printer_name)
+        get_profile_registry().set(name, PROFILE_58, source="fault")
     except Exception as e:  # noqa: BLE001
-        logger.warning("faults: failed to apply 58mm profile to runtime: %s", e)
-    logger.info("faults: width profile set to 58mm for demo")
-    return {"ok": True, "paper_mm": 58}
+        logger.warning("faults: failed to apply 58mm profile: %s", e)
+        return {"ok": False, "error": str(e)}
+    logger.info("faults: width profile of %s set to 58mm for demo", name)
+    return {"ok": True, "paper_mm": 58, "printer": name}
 
 
-def set_correct_width_profile() -> dict:
+def set_correct_width_profile(printer_name: Optional[str] = None) -> dict:
     """
-    Вернуть профиль на 80 мм И применить его к активному модулю печати.
+    Вернуть профиль принтера в реестре на 80 мм.
+
+    Профиль закрепляется как manual — бессрочно, автоопределение его не перетирает
+    (демо-принтер 80 мм, даже если драйвер сообщает другое). Вернуть принтер к
+    автоопределению — POST /profiles/set {"reset": true}.
     """
     global _current_profile_for_demo
     _current_profile_for_demo = PROFILE_80
     try:
-        from smartpos_daemon.actions import printer as _ap
-        _ap._current_profile = PROFILE_80  # noqa: SLF001
+        name = _profile_printer(printer_name)
+        get_profile_registry().set(name, PROFILE_80, source="manual")
     except Exception as e:  # noqa: BLE001
-        logger.warning("faults: failed to apply 80mm profile to runtime: %s", e)
-    logger.info("faults: width profile set to 80mm for demo")
-    return {"ok": True, "paper_mm": 80}
+        logger.warning("faults: failed to apply 80mm profile: %s", e)
+        return {"ok": False, "error": str(e)}
+    logger.info("faults: width profile of %s set to 80mm", name)
+    return {"ok": True, "paper_mm": 80, "printer": name}
@@ -0,0 +1,135 @@
+# smartpos_daemon/fleet.py
+"""
+Один плейбук на несколько принтеров сразу (POST /action/run/batch).
+
+- Запрос с devices=[...] раскладывается в запросы по одному принтеру
+  (device.name), они выполняются параллельно в ограниченном пуле
+- Изоляция по принтерам: каждый запрос идёт через свою очередь принтера
+  (PrinterLanes в runner), ошибка или TIMEOUT одного принтера не трогает остальные
+- Результаты отдаются по мере готовности (on_result — для потоковой выдачи)
+  и сводкой в порядке devices: очистка восьми очередей длится как самая
+  медленная из них, а не как сумма
+- Бюджет времени один на весь запрос: все принтеры получают общий дедлайн
+  (req["_deadline"]), включая ожидание свободного места в пуле
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from .waits import DEADLINE_KEY, Deadline
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["FleetRunner", "FleetTooLarge", "expand_devices"]
+
+# runner(req, on_step) → dict результата плейбука
+Runner = Callable[[Dict[str, Any], Optional[Callable[[Dict[str, Any]], None]]], Dict[str, Any]]
+
+
+class FleetTooLarge(ValueError):
+    """В запросе больше принтеров, чем разрешено max_devices."""
+
+
+def _device_name(dev: Dict[str, Any]) -> str:
+    return str(dev.get("name") or dev.get("printer_name") or "")
+
+
+def expand_devices(req: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Запросы по принтерам: devices — имена или объекты device; общие поля
+    device (type и т.п.) наследуются. Повторы одного принтера отбрасываются.
+    """
+    base_device = dict(req.get("device") or {})
+    base = {k: v for k, v in req.items() if k != "devices"}
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for item in req.get("devices") or []:
+        dev = {"name": item} if isinstance(item, str) else dict(item or {})
+        dev = {**base_device, **dev}
+        name = _device_name(dev)
+        if not name or name in seen:
+            continue
+        dev["name"] = dev["printer_name"] = name  # оба резолвера (демон и actions.printer) видят один принтер
+        seen.add(name)
+        out.append({**base, "device": dev})
+    return out
+
+
+class FleetRunner:
+    """
+    Параллельный запуск плейбука по принтерам.
+
+    runner      — выполнение одного запроса (run_playbook_serialized);
+    max_workers — сколько принтеров обслуживается одновременно;
+    max_devices — предел принтеров в одном запросе (больше → FleetTooLarge);
+    budget      — budget(req) → секунд на весь запрос (None — дедлайн задаёт runner, по принтеру).
+    """
+
+    def __init__(self, runner: Runner, max_workers: int = 8, max_devices: int = 32,
+                 budget: Optional[Callable[[Dict[str, Any]], float]] = None):
+        self._runner = runner
+        self._budget = budget
+        self.max_workers = max(1, int(max_workers))
+        self.max_devices = int(max_devices)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fleet")
+
+    def run(self, req: Dict[str, Any],
+            on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+            on_step: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Выполнить плейбук на всех devices. on_result(item) вызывается по мере готовности,
+        on_step получает события шагов с полем printer. Возвращает сводку.
+        """
+        reqs = expand_devices(req)
+        if not reqs:
+            raise ValueError("devices: at least one printer name is required")
+        if len(reqs) > self.max_devices:
+            raise FleetTooLarge(f"{len(reqs)} devices, max {self.max_devices}")
+        t0 = time.monotonic()
+        if self._budget is not None:
+            deadline = Deadline(self._budget(req))
+            reqs = [{**r, DEADLINE_KEY: deadline} for r in reqs]
+        futures = {self._pool.submit(self._one, r, on_step): i for i, r in enumerate(reqs)}
+        items: List[Optional[Dict[str, Any]]] = [None] * len(reqs)
+        for fut in as_completed(futures):
+            item = fut.result()
+            items[futures[fut]] = item
+            if on_result:
+                try:
+                    on_result(item)
+                except Exception as e:  # noqa: BLE001 (клиент потока ушёл — остальные досчитываем)
+                    logger.debug("fleet: on_result failed: %s", e)
+        summary: Dict[str, int] = {}
+        for item in items:
+            summary[item["result_code"]] = summary.get(item["result_code"], 0) + 1
+        return {
+            "ticket_id": req.get("ticket_id"),
+            "problem_code": req.get("problem_code"),
+            "devices": len(items),
+            "results": items,
+            "summary": summary,
+            "elapsed_s": round(time.monotonic() - t0, 3),
+            "slowest_s": max(i["elapsed_s"] for i in items),
+        }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait)
+
+    # ---------- внутреннее ----------
+
+    def _one(self, req: Dict[str, Any], on_step: Optional[Callable[[Dict[str, Any]], None]]) -> Dict[str, Any]:
+        printer = _device_name(req["device"])
+        t0 = time.monotonic()
+        step_cb = (lambda ev: on_step({**ev, "printer": printer})) if on_step else None
+        try:
+            res = self._runner(req, step_cb)
+        except Exception as e:  # noqa: BLE001 — сбой одного принтера не валит остальные
+            logger.error("fleet: %s failed: %s", printer, e)
+            res = {"ticket_id": req.get("ticket_id"), "problem_code": req.get("problem_code"),
+                   "result_code": "ERROR", "evidence": {"error": str(e)}}
+        return {"printer": printer, "result_code": res.get("result_code"),
+                "elapsed_s": round(time.monotonic() - t0, 3), "result": res}
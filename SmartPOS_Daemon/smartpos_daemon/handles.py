@@ -0,0 +1,313 @@
+# smartpos_daemon/handles.py
+"""
+Пул хэндлов принтеров вместо OpenPrinter/ClosePrinter в каждом действии.
+
+- Хэндл выдаётся в аренду: `with get_pool().lease(name) as h: ...`;
+  после выхода возвращается в пул (не больше max_idle свободных на принтер)
+- Исключение внутри аренды — хэндл считается подозрительным и закрывается
+- Хэндл, пролежавший без дела дольше validate_after, перед выдачей проверяется
+  (GetPrinter уровня 1); старше max_age — просто переоткрывается
+- После рестарта спулера invalidate() повышает поколение: свободные хэндлы
+  закрываются сразу, арендованные — при возврате
+- Бэкенды взаимозаменяемы: Win32HandleBackend (win32print или совместимый
+  с ним объект) → FakeHandleBackend (тесты на Linux)
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .winapi import win32print
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "HandleBackend",
+    "Win32HandleBackend",
+    "FakeHandleBackend",
+    "Lease",
+    "HandlePool",
+    "get_pool",
+    "set_pool",
+]
+
+
+# ---------- Бэкенды ----------
+
+class HandleBackend:
+    """Интерфейс открытия/закрытия хэндлов принтера."""
+
+    name = "base"
+
+    def open(self, printer: str) -> Any:
+        """Открыть хэндл. Исключение — принтер недоступен/не найден."""
+        raise NotImplementedError
+
+    def close(self, handle: Any) -> None:
+        raise NotImplementedError
+
+    def check(self, handle: Any) -> bool:
+        """Хэндл ещё рабочий? (один дешёвый вызов к спулеру)"""
+        return True
+
+
+class Win32HandleBackend(HandleBackend):
+    """OpenPrinter/ClosePrinter/GetPrinter(h, 1) через win32print или совместимый объект."""
+
+    name = "win32"
+
+    def __init__(self, api: Any = None):
+        self.api = api or win32print
+        if not self.api:
+            raise RuntimeError("win32print missing")
+
+    def open(self, printer: str) -> Any:
+        return self.api.OpenPrinter(printer)
+
+    def close(self, handle: Any) -> None:
+        self.api.ClosePrinter(handle)
+
+    def check(self, handle: Any) -> bool:
+        try:
+            self.api.GetPrinter(handle, 1)
+            return True
+        except Exception:  # noqa: BLE001
+            return False
+
+
+class FakeHandleBackend(HandleBackend):
+    """Фейковый спулер для тестов: считает вызовы, restart() «убивает» все хэндлы."""
+
+    name = "fake"
+
+    def __init__(self, printers: Optional[List[str]] = None):
+        self.printers = set(printers or [])
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._next = 0
+        self._open: Dict[int, int] = {}  # handle → epoch спулера при открытии
+        self.opens = 0
+        self.closes = 0
+        self.checks = 0
+
+    def open(self, printer: str) -> Any:
+        with self._lock:
+            if printer not in self.printers:
+                raise RuntimeError(f"printer not found: {printer}")
+            self.opens += 1
+            self._next += 1
+            self._open[self._next] = self._epoch
+            return self._next
+
+    def close(self, handle: Any) -> None:
+        with self._lock:
+            self.closes += 1
+            self._open.pop(handle, None)
+
+    def check(self, handle: Any) -> bool:
+        with self._lock:
+            self.checks += 1
+            return self._open.get(handle) == self._epoch
+
+    def restart(self) -> None:
+        """Рестарт спулера: открытые хэндлы протухают."""
+        with self._lock:
+            self._epoch += 1
+
+    @property
+    def open_handles(self) -> int:
+        with self._lock:
+            return len(self._open)
+
+
+def default_backend() -> HandleBackend:
+    return Win32HandleBackend()
+
+
+# ---------- Пул ----------
+
+class _Slot:
+    __slots__ = ("printer", "handle", "gen", "opened", "used")
+
+    def __init__(self, printer: str, handle: Any, gen: tuple):
+        self.printer = printer
+        self.handle = handle
+        self.gen = gen
+        self.opened = self.used = time.monotonic()
+
+
+class Lease:
+    """Аренда хэндла. Контекстный менеджер; release()/discard() — для явного использования."""
+
+    def __init__(self, pool: "HandlePool", printer: str):
+        self._pool = pool
+        self.printer = printer
+        self._slot: Optional[_Slot] = None
+        self._bad = False
+
+    @property
+    def handle(self) -> Any:
+        if self._slot is None:
+            raise RuntimeError("lease is not active")
+        return self._slot.handle
+
+    def acquire(self) -> Any:
+        if self._slot is None:
+            self._slot = self._pool._take(self.printer)
+        return self._slot.handle
+
+    def discard(self) -> None:
+        """Пометить хэндл как нерабочий: при возврате он будет закрыт."""
+        self._bad = True
+
+    def release(self) -> None:
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._pool._give_back(slot, ok=not self._bad)
+
+    def __enter__(self) -> Any:
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self._bad = True
+        self.release()
+
+
+class HandlePool:
+    """
+    Свободные хэндлы по принтерам + поколение для массовой инвалидации.
+
+    max_idle       — сколько свободных хэндлов держать на принтер;
+    validate_after — простой (сек), после которого хэндл проверяется перед выдачей;
+    max_age        — возраст (сек), после которого хэндл переоткрывается.
+    """
+
+    def __init__(self, backend: Optional[HandleBackend] = None, max_idle: int = 2,
+                 validate_after: float = 5.0, max_age: float = 300.0):
+        self.backend = backend or default_backend()
+        self.max_idle = max(0, int(max_idle))
+        self.validate_after = float(validate_after)
+        self.max_age = float(max_age)
+        self._idle: Dict[str, List[_Slot]] = {}
+        self._gen: Dict[str, int] = {}
+        self._global_gen = 0
+        self._leased = 0
+        self._lock = threading.Lock()
+        self._counters = {"opens": 0, "reuses": 0, "checks": 0, "stale": 0, "discarded": 0, "invalidations": 0}
+
+    def lease(self, printer: str) -> Lease:
+        """Аренда хэндла: `with pool.lease(name) as h: win32print.EnumJobs(h, ...)`."""
+        return Lease(self, printer)
+
+    def invalidate(self, printer: Optional[str] = None) -> None:
+        """Все хэндлы принтера (или всех принтеров) устарели — например, после рестарта спулера."""
+        with self._lock:
+            self._counters["invalidations"] += 1
+            if printer is None:
+                self._global_gen += 1
+                dropped = [s for slots in self._idle.values() for s in slots]
+                self._idle.clear()
+            else:
+                self._gen[printer] = self._gen.get(printer, 0) + 1
+                dropped = self._idle.pop(printer, [])
+        for slot in dropped:
+            self._close(slot)
+
+    def close(self) -> None:
+        """Закрыть свободные хэндлы (остановка демона)."""
+        self.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "leased": self._leased,
+                "idle": {p: len(s) for p, s in self._idle.items() if s},
+                **self._counters,
+            }
+
+    # ---------- внутреннее ----------
+
+    def _current_gen(self, printer: str) -> tuple:
+        return self._global_gen, self._gen.get(printer, 0)
+
+    def _take(self, printer: str) -> _Slot:
+        while True:
+            with self._lock:
+                slots = self._idle.get(printer)
+                slot = slots.pop() if slots else None
+                gen = self._current_gen(printer)
+                if slot is None:
+                    self._counters["opens"] += 1
+                    self._leased += 1
+                    break
+            now = time.monotonic()
+            if now - slot.opened > self.max_age:
+                self._drop(slot, "stale")
+                continue
+            if now - slot.used > self.validate_after:
+                with self._lock:
+                    self._counters["checks"] += 1
+                if not self.backend.check(slot.handle):
+                    self._drop(slot, "stale")
+                    continue
+            with self._lock:
+                self._counters["reuses"] += 1
+                self._leased += 1
+            return slot
+        try:
+            return _Slot(printer, self.backend.open(printer), gen)
+        except Exception:
+            with self._lock:
+                self._leased -= 1
+            raise
+
+    def _give_back(self, slot: _Slot, ok: bool) -> None:
+        slot.used = time.monotonic()
+        with self._lock:
+            self._leased -= 1
+            idle = self._idle.setdefault(slot.printer, [])
+            keep = ok and slot.gen == self._current_gen(slot.printer) and len(idle) < self.max_idle
+            if keep:
+                idle.append(slot)
+            elif not ok:
+                self._counters["discarded"] += 1
+        if not keep:
+            self._close(slot)
+
+    def _drop(self, slot: _Slot, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+        self._close(slot)
+
+    def _close(self, slot: _Slot) -> None:
+        try:
+            self.backend.close(slot.handle)
+        except Exception as e:  # noqa: BLE001 (спулер уже закрыл хэндл сам)
+            logger.debug("handles: close failed for %s: %s", slot.printer, e)
+
+
+_POOL: Optional[HandlePool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> HandlePool:
+    """Общий пул процесса (создаётся при первом обращении)."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = HandlePool()
+        return _POOL
+
+
+def set_pool(pool: Optional[HandlePool]) -> None:
+    """Подменить общий пул (тесты, симулятор). Свободные хэндлы старого пула закрываются."""
+    global _POOL
+    with _POOL_LOCK:
+        old, _POOL = _POOL, pool
+    if old is not None and old is not pool:
+        old.close()
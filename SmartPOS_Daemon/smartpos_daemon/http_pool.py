@@ -0,0 +1,287 @@
+# smartpos_daemon/http_pool.py
+"""
+HTTP-сервер с фиксированным пулом воркеров вместо «поток на соединение».
+
+- Принятые соединения раскладываются по «полосам» (lanes) с ограниченными очередями
+- Полоса выбирается по строке запроса (MSG_PEEK, без чтения тела): лёгкие GET
+  (/health, /status/* и т.п.) идут в быструю полосу, остальное — в основную
+- Поток accept не ждёт строку запроса: соединение, по которому ещё ничего не
+  пришло, уходит потоку-диспетчеру (selectors) и раскладывается, как только
+  станет читаемым; молчащее дольше peek_timeout — в основную полосу. Медленный
+  клиент не задерживает приём остальных
+- Если очередь полосы заполнена — сразу 503 + Retry-After, соединение закрывается
+- Счётчики: глубина очереди, время ожидания воркера, принято/отклонено/обслужено
+
+Только threading, без multiprocessing.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import selectors
+import socket
+import socketserver
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Lane", "PooledHTTPServer", "FAST_PATHS", "FAST_POST_PATHS", "STREAM_PATHS", "classify_fast"]
+
+# GET-пути, которые не трогают спулер надолго и должны отвечать даже под нагрузкой
+FAST_PATHS = ("/health", "/status/", "/faults/status", "/config/get", "/action/jobs", "/spooler/jobs", "/print/raw/", "/profiles", "/metrics")
+
+# POST-пути без спулера (классификация намерений): не ждут плейбуков в main
+FAST_POST_PATHS = ("/intent/",)
+
+# Долгоживущие соединения (SSE / long-poll) — отдельная полоса, чтобы не съедать воркеры main
+STREAM_PATHS = ("/events/", "/spooler/jobs/delta")
+
+
+def classify_fast(method: str, path: str) -> str:
+    """Классификатор по умолчанию: 'stream' для long-poll/SSE, 'fast' для лёгких GET и /intent/, иначе 'main'."""
+    if method == "GET" and path.startswith(STREAM_PATHS):
+        return "stream"
+    if method == "GET" and path.startswith(FAST_PATHS):
+        return "fast"
+    if method == "POST" and path.startswith(FAST_POST_PATHS):
+        return "fast"
+    return "main"
+
+
+class Lane:
+    """Очередь соединений + фиксированное число воркеров."""
+
+    def __init__(self, name: str, workers: int, queue_max: int):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.queue: "queue.Queue[Optional[Tuple[socket.socket, tuple, float]]]" = queue.Queue(maxsize=max(1, int(queue_max)))
+        self.threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.served = 0
+        self.busy = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def offer(self, item: Tuple[socket.socket, tuple, float]) -> bool:
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def _begin(self, enqueued: float) -> None:
+        waited = time.monotonic() - enqueued
+        with self._lock:
+            self.busy += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def _end(self) -> None:
+        with self._lock:
+            self.busy -= 1
+            self.served += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            served = self.served
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queue_depth": self.queue.qsize(),
+                "queue_max": self.queue.maxsize,
+                "queue_depth_max": self.max_depth,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "served": served,
+                "wait_avg_ms": round(1000.0 * self.wait_total / served, 2) if served else 0.0,
+                "wait_max_ms": round(1000.0 * self.wait_max, 2),
+            }
+
+
+class PooledHTTPServer(socketserver.TCPServer):
+    """
+    TCPServer, который обслуживает запросы фиксированными пулами потоков.
+
+    lanes: {"main": (workers, queue_max), "fast": (workers, queue_max), ...}
+    classify(method, path) → имя полосы; неизвестное имя → "main".
+    """
+
+    allow_reuse_address = True
+    peek_timeout = 0.2     # сколько ждать строку запроса для выбора полосы
+    retry_after_sec = 1
+
+    def __init__(self, server_address, handler_class, lanes: Dict[str, Tuple[int, int]],
+                 classify: Callable[[str, str], str] = classify_fast, bind_and_activate: bool = True):
+        self._lanes = {name: Lane(name, w, q) for name, (w, q) in lanes.items()}
+        if "main" not in self._lanes:
+            self._lanes["main"] = Lane("main", 4, 32)
+        self._classify = classify
+        self._incoming: "queue.Queue[Tuple[socket.socket, tuple, float]]" = queue.Queue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._closed = False
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="http-dispatch", daemon=True)
+        self._dispatcher.start()
+        for lane in self._lanes.values():
+            for i in range(lane.workers):
+                t = threading.Thread(target=self._worker, args=(lane,), name=f"http-{lane.name}-{i}", daemon=True)
+                t.start()
+                lane.threads.append(t)
+
+    # ---------- socketserver hooks ----------
+
+    def process_request(self, request, client_address):
+        now = time.monotonic()
+        head = self._peek(request)
+        if head:
+            self._route(request, client_address, now, head)
+            return
+        # строка запроса ещё не пришла — ждёт диспетчер, accept не блокируется
+        self._incoming.put((request, client_address, now))
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def server_close(self):
+        super().server_close()
+        self._closed = True
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+        self._dispatcher.join(1.0)
+        self._wake_r.close()
+        self._wake_w.close()
+        for lane in self._lanes.values():
+            for _ in lane.threads:
+                try:
+                    lane.queue.put(None, timeout=0.5)
+                except queue.Full:
+                    pass
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: lane.stats() for name, lane in self._lanes.items()}
+
+    # ---------- внутреннее ----------
+
+    @staticmethod
+    def _peek(request: socket.socket) -> bytes:
+        """Уже пришедшее начало запроса (MSG_PEEK, без ожидания). Ничего не читаем из сокета."""
+        try:
+            request.setblocking(False)
+            return request.recv(256, socket.MSG_PEEK)
+        except (OSError, ValueError):  # BlockingIOError — данных пока нет
+            return b""
+        finally:
+            try:
+                request.settimeout(None)
+            except OSError:
+                pass
+
+    def _pick_lane(self, head: bytes) -> str:
+        """Полоса по строке запроса; нет строки — "main"."""
+        parts = head.split(b"\r\n", 1)[0].split(b" ")
+        if len(parts) < 2:
+            return "main"
+        method = parts[0].decode("ascii", "replace").upper()
+        path = parts[1].decode("ascii", "replace")
+        return self._classify(method, path)
+
+    def _route(self, request: socket.socket, client_address: tuple, accepted: float, head: bytes) -> None:
+        lane = self._lanes.get(self._pick_lane(head)) or self._lanes["main"]
+        if not lane.offer((request, client_address, accepted)):
+            logger.warning("http_pool: lane %s saturated, 503 to %s", lane.name, client_address[0])
+            self._reject(request)
+            self.shutdown_request(request)
+
+    def _dispatch_loop(self) -> None:
+        """Соединения без строки запроса: раскладываем, когда станут читаемыми или истечёт peek_timeout."""
+        sel = selectors.DefaultSelector()
+        sel.register(self._wake_r, selectors.EVENT_READ)
+        waiting: Dict[socket.socket, Tuple[tuple, float]] = {}
+        try:
+            while not self._closed:
+                now = time.monotonic()
+                timeout = None
+                if waiting:
+                    timeout = max(0.0, min(t for _, t in waiting.values()) + self.peek_timeout - now)
+                ready: List[socket.socket] = []
+                for key, _ in sel.select(timeout):
+                    if key.fileobj is self._wake_r:
+                        try:
+                            while self._wake_r.recv(512):
+                                pass
+                        except OSError:
+                            pass
+                        while True:
+                            try:
+                                request, client_address, accepted = self._incoming.get_nowait()
+                            except queue.Empty:
+                                break
+                            try:
+                                sel.register(request, selectors.EVENT_READ)
+                            except (OSError, ValueError):  # клиент уже закрыл сокет
+                                self.shutdown_request(request)
+                                continue
+                            waiting[request] = (client_address, accepted)
+                    else:
+                        ready.append(key.fileobj)  # type: ignore[arg-type]
+                now = time.monotonic()
+                ready += [r for r, (_, t) in waiting.items() if r not in ready and now - t >= self.peek_timeout]
+                for request in ready:
+                    client_address, accepted = waiting.pop(request)
+                    sel.unregister(request)
+                    self._route(request, client_address, accepted, self._peek(request))
+        finally:
+            for request in waiting:
+                self.shutdown_request(request)
+            while True:
+                try:
+                    self.shutdown_request(self._incoming.get_nowait()[0])
+                except queue.Empty:
+                    break
+            sel.close()
+
+    def _reject(self, request: socket.socket) -> None:
+        body = json.dumps({"error": "busy", "retry_after": self.retry_after_sec}).encode("utf-8")
+        head = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            f"Retry-After: {self.retry_after_sec}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("ascii")
+        try:
+            request.settimeout(1.0)
+            request.sendall(head + body)
+        except OSError:
+            pass
+
+    def _worker(self, lane: Lane) -> None:
+        while True:
+            item = lane.queue.get()
+            if item is None:
+                return
+            request, client_address, enqueued = item
+            lane._begin(enqueued)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:  # noqa: BLE001
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                lane._end()
@@ -0,0 +1,257 @@
+# smartpos_daemon/idempotency.py
+"""
+Идемпотентность запусков плейбуков: повтор того же тикета не повторяет ремонт.
+
+- Ключ — ticket_id + хэш запроса (без ticket_id и служебных полей «_…»): тот же
+  тикет с другим problem_code/device/context — это другой запрос
+- Готовый результат хранится ttl секунд; повтор получает его копию (replayed=True)
+  без обращения к спулеру
+- Повтор, пришедший пока первый запуск ещё идёт, присоединяется к нему
+  (attached=True) и получает его шаги и результат; ждёт не дольше wait_timeout
+  (дальше — AttachTimeout, первый запуск продолжается)
+- Запоминаются только результаты с кодами из cache_codes (по умолчанию FIXED):
+  NOT_FOUND/TIMEOUT/ERROR и прочие отказы при повторе выполняются заново —
+  кассир нажимает «ещё раз» после того, как поправил принтер
+- Хранилище: в памяти (MemoryResultStore) или SQLite (SqliteResultStore) —
+  результаты переживают рестарт демона
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "idempotency_key",
+    "ResultStore",
+    "MemoryResultStore",
+    "SqliteResultStore",
+    "IdempotencyGuard",
+    "AttachTimeout",
+]
+
+Emit = Callable[[Dict[str, Any]], None]
+
+
+def idempotency_key(req: Dict[str, Any]) -> Optional[str]:
+    """«<ticket_id>:<sha1 запроса>»; None — без ticket_id идемпотентности нет."""
+    ticket = req.get("ticket_id")
+    if not ticket:
+        return None
+    basis = {k: v for k, v in req.items() if k != "ticket_id" and not str(k).startswith("_")}
+    raw = json.dumps(basis, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{ticket}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}"
+
+
+# ---------- Хранилища ----------
+
+class ResultStore:
+    """Интерфейс хранилища результатов."""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """(результат, created) или None, если нет или истёк."""
+        raise NotImplementedError
+
+    def put(self, key: str, result: Dict[str, Any], ttl: float) -> None:
+        raise NotImplementedError
+
+    def size(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryResultStore(ResultStore):
+    """Словарь в памяти, не больше max_entries записей (старые вытесняются)."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = int(max_entries)
+        self._items: "OrderedDict[str, Tuple[Dict[str, Any], float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            result, created, expires = item
+            if time.time() >= expires:
+                del self._items[key]
+                return None
+            return result, created
+
+    def put(self, key: str, result: Dict[str, Any], ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._items[key] = (result, now, now + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+
+class SqliteResultStore(ResultStore):
+    """SQLite-файл: результаты переживают рестарт. Истёкшие строки чистятся раз в purge_every записей."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, purge_every: int = 100):
+        self.path = path
+        self.purge_every = int(purge_every)
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires)")
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, created FROM results WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, result: Dict[str, Any], ttl: float) -> None:
+        now = time.time()
+        data = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, result, created, expires) VALUES (?, ?, ?, ?)",
+                (key, data, now, now + ttl),
+            )
+            self._puts += 1
+            if self._puts % self.purge_every == 0:
+                self._db.execute("DELETE FROM results WHERE expires <= ?", (now,))
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results WHERE expires > ?", (time.time(),)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# ---------- Охрана запусков ----------
+
+class AttachTimeout(TimeoutError):
+    """Повтор не дождался результата идущего запуска за wait_timeout."""
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        self.events: List[Dict[str, Any]] = []
+        self.listeners: List[Emit] = []
+
+
+class IdempotencyGuard:
+    """
+    Обёртка запуска плейбука.
+
+    store        — где хранить готовые результаты;
+    ttl          — сколько секунд повтор тикета получает сохранённый результат;
+    cache_codes  — коды результата, которые запоминаются (остальные повтор выполнит заново);
+    wait_timeout — сколько секунд повтор ждёт идущий запуск (None — без ограничения).
+    """
+
+    def __init__(self, store: Optional[ResultStore] = None, ttl: float = 900.0,
+                 cache_codes: Tuple[str, ...] = ("FIXED",), wait_timeout: Optional[float] = 60.0):
+        self.store = store or MemoryResultStore()
+        self.ttl = float(ttl)
+        self.cache_codes = tuple(cache_codes)
+        self.wait_timeout = wait_timeout
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.fresh = 0
+        self.replayed = 0
+        self.attached = 0
+
+    def run(self, req: Dict[str, Any], fn: Callable[[Emit], Dict[str, Any]],
+            on_event: Optional[Emit] = None, wait_timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Выполнить fn(emit) не больше одного раза на ключ за ttl. Повторы помечены replayed/attached.
+        wait_timeout — переопределить self.wait_timeout для этого вызова (например, бюджетом плейбука)."""
+        key = idempotency_key(req)
+        if key is None:
+            return fn(on_event or (lambda ev: None))
+        owner = False
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.attached += 1
+                if on_event:
+                    for ev in flight.events:
+                        on_event(ev)
+                    flight.listeners.append(on_event)
+            else:
+                hit = self.store.get(key)
+                if hit is not None:
+                    self.replayed += 1
+                    result, created = hit
+                    return {**result, "replayed": True, "replayed_age_s": round(time.time() - created, 3)}
+                flight = self._flights[key] = _Flight()
+                if on_event:
+                    flight.listeners.append(on_event)
+                self.fresh += 1
+                owner = True
+        if not owner:
+            timeout = self.wait_timeout if wait_timeout is None else wait_timeout
+            if not flight.done.wait(timeout):
+                with self._lock:
+                    if on_event in flight.listeners:
+                        flight.listeners.remove(on_event)
+                raise AttachTimeout(f"{key}: still running after {timeout}s")
+            if flight.error is not None:
+                raise flight.error
+            return {**(flight.result or {}), "attached": True}
+
+        def emit(ev: Dict[str, Any]) -> None:
+            with self._lock:
+                flight.events.append(ev)
+                listeners = list(flight.listeners)
+            for cb in listeners:
+                try:
+                    cb(ev)
+                except Exception:  # noqa: BLE001
+                    pass
+
+        try:
+            flight.result = fn(emit)
+            if flight.result.get("result_code") in self.cache_codes:
+                self.store.put(key, flight.result, self.ttl)
+        except BaseException as e:  # noqa: BLE001
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {"store": self.store.name, "stored": self.store.size(), "ttl_s": self.ttl, "in_flight": in_flight,
+                "fresh": self.fresh, "replayed": self.replayed, "attached": self.attached}
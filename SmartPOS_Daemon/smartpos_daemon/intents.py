@@ -0,0 +1,119 @@
+# smartpos_daemon/intents.py
+"""
+Классификатор намерений кассира, общий для всех клиентов демона (POST /intent/classify).
+
+- Модель (smartpos.intent_classifier.IntentClassifier) загружается один раз при старте
+  демона: GUI и чат-фронтенды не держат каждый свою копию и не платят за загрузку
+- LRU-кэш по нормализованному запросу (регистр/пробелы не важны): одинаковые фразы
+  кассиров не пересчитываются
+- Пачка запросов — один HTTP-вызов; повторы внутри пачки считаются один раз
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .metrics import get_metrics
+
+__all__ = ["IntentService", "get_intents", "set_intents", "normalize_query"]
+
+
+def normalize_query(text: str) -> str:
+    """Ключ кэша: то же, что нормализация классификатора (нижний регистр, пробелы схлопнуты)."""
+    return " ".join(str(text).lower().split())
+
+
+def _copy(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия результата: вызывающий может менять свой экземпляр, не трогая кэш."""
+    out = type(res)(res)
+    out["alternatives"] = [dict(a) for a in res.get("alternatives") or []]
+    return out
+
+
+class IntentService:
+    """Тёплый классификатор + LRU-кэш результатов (потокобезопасно)."""
+
+    def __init__(self, classifier: Any, cache_size: int = 1024, max_batch: int = 256, load_s: Optional[float] = None):
+        self.classifier = classifier
+        self.cache_size = max(0, int(cache_size))
+        self.max_batch = max(1, int(max_batch))
+        self.load_s = load_s
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        key = normalize_query(text)
+        with self._lock:
+            res = self._cache.get(key)
+            if res is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+        metrics = get_metrics()
+        if res is not None:
+            metrics.inc("smartpos_intent_cache_total", {"result": "hit"})
+            return _copy(res)
+        t0 = time.perf_counter()
+        res = self.classifier.classify_intent(key)
+        metrics.observe("smartpos_intent_classify_seconds", time.perf_counter() - t0)
+        metrics.inc("smartpos_intent_cache_total", {"result": "miss"})
+        with self._lock:
+            self._misses += 1
+            if self.cache_size:
+                self._cache[key] = res
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return _copy(res)
+
+    def classify_many(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Результаты в порядке запросов; одинаковые (после нормализации) считаются один раз."""
+        if len(texts) > self.max_batch:
+            raise ValueError(f"too many texts: {len(texts)} > {self.max_batch}")
+        done: Dict[str, Dict[str, Any]] = {}
+        out = []
+        for text in texts:
+            key = normalize_query(text)
+            if key not in done:
+                done[key] = self.classify(key)
+                out.append(done[key])
+            else:
+                out.append(_copy(done[key]))
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        index = getattr(self.classifier, "index", None)
+        with self._lock:
+            return {
+                "cache_size": len(self._cache),
+                "cache_max": self.cache_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "phrases": len(index) if index is not None else None,
+                "artifact": getattr(self.classifier, "kb", None) is not None,
+                "load_s": self.load_s,
+            }
+
+
+_INTENTS: Optional[IntentService] = None
+_INTENTS_LOCK = threading.Lock()
+
+
+def get_intents() -> Optional[IntentService]:
+    """Классификатор процесса; None — модель не загружена (load_intents в serve_forever)."""
+    with _INTENTS_LOCK:
+        return _INTENTS
+
+
+def set_intents(service: Optional[IntentService]) -> None:
+    global _INTENTS
+    with _INTENTS_LOCK:
+        _INTENTS = service
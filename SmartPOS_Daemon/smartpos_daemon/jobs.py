@@ -0,0 +1,176 @@
+# smartpos_daemon/jobs.py
+"""
+Асинхронные задания плейбуков для POST /action/run?async=1.
+
+- Запрос сразу получает job_id, сам плейбук выполняется в ограниченном пуле потоков
+- GET /action/jobs/{id} отдаёт состояние задания и прогресс по шагам
+- Очередь ограничена: при переполнении submit() бросает JobQueueFull (→ HTTP 503)
+- Завершённые задания хранятся keep_sec секунд (не более keep_max штук)
+
+Только threading, без multiprocessing.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Job", "JobManager", "JobQueueFull"]
+
+# runner(req, on_step) → dict результата плейбука
+Runner = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], None]], Dict[str, Any]]
+
+
+class JobQueueFull(RuntimeError):
+    """Все воркеры заняты и очередь ожидания заполнена."""
+
+
+class Job:
+    """Состояние одного асинхронного запуска плейбука."""
+
+    def __init__(self, req: Dict[str, Any]):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.ticket_id = req.get("ticket_id")
+        self.problem_code = req.get("problem_code")
+        self.state = "queued"  # queued → running → done | error
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.planned: List[str] = []
+        self.current: Optional[str] = None
+        self.steps: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def on_step(self, event: Dict[str, Any]) -> None:
+        """Колбэк прогресса из run_playbook: plan / start / done."""
+        kind = event.get("event")
+        with self._lock:
+            if kind == "plan":
+                self.planned = list(event.get("steps") or [])
+            elif kind == "start":
+                self.current = event.get("step")
+            elif kind == "done":
+                self.current = None
+                self.steps.append({
+                    "step": event.get("step"),
+                    "name": event.get("name"),
+                    "evidence": event.get("evidence") or {},
+                    "at": round(time.time() - (self.started or self.created), 3),
+                })
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            done = len(self.steps)
+            return {
+                "job_id": self.job_id,
+                "ticket_id": self.ticket_id,
+                "problem_code": self.problem_code,
+                "state": self.state,
+                "progress": {"done": done, "total": len(self.planned) or done, "current": self.current},
+                "planned": list(self.planned),
+                "steps": list(self.steps),
+                "queued_s": round((self.started or time.time()) - self.created, 3),
+                "elapsed_s": round((self.finished or time.time()) - self.started, 3) if self.started else 0.0,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobManager:
+    """
+    Ограниченный исполнитель плейбуков.
+
+    max_workers  — сколько плейбуков выполняется одновременно;
+    max_pending  — сколько заданий может ждать свободного воркера;
+    keep_sec/keep_max — сколько хранить завершённые задания для GET /action/jobs/{id}.
+    """
+
+    def __init__(self, runner: Runner, max_workers: int = 2, max_pending: int = 16,
+                 keep_sec: float = 600.0, keep_max: int = 256):
+        self._runner = runner
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="playbook")
+        self._slots = threading.BoundedSemaphore(max(1, int(max_workers)) + max(0, int(max_pending)))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.keep_sec = float(keep_sec)
+        self.keep_max = int(keep_max)
+
+    def submit(self, req: Dict[str, Any]) -> Job:
+        """Поставить плейбук в очередь. JobQueueFull — если мест нет."""
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull("playbook queue is full")
+        job = Job(req)
+        with self._lock:
+            self._gc_locked()
+            self._jobs[job.job_id] = job
+        try:
+            self._pool.submit(self._run, job, req)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            raise
+        logger.info("jobs: queued %s (%s, ticket=%s)", job.job_id, job.problem_code, job.ticket_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [{"job_id": j.job_id, "problem_code": j.problem_code, "state": j.state} for j in jobs]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            states = [j.state for j in self._jobs.values()]
+        return {
+            "queued": states.count("queued"),
+            "running": states.count("running"),
+            "done": states.count("done"),
+            "error": states.count("error"),
+        }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait)
+
+    # ---------- внутреннее ----------
+
+    def _run(self, job: Job, req: Dict[str, Any]) -> None:
+        job.state = "running"
+        job.started = time.time()
+        try:
+            job.result = self._runner(req, job.on_step)
+            job.state = "done"
+        except Exception as e:  # noqa: BLE001
+            logger.error("jobs: %s failed: %s", job.job_id, e)
+            job.error = str(e)
+            job.state = "error"
+        finally:
+            job.finished = time.time()
+            self._slots.release()
+            logger.info("jobs: %s %s in %.2fs", job.job_id, job.state, job.finished - job.started)
+
+    def _gc_locked(self) -> None:
+        """Удалить старые завершённые задания (вызывать под self._lock)."""
+        now = time.time()
+        for jid in list(self._jobs):
+            j = self._jobs[jid]
+            if j.finished and now - j.finished > self.keep_sec:
+                del self._jobs[jid]
+        while len(self._jobs) > self.keep_max:
+            oldest = next((jid for jid, j in self._jobs.items() if j.finished), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
@@ -0,0 +1,266 @@
+# smartpos_daemon/layout.py
+"""
+Профили ширины ленты и предкомпилированные ESC/POS-макеты.
+
+- LayoutProfile — ширина бумаги, символов в строке, кодовая страница и замены
+  символов (кодирует через codepages.Transcoder); неизменяемый, поэтому годится в ключ кэша
+- Template — макет чека: строки с полями {name}. Поля профиля ({paper_mm}, {chars},
+  {rule}, {ruler}) подставляются при компиляции, остальные — при печати
+- compile_template() один раз на (макет, профиль, кодовая страница) кодирует весь
+  статический текст в байты; render() склеивает готовые куски и кодирует только
+  значения полей. Строка, переросшая ширину, переносится (wrap) — тогда она
+  собирается заново, это редкий путь
+- wrap() / columns() / two_columns() — перенос и колонки под 32 и 48 символов
+"""
+
+from __future__ import annotations
+
+import string
+import textwrap
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from .codepages import Transcoder, get_transcoder
+
+__all__ = [
+    "DEFAULT_CODEPAGE",
+    "ESC_INIT",
+    "ESC_CUT",
+    "LayoutProfile",
+    "PROFILE_58",
+    "PROFILE_80",
+    "Template",
+    "CompiledTemplate",
+    "compile_template",
+    "render",
+    "wrap",
+    "columns",
+    "two_columns",
+    "cache_stats",
+    "clear_cache",
+]
+
+DEFAULT_CODEPAGE = "cp866"
+ESC_INIT = b"\x1b@"
+ESC_CUT = b"\x1dV\x01"  # GS V 1 — частичная отрезка
+
+
+@dataclass(frozen=True)
+class LayoutProfile:
+    paper_mm: int
+    chars_per_line: int
+    codepage: str = DEFAULT_CODEPAGE
+    substitutions: Tuple[Tuple[str, str], ...] = ()  # поверх codepages.DEFAULT_SUBSTITUTIONS
+    transcoder: Transcoder = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "transcoder", get_transcoder(self.codepage, dict(self.substitutions)))
+
+    def encode(self, text: str) -> bytes:
+        return self.transcoder.encode(text)
+
+    @property
+    def dots(self) -> int:
+        """Ширина печати в точках (203 dpi): 58 мм — 384, 80 мм — 576."""
+        return {58: 384, 80: 576}.get(self.paper_mm, self.chars_per_line * 12)
+
+
+PROFILE_58 = LayoutProfile(58, 32)
+PROFILE_80 = LayoutProfile(80, 48)
+
+
+# ---------- Перенос и колонки ----------
+
+def wrap(text: str, width: Union[int, LayoutProfile]) -> List[str]:
+    """Перенос по словам под ширину (длинные слова режутся). Пустая строка → [""]."""
+    w = width.chars_per_line if isinstance(width, LayoutProfile) else int(width)
+    out: List[str] = []
+    for para in str(text).split("\n"):
+        out.extend(textwrap.wrap(para, w, break_long_words=True, break_on_hyphens=False) or [""])
+    return out
+
+
+def columns(cells: Sequence[Any], widths: Sequence[int], align: str = "") -> str:
+    """Одна строка колонками фиксированной ширины; align — по символу на колонку ('<', '>', '^')."""
+    out = []
+    for i, (cell, w) in enumerate(zip(cells, widths)):
+        a = align[i] if i < len(align) else "<"
+        out.append(f"{str(cell)[:w]:{a}{w}}")
+    return "".join(out)
+
+
+def two_columns(left: Any, right: Any, width: Union[int, LayoutProfile]) -> str:
+    """«Товар ........ 123.00»: правая колонка прижата к краю, левая обрезается."""
+    w = width.chars_per_line if isinstance(width, LayoutProfile) else int(width)
+    right = str(right)[:w]
+    room = w - len(right) - 1
+    if room <= 0:
+        return right.rjust(w)
+    return str(left)[:room].ljust(room) + " " + right
+
+
+# ---------- Макеты ----------
+
+class Template:
+    """
+    Макет чека. lines — строки текста с полями {name[:spec]} или готовые байты
+    (ESC/POS-команды вставляются как есть). feed — пустых строк в конце.
+    """
+
+    def __init__(self, name: str, lines: Sequence[Union[str, bytes]], init: bool = True,
+                 feed: int = 3, cut: bool = False):
+        self.name = name
+        self.lines = tuple(lines)
+        self.init = init
+        self.feed = int(feed)
+        self.cut = cut
+        self.key = (name, self.lines, init, self.feed, cut)
+
+
+class _Line:
+    """Строка со слотами: куски [(bytes, text) | (None, (field, spec, conv))]."""
+
+    __slots__ = ("parts", "static_len")
+
+    def __init__(self, parts: List[Tuple[Optional[bytes], Any]], static_len: int):
+        self.parts = parts
+        self.static_len = static_len
+
+
+class CompiledTemplate:
+    """Макет под конкретный профиль: статические байты + строки со слотами."""
+
+    def __init__(self, template: Template, profile: LayoutProfile, chunks: List[Union[bytes, _Line]]):
+        self.template = template
+        self.profile = profile
+        self.chunks = chunks
+        self.fields = sorted({f[0] for c in chunks if isinstance(c, _Line) for b, f in c.parts if b is None})
+
+    def render(self, **values: Any) -> bytes:
+        out: List[bytes] = []
+        width = self.profile.chars_per_line
+        enc = self.profile.encode
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                out.append(chunk)
+                continue
+            texts = [_field_text(values, *f) if b is None else None for b, f in chunk.parts]
+            if chunk.static_len + sum(len(t) for t in texts if t is not None) <= width:
+                out.extend(b if b is not None else enc(t) for (b, _), t in zip(chunk.parts, texts))
+                out.append(b"\n")
+            else:
+                line = "".join(t if t is not None else f for (_, f), t in zip(chunk.parts, texts))
+                out.append(enc("\n".join(wrap(line, width)) + "\n"))
+        return b"".join(out)
+
+
+_FORMATTER = string.Formatter()
+
+
+def _field_text(values: Dict[str, Any], name: str, spec: str, conv: Optional[str]) -> str:
+    """
+    Текст поля {name!conv:spec}. Незаданное поле печатается пустым: спецификация
+    держит ширину колонки, а числовая («.2f») к пустому значению не применяется.
+    """
+    if name not in values:
+        try:
+            return format("", spec)
+        except ValueError:
+            return ""
+    value = values[name]
+    if conv:
+        value = _FORMATTER.convert_field(value, conv)
+    return format(value, spec)
+
+
+def _profile_fields(profile: LayoutProfile) -> Dict[str, Any]:
+    n = profile.chars_per_line
+    return {
+        "paper_mm": profile.paper_mm,
+        "chars": n,
+        "rule": "-" * n,
+        "ruler": ("1234567890" * (n // 10))[:n],
+    }
+
+
+def _compile(template: Template, profile: LayoutProfile) -> CompiledTemplate:
+    static = _profile_fields(profile)
+    chunks: List[Union[bytes, _Line]] = []
+    pending: List[bytes] = [ESC_INIT] if template.init else []
+
+    def flush() -> None:
+        if pending:
+            chunks.append(b"".join(pending))
+            pending.clear()
+
+    for line in template.lines:
+        if isinstance(line, bytes):
+            pending.append(line)
+            continue
+        parts: List[Tuple[Optional[bytes], Any]] = []
+        text = ""
+        for literal, field, spec, conv in _FORMATTER.parse(line):
+            text += literal
+            if field is None:
+                continue
+            if field in static:
+                value = static[field]
+                text += format(_FORMATTER.convert_field(value, conv) if conv else value, spec or "")
+                continue
+            parts.append((profile.encode(text), text))
+            text = ""
+            parts.append((None, (field, spec or "", conv)))
+        if not parts:
+            # полностью статическая строка: переносим и кодируем один раз
+            pending.append(profile.encode("\n".join(wrap(text, profile.chars_per_line)) + "\n"))
+            continue
+        parts.append((profile.encode(text), text))
+        flush()
+        chunks.append(_Line(parts, sum(len(t) for b, t in parts if b is not None)))
+    pending.append(b"\n" * template.feed)
+    if template.cut:
+        pending.append(ESC_CUT)
+    flush()
+    return CompiledTemplate(template, profile, chunks)
+
+
+_CACHE: "OrderedDict[Tuple[Any, LayoutProfile], CompiledTemplate]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_CACHE_MAX = 64
+_stats = {"hits": 0, "misses": 0}
+
+
+def compile_template(template: Template, profile: LayoutProfile) -> CompiledTemplate:
+    """Скомпилированный макет из кэша (ключ — макет + профиль, включая кодовую страницу)."""
+    key = (template.key, profile)
+    with _CACHE_LOCK:
+        compiled = _CACHE.get(key)
+        if compiled is not None:
+            _CACHE.move_to_end(key)
+            _stats["hits"] += 1
+            return compiled
+        _stats["misses"] += 1
+    compiled = _compile(template, profile)
+    with _CACHE_LOCK:
+        _CACHE[key] = compiled
+        while len(_CACHE) > _CACHE_MAX:
+            _CACHE.popitem(last=False)
+    return compiled
+
+
+def render(template: Template, profile: LayoutProfile, **values: Any) -> bytes:
+    """Байты чека: скомпилированный макет + значения полей."""
+    return compile_template(template, profile).render(**values)
+
+
+def cache_stats() -> Dict[str, int]:
+    with _CACHE_LOCK:
+        return {"size": len(_CACHE), **_stats}
+
+
+def clear_cache() -> None:
+    with _CACHE_LOCK:
+        _CACHE.clear()
+        _stats.update(hits=0, misses=0)
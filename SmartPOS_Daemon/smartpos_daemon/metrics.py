@@ -0,0 +1,234 @@
+# smartpos_daemon/metrics.py
+"""
+Метрики демона: задержки плейбуков и шагов, коды результатов, вызовы Win32.
+
+- Summary (задержки): последние window наблюдений на серию → p50/p95/p99,
+  плюс сумма и счётчик за всё время
+- Counter: монотонные счётчики (коды результатов, вызовы Win32 и их время)
+- render() — текстовый формат экспозиции Prometheus (GET /metrics)
+- step_timing(): учёт времени внутри шага по потоку — wait_until и вызовы
+  через winapi-прокси добавляют сюда своё время (ожидания / Win32)
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+__all__ = [
+    "QUANTILES",
+    "quantile",
+    "StepClock",
+    "MetricsRegistry",
+    "step_timing",
+    "current_clock",
+    "note_time",
+    "get_metrics",
+    "set_metrics",
+]
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, Any]]) -> Labels:
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+
+def _fmt_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')  # noqa: E731
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    v = float(v)
+    if math.isnan(v):
+        return "NaN"
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """Квантиль по отсортированной выборке (ближайший ранг). Пусто → NaN."""
+    if not sorted_values:
+        return float("nan")
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+class _Summary:
+    __slots__ = ("window", "count", "total")
+
+    def __init__(self, size: int):
+        self.window: Deque[float] = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+
+class MetricsRegistry:
+    """
+    Потокобезопасный реестр метрик.
+
+    window — сколько последних наблюдений каждой серии держать для квантилей.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.window = int(window)
+        self._summaries: Dict[str, Dict[Labels, _Summary]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            s = series.get(key)
+            if s is None:
+                s = series[key] = _Summary(self.window)
+            s.window.append(float(value))
+            s.count += 1
+            s.total += float(value)
+
+    def inc(self, name: str, labels: Optional[Dict[str, Any]] = None, value: float = 1.0) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._summaries.clear()
+            self._counters.clear()
+
+    # ---------- чтение ----------
+
+    def summary(self, name: str, labels: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+        """{"count", "sum", "p50", "p95", "p99"} серии (count=0 — наблюдений не было)."""
+        with self._lock:
+            s = self._summaries.get(name, {}).get(_labels(labels))
+            values = sorted(s.window) if s else []
+            count, total = (s.count, s.total) if s else (0, 0.0)
+        out = {"count": count, "sum": total}
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}"] = quantile(values, q)
+        return out
+
+    def counter(self, name: str, labels: Optional[Dict[str, Any]] = None) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0.0)
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        with self._lock:
+            summaries = {n: {k: (sorted(s.window), s.count, s.total) for k, s in series.items()}
+                         for n, series in self._summaries.items()}
+            counters = {n: dict(series) for n, series in self._counters.items()}
+        lines: List[str] = []
+        for name in sorted(summaries):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} summary")
+            for key, (values, count, total) in sorted(summaries[name].items()):
+                for q in QUANTILES:
+                    lines.append(f"{name}{_fmt_labels(key, (('quantile', str(q)),))} {_fmt_value(quantile(values, q))}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {count}")
+        for name in sorted(counters):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ---------- Учёт времени внутри шага ----------
+
+class StepClock:
+    """Разбивка времени шага: ожидания (wait_until) и вызовы Win32."""
+
+    __slots__ = ("started", "duration_s", "wait_s", "win32_s", "win32_calls")
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.duration_s = 0.0
+        self.wait_s = 0.0
+        self.win32_s = 0.0
+        self.win32_calls = 0
+
+    def breakdown(self) -> Dict[str, float]:
+        return {"wait_s": round(self.wait_s, 4), "win32_s": round(self.win32_s, 4),
+                "win32_calls": self.win32_calls,
+                "other_s": round(max(0.0, self.duration_s - self.wait_s - self.win32_s), 4)}
+
+
+_local = threading.local()
+
+
+@contextmanager
+def step_timing() -> Iterator[StepClock]:
+    """Засечь шаг в текущем потоке; по выходу clock.duration_s заполнен."""
+    clock = StepClock()
+    prev = getattr(_local, "clock", None)
+    _local.clock = clock
+    try:
+        yield clock
+    finally:
+        clock.duration_s = time.monotonic() - clock.started
+        _local.clock = prev
+
+
+def current_clock() -> Optional[StepClock]:
+    """Засечка шага текущего потока (None — поток не внутри step_timing)."""
+    return getattr(_local, "clock", None)
+
+
+def note_time(kind: str, seconds: float) -> None:
+    """Добавить время к засечке текущего потока: kind = "wait" | "win32". Без засечки — no-op."""
+    clock = getattr(_local, "clock", None)
+    if clock is None:
+        return
+    if kind == "wait":
+        clock.wait_s += seconds
+    elif kind == "win32":
+        clock.win32_s += seconds
+        clock.win32_calls += 1
+
+
+_METRICS: Optional[MetricsRegistry] = None
+_METRICS_LOCK = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Общий реестр метрик процесса (создаётся при первом обращении)."""
+    global _METRICS
+    with _METRICS_LOCK:
+        if _METRICS is None:
+            _METRICS = MetricsRegistry()
+            _METRICS.describe("smartpos_playbook_duration_seconds", "Playbook wall time by problem_code")
+            _METRICS.describe("smartpos_playbook_results_total", "Playbook runs by problem_code and result_code")
+            _METRICS.describe("smartpos_step_duration_seconds", "Playbook step wall time")
+            _METRICS.describe("smartpos_step_wait_seconds_total", "Time steps spent in wait_until")
+            _METRICS.describe("smartpos_step_win32_seconds_total", "Time steps spent in Win32 calls")
+            _METRICS.describe("smartpos_win32_calls_total", "Win32 spooler/service API calls")
+            _METRICS.describe("smartpos_win32_call_seconds_total", "Time spent in Win32 API calls")
+            _METRICS.describe("smartpos_win32_errors_total", "Win32 API calls that raised")
+        return _METRICS
+
+
+def set_metrics(registry: Optional[MetricsRegistry]) -> None:
+    """Подменить общий реестр (тесты)."""
+    global _METRICS
+    with _METRICS_LOCK:
+        _METRICS = registry
@@ -0,0 +1,298 @@
+# smartpos_daemon/outcomes.py
+"""
+Журнал исходов плейбуков в SQLite и аналитика по нему.
+
+- Каждый выполненный плейбук (не повтор и не склеенный запрос) — строка runs:
+  ticket_id, problem_code, принтер, result_code, время, evidence; его шаги — строки
+  steps с таймингами (duration_s / wait_s / win32_s из StepResult)
+- Запись пачками в фоновом потоке: record() только кладёт исход в буфер,
+  одна транзакция на batch_size исходов или раз в flush_sec секунд
+- Индексы по problem_code, printer и времени; записи старше keep_days удаляются
+- Запросы: MTTR по коду проблемы, успешность шагов, частота отказов по принтерам —
+  чтобы решать, какие шаги плейбуков убрать или переставить, по реальным данным
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["OutcomeStore", "get_outcomes", "set_outcomes", "FIXED_CODES"]
+
+# Какие result_code считаются «починено»
+FIXED_CODES = ("FIXED",)
+
+# Сколько исходов держать в буфере, пока база не пишется (заблокирована / диск полон)
+MAX_PENDING = 10000
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS runs ("
+    " id INTEGER PRIMARY KEY, ticket_id TEXT, problem_code TEXT NOT NULL, printer TEXT NOT NULL,"
+    " result_code TEXT NOT NULL, started REAL NOT NULL, finished REAL NOT NULL, elapsed_s REAL,"
+    " evidence TEXT)",
+    "CREATE INDEX IF NOT EXISTS runs_code_time ON runs (problem_code, finished)",
+    "CREATE INDEX IF NOT EXISTS runs_printer_time ON runs (printer, finished)",
+    "CREATE INDEX IF NOT EXISTS runs_time ON runs (finished)",
+    "CREATE INDEX IF NOT EXISTS runs_ticket ON runs (ticket_id, printer)",
+    "CREATE TABLE IF NOT EXISTS steps ("
+    " run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE, idx INTEGER NOT NULL,"
+    " step TEXT NOT NULL, name TEXT, ok INTEGER NOT NULL, duration_s REAL, wait_s REAL, win32_s REAL,"
+    " PRIMARY KEY (run_id, idx))",
+    "CREATE INDEX IF NOT EXISTS steps_step ON steps (step)",
+)
+
+_FAILED_STEP_SUFFIXES = ("_error", "_timeout", "_failed")
+
+
+def _step_rows(result: Dict[str, Any]) -> List[Tuple[Any, ...]]:
+    """(idx, step, name, ok, duration_s, wait_s, win32_s) по timings + actions_done результата."""
+    names = list(result.get("actions_done") or [])
+    rows = []
+    for i, t in enumerate(result.get("timings") or []):
+        name = names[i] if i < len(names) else None
+        ok = 0 if name is None or str(name).endswith(_FAILED_STEP_SUFFIXES) else 1
+        rows.append((i, t.get("step"), name, ok, t.get("duration_s"), t.get("wait_s"), t.get("win32_s")))
+    return rows
+
+
+class OutcomeStore:
+    """
+    SQLite-журнал исходов.
+
+    path       — файл базы (":memory:" — только в памяти, для тестов);
+    batch_size — сколько исходов копить до записи;
+    flush_sec  — не держать исход в буфере дольше этого;
+    keep_days  — сколько дней хранить историю.
+    """
+
+    def __init__(self, path: str, batch_size: int = 32, flush_sec: float = 1.0, keep_days: float = 90.0):
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_sec = float(flush_sec)
+        self.keep_days = float(keep_days)
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA foreign_keys=ON")
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        for stmt in _SCHEMA:
+            self._db.execute(stmt)
+        self._db_lock = threading.Lock()
+        self._pending: List[Tuple[Dict[str, Any], str, float]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._last_purge = 0.0
+        self._writer = threading.Thread(target=self._loop, name="outcomes-writer", daemon=True)
+        self._writer.start()
+
+    # ---------- запись ----------
+
+    def record(self, result: Dict[str, Any], printer: str, finished: Optional[float] = None) -> None:
+        """Положить исход плейбука в буфер (запишется фоновым потоком)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._pending.append((result, printer, finished or time.time()))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """Записать буфер сейчас. Возвращает, сколько исходов записано."""
+        with self._cond:
+            batch, self._pending = self._pending, []
+        return self._write(batch)
+
+    def _flush_quietly(self) -> bool:
+        """flush() для фоновой записи и аналитики: ошибка SQLite логируется, исходы остаются в буфере."""
+        with self._cond:
+            batch, self._pending = self._pending, []
+        try:
+            self._write(batch)
+            return True
+        except Exception as e:  # noqa: BLE001 (sqlite3.Error, OSError — база заблокирована, диск полон)
+            self.write_errors += 1
+            logger.error("outcomes: write of %d runs failed (kept for retry): %s", len(batch), e)
+            with self._cond:
+                self._pending[:0] = batch
+                dropped = len(self._pending) - MAX_PENDING
+                if dropped > 0:
+                    del self._pending[:dropped]
+                    logger.error("outcomes: buffer full, %d oldest runs dropped", dropped)
+        return False
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join(timeout=5.0)
+        self._flush_quietly()
+        with self._db_lock:
+            self._db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+        return {"path": self.path, "pending": pending, "written": self.written, "batches": self.batches,
+                "write_errors": self.write_errors}
+
+    # ---------- аналитика ----------
+
+    def mttr(self, since: float = 0.0, problem_code: Optional[str] = None,
+             printer: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Время до починки по тикетам: от начала первого запуска тикета на принтере
+        до конца первого запуска с FIXED. По problem_code: mttr_s, попытки, нерешённые.
+        """
+        where, args = self._where(since, problem_code, printer)
+        fixed = ",".join("?" * len(FIXED_CODES))
+        sql = (
+            "SELECT problem_code, COUNT(*), AVG(repair_s), MAX(repair_s), AVG(attempts), SUM(fixed_at IS NULL) FROM ("
+            "  SELECT problem_code,"
+            f"   MIN(CASE WHEN result_code IN ({fixed}) THEN finished END) AS fixed_at,"
+            f"   MIN(CASE WHEN result_code IN ({fixed}) THEN finished END) - MIN(started) AS repair_s,"
+            "   COUNT(*) AS attempts"
+            f"  FROM runs WHERE ticket_id IS NOT NULL AND {where}"
+            "  GROUP BY ticket_id, printer, problem_code"
+            ") GROUP BY problem_code ORDER BY problem_code"
+        )
+        rows = self._query(sql, (*FIXED_CODES, *FIXED_CODES, *args))
+        return {"since": since, "problems": [
+            {"problem_code": code, "tickets": n, "mttr_s": _r(avg), "max_s": _r(mx),
+             "attempts_avg": _r(att), "unresolved": int(unres or 0)}
+            for code, n, avg, mx, att, unres in rows
+        ]}
+
+    def step_success(self, since: float = 0.0, problem_code: Optional[str] = None,
+                     printer: Optional[str] = None) -> Dict[str, Any]:
+        """По шагу (и коду проблемы): сколько раз выполнялся, доля успешных, время, доля ожиданий."""
+        where, args = self._where(since, problem_code, printer, alias="r")
+        sql = (
+            "SELECT r.problem_code, s.step, COUNT(*), SUM(s.ok), AVG(s.duration_s), MAX(s.duration_s),"
+            " SUM(s.wait_s), SUM(s.win32_s), SUM(s.duration_s),"
+            f" SUM(r.result_code IN ({','.join('?' * len(FIXED_CODES))}))"
+            f" FROM steps s JOIN runs r ON r.id = s.run_id WHERE {where}"
+            " GROUP BY r.problem_code, s.step ORDER BY r.problem_code, MIN(s.idx)"
+        )
+        rows = self._query(sql, (*FIXED_CODES, *args))
+        return {"since": since, "steps": [
+            {"problem_code": code, "step": step, "runs": n, "ok": int(ok or 0),
+             "success_rate": _r((ok or 0) / n), "avg_s": _r(avg), "max_s": _r(mx),
+             "wait_share": _r((wait or 0) / total) if total else None,
+             "win32_share": _r((w32 or 0) / total) if total else None,
+             "run_fixed_rate": _r((fixed or 0) / n)}
+            for code, step, n, ok, avg, mx, wait, w32, total, fixed in rows
+        ]}
+
+    def printer_failures(self, since: float = 0.0, problem_code: Optional[str] = None) -> Dict[str, Any]:
+        """По принтеру: запуски, отказы (не FIXED), доля, разбивка по result_code, последний отказ."""
+        where, args = self._where(since, problem_code, None)
+        rows = self._query(
+            f"SELECT printer, result_code, COUNT(*), MAX(finished) FROM runs WHERE {where}"
+            " GROUP BY printer, result_code ORDER BY printer", args,
+        )
+        per: Dict[str, Dict[str, Any]] = {}
+        for printer, code, n, last in rows:
+            p = per.setdefault(printer, {"printer": printer, "runs": 0, "failures": 0, "by_result": {},
+                                         "last_failure": None})
+            p["runs"] += n
+            p["by_result"][code] = n
+            if code not in FIXED_CODES:
+                p["failures"] += n
+                p["last_failure"] = max(p["last_failure"] or 0.0, last)
+        out = sorted(per.values(), key=lambda p: (-p["failures"], p["printer"]))
+        for p in out:
+            p["failure_rate"] = _r(p["failures"] / p["runs"])
+        return {"since": since, "printers": out}
+
+    # ---------- внутреннее ----------
+
+    def _where(self, since: float, problem_code: Optional[str], printer: Optional[str],
+               alias: str = "") -> Tuple[str, Tuple[Any, ...]]:
+        col = f"{alias}." if alias else ""
+        parts, args = [f"{col}finished >= ?"], [float(since)]
+        if problem_code:
+            parts.append(f"{col}problem_code = ?")
+            args.append(problem_code)
+        if printer:
+            parts.append(f"{col}printer = ?")
+            args.append(printer)
+        return " AND ".join(parts), tuple(args)
+
+    def _query(self, sql: str, args: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+        self._flush_quietly()  # свежие исходы видны в аналитике сразу; сбой записи — не 500 на GET
+        with self._db_lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._cond.wait(self.flush_sec)
+                closed = self._closed
+            if not self._flush_quietly() and not closed:
+                with self._cond:
+                    self._cond.wait(self.flush_sec)  # база недоступна — не крутиться вхолостую
+            if closed:
+                return
+
+    def _write(self, batch: List[Tuple[Dict[str, Any], str, float]]) -> int:
+        if not batch:
+            return 0
+        with self._db_lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            try:
+                for result, printer, finished in batch:
+                    elapsed = result.get("elapsed_s")
+                    cur.execute(
+                        "INSERT INTO runs (ticket_id, problem_code, printer, result_code, started, finished,"
+                        " elapsed_s, evidence) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (result.get("ticket_id"), result.get("problem_code") or "", printer,
+                         result.get("result_code") or "UNKNOWN", finished - float(elapsed or 0.0), finished,
+                         elapsed, json.dumps(result.get("evidence") or {}, ensure_ascii=False, default=str)),
+                    )
+                    run_id = cur.lastrowid
+                    cur.executemany(
+                        "INSERT INTO steps (run_id, idx, step, name, ok, duration_s, wait_s, win32_s)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(run_id, *row) for row in _step_rows(result)],
+                    )
+                now = time.time()
+                if now - self._last_purge > 3600.0:
+                    cur.execute("DELETE FROM runs WHERE finished < ?", (now - self.keep_days * 86400.0,))
+                    self._last_purge = now
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        self.written += len(batch)
+        self.batches += 1
+        return len(batch)
+
+
+def _r(v: Optional[float]) -> Optional[float]:
+    return None if v is None else round(float(v), 3)
+
+
+_OUTCOMES: Optional[OutcomeStore] = None
+_OUTCOMES_LOCK = threading.Lock()
+
+
+def get_outcomes() -> Optional[OutcomeStore]:
+    """Журнал исходов процесса; None — журнал не включён (set_outcomes в serve_forever)."""
+    with _OUTCOMES_LOCK:
+        return _OUTCOMES
+
+
+def set_outcomes(store: Optional[OutcomeStore]) -> None:
+    global _OUTCOMES
+    with _OUTCOMES_LOCK:
+        _OUTCOMES = store
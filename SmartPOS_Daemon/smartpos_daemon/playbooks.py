@@ -0,0 +1,316 @@
+# smartpos_daemon/playbooks.py
+"""
+Декларативные плейбуки: config/playbooks.json → граф шагов (DAG).
+
+- Файл валидируется при старте (неизвестные действия, дубли id, висячие
+  зависимости, циклы → PlaybookError); при изменении файла перечитывается
+  без рестарта демона, а невалидная правка логируется и игнорируется
+- Шаг без "after" ждёт предыдущий шаг списка; "after": [] — корень графа
+- readonly-шаги с выполненными зависимостями идут параллельно;
+  изменяющие шаги — строго по одному и в порядке объявления
+- Один и тот же файл используют run_daemon.py и smartpos_daemon/router.py,
+  реестр действий у каждого свой
+- Время: "budget_sec" плейбука — общий бюджет запроса (иначе request_timeout_sec
+  демона), "timeout_sec" шага — его личный предел, отсчитываемый с фактического
+  старта шага (а не с постановки в общий пул). Шаг, не уложившийся в предел,
+  или не начатый до дедлайна, получает результат TIMEOUT
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .waits import Deadline
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "PlaybookError",
+    "Step",
+    "PlaybookStore",
+    "DEFAULT_PLAYBOOKS_PATH",
+    "execute",
+    "select_variant",
+]
+
+DEFAULT_PLAYBOOKS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "playbooks.json")
+
+# Пул шагов с лимитом времени и параллельных readonly-проб. Общий для всех плейбуков:
+# при запуске на несколько принтеров (fleet) шаги разных принтеров идут одновременно
+_STEP_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="pb-step")
+
+
+class PlaybookError(ValueError):
+    """Невалидное описание плейбуков."""
+
+
+@dataclass(frozen=True)
+class Step:
+    id: str
+    action: str
+    after: Tuple[str, ...] = ()
+    readonly: bool = False
+    args: Dict[str, Any] = field(default_factory=dict)
+    timeout_sec: Optional[float] = None
+
+    def kwargs(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        """args шага; строки форматируются полями запроса ({problem_code}, {ticket_id})."""
+        ctx = {"problem_code": req.get("problem_code", ""), "ticket_id": req.get("ticket_id", "")}
+        return {k: (v.format(**ctx) if isinstance(v, str) else v) for k, v in self.args.items()}
+
+
+def select_variant(req: Dict[str, Any]) -> Optional[str]:
+    """Вариант плейбука из запроса: context.purge, либо context.beautify=true == "hard"."""
+    ctx = req.get("context") or {}
+    return ctx.get("purge") or ("hard" if ctx.get("beautify") is True else None)
+
+
+def _parse_steps(code: str, raw: Any, actions: Dict[str, Callable]) -> List[Step]:
+    if not isinstance(raw, list) or not raw:
+        raise PlaybookError(f"{code}: steps must be a non-empty list")
+    steps: List[Step] = []
+    seen: Dict[str, Step] = {}
+    for i, item in enumerate(raw):
+        if not isinstance(item, dict) or "action" not in item:
+            raise PlaybookError(f"{code}: step #{i} must be an object with 'action'")
+        action = item["action"]
+        if action not in actions:
+            raise PlaybookError(f"{code}: unknown action '{action}'")
+        sid = str(item.get("id") or action)
+        if sid in seen:
+            raise PlaybookError(f"{code}: duplicate step id '{sid}'")
+        if "after" in item:
+            after = tuple(item["after"] or ())
+        else:
+            after = (steps[-1].id,) if steps else ()
+        for dep in after:
+            if dep not in seen:
+                raise PlaybookError(f"{code}: step '{sid}' depends on unknown or later step '{dep}'")
+        timeout = item.get("timeout_sec")
+        if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise PlaybookError(f"{code}: step '{sid}' timeout_sec must be a positive number")
+        step = Step(sid, action, after, bool(item.get("readonly", False)), dict(item.get("args") or {}),
+                    float(timeout) if timeout is not None else None)
+        steps.append(step)
+        seen[sid] = step
+    # зависимости только на ранее объявленные шаги → граф ацикличен по построению
+    return steps
+
+
+def parse_budgets(doc: Dict[str, Any]) -> Dict[str, float]:
+    """budget_sec плейбуков (только заданные)."""
+    out: Dict[str, float] = {}
+    for code, spec in (doc.get("playbooks") or {}).items():
+        budget = spec.get("budget_sec") if isinstance(spec, dict) else None
+        if budget is None:
+            continue
+        if not isinstance(budget, (int, float)) or budget <= 0:
+            raise PlaybookError(f"{code}: budget_sec must be a positive number")
+        out[code] = float(budget)
+    return out
+
+
+def parse(doc: Dict[str, Any], actions: Dict[str, Callable]) -> Dict[str, Dict[str, List[Step]]]:
+    """JSON-документ → {code: {None: steps, "soft": steps, ...}}. Бросает PlaybookError."""
+    if not isinstance(doc, dict) or not isinstance(doc.get("playbooks"), dict):
+        raise PlaybookError("root must contain 'playbooks' object")
+    book: Dict[str, Dict[Optional[str], List[Step]]] = {}
+    for code, spec in doc["playbooks"].items():
+        if not isinstance(spec, dict):
+            raise PlaybookError(f"{code}: playbook must be an object")
+        variants: Dict[Optional[str], List[Step]] = {None: _parse_steps(code, spec.get("steps"), actions)}
+        for name, raw in (spec.get("variants") or {}).items():
+            variants[name] = _parse_steps(f"{code}/{name}", raw, actions)
+        book[code] = variants
+    return book
+
+
+class PlaybookStore:
+    """
+    Плейбуки из JSON-файла с горячей перезагрузкой по mtime.
+
+    actions — реестр {имя действия: функция(req, **args) → StepResult}.
+    """
+
+    def __init__(self, actions: Dict[str, Callable], path: str = DEFAULT_PLAYBOOKS_PATH, check_every: float = 1.0):
+        self.actions = dict(actions)
+        self.path = path
+        self.check_every = float(check_every)
+        self._lock = threading.Lock()
+        self._mtime = 0.0
+        self._checked = 0.0
+        self._book: Dict[str, Dict[Optional[str], List[Step]]] = {}
+        self._budgets: Dict[str, float] = {}
+        self.reload(strict=True)
+
+    def reload(self, strict: bool = False) -> bool:
+        """Перечитать файл. strict=True — ошибка валидации пробрасывается (старт демона)."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            book = parse(doc, self.actions)
+            budgets = parse_budgets(doc)
+        except (OSError, ValueError) as e:
+            if strict:
+                raise PlaybookError(f"{self.path}: {e}") from e
+            logger.error("playbooks: reload of %s rejected, keeping previous version: %s", self.path, e)
+            try:
+                self._mtime = os.path.getmtime(self.path)  # не перечитывать ту же битую правку
+            except OSError:
+                pass
+            return False
+        with self._lock:
+            self._book = book
+            self._budgets = budgets
+            self._mtime = mtime
+        logger.info("playbooks: loaded %d playbooks from %s", len(book), self.path)
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.check_every:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def codes(self) -> List[str]:
+        self._maybe_reload()
+        with self._lock:
+            return list(self._book)
+
+    def steps_for(self, req: Dict[str, Any]) -> List[Step]:
+        """Шаги для запроса с учётом варианта (context.purge / beautify). Неизвестный код → []."""
+        self._maybe_reload()
+        with self._lock:
+            variants = self._book.get(req.get("problem_code", ""), {})
+        variant = select_variant(req)
+        return list(variants.get(variant) or variants.get(None) or [])
+
+    def budget_for(self, req: Dict[str, Any], default: float) -> float:
+        """Бюджет времени запроса: budget_sec плейбука или default (request_timeout_sec демона)."""
+        with self._lock:
+            return self._budgets.get(req.get("problem_code", ""), float(default))
+
+    def describe(self, code: str, variant: Optional[str] = None) -> List[str]:
+        with self._lock:
+            variants = self._book.get(code, {})
+        return [s.action for s in (variants.get(variant) or variants.get(None) or [])]
+
+
+def execute(steps: List[Step], run_step: Callable[[Step], Any],
+            notify: Callable[[Dict[str, Any]], None] = lambda ev: None,
+            deadline: Optional[Deadline] = None,
+            on_timeout: Optional[Callable[[Step, Dict[str, Any]], Any]] = None) -> List[Tuple[Step, Any]]:
+    """
+    Выполнить граф шагов. run_step(step) → StepResult (исключения обрабатывает сам).
+    Возвращает [(step, StepResult)] в порядке объявления. После terminal-шага новые
+    шаги не запускаются (уже запущенные readonly-пробы дожидаемся).
+
+    Время (если задан deadline или timeout_sec шага, нужен on_timeout(step, info) → StepResult):
+    - шаг, не начатый до дедлайна, не запускается — сразу TIMEOUT;
+    - шаг, превысивший свой timeout_sec (с момента фактического старта) или дедлайн,
+      получает TIMEOUT; ещё не начатый в пуле шаг отменяется, начатый readonly
+      дорабатывает в фоне;
+    - изменяющий шаг после TIMEOUT прекращает плейбук, но execute возвращается только
+      когда он действительно закончится: очередь принтера не отпускается, пока в
+      спулере идёт изменение.
+    """
+    order = {s.id: i for i, s in enumerate(steps)}
+    pending = list(steps)
+    done: Dict[str, Any] = {}
+    running: Dict[Future, Step] = {}
+    started: Dict[str, float] = {}  # step.id → monotonic фактического старта в пуле
+    abandoned: List[Future] = []    # брошенные изменяющие шаги: дождаться перед выходом
+    stop = False
+    timed = on_timeout is not None and (deadline is not None or any(s.timeout_sec for s in steps))
+
+    def _finish(step: Step, out: Any) -> None:
+        nonlocal stop
+        done[step.id] = out
+        notify({"event": "done", "step": step.action, "id": step.id, "name": out.name, "evidence": out.evidence,
+                "duration_s": getattr(out, "duration_s", None)})
+        stop = stop or bool(out.terminal)
+
+    def _run(step: Step) -> Any:
+        started[step.id] = time.monotonic()
+        return run_step(step)
+
+    def _limit(step: Step, now: float) -> Optional[float]:
+        """Предел шага; для ещё не начатого — самый ранний возможный (когда проснуться и проверить)."""
+        limits = []
+        if step.timeout_sec:
+            limits.append(started.get(step.id, now) + step.timeout_sec)
+        if deadline is not None:
+            limits.append(deadline.at)
+        return min(limits) if limits else None
+
+    def _expired(step: Step, now: float) -> bool:
+        if deadline is not None and deadline.at <= now:
+            return True
+        t0 = started.get(step.id)
+        return bool(step.timeout_sec) and t0 is not None and t0 + step.timeout_sec <= now
+
+    while True:
+        if not stop:
+            mutating_busy = any(not s.readonly for s in running.values())
+            batch: List[Step] = []
+            for step in pending:
+                if not all(dep in done for dep in step.after):
+                    continue
+                if not step.readonly:
+                    if mutating_busy:
+                        continue
+                    mutating_busy = True
+                batch.append(step)
+            for step in batch:
+                pending.remove(step)
+                if timed and deadline is not None and deadline.expired():
+                    _finish(step, on_timeout(step, {"reason": "budget", "skipped": True, "budget_s": deadline.budget}))
+                    continue
+                notify({"event": "start", "step": step.action, "id": step.id})
+                if len(batch) == 1 and not running and not timed:
+                    # единственный готовый шаг без лимитов — выполняем в текущем потоке, без пула
+                    _finish(step, run_step(step))
+                else:
+                    running[_STEP_POOL.submit(_run, step)] = step
+            if batch and not running:
+                continue
+        if not running:
+            if pending and not stop:
+                logger.error("playbooks: unschedulable steps %s", [s.id for s in pending])
+            break
+        now = time.monotonic()
+        limits = [lim for lim in (_limit(s, now) for s in running.values()) if lim is not None]
+        timeout = max(0.0, min(limits) - now) if limits else None
+        finished, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in sorted(finished, key=lambda f: order[running[f].id]):
+            _finish(running.pop(fut), fut.result())
+        now = time.monotonic()
+        for fut in [f for f, s in running.items() if _expired(s, now)]:
+            step = running.pop(fut)
+            reason = "budget" if deadline is not None and deadline.at <= now else "step_limit"
+            skipped = fut.cancel()  # ещё ждал свободного потока пула — не начнётся вовсе
+            logger.warning("playbooks: step %s abandoned after timeout (%s)", step.id, reason)
+            out = on_timeout(step, {"reason": reason, "skipped": skipped, "limit_s": step.timeout_sec})
+            if not step.readonly:
+                out.terminal = True  # изменяющий шаг ещё работает в фоне — дальше по графу идти нельзя
+                if not skipped:
+                    abandoned.append(fut)
+            _finish(step, out)
+    if abandoned:
+        logger.warning("playbooks: waiting for %d abandoned mutating step(s) to finish", len(abandoned))
+        wait(abandoned)
+    return sorted(((s, done[s.id]) for s in steps if s.id in done), key=lambda p: order[p[0].id])
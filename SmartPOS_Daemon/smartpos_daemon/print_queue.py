@@ -0,0 +1,337 @@
+# smartpos_daemon/print_queue.py
+"""
+Очередь RAW-печати чеков для POST /print/raw.
+
+- На каждый принтер — своя FIFO-очередь и один поток-писатель: чеки уходят в
+  спулер строго в порядке приёма (чеки одного запроса ставятся подряд, атомарно)
+- Подряд идущие мелкие чеки (≤ small_bytes, batch=True) склеиваются в один джоб
+  спулера (до batch_max_count штук / batch_max_bytes байт): в час пик не платим
+  StartDoc/EndDoc и перечисление очереди на каждый чек
+- Каждый чек получает подтверждение: состояние, номер джоба, размер пачки, время
+- Очередь ограничена: при переполнении submit() бросает PrintQueueFull (→ HTTP 503)
+- Каждый джоб пишется внутри gate() (в демоне — ворота службы спулера): рестарт и
+  полная очистка спулера ждут недописанный документ, а новые джобы ждут рестарт
+
+Только threading, без multiprocessing.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Deque, Dict, Iterable, List, Optional, Tuple
+
+from .handles import HandlePool, get_pool as get_handle_pool
+from .winapi import win32print
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "PrintQueueFull",
+    "Receipt",
+    "PrintSink",
+    "WinspoolSink",
+    "FakePrintSink",
+    "PrintQueue",
+]
+
+DOC_NAME = "SMARTPOS_RAW"
+
+
+class PrintQueueFull(RuntimeError):
+    """Очередь принтера заполнена."""
+
+
+class Receipt:
+    """Один чек в очереди и его подтверждение."""
+
+    def __init__(self, printer: str, data: bytes, receipt_id: Optional[str] = None, batch: bool = True):
+        self.receipt_id = receipt_id or uuid.uuid4().hex[:12]
+        self.printer = printer
+        self.data = bytes(data)
+        self.batch = bool(batch)
+        self.seq = 0
+        self.state = "queued"  # queued → printing → printed | error
+        self.job_id: Optional[int] = None
+        self.batch_size = 0
+        self.error: Optional[str] = None
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.done = threading.Event()
+
+    def finish(self, job_id: Optional[int], batch_size: int, error: Optional[str]) -> None:
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.error = error
+        self.state = "error" if error else "printed"
+        self.finished = time.monotonic()
+        self.done.set()
+
+    def ack(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "receipt_id": self.receipt_id,
+            "seq": self.seq,
+            "state": self.state,
+            "ok": self.state == "printed",
+            "job_id": self.job_id,
+            "batch_size": self.batch_size,
+            "bytes": len(self.data),
+            "queued_s": round((self.started or now) - self.created, 3),
+            "print_s": round((self.finished or now) - self.started, 3) if self.started else 0.0,
+            "error": self.error,
+        }
+
+
+# ---------- Куда печатаем ----------
+
+class PrintSink:
+    """Интерфейс вывода: один вызов write() — один джоб спулера."""
+
+    name = "base"
+
+    def write(self, printer: str, document: str, data: bytes) -> Optional[int]:
+        """Напечатать data одним RAW-джобом. Возвращает JobId; исключение — джоб не создан."""
+        raise NotImplementedError
+
+
+class WinspoolSink(PrintSink):
+    """StartDoc/WritePrinter/EndDoc через пул хэндлов (pywin32 или симулятор)."""
+
+    name = "winspool"
+
+    def __init__(self, api: Any = None, pool: Optional[HandlePool] = None):
+        self.api = api or win32print
+        self.pool = pool
+
+    def write(self, printer: str, document: str, data: bytes) -> Optional[int]:
+        if not self.api:
+            raise RuntimeError("win32print missing")
+        with (self.pool or get_handle_pool()).lease(printer) as h:
+            job_id = self.api.StartDocPrinter(h, 1, (document, None, "RAW"))
+            closed = False
+            try:
+                self.api.StartPagePrinter(h)
+                self.api.WritePrinter(h, data)
+                self.api.EndPagePrinter(h)
+                self.api.EndDocPrinter(h)
+                closed = True
+            finally:
+                if not closed:
+                    # недописанный документ не должен «залипнуть» в очереди и занять хэндл пула
+                    try:
+                        self.api.AbortDocPrinter(h)
+                    except Exception as e:  # noqa: BLE001
+                        logger.debug("print_queue: AbortDocPrinter(%s, job %s) failed: %s", printer, job_id, e)
+            return job_id
+
+
+class FakePrintSink(PrintSink):
+    """Фейковый принтер для тестов: запоминает джобы, hold() задерживает печать."""
+
+    name = "fake"
+
+    def __init__(self) -> None:
+        self.jobs: List[Tuple[str, str, bytes]] = []
+        self.fail_next = 0
+        self._gate = threading.Event()
+        self._gate.set()
+        self._lock = threading.Lock()
+
+    def hold(self) -> None:
+        self._gate.clear()
+
+    def release(self) -> None:
+        self._gate.set()
+
+    def write(self, printer: str, document: str, data: bytes) -> Optional[int]:
+        self._gate.wait(5.0)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise OSError("printer offline")
+            self.jobs.append((printer, document, data))
+            return len(self.jobs)
+
+
+# ---------- Очередь ----------
+
+class _Lane:
+    """Очередь одного принтера."""
+
+    def __init__(self, printer: str):
+        self.printer = printer
+        self.pending: Deque[Receipt] = deque()
+        self.cond = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.seq = 0
+        self.receipts = 0
+        self.jobs = 0
+        self.batched = 0   # чеков, ушедших не отдельным джобом
+        self.errors = 0
+        self.bytes = 0
+
+
+class PrintQueue:
+    """
+    Очереди печати по принтерам.
+
+    small_bytes      — чек не больше этого можно склеивать с соседями;
+    batch_max_count  — сколько чеков максимум в одном джобе;
+    batch_max_bytes  — сколько байт максимум в одном джобе;
+    linger_sec       — сколько писатель ждёт продолжения пачки, если очередь опустела;
+    queue_max        — сколько чеков может ждать печати на одном принтере;
+    keep_max         — сколько подтверждений хранить для GET /print/raw/{id};
+    gate             — контекст вокруг каждой записи джоба (None — без ворот).
+    """
+
+    def __init__(self, sink: Optional[PrintSink] = None, small_bytes: int = 2048,
+                 batch_max_count: int = 16, batch_max_bytes: int = 16384, linger_sec: float = 0.0,
+                 queue_max: int = 256, keep_max: int = 1024,
+                 gate: Optional[Callable[[], ContextManager[Any]]] = None):
+        self.sink = sink or WinspoolSink()
+        self.gate = gate or nullcontext
+        self.small_bytes = int(small_bytes)
+        self.batch_max_count = max(1, int(batch_max_count))
+        self.batch_max_bytes = int(batch_max_bytes)
+        self.linger_sec = float(linger_sec)
+        self.queue_max = max(1, int(queue_max))
+        self.keep_max = int(keep_max)
+        self._lanes: Dict[str, _Lane] = {}
+        self._recent: "OrderedDict[str, Receipt]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, printer: str, items: Iterable[Tuple[bytes, Optional[str], bool]]) -> List[Receipt]:
+        """Поставить чеки (data, receipt_id, batch) в очередь принтера подряд. PrintQueueFull — нет мест."""
+        receipts = [Receipt(printer, data, rid, batch) for data, rid, batch in items]
+        lane = self._lane(printer)
+        with lane.cond:
+            if self._closed:
+                raise PrintQueueFull("print queue is closed")
+            if len(lane.pending) + len(receipts) > self.queue_max:
+                raise PrintQueueFull(f"print queue for {printer} is full")
+            for r in receipts:
+                lane.seq += 1
+                r.seq = lane.seq
+                lane.pending.append(r)
+            lane.receipts += len(receipts)
+            lane.cond.notify()
+        with self._lock:
+            for r in receipts:
+                self._recent[r.receipt_id] = r
+            while len(self._recent) > self.keep_max:
+                self._recent.popitem(last=False)
+        return receipts
+
+    def wait(self, receipts: List[Receipt], timeout: float) -> List[Dict[str, Any]]:
+        """Дождаться подтверждений (до timeout на всё). Неготовые — с текущим состоянием."""
+        end = time.monotonic() + max(0.0, float(timeout))
+        for r in receipts:
+            if not r.done.wait(max(0.0, end - time.monotonic())):
+                break
+        return [r.ack() for r in receipts]
+
+    def get(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            r = self._recent.get(receipt_id)
+        return r.ack() if r else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lanes = list(self._lanes.values())
+        out: Dict[str, Any] = {"sink": self.sink.name, "printers": {}}
+        for lane in lanes:
+            with lane.cond:
+                out["printers"][lane.printer] = {
+                    "pending": len(lane.pending),
+                    "receipts": lane.receipts,
+                    "jobs": lane.jobs,
+                    "batched": lane.batched,
+                    "errors": lane.errors,
+                    "bytes": lane.bytes,
+                }
+        return out
+
+    def close(self) -> None:
+        """Новые чеки не принимаются; уже принятые допечатываются."""
+        self._closed = True
+        with self._lock:
+            lanes = list(self._lanes.values())
+        for lane in lanes:
+            with lane.cond:
+                lane.cond.notify_all()
+
+    # ---------- внутреннее ----------
+
+    def _lane(self, printer: str) -> _Lane:
+        with self._lock:
+            lane = self._lanes.get(printer)
+            if lane is None:
+                lane = self._lanes[printer] = _Lane(printer)
+                lane.thread = threading.Thread(target=self._writer, args=(lane,), name=f"print-{printer}", daemon=True)
+                lane.thread.start()
+            return lane
+
+    def _batchable(self, r: Receipt) -> bool:
+        return r.batch and len(r.data) <= self.small_bytes
+
+    def _take(self, lane: _Lane) -> List[Receipt]:
+        """Голова очереди + идущие за ней мелкие чеки (под lane.cond)."""
+        head = lane.pending.popleft()
+        batch = [head]
+        if not self._batchable(head):
+            return batch
+        size = len(head.data)
+        until = time.monotonic() + self.linger_sec
+        while len(batch) < self.batch_max_count:
+            if not lane.pending:
+                left = until - time.monotonic()
+                if left <= 0 or self._closed:
+                    break
+                lane.cond.wait(left)
+                continue
+            nxt = lane.pending[0]
+            if not self._batchable(nxt) or size + len(nxt.data) > self.batch_max_bytes:
+                break
+            batch.append(lane.pending.popleft())
+            size += len(nxt.data)
+        return batch
+
+    def _writer(self, lane: _Lane) -> None:
+        while True:
+            with lane.cond:
+                while not lane.pending and not self._closed:
+                    lane.cond.wait()
+                if not lane.pending:
+                    return
+                batch = self._take(lane)
+            self._print(lane, batch)
+
+    def _print(self, lane: _Lane, batch: List[Receipt]) -> None:
+        now = time.monotonic()
+        for r in batch:
+            r.state, r.started = "printing", now
+        document = DOC_NAME if len(batch) == 1 else f"{DOC_NAME} x{len(batch)}"
+        data = b"".join(r.data for r in batch)
+        try:
+            with self.gate():
+                job_id, error = self.sink.write(lane.printer, document, data), None
+        except Exception as e:  # noqa: BLE001
+            # пачку не делим и не повторяем: часть могла уйти на бумагу — дубли хуже отказа
+            job_id, error = None, str(e)
+            logger.warning("print_queue: %s on %s failed: %s", document, lane.printer, e)
+        with lane.cond:
+            lane.jobs += 1
+            lane.bytes += len(data)
+            if len(batch) > 1:
+                lane.batched += len(batch)
+            if error:
+                lane.errors += len(batch)
+        for r in batch:
+            r.finish(job_id, len(batch), error)
@@ -0,0 +1,311 @@
+# smartpos_daemon/profiles.py
+"""
+Реестр профилей печати (ширина, символов в строке, кодовая страница) по принтерам.
+
+- У каждого принтера свой LayoutProfile: параллельные PR0006/PR0017 на разных
+  принтерах больше не перетирают общий _current_profile
+- Источники профиля по приоритету: заданный явно (set: playbook/manual/fault) →
+  определённый автоматически (не старше ttl) → профиль по умолчанию.
+  Явно заданный профиль бессрочен — до следующего set() или reset()
+- Неудачное определение тоже запоминается на ttl (source="default"): принтер,
+  который не отвечает, не опрашивается заново на каждом get()
+- Автоопределение (ProfileDetector): ширина бумаги из DEVMODE драйвера,
+  модель по ESC/POS-запросу GS I 67 (для сетевых портов, TCP 9100) или по имени
+  драйвера; одно определение на принтер за раз
+- Реестр сохраняется в JSON (атомарная запись), после рестарта демона
+  определённые профили не перепроверяются, пока не истёк ttl
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .handles import HandlePool, get_pool as get_handle_pool
+from .layout import DEFAULT_CODEPAGE, PROFILE_80, LayoutProfile
+from .winapi import win32print
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "MODEL_WIDTHS",
+    "profile_for_width",
+    "query_escpos_model",
+    "ProfileDetector",
+    "Win32ProfileDetector",
+    "ProfileRegistry",
+    "get_registry",
+    "set_registry",
+    "DEFAULT_PROFILES_PATH",
+]
+
+DEFAULT_PROFILES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "printer_profiles.json")
+
+# Подстрока модели/драйвера (без регистра) → ширина бумаги, мм
+MODEL_WIDTHS = (
+    ("ELLIX", 80), ("TM-T88", 80), ("TM-T20", 80), ("TM-M30", 80), ("TM-P20", 58), ("TM-P60", 58),
+    ("XP-58", 58), ("XP-80", 80), ("POS-58", 58), ("POS-80", 80), ("RP58", 58), ("RP80", 80),
+    ("MPRINT G58", 58), ("MPRINT G80", 80), ("ATOL 30F", 58), ("ATOL 55F", 80),
+)
+
+_IP_PORT = re.compile(r"(?:IP_)?(\d{1,3}(?:\.\d{1,3}){3})(?::(\d+))?$")
+
+
+def profile_for_width(paper_mm: float, codepage: str = DEFAULT_CODEPAGE) -> LayoutProfile:
+    """58-мм лента — 32 символа, всё шире — 80 мм / 48 символов."""
+    return LayoutProfile(58, 32, codepage) if paper_mm <= 60 else LayoutProfile(80, 48, codepage)
+
+
+def _model_width(text: str) -> Optional[int]:
+    up = (text or "").upper()
+    for needle, mm in MODEL_WIDTHS:
+        if needle in up:
+            return mm
+    return None
+
+
+def query_escpos_model(host: str, port: int = 9100, timeout: float = 1.0) -> Optional[str]:
+    """GS I 67 — имя модели (ответ «_<имя>\\0»). None — принтер не ответил."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as s:
+            s.settimeout(timeout)
+            s.sendall(b"\x1dI\x43")
+            buf = b""
+            while b"\x00" not in buf and len(buf) < 128:
+                chunk = s.recv(64)
+                if not chunk:
+                    break
+                buf += chunk
+    except OSError:
+        return None
+    name = buf.split(b"\x00", 1)[0].lstrip(b"_").decode("ascii", errors="ignore").strip()
+    return name or None
+
+
+# ---------- Определение ----------
+
+class ProfileDetector:
+    """Интерфейс автоопределения профиля принтера."""
+
+    name = "base"
+
+    def detect(self, printer: str) -> Optional[Tuple[LayoutProfile, Dict[str, Any]]]:
+        """(профиль, улики) или None — определить не удалось."""
+        raise NotImplementedError
+
+
+class Win32ProfileDetector(ProfileDetector):
+    """GetPrinter(2): DEVMODE.dmPaperWidth → ESC/POS GS I 67 (сетевой порт) → имя драйвера."""
+
+    name = "win32"
+
+    def __init__(self, api: Any = None, pool: Optional[HandlePool] = None, query_timeout: float = 1.0):
+        self.api = api or win32print
+        self.pool = pool
+        self.query_timeout = query_timeout
+
+    def detect(self, printer: str) -> Optional[Tuple[LayoutProfile, Dict[str, Any]]]:
+        if not self.api:
+            return None
+        with (self.pool or get_handle_pool()).lease(printer) as h:
+            info = self.api.GetPrinter(h, 2)
+        devmode = info.get("pDevMode")
+        width = devmode.get("PaperWidth") if isinstance(devmode, dict) else getattr(devmode, "PaperWidth", 0)
+        if width:
+            return profile_for_width(width / 10.0), {"via": "devmode", "paper_width_mm": width / 10.0}
+        m = _IP_PORT.match(str(info.get("pPortName") or ""))
+        if m:
+            model = query_escpos_model(m.group(1), int(m.group(2) or 9100), self.query_timeout)
+            mm = _model_width(model or "")
+            if mm:
+                return profile_for_width(mm), {"via": "escpos", "model": model}
+        driver = str(info.get("pDriverName") or "")
+        mm = _model_width(driver) or _model_width(printer)
+        if mm:
+            return profile_for_width(mm), {"via": "driver", "driver": driver}
+        return None
+
+
+# ---------- Реестр ----------
+
+# Записи, которым верим не дольше ttl: результат определения (удачного или нет)
+_EXPIRING = ("detected", "default")
+
+def _to_json(profile: LayoutProfile) -> Dict[str, Any]:
+    return {
+        "paper_mm": profile.paper_mm,
+        "chars_per_line": profile.chars_per_line,
+        "codepage": profile.codepage,
+        "substitutions": [list(p) for p in profile.substitutions],
+    }
+
+
+def _from_json(d: Dict[str, Any]) -> LayoutProfile:
+    return LayoutProfile(
+        int(d["paper_mm"]), int(d["chars_per_line"]), str(d.get("codepage") or DEFAULT_CODEPAGE),
+        tuple((str(a), str(b)) for a, b in d.get("substitutions") or ()),
+    )
+
+
+class ProfileRegistry:
+    """
+    Профили по принтерам.
+
+    path        — JSON-файл реестра (None — только в памяти);
+    default     — профиль принтера, о котором ничего не известно;
+    detector    — автоопределение (None — не определять);
+    ttl         — сколько секунд верить определённому профилю;
+    auto_detect — get() сам определяет профиль, если записи нет или она устарела.
+    """
+
+    def __init__(self, path: Optional[str] = None, default: LayoutProfile = PROFILE_80,
+                 detector: Optional[ProfileDetector] = None, ttl: float = 86400.0, auto_detect: bool = True):
+        self.path = path
+        self.default = default
+        self.detector = detector
+        self.ttl = float(ttl)
+        self.auto_detect = auto_detect
+        self.detections = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._detect_locks: Dict[str, threading.Lock] = {}
+        self._load()
+
+    # ---------- чтение ----------
+
+    def get(self, printer: str) -> LayoutProfile:
+        """Профиль принтера: заданный → определённый (свежий) → определить → по умолчанию."""
+        with self._lock:
+            e = self._entries.get(printer)
+            if e and self._valid(e):
+                return e["profile"]
+        if self.auto_detect and self.detector is not None:
+            found = self.detect(printer)
+            if found is not None:
+                return found
+        return self.default
+
+    def entry(self, printer: str) -> Dict[str, Any]:
+        """Профиль с происхождением: source (manual/playbook/fault/detected/default), age_s, evidence."""
+        profile = self.get(printer)
+        with self._lock:
+            e = self._entries.get(printer)
+            if e is None or e["profile"] != profile or not self._valid(e):
+                return {"printer": printer, **_to_json(profile), "source": "default", "age_s": None, "evidence": {}}
+            return {"printer": printer, **_to_json(profile), "source": e["source"],
+                    "age_s": round(time.time() - e["ts"], 1), "evidence": e.get("evidence") or {}}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            names = list(self._entries)
+        return {"default": _to_json(self.default), "ttl_s": self.ttl, "detections": self.detections,
+                "printers": {n: self.entry(n) for n in names}}
+
+    # ---------- запись ----------
+
+    def set(self, printer: str, profile: LayoutProfile, source: str = "manual",
+            evidence: Optional[Dict[str, Any]] = None) -> LayoutProfile:
+        with self._lock:
+            self._entries[printer] = {"profile": profile, "source": source, "ts": time.time(),
+                                      "evidence": evidence or {}}
+        self._save()
+        return profile
+
+    def reset(self, printer: Optional[str] = None) -> None:
+        """Забыть профиль принтера (или всех): следующий get() определит заново."""
+        with self._lock:
+            if printer is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(printer, None)
+        self._save()
+
+    def detect(self, printer: str, force: bool = False) -> Optional[LayoutProfile]:
+        """Определить профиль (или взять определённый не старше ttl). None — не удалось."""
+        if self.detector is None:
+            return None
+        with self._lock:
+            lock = self._detect_locks.setdefault(printer, threading.Lock())
+        with lock:  # параллельные запросы одного принтера ждут одно определение
+            with self._lock:
+                e = self._entries.get(printer)
+                if not force and e and e["source"] in _EXPIRING and self._valid(e):
+                    return e["profile"] if e["source"] == "detected" else None
+            try:
+                found = self.detector.detect(printer)
+            except Exception as ex:  # noqa: BLE001
+                logger.debug("profiles: detect %s failed: %s", printer, ex)
+                found = None
+            with self._lock:
+                self.detections += 1
+            with self._lock:
+                e = self._entries.get(printer)
+                explicit = bool(e) and e["source"] not in _EXPIRING
+            if found is None:
+                if not explicit:  # не определили — по умолчанию, и не переспрашиваем до истечения ttl
+                    self.set(printer, self.default, "default", {"via": "detect_failed"})
+                return None
+            profile, evidence = found
+            if explicit and not force:
+                return profile  # явно заданный профиль определение не перетирает
+            return self.set(printer, profile, "detected", evidence)
+
+    # ---------- внутреннее ----------
+
+    def _valid(self, e: Dict[str, Any]) -> bool:
+        return e["source"] not in _EXPIRING or time.time() - e["ts"] < self.ttl
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            for name, d in (doc.get("printers") or {}).items():
+                self._entries[name] = {"profile": _from_json(d), "source": d.get("source", "manual"),
+                                       "ts": float(d.get("ts", 0)), "evidence": d.get("evidence") or {}}
+        except Exception as e:  # noqa: BLE001
+            logger.warning("profiles: cannot read %s: %s", self.path, e)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            doc = {"version": 1, "printers": {
+                n: {**_to_json(e["profile"]), "source": e["source"], "ts": e["ts"], "evidence": e["evidence"]}
+                for n, e in self._entries.items()
+            }}
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(doc, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("profiles: cannot write %s: %s", self.path, e)
+
+
+_REGISTRY: Optional[ProfileRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> ProfileRegistry:
+    """Общий реестр процесса (создаётся при первом обращении)."""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = ProfileRegistry(DEFAULT_PROFILES_PATH, detector=Win32ProfileDetector())
+        return _REGISTRY
+
+
+def set_registry(registry: Optional[ProfileRegistry]) -> None:
+    """Подменить общий реестр (тесты, другой файл)."""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        _REGISTRY = registry
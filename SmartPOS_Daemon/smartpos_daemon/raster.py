@@ -0,0 +1,330 @@
+# smartpos_daemon/raster.py
+"""
+Растровая печать логотипов и картинок: ESC/POS GS v 0.
+
+- Вход: PGM/PPM/PBM (netpbm, без зависимостей) или любой формат через Pillow, если он есть
+- Оттенки серого → масштаб под ширину профиля в точках (58 мм — 384, 80 мм — 576)
+  → дизеринг (Флойд–Стейнберг или упорядоченный Байер 8×8) → упаковка по 8 точек
+  в байт → полосы GS v 0 по band_rows строк (буфер принтера не переполняется)
+- NumPy (если установлен) векторизует перевод в серый, масштаб, упорядоченный
+  дизеринг и упаковку (np.packbits). Флойд–Стейнберг последователен по природе —
+  ошибка идёт вправо по строке, поэтому он считается построчно в чистом Python
+- Результат кладётся в дисковый кэш: ключ — хэш картинки + профиль + метод.
+  Повторная печать логотипа — чтение файла, без повторного дизеринга
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .layout import LayoutProfile
+
+try:  # опционально: векторизованный путь
+    import numpy as np
+except ImportError:  # pragma: no cover (зависит от окружения)
+    np = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "GrayImage",
+    "load_image",
+    "dither",
+    "pack_gs_v0",
+    "raster_image",
+    "RasterCache",
+    "get_cache",
+    "set_cache",
+    "DEFAULT_CACHE_DIR",
+]
+
+RASTER_VERSION = 1  # меняется при изменении алгоритмов — старые файлы кэша перестают совпадать
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "raster_cache")
+
+_BAYER8 = (
+    (0, 32, 8, 40, 2, 34, 10, 42), (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38), (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41), (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37), (63, 31, 55, 23, 61, 29, 53, 21),
+)
+# порог ячейки матрицы в шкале 0..255
+_BAYER_T = tuple(tuple(int((v + 0.5) * 4) for v in row) for row in _BAYER8)
+
+
+class GrayImage:
+    """Картинка в оттенках серого: width × height байт, 0 — чёрный, 255 — белый."""
+
+    __slots__ = ("width", "height", "pixels")
+
+    def __init__(self, width: int, height: int, pixels: bytes):
+        if len(pixels) != width * height:
+            raise ValueError(f"pixels: expected {width * height} bytes, got {len(pixels)}")
+        self.width = width
+        self.height = height
+        self.pixels = bytes(pixels)
+
+
+# ---------- Загрузка ----------
+
+def _netpbm_header(data: bytes, count: int) -> Tuple[List[int], int]:
+    """Первые count чисел заголовка netpbm (после магии) и смещение данных."""
+    values: List[int] = []
+    pos = 2
+    while len(values) < count:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos) + 1
+            continue
+        end = pos
+        while data[end:end + 1].isdigit():
+            end += 1
+        if end == pos:
+            raise ValueError("bad netpbm header")
+        values.append(int(data[pos:end]))
+        pos = end
+    return values, pos + 1  # ровно один пробельный символ перед данными
+
+
+def _rgb_to_gray(rgb: bytes) -> bytes:
+    if np is not None:
+        a = np.frombuffer(rgb, np.uint8).reshape(-1, 3).astype(np.uint32)
+        return ((a[:, 0] * 299 + a[:, 1] * 587 + a[:, 2] * 114) // 1000).astype(np.uint8).tobytes()
+    return bytes((rgb[i] * 299 + rgb[i + 1] * 587 + rgb[i + 2] * 114) // 1000 for i in range(0, len(rgb), 3))
+
+
+def load_image(data: bytes) -> GrayImage:
+    """PGM (P5) / PPM (P6) / PBM (P4) — встроенно; остальное — через Pillow. ValueError — не смогли."""
+    magic = data[:2]
+    if magic in (b"P5", b"P6"):
+        (w, h, maxval), off = _netpbm_header(data, 3)
+        if maxval != 255:
+            raise ValueError("only 8-bit netpbm is supported")
+        size = w * h * (3 if magic == b"P6" else 1)
+        if len(data) - off < size:
+            raise ValueError(f"truncated netpbm data: expected {size} bytes, got {max(0, len(data) - off)}")
+        raw = data[off:off + size]
+        return GrayImage(w, h, _rgb_to_gray(raw) if magic == b"P6" else raw)
+    if magic == b"P4":
+        (w, h), off = _netpbm_header(data, 2)
+        stride = (w + 7) // 8
+        if len(data) - off < stride * h:
+            raise ValueError(f"truncated netpbm data: expected {stride * h} bytes, got {max(0, len(data) - off)}")
+        px = bytearray()
+        for y in range(h):
+            row = data[off + y * stride: off + (y + 1) * stride]
+            px.extend(0 if row[x >> 3] & (0x80 >> (x & 7)) else 255 for x in range(w))
+        return GrayImage(w, h, bytes(px))
+    try:
+        from io import BytesIO
+        from PIL import Image
+    except ImportError:
+        raise ValueError("unsupported image format (PGM/PPM/PBM only; install Pillow for PNG/BMP/JPEG)") from None
+    try:
+        img = Image.open(BytesIO(data))
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            bg.alpha_composite(img)
+            img = bg
+        img = img.convert("L")
+    except (OSError, Image.DecompressionBombError) as e:  # UnidentifiedImageError, обрезанный файл
+        raise ValueError(f"bad image: {e}") from e
+    return GrayImage(img.width, img.height, img.tobytes())
+
+
+# ---------- Масштаб и дизеринг ----------
+
+def _scale(img: GrayImage, width: int) -> GrayImage:
+    """Уменьшить до width точек (пропорционально, ближайший сосед). Узкие картинки не растягиваются."""
+    if img.width <= width:
+        return img
+    height = max(1, img.height * width // img.width)
+    xs = [x * img.width // width for x in range(width)]
+    ys = [y * img.height // height for y in range(height)]
+    if np is not None:
+        a = np.frombuffer(img.pixels, np.uint8).reshape(img.height, img.width)
+        return GrayImage(width, height, a[np.ix_(ys, xs)].tobytes())
+    px = img.pixels
+    out = bytearray()
+    for y in ys:
+        base = y * img.width
+        out.extend(px[base + x] for x in xs)
+    return GrayImage(width, height, bytes(out))
+
+
+def _pack_rows(rows: List[List[int]], width: int) -> bytes:
+    out = bytearray()
+    for row in rows:
+        for x in range(0, width, 8):
+            b = 0
+            for i, bit in enumerate(row[x:x + 8]):
+                if bit:
+                    b |= 0x80 >> i
+            out.append(b)
+    return bytes(out)
+
+
+def _floyd(img: GrayImage) -> bytes:
+    w, h = img.width, img.height
+    cur = [float(v) for v in img.pixels[0:w]]
+    rows: List[List[int]] = []
+    for y in range(h):
+        nxt = [float(v) for v in img.pixels[(y + 1) * w:(y + 2) * w]] if y + 1 < h else [0.0] * w
+        bits = [0] * w
+        for x in range(w):
+            old = cur[x]
+            black = old < 128.0
+            bits[x] = 1 if black else 0
+            err = old - (0.0 if black else 255.0)
+            if x + 1 < w:
+                cur[x + 1] += err * 0.4375
+                nxt[x + 1] += err * 0.0625
+            if x:
+                nxt[x - 1] += err * 0.1875
+            nxt[x] += err * 0.3125
+        rows.append(bits)
+        cur = nxt
+    return _pack_rows(rows, w)
+
+
+def _ordered(img: GrayImage) -> bytes:
+    w, h = img.width, img.height
+    if np is not None:
+        a = np.frombuffer(img.pixels, np.uint8).reshape(h, w)
+        t = np.tile(np.array(_BAYER_T, np.uint8), ((h + 7) // 8, (w + 7) // 8))[:h, :w]
+        return np.packbits(a < t, axis=1).tobytes()
+    px = img.pixels
+    rows = [[1 if px[y * w + x] < _BAYER_T[y & 7][x & 7] else 0 for x in range(w)] for y in range(h)]
+    return _pack_rows(rows, w)
+
+
+def _threshold(img: GrayImage) -> bytes:
+    w, h = img.width, img.height
+    if np is not None:
+        a = np.frombuffer(img.pixels, np.uint8).reshape(h, w)
+        return np.packbits(a < 128, axis=1).tobytes()
+    px = img.pixels
+    return _pack_rows([[1 if px[y * w + x] < 128 else 0 for x in range(w)] for y in range(h)], w)
+
+
+_METHODS = {"floyd": _floyd, "ordered": _ordered, "threshold": _threshold}
+
+
+def dither(img: GrayImage, method: str = "floyd") -> bytes:
+    """Биты картинки: строки по (width + 7) // 8 байт, старший бит — левая точка, 1 — печатать."""
+    try:
+        fn = _METHODS[method]
+    except KeyError:
+        raise ValueError(f"unknown dither method: {method}") from None
+    return fn(img)
+
+
+def pack_gs_v0(bits: bytes, width: int, height: int, band_rows: int = 128) -> bytes:
+    """Команды GS v 0 (m=0) полосами по band_rows строк."""
+    stride = (width + 7) // 8
+    out = bytearray()
+    for y in range(0, height, band_rows):
+        rows = min(band_rows, height - y)
+        out += b"\x1dv0\x00" + bytes((stride & 0xFF, stride >> 8, rows & 0xFF, rows >> 8))
+        out += bits[y * stride:(y + rows) * stride]
+    return bytes(out)
+
+
+# ---------- Кэш ----------
+
+class RasterCache:
+    """Готовые байты GS v 0 на диске: <directory>/<sha256>.bin, не больше max_files файлов."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_files: int = 256):
+        self.directory = directory
+        self.max_files = int(max_files)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image: bytes, profile: LayoutProfile, method: str, band_rows: int) -> str:
+        h = hashlib.sha256(image).hexdigest()
+        spec = f"v{RASTER_VERSION}|{h}|{profile.paper_mm}|{profile.dots}|{method}|{band_rows}"
+        return hashlib.sha256(spec.encode("ascii")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))  # атомарно: читатель не увидит половину файла
+            self._evict()
+        except OSError as e:
+            logger.warning("raster cache: write failed: %s", e)
+
+    def _evict(self) -> None:
+        files = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(".bin")]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p))
+        for p in files[: len(files) - self.max_files]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"directory": self.directory, "hits": self.hits, "misses": self.misses,
+                    "numpy": np is not None}
+
+
+def raster_image(image: bytes, profile: LayoutProfile, method: str = "floyd", band_rows: int = 128,
+                 cache: Optional[RasterCache] = None) -> bytes:
+    """ESC/POS-байты картинки под профиль (GS v 0). cache=None — общий кэш процесса."""
+    cache = cache or get_cache()
+    key = cache.key(image, profile, method, band_rows)
+    data = cache.get(key)
+    if data is not None:
+        return data
+    img = _scale(load_image(image), profile.dots)
+    data = pack_gs_v0(dither(img, method), img.width, img.height, band_rows)
+    cache.put(key, data)
+    return data
+
+
+_CACHE: Optional[RasterCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> RasterCache:
+    """Общий кэш процесса (создаётся при первом обращении)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = RasterCache()
+        return _CACHE
+
+
+def set_cache(cache: Optional[RasterCache]) -> None:
+    """Подменить общий кэш (тесты, другой каталог)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        _CACHE = cache
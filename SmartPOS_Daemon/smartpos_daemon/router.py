@@ -9,50 +9,51 @@ from .actions import (
     ensure_width_profile,
     cancel_demo_sticky,   # ← добавить
     soft_purge_printer,
+    force_purge_spooler,
     read_printer_status,
 )
+from .actions.printer import StepResult
+from .playbooks import PlaybookStore, execute
+from .waits import DEADLINE_KEY, Deadline, deadline_of
 # Если используешь отмену инжектора позже:
 # from .faults import cancel_sticky_jobs
 
 
-PLAYBOOKS = {
-    "PR0022": [usb_presence_check, clear_spooler, escpos_probe, test_print_layout],
-    "PR0018": [cancel_demo_sticky, clear_spooler, restart_spooler, test_print_layout],
-    "PR0001": [read_printer_status, escpos_probe, test_print_layout],
-    "PR0015": [read_printer_status, escpos_probe, test_print_layout],
-    "PR0006": [ensure_width_profile, test_print_layout],
-    "PR0017": [ensure_width_profile, test_print_layout],
+# Описание плейбуков — config/playbooks.json (общий файл с run_daemon.py)
+ACTIONS = {
+    fn.__name__: fn
+    for fn in (
+        usb_presence_check, tcp9100_probe, read_printer_status,
+        clear_spooler, restart_spooler, cancel_demo_sticky, soft_purge_printer, force_purge_spooler,
+        escpos_probe, test_print_layout, ensure_width_profile,
+    )
 }
 
+PLAYBOOKS = PlaybookStore(ACTIONS)
+
+REQUEST_TIMEOUT_SEC = 8.0  # как DaemonConfig.request_timeout_sec
+
 
 def run_playbook(req):
-    code = req["problem_code"]
-    steps = PLAYBOOKS.get(code, [])
-    
     # Опции витрины для PR0018:
     # context.purge: "soft" | "hard" | "auto"
     # (совместимость) context.beautify=true == "hard"
-    if code == "PR0018":
-        base = [cancel_demo_sticky, clear_spooler, restart_spooler]
-        purge = (req.get("context", {}).get("purge")
-                 or ("hard" if req.get("context", {}).get("beautify") else None))
-        if purge == "soft":
-            steps = base + [soft_purge_printer, test_print_layout]
-        elif purge == "hard":
-            steps = base + [force_purge_spooler, test_print_layout]
-        elif purge == "auto":
-            steps = base + [soft_purge_printer, force_purge_spooler, test_print_layout]
-        else:
-            steps = base + [test_print_layout]
-    
+    steps = PLAYBOOKS.steps_for(req)
+    if deadline_of(req) is None:
+        req = {**req, DEADLINE_KEY: Deadline(PLAYBOOKS.budget_for(req, REQUEST_TIMEOUT_SEC))}
+
+    def _run_step(step):
+        return ACTIONS[step.action](req, **step.kwargs(req))
+
+    def _on_timeout(step, info):
+        return StepResult(step.action + "_timeout", {"timeout": {step.id: info}}, result="TIMEOUT")
+
     res = {"actions_done": [], "evidence": {}}
-    for step in steps:
-        out = step(req)
+    for _step, out in execute(steps, _run_step, deadline=deadline_of(req), on_timeout=_on_timeout):
         res["actions_done"].append(out.name)
         res["evidence"].update(out.evidence)
-        if out.terminal:
+        if out.terminal or out.result == "TIMEOUT":
             res.update({"result_code": out.result})
-            break
     return res
 
 
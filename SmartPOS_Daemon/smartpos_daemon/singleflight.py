@@ -0,0 +1,124 @@
+# smartpos_daemon/singleflight.py
+"""
+Сериализация и склейка (single-flight) запусков плейбуков по принтеру.
+
+- Одинаковые запросы (тот же принтер + тот же ключ), пришедшие пока первый ещё
+  ждёт или выполняется, не запускаются повторно — получают тот же результат
+- Разные плейбуки на одном принтере выполняются строго по очереди (FIFO)
+- Разные принтеры друг другу не мешают
+
+Так два клиента с PR0018 за секунду дают один рестарт спулера, а не два,
+и EnumJobs/SetJob одного принтера не гоняются параллельно.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+__all__ = ["PrinterLanes", "request_key"]
+
+Emit = Callable[[Dict[str, Any]], None]
+
+
+def request_key(req: Dict[str, Any]) -> str:
+    """Ключ склейки: problem_code + context (ticket_id не учитывается)."""
+    basis = {"problem_code": req.get("problem_code"), "context": req.get("context") or {}}
+    raw = json.dumps(basis, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.events: List[Dict[str, Any]] = []
+        self.listeners: List[Emit] = []
+        self.joined = 0
+
+
+class _PrinterState:
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+        self.calls: Dict[str, _Call] = {}
+
+
+class PrinterLanes:
+    """Очередь запусков на каждый принтер + склейка одинаковых запросов."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._printers: Dict[str, _PrinterState] = {}
+
+    def run(self, printer: str, key: str, fn: Callable[[Emit], Any],
+            on_event: Optional[Emit] = None) -> Tuple[Any, bool]:
+        """
+        Выполнить fn(emit) в очереди принтера printer.
+        Возвращает (результат, shared): shared=True, если результат получен от чужого запуска.
+        События, переданные в emit, получают все участники (опоздавшим — с повтором).
+        """
+        with self._lock:
+            st = self._printers.setdefault(printer, _PrinterState())
+            call = st.calls.get(key)
+            if call is not None:
+                call.joined += 1
+                if on_event:
+                    for ev in call.events:
+                        on_event(ev)
+                    call.listeners.append(on_event)
+                owner = False
+            else:
+                call = _Call()
+                if on_event:
+                    call.listeners.append(on_event)
+                st.calls[key] = call
+                ticket = st.next_ticket
+                st.next_ticket += 1
+                owner = True
+
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        def emit(ev: Dict[str, Any]) -> None:
+            with self._lock:
+                call.events.append(ev)
+                listeners = list(call.listeners)
+            for cb in listeners:
+                try:
+                    cb(ev)
+                except Exception:  # noqa: BLE001
+                    pass
+
+        with st.cond:
+            while st.serving != ticket:
+                st.cond.wait()
+        try:
+            call.result = fn(emit)
+        except BaseException as e:  # noqa: BLE001
+            call.error = e
+        finally:
+            with self._lock:
+                st.calls.pop(key, None)
+            with st.cond:
+                st.serving += 1
+                st.cond.notify_all()
+            call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result, False
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                name: {"waiting": st.next_ticket - st.serving, "in_flight": len(st.calls),
+                       "joined": sum(c.joined for c in st.calls.values())}
+                for name, st in self._printers.items()
+            }
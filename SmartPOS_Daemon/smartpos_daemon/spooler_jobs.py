@@ -0,0 +1,401 @@
+# smartpos_daemon/spooler_jobs.py
+"""
+Таблица джобов спулера с фоновым наблюдателем.
+
+- На каждый принтер — поток, который раз в interval перечитывает очередь
+  (EnumJobs уровня 2) и обновляет таблицу инкрементально: added / changed / removed
+- У записи есть возраст (с момента, как мы её увидели), статус (биты + расшифровка),
+  размер в байтах и страницы; stuck=True — джоб висит в «Удалении» дольше
+  deleting_after или не меняется дольше stuck_after
+- Наблюдатель заводится только для принтера, который спулер действительно знает
+  (перечисление удалось) или который задан в конфиге (pinned); наблюдателей не
+  больше max_watchers. Наблюдатель уходит после max_errors неудачных перечислений
+  подряд, а незакреплённый — ещё и после idle_after секунд без читателей
+- Изменения идут в ленту дельт (EventBus: курсор, long-poll, reset) и подписчикам
+- Действия очистки берут список джобов из таблицы (без своего EnumJobs), а проверка
+  «джоб ушёл» — одно перечисление на все удаляемые джобы, которое заодно обновляет таблицу
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .events import EventBus
+from .handles import HandlePool, get_pool as get_handle_pool
+from .winapi import win32print
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "JOB_STATUS_BITS",
+    "decode_job_status",
+    "JobSource",
+    "WinspoolJobSource",
+    "SpoolerJobTable",
+    "get_table",
+    "set_table",
+]
+
+# winspool.h: JOB_STATUS_*
+JOB_STATUS_BITS = (
+    (0x0001, "paused"), (0x0002, "error"), (0x0004, "deleting"), (0x0008, "spooling"),
+    (0x0010, "printing"), (0x0020, "offline"), (0x0040, "paper_out"), (0x0080, "printed"),
+    (0x0100, "deleted"), (0x0200, "blocked_devq"), (0x0400, "user_intervention"),
+    (0x0800, "restart"), (0x1000, "complete"),
+)
+_DELETING = 0x0004
+
+
+def decode_job_status(raw: int) -> List[str]:
+    return [name for bit, name in JOB_STATUS_BITS if raw & bit]
+
+
+# ---------- Источник ----------
+
+class JobSource:
+    """Интерфейс источника очереди принтера."""
+
+    name = "base"
+
+    def enum(self, printer: str) -> List[Dict[str, Any]]:
+        """Джобы принтера (словари EnumJobs). Исключение — принтер/спулер недоступен."""
+        raise NotImplementedError
+
+
+class WinspoolJobSource(JobSource):
+    """EnumJobs(h, 0, 999, 2) через пул хэндлов (pywin32 или симулятор)."""
+
+    name = "winspool"
+
+    def __init__(self, api: Any = None, pool: Optional[HandlePool] = None):
+        self.api = api or win32print
+        self.pool = pool
+
+    def enum(self, printer: str) -> List[Dict[str, Any]]:
+        if not self.api:
+            raise RuntimeError("win32print missing")
+        with (self.pool or get_handle_pool()).lease(printer) as h:
+            return list(self.api.EnumJobs(h, 0, 999, 2))
+
+
+# ---------- Таблица ----------
+
+class _Row:
+    __slots__ = ("job_id", "document", "status", "size", "pages", "printed", "seen", "changed", "stuck")
+
+    def __init__(self, job: Dict[str, Any], now: float):
+        self.job_id = int(job["JobId"])
+        self.seen = now
+        self.stuck = False
+        self.changed = now
+        self.status = self.size = self.pages = self.printed = -1
+        self.document = ""
+        self.update(job, now)
+
+    def update(self, job: Dict[str, Any], now: float) -> bool:
+        fields = (
+            str(job.get("pDocument") or job.get("Document") or ""),
+            int(job.get("Status") or 0),
+            int(job.get("Size") or 0),
+            int(job.get("TotalPages") or 0),
+            int(job.get("PagesPrinted") or 0),
+        )
+        if fields == (self.document, self.status, self.size, self.pages, self.printed):
+            return False
+        self.document, self.status, self.size, self.pages, self.printed = fields
+        self.changed = now
+        return True
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "document": self.document,
+            "status": self.status,
+            "status_text": decode_job_status(self.status),
+            "size": self.size,
+            "pages": self.pages,
+            "pages_printed": self.printed,
+            "age_s": round(now - self.seen, 3),
+            "idle_s": round(now - self.changed, 3),
+            "stuck": self.stuck,
+        }
+
+
+class _Queue:
+    def __init__(self) -> None:
+        self.rows: Dict[int, _Row] = {}
+        self.ts = 0.0            # monotonic последнего успешного перечисления
+        self.since = time.monotonic()  # с какого момента наблюдаем (для возраста джобов)
+        self.error: Optional[str] = None
+        self.errors = 0          # неудачных перечислений подряд
+        self.read = time.monotonic()   # когда таблицу этого принтера последний раз читали
+        self.pinned = False      # принтер из конфига: наблюдатель не уходит по простою
+        self.lock = threading.Lock()   # одно перечисление принтера за раз
+
+
+class SpoolerJobTable:
+    """
+    Очереди принтеров в памяти + наблюдатели + лента дельт.
+
+    interval       — пауза наблюдателя между перечислениями;
+    stuck_after    — джоб без изменений дольше этого считается зависшим;
+    deleting_after — джоб в «Удалении» дольше этого считается зависшим;
+    max_watchers   — сколько принтеров наблюдается одновременно;
+    idle_after     — наблюдатель незакреплённого принтера уходит после стольких секунд без чтений;
+    max_errors     — наблюдатель уходит после стольких неудачных перечислений подряд.
+    """
+
+    def __init__(self, source: Optional[JobSource] = None, interval: float = 0.5,
+                 stuck_after: float = 30.0, deleting_after: float = 5.0, capacity: int = 1024,
+                 max_watchers: int = 8, idle_after: float = 300.0, max_errors: int = 20):
+        self.source = source or WinspoolJobSource()
+        self.interval = float(interval)
+        self.stuck_after = float(stuck_after)
+        self.deleting_after = float(deleting_after)
+        self.max_watchers = int(max_watchers)
+        self.idle_after = float(idle_after)
+        self.max_errors = int(max_errors)
+        self.feed = EventBus(capacity)
+        self._queues: Dict[str, _Queue] = {}
+        self._watchers: Dict[str, threading.Thread] = {}
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.enumerations = 0
+
+    # ---------- чтение ----------
+
+    def jobs(self, printer: str, max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Джобы принтера из таблицы; старше max_age (по умолчанию interval) — перечитать."""
+        limit = self.interval if max_age is None else float(max_age)
+        q = self._queue(printer)
+        q.read = time.monotonic()
+        rows = self.refresh(printer) if q.read - q.ts > limit else self._rows(q)
+        if q.ts and q.error is None:
+            self.watch(printer)  # спулер знает принтер — наблюдаем
+        elif not q.ts:
+            self._drop_unknown(printer, q)
+        return rows
+
+    def job_ids(self, printer: str, max_age: Optional[float] = None) -> List[int]:
+        return [j["job_id"] for j in self.jobs(printer, max_age)]
+
+    def snapshot(self, printer: str) -> Dict[str, Any]:
+        """Состояние очереди для GET /spooler/jobs (без перечисления, если запись свежая)."""
+        q = self._queue(printer)
+        jobs = self.jobs(printer)
+        now = time.monotonic()
+        return {
+            "printer": printer,
+            "jobs": jobs,
+            "count": len(jobs),
+            "bytes": sum(j["size"] for j in jobs),
+            "stuck": [j["job_id"] for j in jobs if j["stuck"]],
+            "age_s": round(now - q.ts, 3) if q.ts else None,
+            "watched_s": round(now - q.since, 3),
+            "error": q.error,
+            "cursor": self.feed.last_id,
+        }
+
+    def deltas(self, cursor: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """Дельты после cursor (long-poll до timeout). Возвращает (дельты, reset)."""
+        return self.feed.wait(cursor, timeout)
+
+    def subscribe(self, cb: Callable[[str, Dict[str, Any]], None]) -> None:
+        with self._lock:
+            self._listeners.append(cb)
+
+    # ---------- обновление ----------
+
+    def refresh(self, printer: str) -> List[Dict[str, Any]]:
+        """Перечитать очередь, применить изменения, разослать дельты. Возвращает джобы."""
+        q = self._queue(printer)
+        with q.lock:
+            try:
+                raw = self.source.enum(printer)
+                error = None
+            except Exception as e:  # noqa: BLE001
+                raw, error = None, str(e)
+            now = time.monotonic()
+            with self._lock:
+                self.enumerations += 1
+            deltas = self._apply(q, raw, error, now)
+        for op, row in deltas:
+            self._emit(printer, op, row)
+        return self._rows(q)
+
+    def forget(self, printer: str, job_ids: List[int]) -> None:
+        """Убрать джобы из таблицы без перечисления (ушли по данным самого вызывающего)."""
+        q = self._queue(printer)
+        with q.lock:
+            gone = [q.rows.pop(j) for j in job_ids if j in q.rows]
+        now = time.monotonic()
+        for row in gone:
+            self._emit(printer, "removed", row.to_dict(now))
+
+    def invalidate(self, printer: Optional[str] = None) -> None:
+        """Следующее чтение пойдёт в спулер (например, после рестарта)."""
+        with self._lock:
+            queues = list(self._queues.values()) if printer is None else [self._queues.get(printer)]
+        for q in queues:
+            if q is not None:
+                q.ts = 0.0
+
+    def watch(self, printer: str, pinned: bool = False) -> bool:
+        """
+        Запустить фонового наблюдателя для принтера (идемпотентно). pinned — принтер
+        из конфига: его наблюдатель не уходит по простою. False — лимит max_watchers исчерпан.
+        """
+        q = self._queue(printer)
+        q.pinned = q.pinned or pinned
+        with self._lock:
+            t = self._watchers.get(printer)
+            if (t and t.is_alive()) or self._stop.is_set():
+                return True
+            for name in [n for n, w in self._watchers.items() if not w.is_alive()]:
+                del self._watchers[name]
+            if len(self._watchers) >= self.max_watchers:
+                logger.debug("spooler_jobs: not watching %s: %d watchers already", printer, len(self._watchers))
+                return False
+            t = threading.Thread(target=self._watch_loop, args=(printer,), name=f"jobs-{printer}", daemon=True)
+            self._watchers[printer] = t
+        t.start()
+        return True
+
+    def watched(self) -> List[str]:
+        """Принтеры с живым наблюдателем."""
+        with self._lock:
+            return [name for name, t in self._watchers.items() if t.is_alive()]
+
+    def stop(self, timeout: float = 0.0) -> None:
+        """Остановить наблюдателей; timeout > 0 — дождаться их выхода (не дольше timeout на поток)."""
+        self._stop.set()
+        self.feed.close()
+        if timeout > 0:
+            with self._lock:
+                watchers = list(self._watchers.values())
+            for t in watchers:
+                t.join(timeout)
+
+    # ---------- внутреннее ----------
+
+    def _queue(self, printer: str) -> _Queue:
+        with self._lock:
+            q = self._queues.get(printer)
+            if q is None:
+                q = self._queues[printer] = _Queue()
+            return q
+
+    def _drop_unknown(self, printer: str, q: _Queue) -> None:
+        """Принтер ни разу не перечислился и не наблюдается — не держать под него запись."""
+        with self._lock:
+            if self._queues.get(printer) is q and printer not in self._watchers and not q.pinned:
+                del self._queues[printer]
+
+    def _rows(self, q: _Queue) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with q.lock:
+            return [r.to_dict(now) for r in q.rows.values()]
+
+    def _apply(self, q: _Queue, raw: Optional[List[Dict[str, Any]]], error: Optional[str],
+               now: float) -> List[Tuple[str, Dict[str, Any]]]:
+        out: List[Tuple[str, Dict[str, Any]]] = []
+        q.error = error
+        if raw is None:
+            q.errors += 1
+            return out  # спулер недоступен — таблицу не трогаем, q.ts не обновляем
+        q.ts = now
+        q.errors = 0
+        present = set()
+        for job in raw:
+            job_id = int(job["JobId"])
+            present.add(job_id)
+            row = q.rows.get(job_id)
+            if row is None:
+                row = q.rows[job_id] = _Row(job, now)
+                op: Optional[str] = "added"
+            else:
+                op = "changed" if row.update(job, now) else None
+            stuck = self._is_stuck(row, now)
+            if stuck != row.stuck:
+                row.stuck = stuck
+                op = op or ("stuck" if stuck else "changed")
+            if op:
+                out.append((op, row.to_dict(now)))
+        for job_id in [j for j in q.rows if j not in present]:
+            out.append(("removed", q.rows.pop(job_id).to_dict(now)))
+        return out
+
+    def _is_stuck(self, row: _Row, now: float) -> bool:
+        if row.status & _DELETING:
+            return now - row.changed >= self.deleting_after
+        return now - row.changed >= self.stuck_after
+
+    def _emit(self, printer: str, op: str, job: Dict[str, Any]) -> None:
+        delta = {"printer": printer, "op": op, "job": job}
+        self.feed.publish("spooler_job", delta)
+        with self._lock:
+            listeners = list(self._listeners)
+        for cb in listeners:
+            try:
+                cb(printer, delta)
+            except Exception as e:  # noqa: BLE001
+                logger.debug("spooler_jobs: listener failed: %s", e)
+
+    def _watch_loop(self, printer: str) -> None:
+        q = self._queue(printer)
+        try:
+            while not self._stop.is_set():
+                if self._should_leave(printer, q):
+                    return
+                self._watch_step(printer, q)
+        finally:
+            with self._lock:
+                if self._watchers.get(printer) is threading.current_thread():
+                    del self._watchers[printer]
+
+    def _should_leave(self, printer: str, q: _Queue) -> bool:
+        if q.errors >= self.max_errors:
+            logger.info("spooler_jobs: stop watching %s after %d failed enumerations: %s",
+                        printer, q.errors, q.error)
+            return True
+        if not q.pinned and time.monotonic() - q.read > self.idle_after:
+            logger.debug("spooler_jobs: stop watching %s: no readers for %.0fs", printer, self.idle_after)
+            return True
+        return False
+
+    def _watch_step(self, printer: str, q: _Queue) -> None:
+        # свежее перечисление (от действия) откладывает плановое
+        wait = self.interval - (time.monotonic() - q.ts)
+        if wait > 0:
+            self._stop.wait(wait)
+            return
+        self.refresh(printer)
+        if q.error:
+            logger.debug("spooler_jobs: enum failed for %s: %s", printer, q.error)
+            self._stop.wait(self.interval)
+
+
+_TABLE: Optional[SpoolerJobTable] = None
+_TABLE_LOCK = threading.Lock()
+
+
+def get_table() -> SpoolerJobTable:
+    """Общая таблица процесса (создаётся при первом обращении)."""
+    global _TABLE
+    with _TABLE_LOCK:
+        if _TABLE is None:
+            _TABLE = SpoolerJobTable()
+        return _TABLE
+
+
+def set_table(table: Optional[SpoolerJobTable]) -> None:
+    """Подменить общую таблицу (тесты, симулятор). Старая останавливается."""
+    global _TABLE
+    with _TABLE_LOCK:
+        old, _TABLE = _TABLE, table
+    if old is not None and old is not table:
+        old.stop()
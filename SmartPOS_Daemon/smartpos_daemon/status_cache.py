@@ -0,0 +1,349 @@
+# smartpos_daemon/status_cache.py
+"""
+Кэш статуса принтеров с фоновым наблюдателем.
+
+- Читатели (GET /status/receipt, read_printer_status, usb_presence_check) получают
+  последний известный статус из памяти вместе с его возрастом (age_s)
+- Фоновый поток на каждый принтер обновляет запись: ждёт уведомления об изменении
+  (FindFirstPrinterChangeNotification) или, если оно недоступно, опрашивает по таймеру
+- Бэкенды взаимозаменяемы: Win32NotifyBackend → PollingBackend → FakeBackend (тесты на Linux)
+- Если запись старше ttl (или её ещё нет) — читаем синхронно; наблюдатель заводится
+  только для найденного принтера, их не больше max_watchers. Наблюдатель уходит после
+  max_errors неудачных чтений подряд или после idle_after секунд без читателей
+- Принтер, который ни разу не нашёлся и не наблюдается, записи в кэше не получает
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .handles import get_pool as get_handle_pool
+
+from .winapi import win32print  # pywin32 или симулятор спулера
+
+try:
+    import win32event
+except Exception:  # pragma: no cover
+    win32event = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "PRINTER_STATUS_PAPER_OUT",
+    "PRINTER_STATUS_DOOR_OPEN",
+    "decode_status",
+    "StatusBackend",
+    "PollingBackend",
+    "Win32NotifyBackend",
+    "FakeBackend",
+    "PrinterStatusCache",
+    "default_backend",
+    "get_cache",
+    "set_cache",
+]
+
+PRINTER_STATUS_PAPER_OUT = 0x00000020
+PRINTER_STATUS_DOOR_OPEN = 0x00400000
+
+# PRINTER_CHANGE_PRINTER | PRINTER_CHANGE_JOB (winspool.h)
+_CHANGE_FLAGS = 0x000000FF | 0x0000FF00
+
+
+def decode_status(raw: int) -> Dict[str, bool]:
+    """Разобрать биты PRINTER_INFO_2.Status в поля, которые понимает GUI."""
+    return {
+        "paper_out": bool(raw & PRINTER_STATUS_PAPER_OUT),
+        "door_open": bool(raw & PRINTER_STATUS_DOOR_OPEN),
+    }
+
+
+# ---------- Бэкенды ----------
+
+class StatusBackend:
+    """Интерфейс источника статуса."""
+
+    name = "base"
+
+    def read(self, printer: str) -> int:
+        """Сырой Status принтера. Исключение — принтер недоступен/не найден."""
+        raise NotImplementedError
+
+    def wait_change(self, printer: str, timeout: float) -> bool:
+        """Блокироваться до изменения (True) или таймаута (False)."""
+        time.sleep(timeout)
+        return False
+
+    def release(self, printer: str) -> None:
+        """Освободить ресурсы наблюдения за принтером."""
+
+
+class PollingBackend(StatusBackend):
+    """GetPrinter(h, 2) по таймеру наблюдателя; хэндл берётся из общего пула."""
+
+    name = "polling"
+
+    def read(self, printer: str) -> int:
+        if not win32print:
+            raise RuntimeError("win32print missing")
+        with get_handle_pool().lease(printer) as h:
+            return int(win32print.GetPrinter(h, 2)["Status"])
+
+
+class Win32NotifyBackend(PollingBackend):
+    """Ожидание FindFirst/NextPrinterChangeNotification; при ошибке — как PollingBackend."""
+
+    name = "win32_notify"
+
+    def __init__(self) -> None:
+        self._watch: Dict[str, tuple] = {}  # printer → (hPrinter, hChange)
+        self._lock = threading.Lock()
+
+    def _arm(self, printer: str):
+        with self._lock:
+            pair = self._watch.get(printer)
+            if pair:
+                return pair[1]
+            h = win32print.OpenPrinter(printer)
+            try:
+                hc = win32print.FindFirstPrinterChangeNotification(h, _CHANGE_FLAGS, 0, None)
+            except Exception:
+                win32print.ClosePrinter(h)
+                raise
+            self._watch[printer] = (h, hc)
+            return hc
+
+    def wait_change(self, printer: str, timeout: float) -> bool:
+        try:
+            hc = self._arm(printer)
+            rc = win32event.WaitForSingleObject(hc, int(timeout * 1000))
+            if rc == win32event.WAIT_OBJECT_0:
+                win32print.FindNextPrinterChangeNotification(hc, None)
+                return True
+            return False
+        except Exception as e:  # noqa: BLE001 (спулер перезапущен / хэндл протух)
+            logger.debug("status_cache: notify wait failed for %s: %s", printer, e)
+            self.release(printer)
+            time.sleep(timeout)
+            return False
+
+    def release(self, printer: str) -> None:
+        with self._lock:
+            pair = self._watch.pop(printer, None)
+        if not pair:
+            return
+        h, hc = pair
+        for fn, arg in ((win32print.FindClosePrinterChangeNotification, hc), (win32print.ClosePrinter, h)):
+            try:
+                fn(arg)
+            except Exception:
+                pass
+
+
+class FakeBackend(StatusBackend):
+    """Бэкенд для тестов: статус задаётся из кода, изменения будят наблюдателя."""
+
+    name = "fake"
+
+    def __init__(self, statuses: Optional[Dict[str, int]] = None):
+        self._statuses: Dict[str, int] = dict(statuses or {})
+        self._cond = threading.Condition()
+        self._version = 0
+        self.reads = 0
+
+    def set_status(self, printer: str, raw: Optional[int]) -> None:
+        """raw=None — принтер «пропал»."""
+        with self._cond:
+            if raw is None:
+                self._statuses.pop(printer, None)
+            else:
+                self._statuses[printer] = int(raw)
+            self._version += 1
+            self._cond.notify_all()
+
+    def read(self, printer: str) -> int:
+        with self._cond:
+            self.reads += 1
+            if printer not in self._statuses:
+                raise RuntimeError(f"printer not found: {printer}")
+            return self._statuses[printer]
+
+    def wait_change(self, printer: str, timeout: float) -> bool:
+        with self._cond:
+            v = self._version
+            return self._cond.wait_for(lambda: self._version != v, timeout)
+
+
+def default_backend() -> StatusBackend:
+    if win32print and win32event and hasattr(win32print, "FindFirstPrinterChangeNotification"):
+        return Win32NotifyBackend()
+    return PollingBackend()
+
+
+# ---------- Кэш ----------
+
+class PrinterStatusCache:
+    """
+    Последний известный статус каждого принтера + наблюдатели.
+
+    ttl           — запись старше ttl при чтении обновляется синхронно;
+    poll_interval — максимальная пауза наблюдателя между чтениями;
+    max_watchers  — сколько принтеров наблюдается одновременно;
+    idle_after    — наблюдатель уходит после стольких секунд без чтений;
+    max_errors    — наблюдатель уходит после стольких неудачных чтений подряд;
+    on_change(printer, entry) — колбэки при изменении статуса.
+    """
+
+    def __init__(self, backend: Optional[StatusBackend] = None, ttl: float = 2.0, poll_interval: float = 1.0,
+                 max_watchers: int = 8, idle_after: float = 300.0, max_errors: int = 20):
+        self.backend = backend or default_backend()
+        self.ttl = float(ttl)
+        self.poll_interval = float(poll_interval)
+        self.max_watchers = int(max_watchers)
+        self.idle_after = float(idle_after)
+        self.max_errors = int(max_errors)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._watchers: Dict[str, threading.Thread] = {}
+        self._reads: Dict[str, float] = {}  # printer → monotonic последнего чтения (только наблюдаемые)
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def get(self, printer: str, max_age: Optional[float] = None) -> Dict[str, Any]:
+        """Статус из кэша (с age_s). Протухшую/отсутствующую запись читает синхронно."""
+        limit = self.ttl if max_age is None else float(max_age)
+        with self._lock:
+            entry = self._entries.get(printer)
+            if printer in self._reads:
+                self._reads[printer] = time.monotonic()
+        if entry is None or time.time() - entry["ts"] > limit:
+            entry = self.refresh(printer)
+        if entry["detected"]:
+            self.watch(printer)
+        out = dict(entry)
+        out["age_s"] = round(max(0.0, time.time() - entry["ts"]), 3)
+        return out
+
+    def refresh(self, printer: str) -> Dict[str, Any]:
+        """Прочитать статус из бэкенда, обновить запись, уведомить подписчиков при изменении."""
+        try:
+            raw = self.backend.read(printer)
+            entry = {"printer": printer, "detected": True, "status": raw, "error": None, **decode_status(raw)}
+        except Exception as e:  # noqa: BLE001
+            entry = {"printer": printer, "detected": False, "status": None, "error": str(e),
+                     "paper_out": None, "door_open": None}
+        entry["ts"] = time.time()
+        entry["backend"] = self.backend.name
+        with self._lock:
+            prev = self._entries.get(printer)
+            if prev is None and not entry["detected"] and printer not in self._watchers:
+                return entry  # принтер ни разу не найден и не наблюдается — не держать под него запись
+            self._entries[printer] = entry
+            listeners = list(self._listeners)
+        if prev is None or _state(prev) != _state(entry):
+            for cb in listeners:
+                try:
+                    cb(printer, dict(entry))
+                except Exception as e:  # noqa: BLE001
+                    logger.debug("status_cache: listener failed: %s", e)
+        return entry
+
+    def invalidate(self, printer: Optional[str] = None) -> None:
+        """Сбросить запись (например, после рестарта спулера); следующее чтение пойдёт в бэкенд."""
+        with self._lock:
+            if printer is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(printer, None)
+
+    def subscribe(self, cb: Callable[[str, Dict[str, Any]], None]) -> None:
+        with self._lock:
+            self._listeners.append(cb)
+
+    def watch(self, printer: str) -> bool:
+        """Запустить фонового наблюдателя для принтера (идемпотентно). False — лимит max_watchers исчерпан."""
+        with self._lock:
+            t = self._watchers.get(printer)
+            if (t and t.is_alive()) or self._stop.is_set():
+                return True
+            if len(self._watchers) >= self.max_watchers:
+                logger.debug("status_cache: not watching %s: %d watchers already", printer, len(self._watchers))
+                return False
+            t = threading.Thread(target=self._watch_loop, args=(printer,), name=f"status-{printer}", daemon=True)
+            self._watchers[printer] = t
+            self._reads[printer] = time.monotonic()
+        t.start()
+        return True
+
+    def watched(self) -> List[str]:
+        """Принтеры с живым наблюдателем."""
+        with self._lock:
+            return [name for name, t in self._watchers.items() if t.is_alive()]
+
+    def stop(self, timeout: float = 0.0) -> None:
+        """Остановить наблюдателей; timeout > 0 — дождаться их выхода (не дольше timeout на поток)."""
+        self._stop.set()
+        for printer in list(self._watchers):
+            self.backend.release(printer)
+        if timeout > 0:
+            with self._lock:
+                watchers = list(self._watchers.values())
+            for t in watchers:
+                t.join(timeout)
+
+    def _watch_loop(self, printer: str) -> None:
+        errors = 0
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    idle = time.monotonic() - self._reads.get(printer, 0.0)
+                if idle > self.idle_after:
+                    logger.debug("status_cache: stop watching %s: no readers for %.0fs", printer, self.idle_after)
+                    break
+                try:
+                    self.backend.wait_change(printer, self.poll_interval)
+                except Exception as e:  # noqa: BLE001
+                    logger.debug("status_cache: wait_change error for %s: %s", printer, e)
+                    self._stop.wait(self.poll_interval)
+                if self._stop.is_set():
+                    break
+                entry = self.refresh(printer)
+                errors = 0 if entry["detected"] else errors + 1
+                if errors >= self.max_errors:
+                    logger.info("status_cache: stop watching %s after %d failed reads: %s",
+                                printer, errors, entry["error"])
+                    break
+        finally:
+            with self._lock:
+                if self._watchers.get(printer) is threading.current_thread():
+                    del self._watchers[printer]
+                    self._reads.pop(printer, None)
+            self.backend.release(printer)
+
+
+def _state(entry: Dict[str, Any]) -> tuple:
+    return entry.get("detected"), entry.get("status"), entry.get("error")
+
+
+_CACHE: Optional[PrinterStatusCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> PrinterStatusCache:
+    """Общий кэш процесса (создаётся при первом обращении)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = PrinterStatusCache()
+        return _CACHE
+
+
+def set_cache(cache: Optional[PrinterStatusCache]) -> None:
+    """Подменить общий кэш (тесты, симулятор). Старый кэш останавливается."""
+    global _CACHE
+    with _CACHE_LOCK:
+        old, _CACHE = _CACHE, cache
+    if old is not None and old is not cache:
+        old.stop()
@@ -0,0 +1,100 @@
+# smartpos_daemon/waits.py
+"""
+Ожидание «условие или дедлайн» вместо фиксированных time.sleep(...).
+
+wait_until(pred, timeout) опрашивает pred с нарастающим интервалом
+(initial → ×factor → не больше max_interval) и возвращается сразу,
+как только условие выполнено. Результат несёт фактическое время ожидания,
+чтобы шаг плейбука мог положить его в evidence.
+
+Deadline — общий бюджет времени запроса (DaemonConfig.request_timeout_sec или
+budget_sec плейбука). Кладётся в req["_deadline"] и ограничивает все ожидания шагов.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import current_clock, note_time
+
+__all__ = ["WaitResult", "wait_until", "Deadline", "DEADLINE_KEY", "deadline_of", "clamp"]
+
+DEADLINE_KEY = "_deadline"
+
+
+class Deadline:
+    """Абсолютный дедлайн запроса по time.monotonic()."""
+
+    def __init__(self, budget_sec: float):
+        self.budget = max(0.0, float(budget_sec))
+        self.started = time.monotonic()
+        self.at = self.started + self.budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.at
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def clamp(self, timeout: float) -> float:
+        """Не ждать дольше, чем осталось до дедлайна."""
+        return max(0.0, min(float(timeout), self.remaining()))
+
+
+def deadline_of(req: Optional[Dict[str, Any]]) -> Optional[Deadline]:
+    return (req or {}).get(DEADLINE_KEY)
+
+
+def clamp(req: Optional[Dict[str, Any]], timeout: float) -> float:
+    """timeout, урезанный оставшимся бюджетом запроса (если дедлайн задан)."""
+    dl = deadline_of(req)
+    return dl.clamp(timeout) if dl else float(timeout)
+
+
+@dataclass
+class WaitResult:
+    ok: bool            # условие выполнено до дедлайна
+    waited: float       # сколько секунд ждали
+    polls: int          # сколько раз вызывали предикат
+    value: Any = None   # последнее значение предиката
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+
+def wait_until(pred: Callable[[], Any], timeout: float, initial: float = 0.02,
+               max_interval: float = 0.2, factor: float = 1.5,
+               deadline: Optional[float] = None) -> WaitResult:
+    """
+    Ждать, пока pred() вернёт истину, но не дольше timeout секунд
+    (и не позже абсолютного deadline по time.monotonic(), если он задан).
+    Исключение внутри pred считается «ещё не готово».
+    Время ожидания (без вызовов Win32 из pred) добавляется к засечке шага (metrics.step_timing).
+    """
+    clock = current_clock()
+    win32_before = clock.win32_s if clock is not None else 0.0
+    t0 = time.monotonic()
+    end = t0 + max(0.0, float(timeout))
+    if deadline is not None:
+        end = min(end, deadline)
+    interval = max(0.001, float(initial))
+    polls = 0
+    value: Any = None
+    while True:
+        polls += 1
+        try:
+            value = pred()
+        except Exception:  # noqa: BLE001
+            value = None
+        now = time.monotonic()
+        if value or now >= end:
+            if clock is not None:
+                note_time("wait", max(0.0, now - t0 - (clock.win32_s - win32_before)))
+            return WaitResult(bool(value), round(now - t0, 3), polls, value)
+        time.sleep(min(interval, end - now))
+        interval = min(max_interval, interval * factor)
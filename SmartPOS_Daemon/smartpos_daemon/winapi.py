@@ -0,0 +1,142 @@
+# smartpos_daemon/winapi.py
+"""
+Точка подключения Win32 API спулера для демона и пакета.
+
+win32print / win32serviceutil / win32service здесь — прокси: по умолчанию смотрят
+на pywin32 (если он установлен), после use_simulator() — на in-memory симулятор
+(smartpos_daemon.winspool_sim). Модули импортируют прокси вместо pywin32:
+
+    from smartpos_daemon.winapi import win32print
+
+и проверка `if not win32print:` работает как раньше — прокси ложен, пока API нет.
+Вызовы функций через прокси считаются и засекаются (smartpos_daemon.metrics):
+smartpos_win32_calls_total / _call_seconds_total / _errors_total по api и fn.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .metrics import get_metrics, note_time
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "ApiProxy",
+    "win32print",
+    "win32serviceutil",
+    "win32service",
+    "backend_name",
+    "use_pywin32",
+    "use_simulator",
+]
+
+
+class ApiProxy:
+    """Прозрачная обёртка над модулем API; цель можно подменить на лету."""
+
+    def __init__(self, name: str, target: Any = None):
+        self._name = name
+        self._target = target
+        self._wrapped: Dict[str, Tuple[Any, Callable[..., Any]]] = {}  # fn → (цель, обёртка)
+
+    def __getattr__(self, item: str) -> Any:
+        target = self.__dict__.get("_target")
+        if target is None:
+            raise AttributeError(f"{self._name} is not available (no pywin32, simulator not enabled)")
+        cached = self.__dict__["_wrapped"].get(item)
+        if cached is not None and cached[0] is target:
+            return cached[1]  # обёртка создаётся один раз на функцию и цель, а не на каждое обращение
+        attr = getattr(target, item)
+        if not callable(attr) or isinstance(attr, type):
+            return attr  # константы и классы исключений — как есть
+        call = _timed(self._name, item, attr)
+        self._wrapped[item] = (target, call)
+        return call
+
+    def __bool__(self) -> bool:
+        return self._target is not None
+
+    def __repr__(self) -> str:
+        return f"<ApiProxy {self._name} → {self._target!r}>"
+
+
+def _timed(api: str, fn_name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    labels = {"api": api, "fn": fn_name}
+
+    def call(*args: Any, **kwargs: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            get_metrics().inc("smartpos_win32_errors_total", labels)
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            note_time("win32", dt)
+            m = get_metrics()
+            m.inc("smartpos_win32_calls_total", labels)
+            m.inc("smartpos_win32_call_seconds_total", labels, dt)
+
+    call.__name__ = fn_name
+    return call
+
+
+def _try_import(name: str) -> Optional[Any]:
+    try:
+        return importlib.import_module(name)
+    except Exception:  # pragma: no cover (не Windows-среда)
+        return None
+
+
+win32print = ApiProxy("win32print")
+win32serviceutil = ApiProxy("win32serviceutil")
+win32service = ApiProxy("win32service")
+_backend = "none"
+
+
+def _bind(print_api: Any, serviceutil_api: Any, service_api: Any, name: str) -> None:
+    global _backend
+    # хэндлы из пула принадлежат старому бэкенду — закрываем, пока прокси ещё смотрят на него
+    from .handles import set_pool
+    set_pool(None)
+    win32print._target = print_api
+    win32serviceutil._target = serviceutil_api
+    win32service._target = service_api
+    _backend = name
+    from .status_cache import get_cache
+    get_cache().invalidate()
+    from .spooler_jobs import get_table
+    get_table().invalidate()
+    logger.info("winapi: spooler backend = %s", name)
+
+
+def backend_name() -> str:
+    """'pywin32', 'sim' или 'none'."""
+    return _backend
+
+
+def use_pywin32() -> bool:
+    """Вернуться к настоящему pywin32. False — его нет (не Windows): прокси станут ложными."""
+    mods = [_try_import(n) for n in ("win32print", "win32serviceutil", "win32service")]
+    _bind(mods[0], mods[1], mods[2], "pywin32" if mods[0] is not None else "none")
+    return mods[0] is not None
+
+
+def use_simulator(sim: Any = None) -> Any:
+    """Подключить симулятор спулера (по умолчанию новый SpoolerSimulator()). Возвращает его."""
+    if sim is None:
+        from .winspool_sim import SpoolerSimulator
+        sim = SpoolerSimulator()
+    _bind(sim.win32print, sim.win32serviceutil, sim.win32service, "sim")
+    return sim
+
+
+# По умолчанию — pywin32, если он есть; пул/кэш ещё не созданы, поэтому без _bind
+for _proxy in (win32print, win32serviceutil, win32service):
+    _proxy._target = _try_import(_proxy._name)
+if win32print:
+    _backend = "pywin32"
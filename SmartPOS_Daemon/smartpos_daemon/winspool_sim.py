@@ -0,0 +1,482 @@
+# smartpos_daemon/winspool_sim.py
+"""
+In-memory симулятор спулера Windows (winspool + служба Spooler) для Linux.
+
+Повторяет ту часть pywin32, которой пользуется демон, чтобы плейбуки проходили
+целиком на CI и под нагрузочными тестами:
+
+- win32print: OpenPrinter/ClosePrinter, GetDefaultPrinter, GetPrinter (1/2),
+  SetPrinter (PURGE/PAUSE/RESUME), EnumJobs, SetJob, Start/EndDocPrinter,
+  AbortDocPrinter, Start/EndPagePrinter, WritePrinter
+- win32serviceutil: QueryServiceStatus, StopService, StartService, RestartService
+- win32service: константы состояний службы
+
+Поведение:
+- Таблица джобов на принтер; закрытый (EndDoc) джоб «печатается» print_sec и
+  исчезает, а напечатанные данные копятся в printed[printer]
+- Джоб с открытым документом (StartDoc без EndDoc) — «залипший»: DELETE/PURGE
+  только помечают его «Удаление» (JOB_STATUS_DELETING), пока держатель не закроет документ
+- Биты PAPER_OUT / DOOR_OPEN (set_status) останавливают печать очереди
+- Ширина бумаги драйвера (set_paper_width) видна в GetPrinter(2)["pDevMode"]["PaperWidth"]
+- Остановка службы: вызовы API → ошибка RPC, хэндлы протухают, открытые документы теряются
+- Задержка каждого вызова (latency, число или {функция: сек}) и инъекция ошибок
+  (inject — ближайшие N вызовов, fail_rate — случайно, воспроизводимо через seed)
+
+Ошибки — SimError с полями как у pywintypes.error (winerror, funcname, strerror).
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import Counter, deque
+from types import SimpleNamespace
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from .status_cache import PRINTER_STATUS_DOOR_OPEN, PRINTER_STATUS_PAPER_OUT
+
+__all__ = ["SimError", "SpoolerSimulator"]
+
+# winerror.h
+ERROR_INVALID_HANDLE = 6
+ERROR_INVALID_PARAMETER = 87
+ERROR_SERVICE_DOES_NOT_EXIST = 1060
+ERROR_SERVICE_NOT_ACTIVE = 1062
+ERROR_INVALID_PRINTER_NAME = 1801
+RPC_S_SERVER_UNAVAILABLE = 1722
+
+# winsvc.h
+SERVICE_STOPPED = 1
+SERVICE_START_PENDING = 2
+SERVICE_STOP_PENDING = 3
+SERVICE_RUNNING = 4
+
+# winspool.h
+JOB_CONTROL_PAUSE = 1
+JOB_CONTROL_RESUME = 2
+JOB_CONTROL_CANCEL = 3
+JOB_CONTROL_RESTART = 4
+JOB_CONTROL_DELETE = 5
+PRINTER_CONTROL_PAUSE = 1
+PRINTER_CONTROL_RESUME = 2
+PRINTER_CONTROL_PURGE = 3
+JOB_STATUS_PAUSED = 0x0001
+JOB_STATUS_ERROR = 0x0002
+JOB_STATUS_DELETING = 0x0004
+JOB_STATUS_SPOOLING = 0x0008
+JOB_STATUS_PRINTING = 0x0010
+JOB_STATUS_BLOCKED_DEVQ = 0x0200
+PRINTER_STATUS_PAUSED = 0x0001
+
+_PRINT_CONSTANTS = {k: v for k, v in dict(globals()).items() if k.startswith(("JOB_", "PRINTER_"))}
+
+
+class SimError(Exception):
+    """Аналог pywintypes.error: args = (winerror, funcname, strerror)."""
+
+    def __init__(self, winerror: int, funcname: str, strerror: str):
+        super().__init__(winerror, funcname, strerror)
+        self.winerror = winerror
+        self.funcname = funcname
+        self.strerror = strerror
+
+
+class _Job:
+    __slots__ = ("id", "doc", "datatype", "status", "submitted", "owner", "closed_at",
+                 "delete_at", "pages", "data")
+
+    def __init__(self, job_id: int, doc: str, datatype: str, owner: int):
+        self.id = job_id
+        self.doc = doc
+        self.datatype = datatype
+        self.status = JOB_STATUS_SPOOLING
+        self.submitted = time.time()
+        self.owner: Optional[int] = owner    # хэндл с открытым документом
+        self.closed_at: Optional[float] = None
+        self.delete_at: Optional[float] = None
+        self.pages = 0
+        self.data = bytearray()
+
+
+class _Printer:
+    def __init__(self, name: str, port: str):
+        self.name = name
+        self.port = port
+        self.status = 0
+        self.present = True
+        self.paper_mm = 80
+        self.jobs: Dict[int, _Job] = {}
+        self.head_since: Optional[float] = None  # раньше этого момента голова очереди не печатается
+
+
+class SpoolerSimulator:
+    """
+    Симулятор спулера. Экземпляр сам реализует API win32print; фасады
+    win32serviceutil / win32service доступны как атрибуты.
+
+    printers     — имена принтеров (первое — принтер по умолчанию);
+    print_sec    — сколько «печатается» один закрытый джоб;
+    delete_lag   — сколько закрытый джоб висит в «Удалении» после DELETE;
+    stop_sec / start_sec — длительность STOP_PENDING / START_PENDING службы;
+    latency      — задержка каждого вызова API (сек или {имя функции: сек});
+    fail_rate    — вероятность ошибки RPC на любом вызове (seed — для воспроизводимости).
+    """
+
+    def __init__(self, printers: Iterable[str] = ("SAM4S ELLIX40",), print_sec: float = 0.05,
+                 delete_lag: float = 0.0, stop_sec: float = 0.05, start_sec: float = 0.05,
+                 latency: Union[float, Dict[str, float]] = 0.0, fail_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        names = list(printers)
+        self._lock = threading.RLock()
+        self._printers: Dict[str, _Printer] = {n: _Printer(n, f"USB{i + 1:03d}") for i, n in enumerate(names)}
+        self._default = names[0] if names else ""
+        self._handles: Dict[int, Tuple[str, int]] = {}   # handle → (printer, epoch)
+        self._open_docs: Dict[int, int] = {}              # handle → job id
+        self._next_handle = 0x1000
+        self._next_job = 1
+        self._epoch = 0
+        self._svc_state = SERVICE_RUNNING
+        self._svc_until = 0.0
+        self.print_sec = float(print_sec)
+        self.delete_lag = float(delete_lag)
+        self.stop_sec = float(stop_sec)
+        self.start_sec = float(start_sec)
+        self.latency = latency
+        self.fail_rate = float(fail_rate)
+        self._rng = random.Random(seed)
+        self._injected: Dict[str, Deque[SimError]] = {}
+        self.calls: Counter = Counter()
+        self.printed: Dict[str, List[Tuple[str, bytes]]] = {n: [] for n in names}
+
+        self.win32serviceutil = _ServiceUtil(self)
+        self.win32service = SimpleNamespace(
+            SERVICE_STOPPED=SERVICE_STOPPED, SERVICE_START_PENDING=SERVICE_START_PENDING,
+            SERVICE_STOP_PENDING=SERVICE_STOP_PENDING, SERVICE_RUNNING=SERVICE_RUNNING,
+        )
+        for k, v in _PRINT_CONSTANTS.items():
+            setattr(self, k, v)
+
+    @property
+    def win32print(self) -> "SpoolerSimulator":
+        return self
+
+    # ---------- управление стендом ----------
+
+    def set_status(self, printer: str, paper_out: Optional[bool] = None, door_open: Optional[bool] = None,
+                   raw: Optional[int] = None) -> int:
+        """Выставить биты статуса принтера (или raw целиком). Возвращает новый Status."""
+        with self._lock:
+            p = self._printers[printer]
+            if raw is not None:
+                p.status = int(raw)
+            for bit, on in ((PRINTER_STATUS_PAPER_OUT, paper_out), (PRINTER_STATUS_DOOR_OPEN, door_open)):
+                if on is not None:
+                    p.status = (p.status | bit) if on else (p.status & ~bit)
+            return p.status
+
+    def set_paper_width(self, printer: str, paper_mm: int) -> None:
+        """Ширина бумаги в настройках драйвера (DEVMODE.dmPaperWidth)."""
+        with self._lock:
+            self._printers[printer].paper_mm = int(paper_mm)
+
+    def unplug(self, printer: str) -> None:
+        """Принтер пропал (USB/питание): OpenPrinter → ошибка, открытые хэндлы протухают."""
+        with self._lock:
+            self._printers[printer].present = False
+            for h in [h for h, (name, _) in self._handles.items() if name == printer]:
+                self._handles.pop(h)
+                self._open_docs.pop(h, None)
+
+    def plug(self, printer: str) -> None:
+        with self._lock:
+            self._printers[printer].present = True
+
+    def inject(self, func: str, winerror: int = RPC_S_SERVER_UNAVAILABLE,
+               strerror: str = "The RPC server is unavailable.", times: int = 1) -> None:
+        """Следующие times вызовов func завершатся ошибкой."""
+        with self._lock:
+            q = self._injected.setdefault(func, deque())
+            for _ in range(times):
+                q.append(SimError(winerror, func, strerror))
+
+    def jobs(self, printer: str) -> List[Dict[str, Any]]:
+        """Снимок очереди без задержек и инъекций (для тестов)."""
+        with self._lock:
+            self._advance(time.monotonic())
+            return [self._job_info(printer, j) for j in self._printers[printer].jobs.values()]
+
+    def open_handles(self) -> int:
+        with self._lock:
+            return len(self._handles)
+
+    def service_state(self) -> int:
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._svc_state
+
+    # ---------- win32print ----------
+
+    def GetDefaultPrinter(self) -> str:  # noqa: N802
+        self._enter("GetDefaultPrinter")
+        return self._default
+
+    def OpenPrinter(self, name: str, defaults: Any = None) -> int:  # noqa: N802
+        self._enter("OpenPrinter")
+        with self._lock:
+            p = self._printers.get(name)
+            if p is None or not p.present:
+                raise SimError(ERROR_INVALID_PRINTER_NAME, "OpenPrinter", "The printer name is invalid.")
+            self._next_handle += 1
+            self._handles[self._next_handle] = (name, self._epoch)
+            return self._next_handle
+
+    def ClosePrinter(self, h: int) -> None:  # noqa: N802
+        self._enter("ClosePrinter")
+        with self._lock:
+            if h not in self._handles:
+                raise SimError(ERROR_INVALID_HANDLE, "ClosePrinter", "The handle is invalid.")
+            name, _ = self._handles.pop(h)
+            job_id = self._open_docs.pop(h, None)
+            if job_id is not None:  # документ так и не закрыли — спулер его отбрасывает
+                self._printers[name].jobs.pop(job_id, None)
+
+    def GetPrinter(self, h: int, level: int = 2) -> Dict[str, Any]:  # noqa: N802
+        self._enter("GetPrinter")
+        with self._lock:
+            p = self._printer_of(h, "GetPrinter")
+            if level == 1:
+                return {"Flags": 0x800000, "pDescription": f"{p.name},SIM ESC/POS,", "pName": p.name, "pComment": ""}
+            return {
+                "pPrinterName": p.name, "pPortName": p.port, "pDriverName": "SIM ESC/POS",
+                "Status": p.status, "cJobs": len(p.jobs), "Attributes": 0x40,
+                "pDevMode": {"PaperWidth": p.paper_mm * 10},  # десятые доли мм, как DEVMODE.dmPaperWidth
+            }
+
+    def SetPrinter(self, h: int, level: int, info: Any, command: int) -> None:  # noqa: N802
+        self._enter("SetPrinter")
+        with self._lock:
+            p = self._printer_of(h, "SetPrinter")
+            if command == PRINTER_CONTROL_PURGE:
+                for job in list(p.jobs.values()):
+                    self._delete(p, job, lag=0.0)
+            elif command == PRINTER_CONTROL_PAUSE:
+                p.status |= PRINTER_STATUS_PAUSED
+            elif command == PRINTER_CONTROL_RESUME:
+                p.status &= ~PRINTER_STATUS_PAUSED
+
+    def EnumJobs(self, h: int, first: int, count: int, level: int = 1) -> List[Dict[str, Any]]:  # noqa: N802
+        self._enter("EnumJobs")
+        with self._lock:
+            p = self._printer_of(h, "EnumJobs")
+            jobs = list(p.jobs.values())[first:first + count]
+            return [self._job_info(p.name, j) for j in jobs]
+
+    def SetJob(self, h: int, job_id: int, level: int, info: Any, command: int) -> None:  # noqa: N802
+        self._enter("SetJob")
+        with self._lock:
+            p = self._printer_of(h, "SetJob")
+            job = p.jobs.get(job_id)
+            if job is None:
+                raise SimError(ERROR_INVALID_PARAMETER, "SetJob", "The parameter is incorrect.")
+            if command in (JOB_CONTROL_DELETE, JOB_CONTROL_CANCEL):
+                self._delete(p, job, lag=self.delete_lag)
+            elif command == JOB_CONTROL_PAUSE:
+                job.status |= JOB_STATUS_PAUSED
+            elif command == JOB_CONTROL_RESUME:
+                job.status &= ~JOB_STATUS_PAUSED
+            elif command == JOB_CONTROL_RESTART and next(iter(p.jobs)) == job_id:
+                p.head_since = time.monotonic()  # голова очереди печатается заново
+
+    def StartDocPrinter(self, h: int, level: int, doc_info: Tuple[Any, ...]) -> int:  # noqa: N802
+        self._enter("StartDocPrinter")
+        with self._lock:
+            p = self._printer_of(h, "StartDocPrinter")
+            if h in self._open_docs:
+                raise SimError(ERROR_INVALID_PARAMETER, "StartDocPrinter", "The parameter is incorrect.")
+            job = _Job(self._next_job, str(doc_info[0]), str(doc_info[2] if len(doc_info) > 2 else "RAW"), h)
+            self._next_job += 1
+            p.jobs[job.id] = job
+            self._open_docs[h] = job.id
+            return job.id
+
+    def StartPagePrinter(self, h: int) -> None:  # noqa: N802
+        self._enter("StartPagePrinter")
+        with self._lock:
+            self._doc_of(h, "StartPagePrinter").pages += 1
+
+    def WritePrinter(self, h: int, data: bytes) -> int:  # noqa: N802
+        self._enter("WritePrinter")
+        with self._lock:
+            self._doc_of(h, "WritePrinter").data += bytes(data)
+            return len(data)
+
+    def EndPagePrinter(self, h: int) -> None:  # noqa: N802
+        self._enter("EndPagePrinter")
+        with self._lock:
+            self._doc_of(h, "EndPagePrinter")
+
+    def EndDocPrinter(self, h: int) -> None:  # noqa: N802
+        self._enter("EndDocPrinter")
+        with self._lock:
+            job = self._doc_of(h, "EndDocPrinter")
+            name, _ = self._handles[h]
+            del self._open_docs[h]
+            job.owner = None
+            job.closed_at = time.monotonic()
+            job.status &= ~JOB_STATUS_SPOOLING
+            if job.status & JOB_STATUS_DELETING and job.delete_at is None:
+                self._printers[name].jobs.pop(job.id, None)  # «Удаление» дождалось закрытия документа
+
+    def AbortDocPrinter(self, h: int) -> None:  # noqa: N802
+        self._enter("AbortDocPrinter")
+        with self._lock:
+            job = self._doc_of(h, "AbortDocPrinter")
+            del self._open_docs[h]
+            self._printer_of(h, "AbortDocPrinter").jobs.pop(job.id, None)
+
+    # ---------- служба Spooler ----------
+
+    def _svc_query(self, service: str) -> Tuple[int, ...]:
+        self._check_service(service, "QueryServiceStatus")
+        with self._lock:
+            self._advance(time.monotonic())
+            return (0x10, self._svc_state, 0x5, 0, 0, 0, 0)
+
+    def _svc_stop(self, service: str) -> None:
+        self._check_service(service, "ControlService")
+        with self._lock:
+            self._advance(time.monotonic())
+            if self._svc_state != SERVICE_RUNNING:
+                raise SimError(ERROR_SERVICE_NOT_ACTIVE, "ControlService", "The service has not been started.")
+            self._svc_state = SERVICE_STOP_PENDING
+            self._svc_until = time.monotonic() + self.stop_sec
+            self._epoch += 1                   # все хэндлы протухли
+            self._handles.clear()
+            self._open_docs.clear()
+            for p in self._printers.values():  # незакрытые документы и «Удаление» не переживают рестарт
+                for job in list(p.jobs.values()):
+                    if job.owner is not None or job.status & JOB_STATUS_DELETING:
+                        p.jobs.pop(job.id)
+                p.head_since = None
+
+    def _svc_start(self, service: str) -> None:
+        self._check_service(service, "StartService")
+        with self._lock:
+            self._advance(time.monotonic())
+            if self._svc_state == SERVICE_STOPPED:
+                self._svc_state = SERVICE_START_PENDING
+                self._svc_until = time.monotonic() + self.start_sec
+
+    # ---------- внутреннее ----------
+
+    def _enter(self, func: str) -> None:
+        """Учёт вызова, задержка, инъекция ошибок, проверка, что служба работает."""
+        with self._lock:
+            self.calls[func] += 1
+        delay = self.latency.get(func, 0.0) if isinstance(self.latency, dict) else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            q = self._injected.get(func)
+            if q:
+                raise q.popleft()
+            if self.fail_rate and self._rng.random() < self.fail_rate:
+                raise SimError(RPC_S_SERVER_UNAVAILABLE, func, "The RPC server is unavailable.")
+            self._advance(time.monotonic())
+            if self._svc_state != SERVICE_RUNNING:
+                raise SimError(RPC_S_SERVER_UNAVAILABLE, func, "The RPC server is unavailable.")
+
+    def _check_service(self, service: str, func: str) -> None:
+        with self._lock:
+            self.calls[func] += 1
+        if service.lower() != "spooler":
+            raise SimError(ERROR_SERVICE_DOES_NOT_EXIST, func,
+                           "The specified service does not exist as an installed service.")
+
+    def _printer_of(self, h: int, func: str) -> _Printer:
+        entry = self._handles.get(h)
+        if entry is None or entry[1] != self._epoch:
+            raise SimError(ERROR_INVALID_HANDLE, func, "The handle is invalid.")
+        return self._printers[entry[0]]
+
+    def _doc_of(self, h: int, func: str) -> _Job:
+        p = self._printer_of(h, func)
+        job = p.jobs.get(self._open_docs.get(h, -1))
+        if job is None:
+            raise SimError(ERROR_INVALID_HANDLE, func, "The handle is invalid.")
+        return job
+
+    def _delete(self, p: _Printer, job: _Job, lag: float) -> None:
+        job.status |= JOB_STATUS_DELETING
+        if job.owner is not None:
+            return  # залипший документ: висит в «Удалении», пока держатель не закроет его
+        if lag > 0:
+            job.delete_at = time.monotonic() + lag
+        else:
+            p.jobs.pop(job.id, None)
+
+    def _advance(self, now: float) -> None:
+        """Продвинуть состояние по времени: служба, отложенные удаления, печать головы очереди."""
+        if self._svc_state in (SERVICE_STOP_PENDING, SERVICE_START_PENDING) and now >= self._svc_until:
+            self._svc_state = SERVICE_STOPPED if self._svc_state == SERVICE_STOP_PENDING else SERVICE_RUNNING
+        if self._svc_state != SERVICE_RUNNING:
+            return
+        for p in self._printers.values():
+            for job in [j for j in p.jobs.values() if j.delete_at is not None and j.delete_at <= now]:
+                p.jobs.pop(job.id)
+            self._print_head(p, now)
+
+    def _print_head(self, p: _Printer, now: float) -> None:
+        blocked = p.status & (PRINTER_STATUS_PAPER_OUT | PRINTER_STATUS_DOOR_OPEN | PRINTER_STATUS_PAUSED)
+        while p.jobs:
+            head = next(iter(p.jobs.values()))
+            if head.owner is not None or head.status & (JOB_STATUS_PAUSED | JOB_STATUS_DELETING):
+                return  # залипший/приостановленный джоб держит очередь
+            if blocked or not p.present:
+                head.status |= JOB_STATUS_ERROR | JOB_STATUS_BLOCKED_DEVQ
+                p.head_since = now  # печать начнётся не раньше, чем принтер освободится
+                return
+            head.status = (head.status | JOB_STATUS_PRINTING) & ~(JOB_STATUS_ERROR | JOB_STATUS_BLOCKED_DEVQ)
+            start = head.closed_at if p.head_since is None else max(head.closed_at, p.head_since)
+            if now - start < self.print_sec:
+                return
+            p.jobs.pop(head.id)
+            self.printed[p.name].append((head.doc, bytes(head.data)))
+            p.head_since = start + self.print_sec
+
+    def _job_info(self, printer: str, job: _Job) -> Dict[str, Any]:
+        return {
+            "JobId": job.id, "pPrinterName": printer, "pDocument": job.doc, "pDatatype": job.datatype,
+            "Status": job.status, "TotalPages": job.pages, "PagesPrinted": 0, "Size": len(job.data),
+            "Submitted": job.submitted,
+        }
+
+
+class _ServiceUtil:
+    """Фасад win32serviceutil поверх симулятора."""
+
+    def __init__(self, sim: SpoolerSimulator):
+        self._sim = sim
+
+    def QueryServiceStatus(self, service: str, machine: Optional[str] = None) -> Tuple[int, ...]:  # noqa: N802
+        return self._sim._svc_query(service)
+
+    def StopService(self, service: str, machine: Optional[str] = None) -> Tuple[int, ...]:  # noqa: N802
+        self._sim._svc_stop(service)
+        return self._sim._svc_query(service)
+
+    def StartService(self, service: str, args: Any = None, machine: Optional[str] = None) -> None:  # noqa: N802
+        self._sim._svc_start(service)
+
+    def RestartService(self, service: str, args: Any = None, waitSeconds: int = 30,  # noqa: N802,N803
+                       machine: Optional[str] = None) -> None:
+        """Как в pywin32: остановить, дождаться STOPPED (≤ waitSeconds), запустить."""
+        try:
+            self.StopService(service)
+        except SimError:
+            pass  # уже остановлена
+        end = time.monotonic() + waitSeconds
+        while self._sim._svc_query(service)[1] != SERVICE_STOPPED and time.monotonic() < end:
+            time.sleep(0.01)
+        self.StartService(service)
@@ -1,10 +1,15 @@
-import json, os, argparse, sys, re
+import json, os, argparse, sys, re, logging, uuid
 
 def find_config(start_dir: str) -> tuple[str, dict]:
     """
     Ищет config_smartpos.json или config.json, поднимаясь вверх от start_dir до корня диска.
+    SMARTPOS_CONFIG (путь к файлу) — без поиска по каталогам.
     Возвращает (путь, данные). Бросает FileNotFoundError если не найдено.
     """
+    env = os.environ.get("SMARTPOS_CONFIG")
+    if env:
+        with open(env, "r", encoding="utf-8") as f:
+            return os.path.abspath(env), json.load(f)
     cur = os.path.abspath(start_dir)
     tried = []
     while True:
@@ -22,6 +27,7 @@ def find_config(start_dir: str) -> tuple[str, dict]:
     raise FileNotFoundError("Config not found. Tried: " + " | ".join(tried))
 
 def main():
+    logging.basicConfig(level=logging.INFO, filename=os.environ.get("SMARTPOS_LOG", "smartpos_agent.log"))
     parser = argparse.ArgumentParser(description="SmartPOS Demo (offline)")
     # По умолчанию стартуем поиск от папки, где лежит этот файл (…\src\python\cli)
     default_start = os.path.dirname(__file__)
@@ -42,11 +48,23 @@ def main():
         else:
             raise FileNotFoundError(f"Не найдена база фраз: {dataset_path}")
 
-    from smartpos.intent_classifier import IntentClassifier
-    from smartpos.http_client import run_playbook
+    from smartpos.intent_classifier import IntentClassifier, VECTOR_THRESHOLD, VECTOR_WEIGHT
+    from smartpos.http_client import classify_intent, run_playbook
     from smartpos.gui_templates import make_gui_messages
 
-    classifier = IntentClassifier(dataset_path=dataset_path)
+    daemon_url = cfg.get("daemon_url", "http://127.0.0.1:8181")
+    local = []  # своя модель — только если демон недоступен (грузится при первой фразе)
+
+    def classify(text: str) -> dict:
+        ok, res = classify_intent(daemon_url, text)
+        if ok:
+            return res
+        if not local:
+            # Векторный режим (опечатки): порог косинуса и вес в общем скоре; вес 0 — выключить
+            local.append(IntentClassifier(dataset_path=dataset_path,
+                                          vector_threshold=float(cfg.get("intent_vector_threshold", VECTOR_THRESHOLD)),
+                                          vector_weight=float(cfg.get("intent_vector_weight", VECTOR_WEIGHT))))
+        return local[0].classify_intent(text)
 
     print("=== SmartPOS MVP (офлайн) ===")
     print(f"[config] {cfg_path}")
@@ -67,7 +85,7 @@ def main():
             print("[hint] Похоже, вы вставили команду PowerShell/URL. Запустите её в окне PowerShell, а сюда вводите фразы кассира (пример: 'печать висит').")
             continue
 
-        res = classifier.classify_intent(user)
+        res = classify(user)
         print(f"[intent] code={res['problem_code']} conf={res['confidence']}")
         chosen = res["problem_code"]
         if res["needed_clarification"]:
@@ -82,13 +100,12 @@ def main():
                 if 1 <= idx <= len(options):
                     chosen = options[idx-1]
         payload = {
-            "ticket_id": "SP-EXPO-0001",
+            "ticket_id": f"SP-DEMO-{uuid.uuid4().hex[:12]}",  # новый тикет на каждую фразу: повтор не берёт чужой кэш
             "problem_code": chosen,
-            "problem_code": res["problem_code"],
             "device": { "type": "receipt_printer", "name": cfg.get("printer_name","POS_Receipt"), "conn": "USB" },
             "context": { "beautify": False, "purge": cfg.get("auto_purge","soft"), "raw_user": user }
         }
-        ok, resp = run_playbook(cfg.get("daemon_url","http://127.0.0.1:8181"), payload)
+        ok, resp = run_playbook(daemon_url, payload)
         if not ok:
             print("[daemon] нет связи или ошибка:", resp)
             continue
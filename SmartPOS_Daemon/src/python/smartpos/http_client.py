@@ -16,3 +16,21 @@ def run_playbook(daemon_url: str, payload: dict) -> tuple[bool, dict | str]:
         return False, f"HTTP {e.code}"
     except Exception as e:
         return False, str(e)
+
+def classify_intent(daemon_url: str, text: str | list[str], timeout: float = 3.0) -> tuple[bool, dict | str]:
+    """Классификация фразы (или списка фраз) тёплой моделью демона: POST /intent/classify"""
+    body = {"texts": text} if isinstance(text, list) else {"text": text}
+    try:
+        req = urllib.request.Request(
+            url=f"{daemon_url}/intent/classify",
+            data=json.dumps(body, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            data = json.loads(resp.read().decode("utf-8"))
+        return True, data
+    except urllib.error.HTTPError as e:
+        return False, f"HTTP {e.code}"
+    except Exception as e:
+        return False, str(e)
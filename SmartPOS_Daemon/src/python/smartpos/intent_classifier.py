@@ -5,8 +5,15 @@ import os
 import re
 from typing import Dict, List, Optional
 
+from smartpos.kb_artifact import default_artifact_path, load_kb, source_hash, write_artifact
+from smartpos.kb_index import PhraseIndex
+from smartpos.kb_vectors import NGramVectors
+from smartpos.keyword_matcher import KeywordMatcher
+
 LOG_PATH = os.environ.get("SMARTPOS_LOG", "smartpos_agent.log")
-logging.basicConfig(level=logging.INFO, filename=LOG_PATH)
+# Файл лога настраивает процесс (smartpos_demo.main); импорт модуля — например,
+# демоном — не должен перехватывать корневой логгер
+logger = logging.getLogger(__name__)
 
 class IntentResult(dict):
     """Результат классификации намерения кассира."""
@@ -21,6 +28,7 @@ def _load_dataset(path: str) -> Dict[str, List[str]]:
 
 def _keyword_score(query: str, phrases: List[str], keywords: List[str]) -> float:
     """
+    Эталонная (линейная) версия скоринга; classify_intent считает то же через PhraseIndex.
     Улучшенная эвристика:
     - +1.5 за каждое ключевое слово
     - +3.0 за точное совпадение одной из эталонных фраз
@@ -55,6 +63,14 @@ def _code_keywords() -> Dict[str, List[str]]:
     }
 
 
+# Сильные маркеры «неверная ширина/обрезает» (для PR0006/PR0017)
+WIDTH_CODES = ("PR0006", "PR0017")
+WIDTH_MM = ("80", "58")
+WIDTH_WORDS = ["обрезает", "режет", "край", "ширина", "не влазит", "не влезает", "не помещается", "узкая печать", "cut off"]
+WIDTH_SIDES = ["справа", "слева", "правый", "левый"]
+WIDTH_MAX = 4.0
+
+
 def _strong_signals_width(q: str) -> float:
     """
     Выделяем сильные маркеры «неверная ширина/обрезает»:
@@ -69,53 +85,100 @@ def _strong_signals_width(q: str) -> float:
     if re.search(r'\b(80|58)\s*(мм|mm)\b', ql):
         score += 1.5
     # явные слова
-    for kw in ["обрезает", "режет", "край", "ширина", "не влазит", "не влезает", "не помещается", "узкая печать", "cut off"]:
+    for kw in WIDTH_WORDS:
         if kw in ql:
             score += 0.6
     # упоминания сторон
-    for kw in ["справа", "слева", "правый", "левый"]:
+    for kw in WIDTH_SIDES:
         if kw in ql:
             score += 0.3
-    return min(score, 4.0)
+    return min(score, WIDTH_MAX)
+
+
+def _build_matcher(kwords: Dict[str, List[str]]) -> KeywordMatcher:
+    """Все ключевые слова кодов и маркеры ширины — один автомат (один проход по запросу)."""
+    entries = [(kw, code, 1.5, "kw", False) for code, kws in kwords.items() for kw in kws]
+    for code in WIDTH_CODES:
+        entries += [(kw, code, 0.6, "width", False) for kw in WIDTH_WORDS]
+        entries += [(kw, code, 0.3, "width", False) for kw in WIDTH_SIDES]
+        # \b(80|58)\s*(мм|mm)\b: запрос нормализован, пробелов между числом и единицей 0 или 1
+        entries += [(f"{n}{sp}{unit}", code, 1.5, "width_mm", True)
+                    for n in WIDTH_MM for sp in ("", " ") for unit in ("мм", "mm")]
+    return KeywordMatcher(entries)
+
+
+def _hit_scores(hits) -> Dict[str, float]:
+    """Скор по кодам из попаданий автомата: 1.5 за ключевое слово, маркеры ширины — не больше WIDTH_MAX."""
+    kw: Dict[str, float] = {}
+    width: Dict[str, float] = {}
+    mm = set()
+    for h in KeywordMatcher.distinct(hits):
+        if h.kind == "kw":
+            kw[h.code] = kw.get(h.code, 0.0) + h.weight
+        elif h.kind == "width_mm":
+            mm.add(h.code)  # одно совпадение «80/58 мм» на запрос, как re.search
+        else:
+            width[h.code] = width.get(h.code, 0.0) + h.weight
+    for code in set(width) | mm:
+        kw[code] = kw.get(code, 0.0) + min(width.get(code, 0.0) + (1.5 if code in mm else 0.0), WIDTH_MAX)
+    return kw
+
+# Векторный режим (символьные n-граммы): косинус ниже порога не учитывается,
+# выше — добавляет VECTOR_WEIGHT * косинус (точная фраза даёт столько же, сколько +3.0 по токенам)
+VECTOR_THRESHOLD = 0.5
+VECTOR_WEIGHT = 3.0
 
 class IntentClassifier:
     """
-    Офлайн-классификатор для SmartPOS: keyword/fuzzy fallback.
-    Если будет локальный FAISS-индекс, можно догрузить его отдельно.
+    Офлайн-классификатор для SmartPOS: ключевые слова + фразы + векторный режим.
+    Векторный режим (TF-IDF по символьным n-граммам, smartpos.kb_vectors) ловит опечатки
+    и включается, только если в запросе есть слова, которых нет в базе фраз.
+    vector_weight=0 — выключить. faiss_index_path не используется (оставлен для совместимости).
+    База фраз, индекс и векторы берутся из скомпилированного артефакта (smartpos.kb_artifact,
+    по умолчанию <dataset>.kbc рядом с JSON), отображённого в память; если его нет или он
+    собран из другой версии JSON — база разбирается заново и артефакт перезаписывается.
     """
 
-    def __init__(self, dataset_path: str, faiss_index_path: Optional[str] = None):
-        self.dataset = _load_dataset(dataset_path)
-        self.faiss_enabled = False
+    def __init__(self, dataset_path: str, faiss_index_path: Optional[str] = None,
+                 vector_threshold: float = VECTOR_THRESHOLD, vector_weight: float = VECTOR_WEIGHT,
+                 artifact_path: Optional[str] = None, use_artifact: bool = True):
         self.faiss_index_path = faiss_index_path
+        self.artifact_path = (artifact_path or default_artifact_path(dataset_path)) if use_artifact else None
+        self.kb = load_kb(self.artifact_path, dataset_path) if use_artifact else None
+        if self.kb is not None:
+            self.dataset, self.index, vectors = self.kb.dataset, self.kb.index, self.kb.vectors
+        else:
+            digest = source_hash(dataset_path) if use_artifact else None
+            self.dataset = _load_dataset(dataset_path)
+            self.index = PhraseIndex(self.dataset)
+            vectors = None
+            if use_artifact or vector_weight > 0:
+                vectors = NGramVectors(self.index.phrases, self.index.phrase_code, len(self.index.codes))
+            if use_artifact:
+                try:
+                    write_artifact(self.artifact_path, digest, self.dataset, self.index, vectors)
+                    logger.info("KB artifact compiled: %s", self.artifact_path)
+                except OSError as e:  # только чтение / файл занят другим процессом — работаем из памяти
+                    logger.warning("KB artifact not written (%s): %s", self.artifact_path, e)
         self.kwords = _code_keywords()
-        try:
-            if faiss_index_path and os.path.exists(faiss_index_path):
-                import faiss  # опционально
-                self.faiss = faiss
-                self.faiss_enabled = True
-                logging.info("FAISS index detected at %s", faiss_index_path)
-        except Exception as e:
-            logging.warning("FAISS disabled: %s", e)
-            self.faiss_enabled = False
+        self.matcher = _build_matcher(self.kwords)
+        self.vector_threshold = vector_threshold
+        self.vector_weight = vector_weight
+        self.vectors = vectors if vector_weight > 0 else None
 
     def classify_intent(self, user_text: str) -> IntentResult:
         query = _normalize(user_text)
+        phrase_scores = self.index.score(query)  # только фразы с общими токенами
+        hits = self.matcher.find(query)          # ключевые слова и маркеры ширины — один проход
+        kw_scores = _hit_scores(hits)
+        vec_scores, vec_pids = self._vector_scores(query)
         scores = []
-        for code, phrases in self.dataset.items():
-            s = _keyword_score(query, phrases, self.kwords.get(code, []))
-            # Сильные сигналы ширины для PR0006/PR0017
-            if code in ("PR0006", "PR0017"):
-                s += _strong_signals_width(query)
+        for ci, code in enumerate(self.index.codes):
+            s = phrase_scores[code] + kw_scores.get(code, 0.0)
+            if vec_scores[ci] >= self.vector_threshold:
+                s += self.vector_weight * vec_scores[ci]
             scores.append((code, s, "kw"))
 
-        # (Опционально) добавить FAISS-скоринг при наличии индекса
-        if self.faiss_enabled:
-            try:
-                pass
-            except Exception as e:
-                logging.error("FAISS scoring error: %s", e)
-
         scores.sort(key=lambda x: x[1], reverse=True)
         top = scores[0]
         alt = [{"code": c, "score": round(s, 2)} for c, s, _ in scores[1:4]]
@@ -124,14 +187,27 @@ class IntentClassifier:
         need_clar = conf < 0.75
 
         rationale_bits = []
-        for kw in self.kwords.get(top[0], []):
-            if kw in query:
-                rationale_bits.append(kw)
+        for h in sorted(KeywordMatcher.distinct(hits), key=lambda h: h.start):
+            if h.code == top[0] and h.keyword not in rationale_bits:
+                rationale_bits.append(h.keyword)
+        if rationale_bits:
+            rationale = f"ключевые: {', '.join(rationale_bits[:3])}"
+        else:
+            ci = self.index.codes.index(top[0])
+            near = vec_pids[ci] if vec_scores[ci] >= self.vector_threshold else None
+            rationale = f"похоже на «{self.index.phrases[near]}»" if near is not None else "совпадение по фразам"
 
         return IntentResult(
             problem_code=top[0],
             confidence=round(conf, 2),
-            short_rationale=f"ключевые: {', '.join(rationale_bits[:3])}" if rationale_bits else "совпадение по фразам",
+            short_rationale=rationale,
             needed_clarification=need_clar,
             alternatives=alt
         )
+
+    def _vector_scores(self, query: str):
+        """Косинус ближайшей фразы по кодам; только если в запросе есть слова вне словаря фраз (опечатки)."""
+        n = len(self.index.codes)
+        if self.vectors is None or all(t in self.index.postings for t in query.split()):
+            return [0.0] * n, [None] * n
+        return self.vectors.best(query)
@@ -0,0 +1,339 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Optional, Tuple
+
+from smartpos import kb_vectors
+from smartpos.kb_index import PhraseIndex
+from smartpos.kb_vectors import NGramVectors
+
+MAGIC = b"SPKB"
+ARTIFACT_VERSION = 1  # меняется при изменении нормализации/формата — старые файлы пересобираются
+SUFFIX = ".kbc"
+_ALIGN = 8
+
+
+def default_artifact_path(dataset_path: str) -> str:
+    """phrases_pr.json → phrases_pr.kbc рядом с исходником."""
+    return os.path.splitext(dataset_path)[0] + SUFFIX
+
+
+def source_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _params() -> dict:
+    """То, от чего зависят векторы: при расхождении файл считается устаревшим."""
+    return {"ngrams": list(kb_vectors.NGRAMS), "dim": kb_vectors.DIM, "max_df": kb_vectors.MAX_DF}
+
+
+# ---------- ленивые представления над отображённым файлом ----------
+
+class _Strings(Sequence):
+    """Строки из utf-8 блоба по смещениям; декодируются только при обращении."""
+
+    def __init__(self, blob: memoryview, offsets: Sequence[int]):
+        self._blob, self._off = blob, offsets
+
+    def __len__(self) -> int:
+        return len(self._off) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return str(self._blob[self._off[i]:self._off[i + 1]], "utf-8")
+
+
+class _Postings(Mapping):
+    """токен → id фраз: бинарный поиск по отсортированным токенам."""
+
+    def __init__(self, tokens: _Strings, ptr: Sequence[int], ids: memoryview):
+        self._tokens, self._ptr, self._ids = tokens, ptr, ids
+
+    def _find(self, token) -> int:
+        i = bisect_left(self._tokens, token)
+        return i if i < len(self._tokens) and self._tokens[i] == token else -1
+
+    def __getitem__(self, token):
+        i = self._find(token)
+        if i < 0:
+            raise KeyError(token)
+        return self._ids[self._ptr[i]:self._ptr[i + 1]]
+
+    def __contains__(self, token) -> bool:
+        return self._find(token) >= 0
+
+    def __iter__(self):
+        return iter(self._tokens)
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+class _SortedMap(Mapping):
+    """int → значение по отсортированному массиву ключей (idf корзин, номер столбца корзины)."""
+
+    def __init__(self, keys: Sequence[int], values: Optional[Sequence] = None):
+        self._keys, self._values = keys, values
+
+    def _find(self, key) -> int:
+        i = bisect_left(self._keys, key)
+        return i if i < len(self._keys) and self._keys[i] == key else -1
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return i if self._values is None else self._values[i]
+
+    def __contains__(self, key) -> bool:
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class _Dataset(Mapping):
+    """код → его нормализованные фразы (фразы кода лежат подряд)."""
+
+    def __init__(self, codes: List[str], code_ptr: Sequence[int], phrases: _Strings):
+        self._codes = {c: i for i, c in enumerate(codes)}
+        self._ptr, self._phrases = code_ptr, phrases
+
+    def __getitem__(self, code) -> List[str]:
+        i = self._codes[code]
+        return self._phrases[self._ptr[i]:self._ptr[i + 1]]
+
+    def __iter__(self):
+        return iter(self._codes)
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+
+class KnowledgeBase:
+    """Скомпилированная база: dataset, индекс фраз и матрица n-грамм, отображённые из файла."""
+
+    def __init__(self, path: str, mm: mmap.mmap, header: dict, sections: Dict[str, memoryview]):
+        self.path, self._mm, self.header = path, mm, header
+        codes = header["codes"]
+        phrases = _Strings(sections["phrase_blob"], sections["phrase_off"])
+        tokens = _Strings(sections["token_blob"], sections["token_off"])
+        self.dataset = _Dataset(codes, sections["code_ptr"], phrases)
+        self.index = PhraseIndex.from_parts(
+            codes, phrases, sections["phrase_code"], _Postings(tokens, sections["post_ptr"], sections["post_ids"]))
+        self.vectors = NGramVectors.from_parts(
+            sections["phrase_code"], len(codes),
+            _SortedMap(sections["idf_keys"], sections["idf_vals"]),
+            sections["buckets"], _SortedMap(sections["buckets"]),
+            sections["indptr"], sections["rows"], sections["vals"])
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        except BufferError:  # ещё есть живые представления — закроется вместе с процессом
+            pass
+
+
+# ---------- сборка ----------
+
+def _sections(dataset: Mapping[str, List[str]], index: PhraseIndex, vectors: NGramVectors) -> Dict[str, array]:
+    code_ptr = array("q", [0])
+    for code in index.codes:
+        code_ptr.append(code_ptr[-1] + len(dataset[code]))
+    phrase_blob, phrase_off = bytearray(), array("q", [0])
+    for p in index.phrases:
+        phrase_blob += p.encode("utf-8")
+        phrase_off.append(len(phrase_blob))
+    token_blob, token_off = bytearray(), array("q", [0])
+    post_ptr, post_ids = array("q", [0]), array("i")
+    for t in sorted(index.postings):
+        token_blob += t.encode("utf-8")
+        token_off.append(len(token_blob))
+        post_ids.extend(index.postings[t])
+        post_ptr.append(len(post_ids))
+    idf_keys = sorted(vectors.idf)
+    return {
+        "code_ptr": code_ptr,
+        "phrase_blob": array("B", phrase_blob), "phrase_off": phrase_off,
+        "phrase_code": array("i", index.phrase_code),
+        "token_blob": array("B", token_blob), "token_off": token_off,
+        "post_ptr": post_ptr, "post_ids": post_ids,
+        "idf_keys": array("i", idf_keys), "idf_vals": array("d", [vectors.idf[b] for b in idf_keys]),
+        "buckets": array("i", vectors.buckets), "indptr": array("q", vectors.indptr),
+        "rows": array("i", vectors.rows), "vals": array("f", vectors.vals),
+    }
+
+
+def compile_kb(dataset_path: str, out_path: Optional[str] = None) -> str:
+    """JSON базы фраз → бинарный артефакт (атомарная запись). Возвращает путь."""
+    from smartpos.intent_classifier import _load_dataset
+
+    out_path = out_path or default_artifact_path(dataset_path)
+    digest = source_hash(dataset_path)
+    dataset = _load_dataset(dataset_path)
+    index = PhraseIndex(dataset)
+    vectors = NGramVectors(index.phrases, index.phrase_code, len(index.codes))
+    write_artifact(out_path, digest, dataset, index, vectors)
+    return out_path
+
+
+def write_artifact(out_path: str, digest: str, dataset: Mapping[str, List[str]],
+                   index: PhraseIndex, vectors: NGramVectors) -> None:
+    sections = _sections(dataset, index, vectors)
+    layout: Dict[str, Tuple[int, int, str]] = {}
+    offset = 0
+    for name, arr in sections.items():
+        size = len(arr) * arr.itemsize
+        layout[name] = (offset, size, arr.typecode)
+        offset += -(-size // _ALIGN) * _ALIGN
+    header = json.dumps({
+        "version": ARTIFACT_VERSION, "byteorder": sys.byteorder, "source_sha256": digest,
+        "params": _params(), "codes": index.codes, "phrases": len(index.phrases), "nnz": vectors.nnz,
+        "sections": layout,
+    }, ensure_ascii=False).encode("utf-8")
+    head = MAGIC + struct.pack("<I", len(header)) + header
+    base = -(-len(head) // _ALIGN) * _ALIGN
+    tmp = f"{out_path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(head + b"\0" * (base - len(head)))
+            for name, arr in sections.items():
+                off, size, _ = layout[name]
+                f.seek(base + off)
+                f.write(arr.tobytes())
+            f.truncate(base + offset)
+        os.replace(tmp, out_path)  # на Windows не удастся, пока старый файл отображён другим процессом
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# ---------- загрузка ----------
+
+# Секции артефакта и их типы: всё, что не совпадает, — чужой/битый файл
+_LAYOUT = {
+    "code_ptr": "q", "phrase_blob": "B", "phrase_off": "q", "phrase_code": "i",
+    "token_blob": "B", "token_off": "q", "post_ptr": "q", "post_ids": "i",
+    "idf_keys": "i", "idf_vals": "d", "buckets": "i", "indptr": "q", "rows": "i", "vals": "f",
+}
+
+
+def _valid_layout(header: dict, base: int, file_size: int) -> bool:
+    """Секции на месте, в пределах файла и кратны размеру элемента (до mmap — ничего не отображаем зря)."""
+    codes, layout = header.get("codes"), header.get("sections")
+    if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes) or not isinstance(layout, dict):
+        return False
+    if set(layout) != set(_LAYOUT):
+        return False
+    for name, typecode in _LAYOUT.items():
+        entry = layout[name]
+        if not (isinstance(entry, list) and len(entry) == 3 and entry[2] == typecode):
+            return False
+        off, size = entry[0], entry[1]
+        if not (isinstance(off, int) and isinstance(size, int) and off >= 0 and size >= 0):
+            return False
+        if size % array(typecode).itemsize or base + off + size > file_size:
+            return False
+    return True
+
+
+def _consistent(header: dict, sec: Dict[str, memoryview]) -> bool:
+    """Длины секций согласованы между собой (O(1): последние смещения = размеры блобов и т.п.)."""
+    n, n_codes = len(sec["phrase_code"]), len(header["codes"])
+    return (
+        len(sec["code_ptr"]) == n_codes + 1 and sec["code_ptr"][-1] == n
+        and len(sec["phrase_off"]) == n + 1 and sec["phrase_off"][-1] == len(sec["phrase_blob"])
+        and len(sec["token_off"]) >= 1 and sec["token_off"][-1] == len(sec["token_blob"])
+        and len(sec["post_ptr"]) == len(sec["token_off"]) and sec["post_ptr"][-1] == len(sec["post_ids"])
+        and len(sec["idf_keys"]) == len(sec["idf_vals"])
+        and len(sec["indptr"]) == len(sec["buckets"]) + 1 and sec["indptr"][-1] == len(sec["rows"])
+        and len(sec["rows"]) == len(sec["vals"])
+    )
+
+
+def load_kb(path: str, dataset_path: Optional[str] = None) -> Optional[KnowledgeBase]:
+    """
+    Отобразить артефакт в память. None — файла нет, он другой версии/параметров,
+    собран из другой версии исходника (sha256 dataset_path) или повреждён
+    (заголовок, раскладка секций) — вызывающий пересобирает его из JSON.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    with f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = f.read(8)
+        if len(head) < 8 or head[:4] != MAGIC:
+            return None
+        (hlen,) = struct.unpack("<I", head[4:])
+        if 8 + hlen > file_size:
+            return None
+        try:
+            header = json.loads(f.read(hlen).decode("utf-8"))
+        except ValueError:  # в т.ч. UnicodeDecodeError
+            return None
+        if (not isinstance(header, dict) or header.get("version") != ARTIFACT_VERSION
+                or header.get("byteorder") != sys.byteorder or header.get("params") != _params()):
+            return None
+        base = -(-(8 + hlen) // _ALIGN) * _ALIGN
+        if not _valid_layout(header, base, file_size):
+            return None
+        if dataset_path is not None and header.get("source_sha256") != source_hash(dataset_path):
+            return None
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+    views: List[memoryview] = []
+    sections: Dict[str, memoryview] = {}
+    try:
+        view = memoryview(mm)
+        views.append(view)
+        for name, (off, size, typecode) in header["sections"].items():
+            part = view[base + off:base + off + size]
+            views.append(part)
+            sections[name] = part.cast(typecode)
+            views.append(sections[name])
+        if _consistent(header, sections):
+            return KnowledgeBase(path, mm, header, sections)
+    except (TypeError, ValueError, IndexError):
+        pass
+    # Битый файл: сначала отпустить все представления, иначе mmap.close() → BufferError
+    sections.clear()
+    for v in reversed(views):
+        v.release()
+    mm.close()
+    return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compile SmartPOS phrase KB into a binary artifact")
+    parser.add_argument("dataset", help="phrases_pr.json")
+    parser.add_argument("-o", "--out", help=f"output path (default: <dataset>{SUFFIX})")
+    args = parser.parse_args(argv)
+    out = compile_kb(args.dataset, args.out)
+    kb = load_kb(out, args.dataset)
+    print(f"{out}: {kb.header['phrases']} phrases, {len(kb.index.postings)} tokens, nnz={kb.header['nnz']}")
+    kb.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+from __future__ import annotations
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+
+class PhraseIndex:
+    """
+    Инвертированный индекс эталонных фраз: токен → id фраз (и их коды проблем).
+    Строится один раз при загрузке базы; запрос трогает только фразы,
+    у которых есть общие токены с запросом или частичное совпадение строкой:
+    - +3.0 за точное совпадение фразы
+    - +1.0 если фраза — подстрока запроса или запрос — подстрока фразы
+      («бумаг» → «нет бумаги»); такие фразы ищутся через словарь токенов,
+      а не проходом по всей базе
+    - +0.5 * число общих токенов
+    Результат совпадает с линейным _keyword_score для любого запроса.
+    """
+
+    _lookup: Optional[Tuple[str, List[int], List[str]]] = None
+
+    def __init__(self, dataset: Dict[str, List[str]]):
+        self.codes: List[str] = list(dataset)
+        self.phrases: Sequence[str] = []
+        self.phrase_code: Sequence[int] = []
+        self.postings: Mapping[str, Sequence[int]] = {}
+        for ci, code in enumerate(self.codes):
+            for p in dataset[code]:
+                self._add(ci, p)
+
+    @classmethod
+    def from_parts(cls, codes: List[str], phrases: Sequence[str], phrase_code: Sequence[int],
+                   postings: Mapping[str, Sequence[int]]) -> "PhraseIndex":
+        """Индекс поверх готовых массивов (например, отображённых из скомпилированной базы)."""
+        idx = cls.__new__(cls)
+        idx.codes, idx.phrases, idx.phrase_code, idx.postings = list(codes), phrases, phrase_code, postings
+        return idx
+
+    def _add(self, code_idx: int, phrase: str) -> None:
+        pid = len(self.phrases)
+        self.phrases.append(phrase)
+        self.phrase_code.append(code_idx)
+        for t in set(phrase.split()):
+            self.postings.setdefault(t, []).append(pid)
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def candidates(self, qtoks: Iterable[str]) -> Dict[int, int]:
+        """id фразы → число общих с запросом токенов (только фразы с общими токенами)."""
+        overlap: Dict[int, int] = {}
+        for t in qtoks:
+            for pid in self.postings.get(t, ()):
+                overlap[pid] = overlap.get(pid, 0) + 1
+        return overlap
+
+    def _vocab(self) -> Tuple[str, List[int], List[str]]:
+        """
+        Словарь токенов одной строкой со смещениями (строится при первом частичном запросе):
+        поиск подстроки по нему идёт в str.find, а не в цикле Python.
+        """
+        if self._lookup is None:
+            vocab = sorted(self.postings)
+            offsets, pos = [], 0
+            for t in vocab:
+                offsets.append(pos)
+                pos += len(t) + 1
+            self._lookup = ("\n".join(vocab), offsets, vocab)
+        return self._lookup
+
+    def _tokens_containing(self, part: str) -> List[str]:
+        """Токены словаря, в которые part входит подстрокой."""
+        blob, offsets, vocab = self._vocab()
+        found = []
+        i = blob.find(part)
+        while i >= 0:
+            k = bisect_right(offsets, i) - 1
+            found.append(vocab[k])
+            i = blob.find(part, offsets[k] + len(vocab[k]) + 1)
+        return found
+
+    def partial(self, query: str) -> Set[int]:
+        """id фраз, где фраза — подстрока запроса или запрос — подстрока фразы (и точные совпадения)."""
+        qtoks = query.split()
+        # фраза внутри запроса: её последний токен — подстрока одного из токенов запроса
+        pieces = {t[i:j] for t in set(qtoks) for i in range(len(t)) for j in range(i + 1, len(t) + 1)}
+        inside: Set[int] = {pid for piece in pieces for pid in self.postings.get(piece, ())}
+        # запрос внутри фразы: каждый его токен — подстрока токена фразы, а средние — токены целиком
+        if not qtoks:
+            cand: Iterable[int] = range(len(self.phrases))
+        elif len(qtoks) > 2:
+            cand = self.postings.get(qtoks[1], ())
+        else:
+            cand = {pid for t in self._tokens_containing(max(qtoks, key=len)) for pid in self.postings[t]}
+        hits = {pid for pid in inside if self.phrases[pid] in query}
+        hits.update(pid for pid in cand if query in self.phrases[pid])
+        return hits
+
+    def score(self, query: str) -> Dict[str, float]:
+        """Скор фраз по кодам для нормализованного запроса (коды без совпадений — 0.0)."""
+        scores = [0.0] * len(self.codes)
+        touched = self.candidates(set(query.split()))
+        for pid in self.partial(query):
+            touched.setdefault(pid, 0)
+        for pid, common in touched.items():
+            p = self.phrases[pid]
+            if p == query:
+                s = 3.0
+            elif p in query or query in p:
+                s = 1.0
+            else:
+                s = 0.0
+            scores[self.phrase_code[pid]] += s + 0.5 * common
+        return dict(zip(self.codes, scores))
@@ -0,0 +1,129 @@
+from __future__ import annotations
+import math
+import zlib
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:  # опционально: векторизованный путь
+    import numpy as np
+except ImportError:  # pragma: no cover (зависит от окружения)
+    np = None
+
+NGRAMS = (2, 3, 4)
+DIM = 1 << 18   # корзин хэша: коллизии редки, а матрица всё равно разреженная
+MAX_DF = 0.5    # n-граммы из большей доли фраз почти не различают коды — выбрасываем
+
+
+@lru_cache(maxsize=65536)
+def _word_grams(word: str) -> Tuple[int, ...]:
+    """Корзины хэшированных символьных n-грамм слова (с границами « слово »)."""
+    w = f" {word} "
+    return tuple(zlib.crc32(w[i:i + n].encode("utf-8")) % DIM for n in NGRAMS for i in range(len(w) - n + 1))
+
+
+def _grams(text: str) -> Dict[int, float]:
+    """Корзина → частота по всем словам текста."""
+    counts: Dict[int, float] = {}
+    for word in text.split():
+        for b in _word_grams(word):
+            counts[b] = counts.get(b, 0.0) + 1.0
+    return counts
+
+
+class NGramVectors:
+    """
+    TF-IDF по хэшированным символьным n-граммам для всех эталонных фраз:
+    устойчиво к опечаткам («пичать висит», «принер офлайн»).
+    Матрица фраз хранится разреженной по корзинам (CSC: indptr/rows/vals),
+    запрос — одно произведение матрицы на вектор; с numpy — векторизованно,
+    без numpy — тот же проход на чистом Python. Векторы фраз и запроса
+    нормированы, скор — косинус.
+    """
+
+    def __init__(self, phrases: Sequence[str], phrase_code: Sequence[int], n_codes: int):
+        self.n = len(phrases)
+        self.phrase_code = phrase_code
+        self.n_codes = n_codes
+        grams = [_grams(p) for p in phrases]
+        df: Dict[int, int] = {}
+        for g in grams:
+            for b in g:
+                df[b] = df.get(b, 0) + 1
+        limit = max(1, int(MAX_DF * self.n)) if self.n > 10 else self.n
+        self.idf: Dict[int, float] = {b: math.log((1 + self.n) / (1 + d)) + 1.0 for b, d in df.items() if d <= limit}
+        cols: Dict[int, List[Tuple[int, float]]] = {}
+        for pid, g in enumerate(grams):
+            vec = self._weigh(g)
+            for b, v in vec.items():
+                cols.setdefault(b, []).append((pid, v))
+        self.buckets = array("i", sorted(cols))                # корзины с ненулевыми столбцами
+        self.indptr = array("q", [0])
+        self.rows = array("i")
+        self.vals = array("f")
+        for b in self.buckets:
+            for pid, v in cols[b]:
+                self.rows.append(pid)
+                self.vals.append(v)
+            self.indptr.append(len(self.rows))
+        self._col = {b: i for i, b in enumerate(self.buckets)}
+        self._np = None
+        if np is not None:
+            self._np = (np.frombuffer(self.rows, np.int32), np.frombuffer(self.vals, np.float32))
+
+    @classmethod
+    def from_parts(cls, phrase_code: Sequence[int], n_codes: int, idf: Mapping[int, float],
+                   buckets: Sequence[int], cols: Mapping[int, int],
+                   indptr: Sequence[int], rows: Sequence[int], vals: Sequence[float]) -> "NGramVectors":
+        """Матрица поверх готовых массивов (например, отображённых из скомпилированной базы)."""
+        vec = cls.__new__(cls)
+        vec.n, vec.phrase_code, vec.n_codes = len(phrase_code), phrase_code, n_codes
+        vec.idf, vec.buckets, vec._col = idf, buckets, cols
+        vec.indptr, vec.rows, vec.vals = indptr, rows, vals
+        vec._np = (np.frombuffer(rows, np.int32), np.frombuffer(vals, np.float32)) if np is not None else None
+        return vec
+
+    def _weigh(self, grams: Dict[int, float]) -> Dict[int, float]:
+        """Сублинейный tf * idf, L2-нормировка; неизвестные/частые n-граммы отбрасываются."""
+        vec = {b: (1.0 + math.log(c)) * self.idf[b] for b, c in grams.items() if b in self.idf}
+        norm = math.sqrt(sum(v * v for v in vec.values()))
+        return {b: v / norm for b, v in vec.items()} if norm else {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def nnz(self) -> int:
+        return len(self.rows)
+
+    def similarities(self, query: str) -> Dict[int, float]:
+        """id фразы → косинус с запросом (только фразы с общими n-граммами)."""
+        q = self._weigh(_grams(query))
+        spans = [(self.indptr[i], self.indptr[i + 1], w) for b, w in q.items() if (i := self._col.get(b)) is not None]
+        if not spans:
+            return {}
+        if self._np is not None:
+            rows, vals = self._np
+            idx = np.concatenate([rows[s:e] for s, e, _ in spans])
+            wts = np.concatenate([vals[s:e] * w for s, e, w in spans])
+            sims = np.bincount(idx, weights=wts, minlength=self.n)
+            hit = np.flatnonzero(sims)
+            return dict(zip(hit.tolist(), sims[hit].tolist()))
+        sims: Dict[int, float] = {}
+        rows, vals = self.rows, self.vals
+        for s, e, w in spans:
+            for j in range(s, e):
+                pid = rows[j]
+                sims[pid] = sims.get(pid, 0.0) + vals[j] * w
+        return sims
+
+    def best(self, query: str) -> Tuple[List[float], List[Optional[int]]]:
+        """По каждому коду: максимальный косинус среди его фраз и id ближайшей фразы."""
+        best = [0.0] * self.n_codes
+        best_pid: List[Optional[int]] = [None] * self.n_codes
+        for pid, s in self.similarities(query).items():
+            ci = self.phrase_code[pid]
+            if s > best[ci]:
+                best[ci] = s
+                best_pid[ci] = pid
+        return best, best_pid
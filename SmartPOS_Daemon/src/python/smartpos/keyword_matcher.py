@@ -0,0 +1,107 @@
+from __future__ import annotations
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class Hit(NamedTuple):
+    """Найденное ключевое слово: кому (code), сколько весит, где в запросе."""
+    keyword: str
+    code: str
+    weight: float
+    kind: str
+    start: int
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordMatcher:
+    """
+    Автомат Ахо–Корасик по всем ключевым словам и маркерам классификатора.
+    Один проход по запросу находит все вхождения (в том числе перекрывающиеся);
+    одно слово может принадлежать нескольким кодам со своими весами.
+    whole_word=True — вхождение засчитывается только на границах слова (как \\b).
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, float, str, bool]] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._own: List[List[int]] = [[]]   # слова, заканчивающиеся в состоянии
+        self._out: List[List[int]] = [[]]   # они же + по суффиксным ссылкам (после build)
+        self._entries: List[Tuple[str, str, float, str, bool]] = []
+        self._dirty = False
+        for keyword, code, weight, kind, whole_word in entries:
+            self.add(keyword, code, weight, kind, whole_word)
+        self.build()
+
+    def add(self, keyword: str, code: str, weight: float, kind: str = "kw", whole_word: bool = False) -> None:
+        keyword = keyword.lower()
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._own.append([])
+            state = nxt
+        self._own[state].append(len(self._entries))
+        self._entries.append((keyword, code, float(weight), kind, whole_word))
+        self._dirty = True
+
+    def build(self) -> None:
+        """Суффиксные ссылки (BFS). find() перестраивает сам, если были add()."""
+        self._out = [list(o) for o in self._own]
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find(self, text: str) -> List[Hit]:
+        """Все вхождения в порядке окончания в тексте (текст — уже нормализованный запрос)."""
+        if self._dirty:
+            self.build()
+        goto, fail, out, entries = self._goto, self._fail, self._out, self._entries
+        hits: List[Hit] = []
+        state = 0
+        n = len(text)
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for eid in out[state]:
+                keyword, code, weight, kind, whole_word = entries[eid]
+                start = i - len(keyword) + 1
+                if whole_word and ((start > 0 and _is_word(text[start - 1])) or (i + 1 < n and _is_word(text[i + 1]))):
+                    continue
+                hits.append(Hit(keyword, code, weight, kind, start))
+        return hits
+
+    @staticmethod
+    def distinct(hits: Iterable[Hit]) -> List[Hit]:
+        """Каждое (слово, код) — один раз, как проверка `kw in query`."""
+        seen = set()
+        out = []
+        for h in hits:
+            key = (h.keyword, h.code, h.kind)
+            if key not in seen:
+                seen.add(key)
+                out.append(h)
+        return out
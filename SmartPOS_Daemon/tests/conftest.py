@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Общие фикстуры тестов демона: симулятор спулера вместо pywin32, чистый реестр
+профилей и остановка фоновых наблюдателей (таблица джобов, кэш статусов) —
+их вызовы Win32 не должны попадать в счётчики соседних тестов.
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import pytest
+
+from smartpos_daemon.profiles import ProfileRegistry, set_registry
+from smartpos_daemon.spooler_jobs import get_table, set_table
+from smartpos_daemon.status_cache import get_cache, set_cache
+from smartpos_daemon.winapi import use_pywin32, use_simulator
+from smartpos_daemon.winspool_sim import SpoolerSimulator
+
+
+def _stop_watchers() -> None:
+    """Остановить наблюдателей общей таблицы джобов и кэша статусов; следующий get() создаст новые."""
+    get_table().stop(timeout=1.0)
+    get_cache().stop(timeout=1.0)
+    set_table(None)
+    set_cache(None)
+
+
+@pytest.fixture()
+def no_watchers():
+    """Тест начинается и заканчивается без фоновых потоков, опрашивающих спулер."""
+    _stop_watchers()
+    yield
+    _stop_watchers()
+
+
+@pytest.fixture()
+def spooler_sim(no_watchers):
+    """
+    Фабрика: spooler_sim(**kw) подключает SpoolerSimulator(**kw) и реестр профилей
+    в памяти (registry= — свой); после теста — обратно pywin32 и общий реестр.
+    """
+    def use(registry=None, **kwargs):
+        sim = use_simulator(SpoolerSimulator(**kwargs))
+        set_registry(registry if registry is not None else ProfileRegistry())
+        return sim
+
+    yield use
+    set_registry(None)
+    use_pywin32()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: табличная перекодировка в кодовую страницу принтера (smartpos_daemon.codepages).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+from smartpos_daemon.codepages import Transcoder, get_transcoder
+from smartpos_daemon.layout import LayoutProfile
+
+
+def test_encodable_text_matches_codec():
+    text = "\x1b@Кофе латте 245.00 ёЁ №5 ░▒▓ °\n" * 10
+    assert get_transcoder("cp866").encode(text) == text.encode("cp866")
+    assert get_transcoder("cp1251").encode("Привет, мир") == "Привет, мир".encode("cp1251")
+
+
+def test_missing_characters_are_substituted_not_dropped():
+    tc = Transcoder("cp866")
+    assert tc.encode("«Ёлка» — €10…") == '"Ёлка" - EUR10...'.encode("cp866")
+    assert tc.encode("café ﬁ") == b"cafe fi"
+    assert tc.encode("ёжик") == "ёжик".encode("cp866")  # разложенная «ё»
+    assert tc.encode("чай 中") == "чай ?".encode("cp866") and tc.lost == {"中"}
+
+
+def test_configured_substitutions_override_native_characters():
+    assert Transcoder("cp866").encode("№7") == "№7".encode("cp866")
+    assert Transcoder("cp866", {"№": "N", "«": "<<"}).encode("«№7»") == b'<<N7"'
+    assert get_transcoder("cp866", {"№": "N"}) is get_transcoder("cp866", {"№": "N"})
+
+
+def test_layout_profile_encodes_through_transcoder():
+    p = LayoutProfile(58, 32, substitutions=(("№", "N"),))
+    assert p.encode("Чек №1 «ок»") == 'Чек N1 "ок"'.encode("cp866")
+    assert p == LayoutProfile(58, 32, substitutions=(("№", "N"),)) and hash(p) == hash(LayoutProfile(58, 32, substitutions=(("№", "N"),)))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: шина событий с курсорами подписчиков (smartpos_daemon.events).
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from smartpos_daemon.events import EventBus
+
+
+def test_cursor_resume_and_wakeup():
+    bus = EventBus(capacity=16)
+    bus.publish("printer_status", {"paper_out": True})
+    events, reset = bus.wait(0, timeout=0.0)
+    assert [e["kind"] for e in events] == ["printer_status"] and not reset
+    cursor = events[-1]["id"]
+
+    threading.Timer(0.05, lambda: bus.publish("playbook_step", {"step": "clear_spooler"})).start()
+    t0 = time.time()
+    events, reset = bus.wait(cursor, timeout=2.0)
+    assert time.time() - t0 < 1.0
+    assert [e["data"]["step"] for e in events] == ["clear_spooler"] and not reset
+
+    # переподключение с тем же курсором отдаёт то же самое
+    again, _ = bus.wait(cursor, timeout=0.0)
+    assert again == events
+
+
+def test_reset_when_cursor_fell_out_of_buffer():
+    bus = EventBus(capacity=2)
+    for i in range(5):
+        bus.publish("sticky", {"active": i})
+    events, reset = bus.wait(1, timeout=0.0)
+    assert reset is True
+    assert [e["data"]["active"] for e in events] == [3, 4]
+
+    # курсор из будущего (демон перезапущен) → тоже reset
+    events, reset = bus.wait(100, timeout=0.0)
+    assert reset is True and len(events) == 2
+
+
+def test_close_wakes_waiters():
+    bus = EventBus()
+    threading.Timer(0.05, bus.close).start()
+    t0 = time.time()
+    events, _ = bus.wait(0, timeout=5.0)
+    assert events == [] and time.time() - t0 < 1.0 and bus.closed
+
+
+def test_stream_with_stale_last_event_id_resets_once(monkeypatch):
+    import socket
+
+    import run_daemon
+    from smartpos_daemon.http_pool import PooledHTTPServer
+
+    bus = EventBus()
+    monkeypatch.setattr(run_daemon, "BUS", bus)
+    monkeypatch.setattr(run_daemon.CONFIG, "events_keepalive_sec", 0.05)
+    httpd = PooledHTTPServer(("127.0.0.1", 0), run_daemon.JsonHandler, lanes={"main": (1, 4), "stream": (1, 4)})
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    sock = socket.create_connection(httpd.server_address, timeout=2.0)
+    try:
+        # курсор от прошлого запуска демона, шина после рестарта пуста
+        sock.sendall(b"GET /events/stream HTTP/1.1\r\nHost: x\r\nLast-Event-ID: 100\r\n\r\n")
+        time.sleep(0.3)
+        bus.publish("sticky", {"active": True})
+        buf, t0 = b"", time.time()
+        while b"event: sticky" not in buf and time.time() - t0 < 2.0:
+            buf += sock.recv(65536)
+        assert buf.count(b"event: reset") == 1          # не крутимся на каждом wait
+        assert 1 <= buf.count(b": keepalive") < 20
+        assert b"id: 1\nevent: sticky" in buf
+    finally:
+        sock.close()
+        bus.close()
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: один плейбук на несколько принтеров (smartpos_daemon.fleet, POST /action/run/batch).
+Строго stdlib, оффлайн, без win32 (симулятор спулера).
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from smartpos_daemon.fleet import FleetRunner, FleetTooLarge, expand_devices
+from smartpos_daemon.waits import deadline_of, wait_until
+
+
+def test_devices_expand_to_one_request_per_printer():
+    reqs = expand_devices({"ticket_id": "t", "problem_code": "PR0018", "device": {"type": "receipt_printer"},
+                           "devices": ["A", {"printer_name": "B"}, "A", ""]})
+    assert [r["device"]["name"] for r in reqs] == ["A", "B"]
+    assert all(r["device"]["type"] == "receipt_printer" and "devices" not in r for r in reqs)
+    assert reqs[1]["device"]["printer_name"] == "B" and reqs[0]["ticket_id"] == "t"
+
+
+def test_fan_out_takes_as_long_as_the_slowest_printer():
+    def runner(req, on_step):
+        name = req["device"]["name"]
+        on_step({"event": "done", "step": "clear_spooler"})
+        time.sleep(0.2 if name == "slow" else 0.05)
+        if name == "broken":
+            raise RuntimeError("rpc down")
+        return {"result_code": "FIXED", "printer": name}
+
+    fleet = FleetRunner(runner, max_workers=8, max_devices=8)
+    order, steps = [], []
+    res = fleet.run({"problem_code": "PR0018", "devices": ["p1", "p2", "slow", "broken", "p5", "p6"]},
+                    on_result=lambda item: order.append(item["printer"]), on_step=steps.append)
+    assert res["elapsed_s"] < 0.35  # не сумма (0.45 с), а самый медленный
+    assert [i["printer"] for i in res["results"]] == ["p1", "p2", "slow", "broken", "p5", "p6"]
+    assert order[-1] == "slow" and res["summary"] == {"FIXED": 5, "ERROR": 1}
+    assert res["results"][3]["result"]["evidence"]["error"] == "rpc down"
+    assert sorted(ev["printer"] for ev in steps) == sorted(["p1", "p2", "slow", "broken", "p5", "p6"])
+
+    with pytest.raises(FleetTooLarge):
+        fleet.run({"devices": [f"p{i}" for i in range(9)]})
+    with pytest.raises(ValueError):
+        fleet.run({"devices": []})
+    fleet.shutdown()
+
+
+def test_one_deadline_covers_the_whole_batch():
+    def runner(req, on_step):
+        dl = deadline_of(req)
+        time.sleep(0.1)  # один воркер: принтеры идут по очереди
+        return {"result_code": "TIMEOUT" if dl.expired() else "FIXED", "deadline": dl}
+
+    fleet = FleetRunner(runner, max_workers=1, budget=lambda req: 0.25)
+    res = fleet.run({"problem_code": "PR0018", "devices": ["p1", "p2", "p3", "p4"]})
+    deadlines = {id(i["result"]["deadline"]) for i in res["results"]}
+    assert len(deadlines) == 1  # общий дедлайн, а не свой на каждый принтер
+    assert [i["result_code"] for i in res["results"]] == ["FIXED", "FIXED", "TIMEOUT", "TIMEOUT"]
+    fleet.shutdown()
+
+
+@pytest.fixture()
+def daemon_three_printers(spooler_sim):
+    import run_daemon
+    from smartpos_daemon.http_pool import PooledHTTPServer
+
+    sim = spooler_sim(printers=("A", "B", "C"), print_sec=0.01, stop_sec=0.05, start_sec=0.05)
+    httpd = PooledHTTPServer(("127.0.0.1", 0), run_daemon.JsonHandler, lanes={"main": (2, 4), "fast": (1, 4)})
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    try:
+        yield httpd.server_address[1], sim
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _post(port, path, body):
+    req = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=json.dumps(body).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    return urllib.request.urlopen(req, timeout=10)
+
+
+def test_batch_endpoint_streams_results_and_shares_one_spooler_restart(daemon_three_printers):
+    port, sim = daemon_three_printers
+    body = {"ticket_id": "fleet-1", "problem_code": "PR0018", "devices": ["A", "B", "C"]}
+    with _post(port, "/action/run/batch?stream=1", body) as r:
+        assert r.headers["Content-Type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in r.read().decode("utf-8").splitlines()]
+    results = [x for x in lines if x["type"] == "result"]
+    assert sorted(x["printer"] for x in results) == ["A", "B", "C"]
+    assert all(x["result_code"] == "FIXED" for x in results), results
+    assert lines[-1]["type"] == "summary" and lines[-1]["summary"] == {"FIXED": 3}
+    assert sim.calls["ControlService"] < 3  # рестарты, совпавшие по времени, склеены
+    for name in ("A", "B", "C"):
+        assert wait_until(lambda: not sim.jobs(name), 1.0)
+        assert [d for d, _ in sim.printed[name]] == ["SMARTPOS_LAYOUT"]
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(port, "/action/run/batch", {"problem_code": "PR0018"})
+    assert e.value.code == 400
+
+
+def test_restart_is_not_started_once_the_budget_is_spent_at_the_gate(spooler_sim):
+    import run_daemon as rd
+    from smartpos_daemon.waits import Deadline
+
+    sim = spooler_sim(stop_sec=0.01, start_sec=0.01)
+    with rd._SPOOLER_GATE.step():  # шаг другого принтера держит ворота дольше бюджета
+        t0 = time.monotonic()
+        out = rd.restart_spooler({"problem_code": "PR0018", rd.DEADLINE_KEY: Deadline(0.1)})
+    assert out.result == "TIMEOUT" and time.monotonic() - t0 < 1.0
+    assert out.evidence["timeout"]["restart_spooler"]["stage"] == "gate"
+
+    out = rd.restart_spooler({"problem_code": "PR0018", rd.DEADLINE_KEY: Deadline(0.0)})  # ворота свободны, бюджета нет
+    assert out.result == "TIMEOUT" and sim.calls["ControlService"] == 0
+
+    out = rd.restart_spooler({"problem_code": "PR0018", rd.DEADLINE_KEY: Deadline(5.0)})  # ворота не остались закрытыми
+    assert out.name == "spooler_restart" and sim.calls["ControlService"] == 1
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: пул хэндлов принтеров (smartpos_daemon.handles) на фейковом спулере.
+"""
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+from smartpos_daemon.handles import FakeHandleBackend, HandlePool
+
+
+def test_handles_are_reused_across_leases():
+    backend = FakeHandleBackend(["POS"])
+    pool = HandlePool(backend)
+    for _ in range(4):  # как шаги PR0022: presence, clear, probe, test
+        with pool.lease("POS") as h:
+            assert h == 1
+    assert backend.opens == 1
+    st = pool.stats()
+    assert st["reuses"] == 3 and st["leased"] == 0 and st["idle"] == {"POS": 1}
+
+
+def test_concurrent_leases_get_distinct_handles_and_idle_is_capped():
+    backend = FakeHandleBackend(["POS"])
+    pool = HandlePool(backend, max_idle=1)
+    a, b = pool.lease("POS"), pool.lease("POS")
+    assert a.acquire() != b.acquire()
+    a.release()
+    b.release()
+    assert backend.opens == 2 and backend.open_handles == 1
+
+
+def test_invalidate_after_spooler_restart_reopens():
+    backend = FakeHandleBackend(["POS"])
+    pool = HandlePool(backend)
+    lease = pool.lease("POS")
+    held = lease.acquire()
+    with pool.lease("POS"):
+        pass
+    backend.restart()
+    pool.invalidate()
+    assert backend.open_handles == 1          # свободный хэндл закрыт сразу
+    lease.release()
+    assert backend.open_handles == 0          # арендованный — при возврате
+    with pool.lease("POS") as h:
+        assert h != held and backend.check(h)
+
+
+def test_idle_handle_is_validated_and_broken_one_discarded():
+    backend = FakeHandleBackend(["POS"])
+    pool = HandlePool(backend, validate_after=0.0)
+    with pool.lease("POS") as first:
+        pass
+    backend.restart()  # рестарт, о котором пул не знает
+    with pool.lease("POS") as h:
+        assert h != first
+    assert pool.stats()["stale"] == 1 and backend.checks == 1
+
+    with pytest.raises(OSError):
+        with pool.lease("POS"):
+            raise OSError("RPC server unavailable")
+    assert pool.stats()["discarded"] == 1 and backend.open_handles == 0
+
+
+def test_open_failure_propagates_and_does_not_leak_lease():
+    pool = HandlePool(FakeHandleBackend([]))
+    with pytest.raises(RuntimeError, match="not found"):
+        with pool.lease("GHOST"):
+            pass
+    assert pool.stats()["leased"] == 0
+
+
+def test_parallel_leases_are_safe():
+    backend = FakeHandleBackend(["POS"])
+    pool = HandlePool(backend, max_idle=4)
+    in_use = set()
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        for _ in range(50):
+            with pool.lease("POS") as h:
+                with lock:
+                    if h in in_use:
+                        errors.append(h)
+                    in_use.add(h)
+                with lock:
+                    in_use.discard(h)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and backend.opens <= 4 and pool.stats()["leased"] == 0
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: пул воркеров HTTP с ограниченными очередями (smartpos_daemon.http_pool).
+Локальный сервер на 127.0.0.1:0, без win32.
+"""
+from __future__ import annotations
+
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler
+
+from smartpos_daemon.http_pool import PooledHTTPServer
+
+GATE = threading.Event()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):  # noqa: N802
+        if self.path.startswith("/slow"):
+            GATE.wait(3.0)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"path": self.path}).encode("utf-8"))
+
+
+def _get(port: int, path: str):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=3) as r:
+            return r.status, dict(r.headers)
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers)
+
+
+def _wait_for(cond, timeout: float = 2.0) -> None:
+    end = time.time() + timeout
+    while not cond():
+        assert time.time() < end, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_saturated_main_lane_rejects_but_fast_lane_serves():
+    GATE.clear()
+    httpd = PooledHTTPServer(("127.0.0.1", 0), _Handler, lanes={"main": (1, 1), "fast": (1, 4)})
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        slow = [threading.Thread(target=_get, args=(port, "/slow")) for _ in range(2)]
+        # первый запрос занимает воркер, второй — единственное место в очереди
+        slow[0].start()
+        _wait_for(lambda: httpd.stats()["main"]["busy"] == 1)
+        slow[1].start()
+        _wait_for(lambda: httpd.stats()["main"]["queue_depth"] == 1)
+        code, headers = _get(port, "/slow")
+        assert code == 503
+        assert headers.get("Retry-After") == "1"
+
+        code, _ = _get(port, "/health")
+        assert code == 200
+
+        GATE.set()
+        for t in slow:
+            t.join(3.0)
+        st = httpd.stats()
+        assert st["main"]["rejected"] == 1
+        assert st["main"]["served"] == 2
+        assert st["fast"]["served"] == 1
+    finally:
+        GATE.set()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_silent_clients_do_not_stall_accept():
+    httpd = PooledHTTPServer(("127.0.0.1", 0), _Handler, lanes={"main": (4, 8), "fast": (1, 4)})
+    httpd.peek_timeout = 0.3
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    silent = [socket.create_connection(("127.0.0.1", port)) for _ in range(4)]  # соединились и молчат
+    try:
+        time.sleep(0.05)
+        t0 = time.monotonic()
+        code, _ = _get(port, "/health")
+        assert code == 200 and time.monotonic() - t0 < 0.25  # раньше: по peek_timeout на каждого молчуна
+        assert httpd.stats()["fast"]["served"] == 1
+        _wait_for(lambda: httpd.stats()["main"]["accepted"] == 4)  # молчуны — в main после peek_timeout
+    finally:
+        for s in silent:
+            s.close()
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: идемпотентность запусков плейбуков по ticket_id (smartpos_daemon.idempotency).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from smartpos_daemon.idempotency import (
+    AttachTimeout, IdempotencyGuard, MemoryResultStore, SqliteResultStore, idempotency_key,
+)
+
+
+def _counting(result_code="FIXED"):
+    calls = []
+
+    def fn(emit):
+        calls.append(1)
+        emit({"type": "done", "step": "s1"})
+        return {"ticket_id": "t1", "result_code": result_code, "n": len(calls)}
+
+    return fn, calls
+
+
+def test_key_ignores_ticket_and_private_fields():
+    a = idempotency_key({"ticket_id": "t1", "problem_code": "PR0018", "_deadline": object()})
+    assert a == idempotency_key({"problem_code": "PR0018", "ticket_id": "t1"})
+    assert a != idempotency_key({"ticket_id": "t1", "problem_code": "PR0022"})
+    assert idempotency_key({"problem_code": "PR0018"}) is None
+
+
+def test_repeat_is_replayed_without_running_again():
+    guard = IdempotencyGuard()
+    fn, calls = _counting()
+    req = {"ticket_id": "t1", "problem_code": "PR0018"}
+    first = guard.run(req, fn)
+    again = guard.run(req, fn)
+    assert len(calls) == 1 and again["n"] == 1 and again["replayed"] is True and "replayed" not in first
+
+    guard.run({**req, "problem_code": "PR0022"}, fn)  # тот же тикет, другой запрос
+    guard.run({"problem_code": "PR0018"}, fn)          # без ticket_id — всегда заново
+    guard.run({"problem_code": "PR0018"}, fn)
+    assert len(calls) == 4 and guard.stats()["replayed"] == 1
+
+
+@pytest.mark.parametrize("code", ["TIMEOUT", "NOT_FOUND", "ERROR", "HARDWARE_FAULT"])
+def test_failed_results_are_not_cached(code):
+    guard = IdempotencyGuard()
+    fn, calls = _counting(code)
+    guard.run({"ticket_id": "t1"}, fn)
+    again = guard.run({"ticket_id": "t1"}, fn)
+    assert len(calls) == 2 and "replayed" not in again and guard.stats()["stored"] == 0
+
+
+def test_repeat_during_run_attaches_and_gets_steps():
+    guard = IdempotencyGuard()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow(emit):
+        calls.append(1)
+        emit({"type": "start", "step": "s1"})
+        started.set()
+        release.wait(5)
+        emit({"type": "done", "step": "s1"})
+        return {"result_code": "FIXED"}
+
+    first = {}
+    t = threading.Thread(target=lambda: first.update(guard.run({"ticket_id": "t1"}, slow)))
+    t.start()
+    assert started.wait(5)
+
+    seen, out = [], {}
+    t2 = threading.Thread(target=lambda: out.update(guard.run({"ticket_id": "t1"}, slow, on_event=seen.append)))
+    t2.start()
+    time.sleep(0.05)
+    release.set()
+    t.join(5)
+    t2.join(5)
+    assert len(calls) == 1 and out["attached"] is True and out["result_code"] == first["result_code"]
+    assert [e["type"] for e in seen] == ["start", "done"]
+
+
+def test_attached_wait_is_bounded():
+    guard = IdempotencyGuard(wait_timeout=5.0)
+    started, release = threading.Event(), threading.Event()
+
+    def stuck(emit):
+        started.set()
+        release.wait(5)
+        return {"result_code": "FIXED"}
+
+    t = threading.Thread(target=lambda: guard.run({"ticket_id": "t1"}, stuck))
+    t.start()
+    assert started.wait(5)
+    seen = []
+    t0 = time.perf_counter()
+    with pytest.raises(AttachTimeout):
+        guard.run({"ticket_id": "t1"}, stuck, on_event=seen.append, wait_timeout=0.05)
+    assert time.perf_counter() - t0 < 1.0
+    release.set()
+    t.join(5)
+    assert guard.run({"ticket_id": "t1"}, stuck)["replayed"] is True and seen == []
+
+
+def test_ttl_expiry_and_memory_bound():
+    guard = IdempotencyGuard(ttl=0.05)
+    fn, calls = _counting()
+    guard.run({"ticket_id": "t1"}, fn)
+    time.sleep(0.08)
+    guard.run({"ticket_id": "t1"}, fn)
+    assert len(calls) == 2
+
+    store = MemoryResultStore(max_entries=2)
+    for i in range(3):
+        store.put(str(i), {"i": i}, 60)
+    assert store.size() == 2 and store.get("0") is None
+
+
+def test_sqlite_store_survives_restart(tmp_path):
+    path = str(tmp_path / "results.db")
+    fn, calls = _counting()
+    store = SqliteResultStore(path)
+    IdempotencyGuard(store).run({"ticket_id": "t1"}, fn)
+    store.close()
+
+    again = SqliteResultStore(path)
+    res = IdempotencyGuard(again).run({"ticket_id": "t1"}, fn)
+    assert len(calls) == 1 and res["replayed"] is True and res["result_code"] == "FIXED"
+    assert again.size() == 1
+    again.close()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: инвертированный индекс фраз IntentClassifier (smartpos.kb_index).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import time
+
+from smartpos.intent_classifier import IntentClassifier, _keyword_score, _normalize
+from smartpos.kb_index import PhraseIndex
+
+KB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "kb_core", "phrases_pr.json")
+
+
+def test_index_scores_match_linear_scan():
+    clf = IntentClassifier(KB)
+    queries = [p for phrases in clf.dataset.values() for p in phrases]
+    queries += ["печать висит уже час", "принтер не видит usb", "обрезает справа 80 мм", "нет бумаги"]
+    queries += ["бумаг", "крышк", "печат", "ет бума", "не печатает чек совсем", " ", ""]
+    for q in map(_normalize, queries):
+        indexed = clf.index.score(q)
+        for code, phrases in clf.dataset.items():
+            assert indexed[code] == _keyword_score(q, phrases, []), (q, code)
+
+
+def test_only_phrases_sharing_tokens_are_touched():
+    idx = PhraseIndex({"A": ["печать висит", "очередь стоит"], "B": ["нет бумаги"]})
+    assert idx.candidates({"печать", "сегодня"}) == {0: 1}
+    assert idx.score("печать висит") == {"A": 4.0, "B": 0.0}
+    assert idx.score("сегодня") == {"A": 0.0, "B": 0.0}
+
+
+def test_partial_words_match_like_linear_scan():
+    idx = PhraseIndex({"A": ["печать висит", "очередь стоит"], "B": ["нет бумаги"]})
+    assert idx.score("бумаг") == {"A": 0.0, "B": 1.0}
+    assert idx.score("ет бума") == {"A": 0.0, "B": 1.0}
+    assert idx.score("опять нет бумаги в принтере") == {"A": 0.0, "B": 2.0}
+    assert idx.score("") == {"A": 2.0, "B": 1.0}  # пустая строка — подстрока любой фразы
+
+
+def test_classification_stays_fast_on_a_large_kb(tmp_path):
+    rnd = random.Random(7)
+    vocab = [f"слово{i}" for i in range(5000)]
+    codes = ("PR0022", "PR0018", "PR0001", "PR0015", "PR0006", "PR0017")
+    big = {code: [" ".join(rnd.sample(vocab, 4)) for _ in range(3000)] for code in codes}
+    big["PR0018"] += ["печать висит"]
+    path = tmp_path / "big.json"
+    path.write_text(json.dumps(big, ensure_ascii=False), encoding="utf-8")
+
+    clf = IntentClassifier(str(path))
+    assert len(clf.index) == 18001
+    assert clf.classify_intent("печать висит")["problem_code"] == "PR0018"
+    queries = [_normalize(f"печать висит {vocab[i]} {vocab[i + 1]}") for i in range(20)]
+    t0 = time.perf_counter()
+    for q in queries:
+        clf.classify_intent(q)
+    indexed = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for q in queries:  # эталон: линейный проход по всем фразам
+        for code, phrases in clf.dataset.items():
+            _keyword_score(q, phrases, [])
+    linear = time.perf_counter() - t0
+    # относительная граница — не зависит от скорости машины CI
+    assert indexed * 10 < linear, (indexed, linear)
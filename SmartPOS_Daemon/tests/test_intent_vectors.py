@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: векторный режим IntentClassifier — TF-IDF по символьным n-граммам (smartpos.kb_vectors).
+Строго stdlib, оффлайн, без win32 (numpy — если установлен).
+"""
+from __future__ import annotations
+
+import math
+import os
+
+from smartpos.intent_classifier import IntentClassifier
+from smartpos.kb_vectors import NGramVectors, _grams
+
+KB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "kb_core", "phrases_pr.json")
+
+
+def test_similarities_are_cosines_of_tfidf_vectors():
+    phrases = ["печать висит", "очередь стоит", "нет бумаги", "принтер офлайн"]
+    vec = NGramVectors(phrases, [0, 0, 1, 2], 3)
+    assert len(vec) == 4 and vec.nnz == len(vec.rows)
+    sims = vec.similarities("печать висит")
+    assert math.isclose(sims[0], 1.0, rel_tol=1e-5)
+    # та же матрица, посчитанная «в лоб»: косинус взвешенных векторов
+    q = vec._weigh(_grams("пичать висит"))
+    for pid, p in enumerate(phrases):
+        v = vec._weigh(_grams(p))
+        expected = sum(w * v.get(b, 0.0) for b, w in q.items())
+        assert math.isclose(vec.similarities("пичать висит").get(pid, 0.0), expected, rel_tol=1e-4, abs_tol=1e-6)
+    best, pids = vec.best("принер офлайн")
+    assert pids[2] == 3 and best[2] > 0.5 and best[2] == max(best)
+    assert vec.similarities("") == {}
+
+
+def test_typos_are_classified_through_vectors():
+    clf = IntentClassifier(KB)
+    off = IntentClassifier(KB, vector_weight=0)
+    assert off.vectors is None
+    res = clf.classify_intent("нет бумги")
+    assert res["problem_code"] == "PR0001" and off.classify_intent("нет бумги")["problem_code"] != "PR0001"
+    assert res["short_rationale"] == "похоже на «пишет нет бумаги»"
+    res = clf.classify_intent("принер офлайн")
+    assert res["problem_code"] == "PR0022" and res["confidence"] > off.classify_intent("принер офлайн")["confidence"]
+    assert clf.classify_intent("пичать висит")["problem_code"] == "PR0018"
+
+
+def test_vectors_do_not_change_known_phrases_and_respect_threshold():
+    clf = IntentClassifier(KB)
+    off = IntentClassifier(KB, vector_weight=0)
+    for phrases in clf.dataset.values():
+        for p in phrases:  # все слова известны — векторный режим не включается
+            assert clf.classify_intent(p) == off.classify_intent(p)
+    strict = IntentClassifier(KB, vector_threshold=1.01)
+    assert strict.classify_intent("нет бумги") == off.classify_intent("нет бумги")
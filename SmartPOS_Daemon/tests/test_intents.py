@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: общий классификатор намерений демона и LRU-кэш (smartpos_daemon.intents, POST /intent/classify).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import threading
+
+import pytest
+
+from smartpos.intent_classifier import IntentClassifier
+from smartpos_daemon.http_pool import classify_fast
+from smartpos_daemon.intents import IntentService, get_intents, set_intents
+
+KB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "kb_core", "phrases_pr.json")
+
+
+class _Counting:
+    def __init__(self, clf):
+        self.clf, self.calls = clf, []
+
+    def classify_intent(self, text):
+        self.calls.append(text)
+        return self.clf.classify_intent(text)
+
+
+def test_cache_keys_on_normalized_query_and_evicts_lru(tmp_path):
+    shutil.copy(KB, tmp_path / "kb.json")
+    clf = _Counting(IntentClassifier(str(tmp_path / "kb.json")))
+    svc = IntentService(clf, cache_size=2)
+    first = svc.classify("Печать  висит")
+    assert first == clf.clf.classify_intent("печать висит") and first["alternatives"]
+    first["alternatives"].clear()                      # копия: кэш не портится
+    assert svc.classify(" печать висит ")["alternatives"]
+    assert clf.calls == ["печать висит"]
+    svc.classify("нет бумаги")
+    svc.classify("печать висит")                       # свежий — «нет бумаги» теперь самый старый
+    svc.classify("крышка открыта")
+    svc.classify("нет бумаги")
+    assert clf.calls == ["печать висит", "нет бумаги", "крышка открыта", "нет бумаги"]
+    st = svc.stats()
+    assert (st["hits"], st["misses"], st["cache_size"], st["cache_max"]) == (2, 4, 2, 2)
+
+
+def test_batch_scores_duplicates_once_and_is_bounded(tmp_path):
+    shutil.copy(KB, tmp_path / "kb.json")
+    clf = _Counting(IntentClassifier(str(tmp_path / "kb.json")))
+    svc = IntentService(clf, cache_size=0, max_batch=3)
+    res = svc.classify_many(["нет бумги", "НЕТ БУМГИ", "печать висит"])
+    assert [r["problem_code"] for r in res] == ["PR0001", "PR0001", "PR0018"]
+    assert clf.calls == ["нет бумги", "печать висит"] and svc.stats()["cache_size"] == 0
+    with pytest.raises(ValueError):
+        svc.classify_many(["a"] * 4)
+
+
+def test_endpoint_serves_one_warm_model(tmp_path):
+    import run_daemon
+    from smartpos.http_client import classify_intent
+    from smartpos_daemon.http_pool import PooledHTTPServer
+
+    shutil.copy(KB, tmp_path / "kb.json")
+    saved = run_daemon.CONFIG.intent_kb
+    run_daemon.CONFIG.intent_kb = str(tmp_path / "kb.json")
+    httpd = PooledHTTPServer(("127.0.0.1", 0), run_daemon.JsonHandler, lanes={"main": (1, 4), "fast": (1, 4)})
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        assert classify_intent(url, "печать висит") == (False, "HTTP 503")  # модель ещё не загружена
+        svc = run_daemon.load_intents()
+        assert get_intents() is svc and svc.stats()["phrases"] == len(svc.classifier.index)
+
+        ok, res = classify_intent(url, "пичать висит")
+        assert ok and res["problem_code"] == "PR0018" and {"confidence", "alternatives"} <= set(res)
+        ok, res = classify_intent(url, ["принер офлайн", "пичать висит"])
+        assert ok and [r["problem_code"] for r in res["results"]] == ["PR0022", "PR0018"]
+        assert svc.stats()["hits"] == 1
+        assert run_daemon.intent_classify({"texts": "печать"})[0] == 400
+        assert run_daemon.intent_classify({})[0] == 400
+        assert run_daemon.intent_classify({"texts": ["x"] * (run_daemon.CONFIG.intent_batch_max + 1)})[0] == 400
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        set_intents(None)
+        run_daemon.CONFIG.intent_kb = saved
+    assert classify_fast("POST", "/intent/classify") == "fast" and classify_fast("POST", "/action/run") == "main"
+
+
+def test_daemon_uses_the_clients_vector_settings(tmp_path):
+    import json
+    import run_daemon
+
+    shutil.copy(KB, tmp_path / "kb.json")
+    (tmp_path / "config_smartpos.json").write_text(
+        json.dumps({"intent_vector_threshold": 0.7, "intent_vector_weight": 2.0}), encoding="utf-8")
+    saved = (run_daemon.CONFIG.intent_kb, run_daemon.CONFIG.client_config, run_daemon.CONFIG.intent_vector_weight)
+    run_daemon.CONFIG.intent_kb = str(tmp_path / "kb.json")
+    run_daemon.CONFIG.client_config = str(tmp_path / "config_smartpos.json")
+    try:
+        clf = run_daemon.load_intents().classifier
+        assert (clf.vector_threshold, clf.vector_weight) == (0.7, 2.0)  # как у демо с этим конфигом
+        run_daemon.CONFIG.intent_vector_weight = 0.0                       # явная настройка демона важнее
+        assert run_daemon.load_intents().classifier.vectors is None
+        run_daemon.CONFIG.client_config = str(tmp_path / "missing.json")
+        run_daemon.CONFIG.intent_vector_weight = None
+        clf = run_daemon.load_intents().classifier
+        assert (clf.vector_threshold, clf.vector_weight) == (0.5, 3.0)
+    finally:
+        set_intents(None)
+        run_daemon.CONFIG.intent_kb, run_daemon.CONFIG.client_config, run_daemon.CONFIG.intent_vector_weight = saved
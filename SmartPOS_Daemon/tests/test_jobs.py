@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: асинхронные задания плейбуков (smartpos_daemon.jobs).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from smartpos_daemon.jobs import JobManager, JobQueueFull
+
+
+def _wait_state(mgr: JobManager, job_id: str, state: str, timeout: float = 2.0) -> dict:
+    end = time.time() + timeout
+    while time.time() < end:
+        job = mgr.get(job_id)
+        if job and job["state"] == state:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not reach {state}: {mgr.get(job_id)}")
+
+
+def test_job_reports_steps_and_result():
+    def runner(req, on_step):
+        on_step({"event": "plan", "steps": ["a", "b"]})
+        for name in ("a", "b"):
+            on_step({"event": "start", "step": name})
+            on_step({"event": "done", "step": name, "name": name + "_ok", "evidence": {name: 1}})
+        return {"result_code": "FIXED", "ticket_id": req["ticket_id"]}
+
+    mgr = JobManager(runner, max_workers=1, max_pending=1)
+    job = mgr.submit({"ticket_id": "T-1", "problem_code": "PR0018"})
+    res = _wait_state(mgr, job.job_id, "done")
+    assert res["progress"] == {"done": 2, "total": 2, "current": None}
+    assert [s["name"] for s in res["steps"]] == ["a_ok", "b_ok"]
+    assert res["result"]["result_code"] == "FIXED"
+    mgr.shutdown(wait=True)
+
+
+def test_queue_is_bounded():
+    gate = threading.Event()
+
+    def runner(req, on_step):
+        gate.wait(2.0)
+        return {}
+
+    mgr = JobManager(runner, max_workers=1, max_pending=1)
+    mgr.submit({"problem_code": "PR0018"})
+    mgr.submit({"problem_code": "PR0018"})
+    with pytest.raises(JobQueueFull):
+        mgr.submit({"problem_code": "PR0018"})
+    gate.set()
+    mgr.shutdown(wait=True)
+    assert mgr.stats()["done"] == 2
+
+
+def test_runner_error_is_recorded():
+    def runner(req, on_step):
+        raise RuntimeError("boom")
+
+    mgr = JobManager(runner, max_workers=1)
+    job = mgr.submit({"problem_code": "PR0001"})
+    res = _wait_state(mgr, job.job_id, "error")
+    assert res["error"] == "boom"
+    assert mgr.get("nope") is None
+    mgr.shutdown(wait=True)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: скомпилированная база фраз для IntentClassifier (smartpos.kb_artifact).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import shutil
+import struct
+import time
+
+import pytest
+
+from smartpos.intent_classifier import IntentClassifier
+from smartpos.kb_artifact import compile_kb, load_kb, main
+
+KB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "kb_core", "phrases_pr.json")
+
+
+def _copy_kb(tmp_path):
+    path = tmp_path / "phrases.json"
+    shutil.copy(KB, path)
+    return str(path)
+
+
+def test_mapped_kb_matches_json_build(tmp_path):
+    src = _copy_kb(tmp_path)
+    out = compile_kb(src)
+    assert out == str(tmp_path / "phrases.kbc")
+    kb = load_kb(out, src)
+    ref = IntentClassifier(src, use_artifact=False)
+    assert dict(kb.dataset) == dict(ref.dataset)
+    assert sorted(kb.index.postings) == sorted(ref.index.postings)
+    assert list(kb.index.postings["печать"]) == ref.index.postings["печать"]
+    assert "нетакогослова" not in kb.index.postings
+    assert kb.vectors.similarities("пичать висит") == ref.vectors.similarities("пичать висит")
+
+    clf = IntentClassifier(src)
+    assert clf.kb is not None
+    queries = [p for phrases in ref.dataset.values() for p in phrases] + ["нет бумги", "обрезает справа 80 мм", ""]
+    for q in queries:
+        assert clf.classify_intent(q) == ref.classify_intent(q), q
+
+
+def test_artifact_is_rebuilt_when_source_changes(tmp_path):
+    src = _copy_kb(tmp_path)
+    assert IntentClassifier(src).kb is None        # первый запуск: собрали и записали
+    assert IntentClassifier(src).kb is not None    # второй: отображён из файла
+
+    data = json.loads(open(src, encoding="utf-8").read())
+    data["PR0015"].append("Лоток Нараспашку")
+    with open(src, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    assert load_kb(src[:-5] + ".kbc", src) is None  # другой sha256 исходника
+    clf = IntentClassifier(src)
+    assert clf.kb is None and "лоток нараспашку" in clf.dataset["PR0015"]
+    assert IntentClassifier(src).classify_intent("лоток нараспашку")["problem_code"] == "PR0015"
+
+    with open(src[:-5] + ".kbc", "r+b") as f:  # битый файл — не падаем, пересобираем
+        f.write(b"XXXX")
+    assert load_kb(src[:-5] + ".kbc", src) is None
+    assert IntentClassifier(src).kb is None
+
+
+def _rewrite_header(path, edit):
+    """Пересобрать файл с изменённым заголовком; секции остаются как были."""
+    raw = open(path, "rb").read()
+    (hlen,) = struct.unpack("<I", raw[4:8])
+    header = json.loads(raw[8:8 + hlen])
+    body = raw[-(-(8 + hlen) // 8) * 8:]
+    edit(header)
+    head = raw[:4] + struct.pack("<I", len(json.dumps(header).encode())) + json.dumps(header).encode()
+    with open(path, "wb") as f:
+        f.write(head + b"\0" * (-len(head) % 8) + body)
+
+
+def _drop_sections(h):
+    del h["sections"]
+
+
+def _odd_size(h):
+    h["sections"]["rows"][1] -= 1       # не кратно 4 байтам int32
+
+
+def _shift(h):
+    h["sections"]["vals"][0] += 8       # секция «съехала» за конец файла
+
+
+def _empty_ptr(h):
+    h["sections"]["code_ptr"][1] = 0    # раскладка верна, но длины секций не сходятся (уже отображено)
+
+
+def _garbage(h):
+    h["sections"] = "x"
+
+
+@pytest.mark.parametrize("corrupt", ["truncated", _drop_sections, _odd_size, _shift, _empty_ptr, _garbage])
+def test_corrupt_artifact_is_treated_as_stale(tmp_path, corrupt):
+    src = _copy_kb(tmp_path)
+    out = compile_kb(src)
+    if corrupt == "truncated":
+        with open(out, "r+b") as f:
+            f.truncate(os.path.getsize(out) // 2)
+    else:
+        _rewrite_header(out, corrupt)
+    assert load_kb(out, src) is None
+    clf = IntentClassifier(src)               # пересобрали из JSON и перезаписали
+    assert clf.kb is None and clf.classify_intent("печать висит")["problem_code"] == "PR0018"
+    assert load_kb(out, src) is not None
+
+
+def test_daemon_starts_with_a_truncated_artifact(tmp_path):
+    import run_daemon
+    from smartpos_daemon.intents import set_intents
+
+    src = _copy_kb(tmp_path)
+    out = compile_kb(src)
+    with open(out, "r+b") as f:
+        f.truncate(os.path.getsize(out) - 100)
+    saved = run_daemon.CONFIG.intent_kb
+    run_daemon.CONFIG.intent_kb = src
+    try:
+        assert run_daemon.load_intents().classify("нет бумги")["problem_code"] == "PR0001"
+    finally:
+        set_intents(None)
+        run_daemon.CONFIG.intent_kb = saved
+
+
+def test_unwritable_artifact_falls_back_to_memory(tmp_path):
+    src = _copy_kb(tmp_path)
+    clf = IntentClassifier(src, artifact_path=str(tmp_path / "missing" / "kb.kbc"))
+    assert clf.kb is None and clf.classify_intent("печать висит")["problem_code"] == "PR0018"
+
+
+def test_cold_start_is_fast_on_a_large_kb(tmp_path, capsys):
+    rnd = random.Random(3)
+    vocab = [f"слово{i}" for i in range(8000)]
+    data = json.loads(open(KB, encoding="utf-8").read())
+    for code in data:
+        data[code] += [" ".join(rnd.sample(vocab, 4)) for _ in range(2000)]
+    src = tmp_path / "big.json"
+    src.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    assert main([str(src)]) == 0
+    assert "phrases" in capsys.readouterr().out
+
+    t0 = time.perf_counter()
+    clf = IntentClassifier(str(src))
+    res = clf.classify_intent("пичать висит")
+    assert time.perf_counter() - t0 < 0.05
+    assert clf.kb is not None and len(clf.index) > 12000 and res["problem_code"] == "PR0018"
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: автомат Ахо–Корасик для ключевых слов классификатора (smartpos.keyword_matcher).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import os
+
+from smartpos.intent_classifier import (
+    IntentClassifier, _hit_scores, _keyword_score, _normalize, _strong_signals_width,
+)
+from smartpos.keyword_matcher import KeywordMatcher
+
+KB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "kb_core", "phrases_pr.json")
+
+
+def test_overlapping_hits_and_shared_keywords():
+    m = KeywordMatcher([("печать", "A", 1.0, "kw", False), ("печать висит", "B", 2.0, "kw", False),
+                        ("ать", "C", 0.5, "kw", False), ("печать", "D", 0.3, "width", False)])
+    hits = m.find("печать висит")
+    assert sorted((h.keyword, h.code, h.start) for h in hits) == [
+        ("ать", "C", 3), ("печать", "A", 0), ("печать", "D", 0), ("печать висит", "B", 0)]
+    assert len(KeywordMatcher.distinct(m.find("печать печать"))) == 3  # повтор слова не дублирует код
+    m.add("висит", "E", 1.0)  # дообучение без явного build()
+    assert {h.code for h in m.find("висит")} == {"E"}
+
+
+def test_whole_word_respects_boundaries():
+    m = KeywordMatcher([("80 мм", "W", 1.5, "width_mm", True), ("край", "K", 0.6, "width", False)])
+    assert [h.code for h in m.find("лента 80 мм режет")] == ["W"]
+    assert m.find("лента 180 мм") == [] and m.find("80 ммм") == []
+    assert [h.code for h in m.find("по краю нет, по крайней")] == ["K"]  # подстрока, как `in`
+
+
+def test_scores_match_substring_scan():
+    clf = IntentClassifier(KB)
+    queries = [p for phrases in clf.dataset.values() for p in phrases]
+    queries += ["обрезает справа 80 мм и слева 58mm", "180 мм ширина", "80мм режет край", "печать висит уже час"]
+    for q in map(_normalize, queries):
+        scores = _hit_scores(clf.matcher.find(q))
+        for code in clf.dataset:
+            expected = _keyword_score(q, [], clf.kwords.get(code, []))
+            if code in ("PR0006", "PR0017"):
+                expected += _strong_signals_width(q)
+            assert abs(scores.get(code, 0.0) - expected) < 1e-9, (q, code)
+
+
+def test_rationale_lists_hits_in_query_order():
+    res = IntentClassifier(KB).classify_intent("обрезает справа 80 мм")
+    assert res["problem_code"] == "PR0006"
+    assert res["short_rationale"].startswith("ключевые: обрезает, справа")
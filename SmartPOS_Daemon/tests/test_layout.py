@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: макеты ESC/POS и профили ширины (smartpos_daemon.layout).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+from smartpos_daemon.layout import (
+    ESC_INIT,
+    PROFILE_58,
+    PROFILE_80,
+    LayoutProfile,
+    Template,
+    cache_stats,
+    clear_cache,
+    compile_template,
+    render,
+    two_columns,
+    wrap,
+)
+
+RECEIPT = Template("receipt", ["ЧЕК №{num}", "{rule}", "{item}", b"\x1ba\x01", "Спасибо!"], feed=1, cut=True)
+
+
+def _legacy(profile: LayoutProfile, lines) -> bytes:
+    return ESC_INIT + ("\n".join(lines) + "\n\n\n").encode(profile.codepage, errors="ignore")
+
+
+def test_render_matches_string_building_byte_for_byte():
+    t = Template("layout", ["{title} ({paper_mm}mm)", "{rule}", "{ruler}", "Ширина: {chars} символов"], feed=2)
+    for p in (PROFILE_58, PROFILE_80):
+        n = p.chars_per_line
+        legacy = _legacy(p, [f"T ({p.paper_mm}mm)", "-" * n, ("1234567890" * (n // 10))[:n], f"Ширина: {n} символов"])
+        assert render(t, p, title="T") == legacy
+
+
+def test_compiled_once_per_template_and_profile():
+    clear_cache()
+    for i in range(5):
+        render(RECEIPT, PROFILE_58, num=i, item="x")
+        render(RECEIPT, PROFILE_80, num=i, item="x")
+    render(RECEIPT, LayoutProfile(80, 48, "cp1251"), num=1, item="x")
+    assert cache_stats() == {"size": 3, "hits": 8, "misses": 3}
+    assert compile_template(RECEIPT, PROFILE_58).fields == ["item", "num"]
+
+
+def test_overlong_field_line_is_wrapped_and_commands_kept():
+    data = render(RECEIPT, PROFILE_58, num=7, item="слово " * 8)
+    text = data.decode("cp866")
+    assert text.startswith("\x1b@ЧЕК №7\n" + "-" * 32 + "\n")
+    body = text.split("\n")[2:4]
+    assert all(len(line) <= 32 for line in body) and body[1].startswith("слово")
+    assert b"\x1ba\x01" in data and data.endswith(b"\n\x1dV\x01")
+
+
+def test_wrap_and_columns_helpers():
+    assert wrap("a " * 20, 10) == ["a a a a a"] * 4
+    assert wrap("x" * 50, PROFILE_58) == ["x" * 32, "x" * 18]
+    line = two_columns("Кофе латте большой с сиропом", "245.00", PROFILE_58)
+    assert len(line) == 32 and line.endswith(" 245.00")
+    assert len(two_columns("Кофе", "245.00", PROFILE_80)) == 48
+
+
+def test_missing_fields_are_blank_and_conversions_apply():
+    t = Template("total", ["Итого:{total:>8.2f}|", "{note!r}|{tag!s:<4}|", "{chars!r:>3}"], init=False, feed=0)
+    assert render(t, PROFILE_58, total=12.5, note="x", tag=7).decode("cp866") == "Итого:   12.50|\n'x'|7   |\n 32\n"
+    assert render(t, PROFILE_58).decode("cp866") == "Итого:|\n|    |\n 32\n"
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: тайминги шагов и метрики демона (smartpos_daemon.metrics, GET /metrics).
+Строго stdlib, оффлайн, без win32 (симулятор спулера).
+"""
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from smartpos_daemon.metrics import MetricsRegistry, set_metrics, step_timing
+from smartpos_daemon.waits import wait_until
+
+
+def test_summary_quantiles_and_text_exposition():
+    m = MetricsRegistry(window=100)
+    for i in range(1, 201):  # в окне остаются 101..200
+        m.observe("lat_seconds", i / 1000, {"step": "clear_spooler"})
+    m.inc("runs_total", {"code": 'a"b'})
+    s = m.summary("lat_seconds", {"step": "clear_spooler"})
+    assert s["count"] == 200 and s["p50"] == 0.15 and s["p99"] == 0.199
+    assert m.summary("lat_seconds")["count"] == 0
+
+    text = m.render()
+    assert "# TYPE lat_seconds summary" in text
+    assert 'lat_seconds{step="clear_spooler",quantile="0.95"} 0.195' in text
+    assert 'lat_seconds_count{step="clear_spooler"} 200' in text
+    assert 'runs_total{code="a\\"b"} 1' in text
+
+
+@pytest.fixture()
+def sim_api(spooler_sim):
+    from smartpos_daemon.winapi import win32print
+
+    metrics = MetricsRegistry()
+    set_metrics(metrics)
+    spooler_sim(latency=0.01)
+    try:
+        yield win32print, metrics
+    finally:
+        set_metrics(None)
+
+
+def test_step_clock_splits_waits_and_win32_calls(sim_api):
+    api, metrics = sim_api
+    with step_timing() as clock:
+        api.ClosePrinter(api.OpenPrinter(api.GetDefaultPrinter()))
+        wait_until(lambda: api.GetDefaultPrinter() and False, 0.05)
+        time.sleep(0.02)
+    b = clock.breakdown()
+    assert clock.win32_calls >= 2 and b["win32_s"] >= 0.015
+    assert 0.03 <= b["wait_s"] + b["win32_s"] and b["other_s"] >= 0.015
+    assert abs(b["wait_s"] + b["win32_s"] + b["other_s"] - clock.duration_s) < 0.005
+    assert metrics.counter("smartpos_win32_calls_total", {"api": "win32print", "fn": "OpenPrinter"}) == 1
+    assert isinstance(api.JOB_CONTROL_DELETE, int)  # константы не оборачиваются
+    assert api.OpenPrinter is api.OpenPrinter       # обёртка не создаётся на каждое обращение
+
+
+def test_playbook_result_carries_step_timings(spooler_sim):
+    import run_daemon
+
+    metrics = MetricsRegistry()
+    set_metrics(metrics)
+    spooler_sim(print_sec=0.01, stop_sec=0.01, start_sec=0.01)
+    try:
+        res = run_daemon.run_playbook({"ticket_id": "m1", "problem_code": "PR0018"})
+    finally:
+        set_metrics(None)
+    steps = [t["step"] for t in res["timings"]]
+    assert steps == run_daemon.PLAYBOOKS.describe("PR0018")
+    assert all(t["duration_s"] is not None and "win32_s" in t for t in res["timings"])
+
+    text = metrics.render()
+    assert 'smartpos_playbook_results_total{playbook="PR0018",result_code="' + res["result_code"] + '"} 1' in text
+    for step in steps:
+        assert metrics.summary("smartpos_step_duration_seconds", {"playbook": "PR0018", "step": step})["count"] == 1
+    assert 'smartpos_win32_calls_total{api="win32print",fn="OpenPrinter"}' in text
+
+    set_metrics(metrics)
+    try:
+        run_daemon.run_playbook({"ticket_id": "m2", "problem_code": "PR9999-<script>"})
+    finally:
+        set_metrics(None)
+    text = metrics.render()
+    assert 'smartpos_playbook_results_total{playbook="other",' in text and "PR9999" not in text
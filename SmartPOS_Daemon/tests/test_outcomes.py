@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: журнал исходов плейбуков и аналитика MTTR (smartpos_daemon.outcomes).
+Строго stdlib, оффлайн, без win32 (симулятор спулера).
+"""
+from __future__ import annotations
+
+import time
+
+from smartpos_daemon.outcomes import OutcomeStore, set_outcomes
+
+
+def _res(ticket, code, result_code, elapsed, steps):
+    return {
+        "ticket_id": ticket, "problem_code": code, "result_code": result_code, "elapsed_s": elapsed,
+        "evidence": {"x": 1},
+        "actions_done": [name for _, name, _ in steps],
+        "timings": [{"id": s, "step": s, "duration_s": d, "wait_s": d / 2, "win32_s": d / 4} for s, _, d in steps],
+    }
+
+
+def test_writes_are_batched_and_survive_reopen(tmp_path):
+    path = str(tmp_path / "outcomes.db")
+    store = OutcomeStore(path, batch_size=3, flush_sec=60.0)
+    for i in range(2):
+        store.record(_res(f"t{i}", "PR0018", "FIXED", 1.0, [("clear_spooler", "print_queue_clear", 0.2)]), "A")
+    assert store.stats()["written"] == 0 and store.stats()["pending"] == 2
+    store.record(_res("t2", "PR0018", "FIXED", 1.0, []), "A")  # третий — пачка уходит одной транзакцией
+    deadline = time.time() + 2.0
+    while store.stats()["written"] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert store.stats()["written"] == 3 and store.stats()["batches"] == 1
+    store.close()
+
+    again = OutcomeStore(path)
+    assert again.printer_failures()["printers"][0]["runs"] == 3
+    again.close()
+
+
+def test_mttr_step_success_and_printer_failures():
+    store = OutcomeStore(":memory:", flush_sec=60.0)
+    now = time.time()
+    clear_ok = ("clear_spooler", "print_queue_clear", 0.5)
+    clear_bad = ("clear_spooler", "print_queue_clear_error", 0.1)
+    restart = ("restart_spooler", "spooler_restart", 4.0)
+    # тикет T1 на A: первая попытка неудачна, вторая через 60 с чинит
+    store.record(_res("T1", "PR0018", "NOT_FOUND", 2.0, [clear_bad]), "A", finished=now - 100)
+    store.record(_res("T1", "PR0018", "FIXED", 5.0, [clear_ok, restart]), "A", finished=now - 40)
+    store.record(_res("T2", "PR0018", "FIXED", 10.0, [clear_ok, restart]), "B", finished=now - 10)
+    store.record(_res("T3", "PR0022", "NOT_FOUND", 1.0, []), "B", finished=now - 5)
+    store.record(_res("OLD", "PR0018", "TIMEOUT", 1.0, []), "C", finished=now - 10 * 86400)
+
+    mttr = {p["problem_code"]: p for p in store.mttr(since=now - 3600)["problems"]}
+    assert mttr["PR0018"]["tickets"] == 2 and mttr["PR0018"]["mttr_s"] == 36.0  # (62 + 10) / 2
+    assert mttr["PR0018"]["attempts_avg"] == 1.5 and mttr["PR0018"]["unresolved"] == 0
+    assert mttr["PR0022"]["unresolved"] == 1 and mttr["PR0022"]["mttr_s"] is None
+    assert store.mttr(since=now - 3600, printer="B")["problems"][0]["mttr_s"] == 10.0
+
+    steps = {s["step"]: s for s in store.step_success(since=now - 3600, problem_code="PR0018")["steps"]}
+    assert steps["clear_spooler"]["runs"] == 3 and steps["clear_spooler"]["success_rate"] == 0.667
+    assert steps["restart_spooler"]["avg_s"] == 4.0 and steps["restart_spooler"]["wait_share"] == 0.5
+    assert list(steps) == ["clear_spooler", "restart_spooler"]
+
+    printers = store.printer_failures(since=now - 3600)["printers"]
+    assert [(p["printer"], p["failures"], p["runs"]) for p in printers] == [("A", 1, 2), ("B", 1, 2)]
+    assert printers[0]["by_result"] == {"FIXED": 1, "NOT_FOUND": 1} and printers[0]["failure_rate"] == 0.5
+    assert [p["printer"] for p in store.printer_failures()["printers"]] == ["A", "B", "C"]  # без окна — и старые
+    store.close()
+
+
+def test_query_survives_a_failing_write():
+    import sqlite3
+
+    store = OutcomeStore(":memory:", flush_sec=60.0)
+    write = store._write
+
+    def locked(batch):
+        if batch:
+            raise sqlite3.OperationalError("database is locked")
+        return 0
+
+    store._write = locked
+    store.record(_res("L1", "PR0018", "FIXED", 1.0, []), "A")
+    assert store.mttr()["problems"] == []                  # аналитика отвечает, без 500
+    assert store.stats()["pending"] == 1 and store.stats()["write_errors"] == 1
+    store._write = write
+    assert store.mttr()["problems"][0]["tickets"] == 1     # исход не потерян — записан при следующем запросе
+    store.close()
+
+
+def test_daemon_records_each_executed_playbook(spooler_sim):
+    import run_daemon
+
+    store = OutcomeStore(":memory:")
+    set_outcomes(store)
+    spooler_sim(printers=("A",), print_sec=0.01, stop_sec=0.01, start_sec=0.01)
+    try:
+        req = {"ticket_id": "out-1", "problem_code": "PR0018", "device": {"name": "A"}}
+        res = run_daemon.run_playbook_serialized(req)
+        assert run_daemon.run_playbook_serialized(req)["replayed"] is True  # повтор не пишется
+        code, body = run_daemon.outcomes_query("/outcomes/steps", {"problem_code": "PR0018"})
+        assert code == 200 and [s["step"] for s in body["steps"]] == [t["step"] for t in res["timings"]]
+        assert all(s["runs"] == 1 for s in body["steps"])
+        code, body = run_daemon.outcomes_query("/outcomes/printers", {})
+        assert body["printers"][0]["printer"] == "A" and body["printers"][0]["runs"] == 1
+        assert run_daemon.outcomes_query("/outcomes/mttr", {"hours": "x"})[0] == 400
+    finally:
+        set_outcomes(None)
+        store.close()
+    assert run_daemon.outcomes_query("/outcomes/mttr", {})[0] == 503
+
+
+def test_daemon_starts_without_a_writable_journal(tmp_path):
+    import run_daemon
+
+    (tmp_path / "file").write_text("x")
+    (tmp_path / "broken.db").write_bytes(b"not a sqlite database" * 100)
+    saved = run_daemon.CONFIG.outcomes_db
+    try:
+        for path in (tmp_path / "file" / "outcomes.db", tmp_path / "broken.db"):
+            run_daemon.CONFIG.outcomes_db = str(path)
+            assert run_daemon.open_outcomes() is None
+            assert run_daemon.outcomes_query("/outcomes/mttr", {})[0] == 503
+        run_daemon.CONFIG.outcomes_db = str(tmp_path / "ok" / "outcomes.db")
+        store = run_daemon.open_outcomes()
+        assert store is not None and run_daemon.outcomes_query("/outcomes/mttr", {})[0] == 200
+        store.close()
+    finally:
+        set_outcomes(None)
+        run_daemon.CONFIG.outcomes_db = saved
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: декларативные плейбуки и DAG-исполнитель (smartpos_daemon.playbooks).
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from smartpos_daemon import playbooks
+from smartpos_daemon.playbooks import DEFAULT_PLAYBOOKS_PATH, PlaybookError, PlaybookStore, execute, parse
+from smartpos_daemon.waits import Deadline
+
+
+class _Out:
+    def __init__(self, name, evidence=None, terminal=False, result=None):
+        self.name, self.evidence, self.terminal, self.result = name, evidence or {}, terminal, result
+
+
+ALL_ACTIONS = {name: (lambda req, **kw: _Out("x")) for name in (
+    "usb_presence_check", "tcp9100_probe", "read_printer_status", "clear_spooler", "restart_spooler",
+    "force_clear_stuck_jobs", "cancel_demo_sticky", "soft_purge_printer", "force_purge_spooler",
+    "escpos_probe", "test_print_layout", "ensure_width_profile",
+)}
+
+
+def test_shipped_playbooks_validate_and_select_variants():
+    store = PlaybookStore(ALL_ACTIONS)
+    assert set(store.codes()) >= {"PR0022", "PR0018", "PR0001", "PR0015", "PR0006", "PR0017"}
+    plain = [s.action for s in store.steps_for({"problem_code": "PR0018"})]
+    hard = [s.action for s in store.steps_for({"problem_code": "PR0018", "context": {"beautify": True}})]
+    soft = [s.action for s in store.steps_for({"problem_code": "PR0018", "context": {"purge": "soft"}})]
+    assert plain[-1] == "test_print_layout" and "force_purge_spooler" not in plain
+    assert "force_purge_spooler" in hard and "soft_purge_printer" in soft
+    assert store.steps_for({"problem_code": "PR9999"}) == []
+    assert store.path == DEFAULT_PLAYBOOKS_PATH
+    assert store.budget_for({"problem_code": "PR0018"}, 8.0) > 8.0
+    assert store.budget_for({"problem_code": "PR0006"}, 8.0) == 8.0
+
+
+@pytest.mark.parametrize("steps, msg", [
+    ([{"action": "nope"}], "unknown action"),
+    ([{"action": "clear_spooler"}, {"action": "clear_spooler"}], "duplicate"),
+    ([{"id": "a", "action": "clear_spooler", "after": ["b"]}, {"id": "b", "action": "escpos_probe"}], "later step"),
+])
+def test_invalid_playbooks_are_rejected(steps, msg):
+    with pytest.raises(PlaybookError, match=msg):
+        parse({"playbooks": {"PRX": {"steps": steps}}}, ALL_ACTIONS)
+
+
+def test_readonly_probes_run_concurrently_and_mutating_steps_stay_ordered():
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "a", "action": "usb_presence_check", "readonly": True, "after": []},
+        {"id": "b", "action": "tcp9100_probe", "readonly": True, "after": []},
+        {"id": "c", "action": "clear_spooler", "after": ["a", "b"]},
+        {"id": "d", "action": "escpos_probe"},
+    ]}}}, ALL_ACTIONS)
+    steps = book["P"][None]
+    log = []
+    barrier = threading.Barrier(2, timeout=2.0)
+
+    def run_step(step):
+        if step.readonly:
+            barrier.wait()  # обе пробы должны оказаться в работе одновременно
+        log.append(step.id)
+        return _Out(step.id + "_ok")
+
+    t0 = time.time()
+    out = execute(steps, run_step)
+    assert time.time() - t0 < 1.0
+    assert [s.id for s, _ in out] == ["a", "b", "c", "d"]
+    assert log[2:] == ["c", "d"]
+
+
+def test_terminal_step_stops_scheduling():
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "a", "action": "clear_spooler"},
+        {"id": "b", "action": "escpos_probe"},
+    ]}}}, ALL_ACTIONS)
+    out = execute(book["P"][None], lambda s: _Out(s.id, terminal=(s.id == "a"), result="ERROR"))
+    assert [s.id for s, _ in out] == ["a"]
+
+
+def test_hot_reload_keeps_previous_version_on_bad_edit(tmp_path):
+    path = tmp_path / "playbooks.json"
+    path.write_text(json.dumps({"playbooks": {"P": {"steps": [{"action": "clear_spooler"}]}}}), encoding="utf-8")
+    store = PlaybookStore(ALL_ACTIONS, path=str(path), check_every=0.0)
+    assert [s.action for s in store.steps_for({"problem_code": "P"})] == ["clear_spooler"]
+
+    path.write_text(json.dumps({"playbooks": {"P": {"steps": [{"action": "escpos_probe"}]}}}), encoding="utf-8")
+    os.utime(path, (time.time() + 5, time.time() + 5))
+    assert [s.action for s in store.steps_for({"problem_code": "P"})] == ["escpos_probe"]
+
+    path.write_text(json.dumps({"playbooks": {"P": {"steps": [{"action": "rm_rf"}]}}}), encoding="utf-8")
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert [s.action for s in store.steps_for({"problem_code": "P"})] == ["escpos_probe"]
+
+
+def _timeout_out(step, info):
+    return _Out(step.id + "_timeout", {"timeout": {step.id: info}}, result="TIMEOUT")
+
+
+def test_step_limit_abandons_slow_mutating_step_and_stops():
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "restart", "action": "restart_spooler", "timeout_sec": 0.1},
+        {"id": "test", "action": "test_print_layout"},
+    ]}}}, ALL_ACTIONS)
+    finished = []
+
+    def run_step(step):
+        time.sleep(0.3)
+        finished.append(step.id)
+        return _Out(step.id)
+
+    out = execute(book["P"][None], run_step, on_timeout=_timeout_out)
+    assert finished == ["restart"]  # вернулись только после того, как изменение в спулере закончилось
+    assert [(s.id, o.result) for s, o in out] == [("restart", "TIMEOUT")]
+    assert out[0][1].evidence["timeout"]["restart"]["reason"] == "step_limit"
+
+
+def test_slow_readonly_probe_times_out_without_stopping_playbook():
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "status", "action": "read_printer_status", "readonly": True, "after": [], "timeout_sec": 0.05},
+        {"id": "probe", "action": "escpos_probe", "after": []},
+        {"id": "test", "action": "test_print_layout", "after": ["status", "probe"]},
+    ]}}}, ALL_ACTIONS)
+    release = threading.Event()
+
+    def run_step(step):
+        if step.id == "status":
+            release.wait(2.0)
+        return _Out(step.id)
+
+    out = execute(book["P"][None], run_step, on_timeout=_timeout_out)
+    release.set()
+    assert [(s.id, o.result) for s, o in out] == [("status", "TIMEOUT"), ("probe", None), ("test", None)]
+
+
+def test_budget_abandons_running_step_and_skips_the_rest():
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "a", "action": "cancel_demo_sticky"},
+        {"id": "b", "action": "clear_spooler"},
+    ]}}}, ALL_ACTIONS)
+    ran = []
+
+    def run_step(step):
+        ran.append(step.id)
+        time.sleep(0.3)
+        return _Out(step.id)
+
+    out = execute(book["P"][None], run_step, deadline=Deadline(0.1), on_timeout=_timeout_out)
+    assert ran == ["a"]
+    assert [(s.id, o.result) for s, o in out] == [("a", "TIMEOUT")]
+    assert out[0][1].evidence["timeout"]["a"]["reason"] == "budget"
+
+    out = execute(book["P"][None], run_step, deadline=Deadline(0.0), on_timeout=_timeout_out)
+    assert ran == ["a"]
+    assert [(s.id, o.result) for s, o in out] == [("a", "TIMEOUT"), ("b", "TIMEOUT")]
+    assert all(o.evidence["timeout"][s.id]["skipped"] for s, o in out)
+
+
+def test_step_limit_counts_from_the_actual_start(monkeypatch):
+    monkeypatch.setattr(playbooks, "_STEP_POOL", ThreadPoolExecutor(max_workers=1))
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "slow", "action": "read_printer_status", "readonly": True, "after": []},
+        {"id": "quick", "action": "escpos_probe", "readonly": True, "after": [], "timeout_sec": 0.1},
+    ]}}}, ALL_ACTIONS)
+
+    def run_step(step):
+        time.sleep(0.2 if step.id == "slow" else 0.01)
+        return _Out(step.id)
+
+    out = execute(book["P"][None], run_step, on_timeout=_timeout_out)
+    assert [(s.id, o.result) for s, o in out] == [("slow", None), ("quick", None)]  # очередь пула — не его время
+
+
+def test_abandoned_steps_that_never_started_are_cancelled(monkeypatch):
+    monkeypatch.setattr(playbooks, "_STEP_POOL", ThreadPoolExecutor(max_workers=1))
+    book = parse({"playbooks": {"P": {"steps": [
+        {"id": "a", "action": "read_printer_status", "readonly": True, "after": []},
+        {"id": "b", "action": "escpos_probe", "readonly": True, "after": []},
+    ]}}}, ALL_ACTIONS)
+    ran = []
+    release = threading.Event()
+
+    def run_step(step):
+        ran.append(step.id)
+        release.wait(2.0)
+        return _Out(step.id)
+
+    out = execute(book["P"][None], run_step, deadline=Deadline(0.1), on_timeout=_timeout_out)
+    release.set()
+    playbooks._STEP_POOL.shutdown(wait=True)
+    assert ran == ["a"] and [(s.id, o.result) for s, o in out] == [("a", "TIMEOUT"), ("b", "TIMEOUT")]
+    assert [o.evidence["timeout"][s.id]["skipped"] for s, o in out] == [False, True]
+
+
+def test_invalid_timeouts_are_rejected():
+    with pytest.raises(PlaybookError, match="timeout_sec"):
+        parse({"playbooks": {"P": {"steps": [{"action": "clear_spooler", "timeout_sec": 0}]}}}, ALL_ACTIONS)
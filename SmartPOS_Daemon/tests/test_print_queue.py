@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: очередь RAW-печати с пачками (smartpos_daemon.print_queue).
+Строго stdlib, оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import base64
+
+import pytest
+
+from smartpos_daemon.handles import HandlePool, Win32HandleBackend
+from smartpos_daemon.print_queue import FakePrintSink, PrintQueue, PrintQueueFull, WinspoolSink
+from smartpos_daemon.waits import wait_until
+from smartpos_daemon.winspool_sim import SpoolerSimulator
+
+POS = "SAM4S ELLIX40"
+
+
+def _items(*chunks, batch=True):
+    return [(c, f"r{i}", batch) for i, c in enumerate(chunks)]
+
+
+def test_burst_is_batched_in_order_with_acks():
+    sink = FakePrintSink()
+    q = PrintQueue(sink, batch_max_count=3)
+    sink.hold()  # первый чек занимает писателя, остальные копятся
+    first = q.submit(POS, [(b"A", "a", True)])
+    assert wait_until(lambda: first[0].state == "printing", 1.0)
+    rest = q.submit(POS, _items(b"B", b"C", b"D", b"E"))
+    sink.release()
+    acks = q.wait(first + rest, 2.0)
+
+    assert [a["state"] for a in acks] == ["printed"] * 5
+    assert [a["seq"] for a in acks] == [1, 2, 3, 4, 5]
+    assert [d for _, _, d in sink.jobs] == [b"A", b"BCD", b"E"]
+    assert [a["batch_size"] for a in acks] == [1, 3, 3, 3, 1]
+    assert acks[1]["job_id"] == acks[3]["job_id"] != acks[4]["job_id"]
+    assert q.stats()["printers"][POS]["batched"] == 3
+
+
+def test_large_or_unbatchable_receipts_get_own_jobs():
+    sink = FakePrintSink()
+    q = PrintQueue(sink, small_bytes=4)
+    sink.hold()
+    head = q.submit(POS, [(b"H", None, True)])
+    assert wait_until(lambda: head[0].state == "printing", 1.0)
+    rs = q.submit(POS, [(b"a", None, True), (b"BIGBIG", None, True), (b"b", None, False), (b"c", None, True)])
+    sink.release()
+    q.wait(head + rs, 2.0)
+    assert [d for _, _, d in sink.jobs] == [b"H", b"a", b"BIGBIG", b"b", b"c"]
+
+
+def test_failed_batch_reports_errors_and_queue_continues():
+    sink = FakePrintSink()
+    sink.fail_next = 1
+    q = PrintQueue(sink)
+    acks = q.wait(q.submit(POS, _items(b"x", b"y")), 2.0)
+    assert [a["state"] for a in acks] == ["error", "error"] and "offline" in acks[0]["error"]
+    acks = q.wait(q.submit(POS, _items(b"z")), 2.0)
+    assert acks[0]["ok"] and q.get(acks[0]["receipt_id"])["state"] == "printed"
+
+
+def test_full_queue_rejects_whole_request():
+    sink = FakePrintSink()
+    q = PrintQueue(sink, queue_max=2)
+    sink.hold()
+    head = q.submit(POS, _items(b"1"))
+    assert wait_until(lambda: head[0].state == "printing", 1.0)
+    q.submit(POS, _items(b"2", b"3"))
+    with pytest.raises(PrintQueueFull):
+        q.submit(POS, _items(b"4"))
+    sink.release()
+    q.close()
+
+
+def test_winspool_sink_prints_batch_as_one_spooler_job():
+    sim = SpoolerSimulator(print_sec=0.01)
+    q = PrintQueue(WinspoolSink(api=sim, pool=HandlePool(Win32HandleBackend(sim))))
+    sim.set_status(POS, paper_out=True)  # джобы копятся в очереди спулера
+    acks = q.wait(q.submit(POS, _items(b"\x1b@1", b"\x1b@2")), 2.0)
+    assert all(a["ok"] for a in acks)
+    assert len(sim.jobs(POS)) == 1
+    sim.set_status(POS, paper_out=False)
+    assert wait_until(lambda: not sim.jobs(POS), 1.0)
+    assert sim.printed[POS][0][1] == b"\x1b@1\x1b@2"
+
+
+def test_winspool_sink_aborts_a_half_written_job():
+    sim = SpoolerSimulator(print_sec=0.01)
+    sink = WinspoolSink(api=sim, pool=HandlePool(Win32HandleBackend(sim)))
+    sim.inject("WritePrinter")
+    with pytest.raises(Exception):
+        sink.write(POS, "SMARTPOS_RAW", b"\x1b@1")
+    assert sim.jobs(POS) == [] and sim.calls["AbortDocPrinter"] == 1  # не «залип» в очереди
+    assert sink.write(POS, "SMARTPOS_RAW", b"\x1b@2")                  # хэндл пула снова пригоден
+    assert wait_until(lambda: not sim.jobs(POS), 1.0) and sim.printed[POS][0][1] == b"\x1b@2"
+
+
+def test_http_print_raw_validates_and_acks(spooler_sim):
+    import run_daemon as rd
+
+    sim = spooler_sim(print_sec=0.01)
+    code, res = rd.print_raw({"receipts": [{"id": "r1", "data_b64": "not base64!"}]})
+    assert code == 400
+    data = base64.b64encode(b"\x1b@hello").decode()
+    logo = base64.b64encode(b"P4\n16 4\n\x00").decode()  # обрезанный PBM — 400, а не 500
+    code, res = rd.print_raw({"receipts": [{"id": "r1", "data_b64": data, "logo_b64": logo}]})
+    assert code == 400 and res["detail"].startswith("logo_b64")
+    code, res = rd.print_raw({"receipts": [{"id": "r1", "data_b64": data}, {"id": "r2", "data_b64": data}]})
+    assert code == 200 and res["ok"] and [a["receipt_id"] for a in res["acks"]] == ["r1", "r2"]
+    assert wait_until(lambda: not sim.jobs(POS), 1.0)
+    assert len(sim.printed[POS]) == 1
+
+
+def test_writes_wait_for_spooler_restart_and_restart_waits_for_writes():
+    import threading
+
+    import run_daemon as rd
+
+    assert rd.PRINTS.gate == rd._SPOOLER_GATE.step
+    gate = rd._SpoolerGate()
+    sink = FakePrintSink()
+    q = PrintQueue(sink, gate=gate.step)
+    with gate.restart():  # служба перезапускается — чек ждёт у ворот
+        rs = q.submit(POS, _items(b"A"))
+        assert not rs[0].done.wait(0.1) and sink.jobs == []
+    assert q.wait(rs, 1.0)[0]["state"] == "printed"
+
+    sink.hold()  # документ пишется — рестарт ждёт его конца
+    rs = q.submit(POS, _items(b"B"))
+    assert wait_until(lambda: rs[0].state == "printing", 1.0)
+    restarted = threading.Event()
+
+    def restart():
+        with gate.restart():
+            restarted.set()
+
+    threading.Thread(target=restart, daemon=True).start()
+    assert not restarted.wait(0.1)
+    sink.release()
+    assert restarted.wait(1.0) and q.wait(rs, 1.0)[0]["state"] == "printed"
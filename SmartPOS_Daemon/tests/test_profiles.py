@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: реестр профилей печати по принтерам (smartpos_daemon.profiles).
+Строго stdlib, оффлайн, без win32 (симулятор спулера).
+"""
+from __future__ import annotations
+
+import socket
+import threading
+
+import pytest
+
+from smartpos_daemon.handles import HandlePool, Win32HandleBackend
+from smartpos_daemon.layout import PROFILE_58, PROFILE_80, LayoutProfile
+from smartpos_daemon.profiles import ProfileRegistry, Win32ProfileDetector, query_escpos_model
+from smartpos_daemon.winspool_sim import SpoolerSimulator
+
+
+def _detector(sim):
+    return Win32ProfileDetector(api=sim, pool=HandlePool(Win32HandleBackend(sim)))
+
+
+def test_profiles_are_per_printer_and_persisted(tmp_path):
+    path = str(tmp_path / "profiles.json")
+    reg = ProfileRegistry(path)
+    custom = LayoutProfile(58, 30, "cp1251", (("№", "N"),))
+    reg.set("A", PROFILE_58, source="fault")
+    reg.set("B", custom)
+    assert reg.get("A") == PROFILE_58 and reg.get("C") == PROFILE_80
+
+    again = ProfileRegistry(path)
+    assert again.get("B") == custom and again.entry("A")["source"] == "fault"
+    again.reset("A")
+    assert ProfileRegistry(path).get("A") == PROFILE_80
+
+
+def test_detection_is_cached_for_ttl():
+    sim = SpoolerSimulator(printers=("A", "B"))
+    sim.set_paper_width("A", 58)
+    reg = ProfileRegistry(detector=_detector(sim), ttl=60.0)
+    for _ in range(3):
+        assert reg.get("A") == PROFILE_58 and reg.get("B") == PROFILE_80
+    assert reg.detections == 2 and reg.entry("A")["evidence"]["via"] == "devmode"
+
+    sim.set_paper_width("A", 80)
+    assert reg.get("A") == PROFILE_58           # ещё в пределах ttl
+    assert reg.detect("A", force=True) == PROFILE_80
+
+    stale = ProfileRegistry(detector=_detector(sim), ttl=0.0)
+    stale.get("A")
+    stale.get("A")
+    assert stale.detections == 2
+
+
+def test_explicit_profile_wins_over_detection_and_failures_fall_back():
+    sim = SpoolerSimulator(printers=("A",))
+    reg = ProfileRegistry(detector=_detector(sim))
+    reg.set("A", PROFILE_58, source="fault")
+    assert reg.detect("A") == PROFILE_80 and reg.get("A") == PROFILE_58
+
+    sim.set_paper_width("A", 0)  # драйвер ширину не сообщает, имя драйвера незнакомое
+    assert ProfileRegistry(detector=_detector(sim)).get("A") == PROFILE_80
+    assert ProfileRegistry(detector=_detector(sim)).get("GHOST") == PROFILE_80
+
+
+def test_failed_detection_is_cached_for_ttl(tmp_path):
+    sim = SpoolerSimulator(printers=("A",))
+    sim.set_paper_width("A", 0)
+    path = str(tmp_path / "profiles.json")
+    reg = ProfileRegistry(path, detector=_detector(sim), ttl=60.0)
+    for _ in range(3):
+        assert reg.get("A") == PROFILE_80 and reg.get("GHOST") == PROFILE_80
+    assert reg.detections == 2                  # по одному опросу на принтер, дальше — из кэша
+    entry = reg.entry("A")
+    assert entry["source"] == "default" and entry["evidence"] == {"via": "detect_failed"}
+    assert ProfileRegistry(path, detector=_detector(sim), ttl=60.0).detect("A") is None  # и после рестарта
+
+    sim.set_paper_width("A", 58)
+    assert reg.get("A") == PROFILE_80
+    assert reg.detect("A", force=True) == PROFILE_58 and reg.entry("A")["source"] == "detected"
+
+    stale = ProfileRegistry(detector=_detector(sim), ttl=0.0)
+    stale.get("GHOST")
+    stale.get("GHOST")
+    assert stale.detections == 2
+
+    reg.set("A", PROFILE_58, source="fault")     # неудача явно заданный профиль не затирает
+    sim.set_paper_width("A", 0)
+    assert reg.detect("A", force=True) is None and reg.entry("A")["source"] == "fault"
+
+
+def test_escpos_model_query():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+
+    def serve():
+        conn, _ = srv.accept()
+        with conn:
+            assert conn.recv(3) == b"\x1dI\x43"
+            conn.sendall(b"_TM-T20II\x00")
+
+    t = threading.Thread(target=serve, daemon=True)
+    t.start()
+    assert query_escpos_model("127.0.0.1", srv.getsockname()[1]) == "TM-T20II"
+    t.join(1.0)
+    srv.close()
+
+
+@pytest.fixture()
+def daemon_two_printers(tmp_path, spooler_sim):
+    import run_daemon
+
+    reg = ProfileRegistry(str(tmp_path / "profiles.json"), detector=Win32ProfileDetector())
+    sim = spooler_sim(registry=reg, printers=("A", "B"), print_sec=0.01)
+    yield run_daemon, sim, reg
+
+
+def test_width_fix_touches_only_its_printer(daemon_two_printers):
+    rd, sim, reg = daemon_two_printers
+    rd.set_wrong_width_profile("A")
+    rd.set_wrong_width_profile("B")
+    res = rd.run_playbook_serialized({"ticket_id": "w1", "problem_code": "PR0006", "device": {"name": "A"}})
+    assert res["result_code"] == "FIXED", res
+    assert reg.get("A") == PROFILE_80 and reg.get("B") == PROFILE_58
+    assert sim.jobs("A") or sim.printed["A"]
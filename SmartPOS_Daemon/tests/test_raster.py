@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: растровая печать GS v 0 и дисковый кэш дизеринга (smartpos_daemon.raster).
+Строго stdlib (NumPy — если есть), оффлайн, без win32.
+"""
+from __future__ import annotations
+
+import pytest
+
+from smartpos_daemon import raster
+from smartpos_daemon.layout import PROFILE_58, PROFILE_80
+from smartpos_daemon.raster import GrayImage, RasterCache, dither, load_image, pack_gs_v0, raster_image
+
+
+def _pgm(w: int, h: int, fn) -> bytes:
+    return f"P5\n# logo\n{w} {h}\n255\n".encode() + bytes(fn(x, y) for y in range(h) for x in range(w))
+
+
+def test_netpbm_loading():
+    img = load_image(_pgm(3, 2, lambda x, y: x * 100))
+    assert (img.width, img.height, img.pixels) == (3, 2, bytes([0, 100, 200] * 2))
+    assert load_image(b"P6 1 1 255\n" + bytes([255, 0, 0])).pixels == bytes([76])
+    assert load_image(b"P4\n10 1\n" + bytes([0b10000000, 0b01000000])).pixels == bytes([0] + [255] * 8 + [0])
+    with pytest.raises(ValueError):
+        load_image(b"GIF89a")
+
+
+@pytest.mark.parametrize("data", [
+    b"P4\n16 4\n\x00",                 # обрезанный PBM
+    b"P5\n4 4\n255\n\x00\x00",           # обрезанный PGM
+    b"P6 2 2 255\n" + bytes(5),         # обрезанный PPM
+    b"P5\n4 4\n",                       # заголовок без maxval
+    b"P4\n# only a comment",
+    b"P4",
+])
+def test_malformed_netpbm_is_a_value_error(data):
+    with pytest.raises(ValueError):
+        load_image(data)
+
+
+def test_malformed_logo_is_rejected_by_pillow_path():
+    pytest.importorskip("PIL")
+    with pytest.raises(ValueError, match="bad image"):
+        load_image(b"\x89PNG\r\n\x1a\n" + bytes(16))
+
+
+@pytest.mark.parametrize("method", ["floyd", "ordered", "threshold"])
+def test_dither_packs_rows_msb_first(method):
+    black_left = GrayImage(10, 2, bytes(([0] * 5 + [255] * 5) * 2))
+    assert dither(black_left, method) == bytes([0b11111000, 0]) * 2
+
+
+def test_mid_gray_dithers_to_about_half_the_dots():
+    img = GrayImage(64, 64, bytes([128]) * 64 * 64)
+    for method in ("floyd", "ordered"):
+        ones = sum(bin(b).count("1") for b in dither(img, method))
+        assert 0.4 < ones / (64 * 64) < 0.6
+
+
+def test_gs_v0_bands():
+    bits = bytes(range(2 * 5))
+    out = pack_gs_v0(bits, 16, 5, band_rows=4)
+    assert out[:8] == b"\x1dv0\x00\x02\x00\x04\x00" and out[8:16] == bits[:8]
+    assert out[16:24] == b"\x1dv0\x00\x02\x00\x01\x00" and out[24:] == bits[8:]
+
+
+def test_image_is_scaled_to_profile_dots_and_cached_on_disk(tmp_path, monkeypatch):
+    cache = RasterCache(str(tmp_path))
+    logo = _pgm(768, 20, lambda x, y: 0 if x < 384 else 255)
+    data = raster_image(logo, PROFILE_58, cache=cache)
+    assert data[4:8] == bytes([48, 0, 10, 0])  # 384 точки = 48 байт, высота пропорционально
+    assert cache.misses == 1 and len(list(tmp_path.iterdir())) == 1
+
+    monkeypatch.setattr(raster, "dither", lambda *a, **k: pytest.fail("must be served from cache"))
+    assert raster_image(logo, PROFILE_58, cache=cache) == data and cache.hits == 1
+    monkeypatch.undo()
+    assert raster_image(logo, PROFILE_80, cache=cache)[4:6] == bytes([72, 0])  # другой профиль — другой ключ
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: очередь и склейка запусков по принтеру (smartpos_daemon.singleflight).
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from smartpos_daemon.singleflight import PrinterLanes, request_key
+
+
+def test_identical_requests_share_one_execution():
+    lanes = PrinterLanes()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn(emit):
+        calls.append(1)
+        emit({"event": "done", "step": "clear_spooler"})
+        started.set()
+        release.wait(2.0)
+        return {"result_code": "FIXED"}
+
+    key = request_key({"problem_code": "PR0018", "ticket_id": "A"})
+    assert key == request_key({"problem_code": "PR0018", "ticket_id": "B"})
+
+    out = {}
+    seen = []
+    t1 = threading.Thread(target=lambda: out.setdefault("a", lanes.run("P1", key, fn)))
+    t1.start()
+    started.wait(2.0)
+    t2 = threading.Thread(target=lambda: out.setdefault("b", lanes.run("P1", key, fn, on_event=seen.append)))
+    t2.start()
+    time.sleep(0.05)
+    release.set()
+    t1.join(2.0)
+    t2.join(2.0)
+
+    assert len(calls) == 1
+    assert out["a"] == ({"result_code": "FIXED"}, False)
+    assert out["b"] == ({"result_code": "FIXED"}, True)
+    assert seen == [{"event": "done", "step": "clear_spooler"}]  # опоздавшему — повтор событий
+
+
+def test_different_playbooks_on_same_printer_run_in_order():
+    lanes = PrinterLanes()
+    order = []
+    active = []
+
+    def make(name):
+        def fn(emit):
+            active.append(name)
+            assert len(active) == 1, active
+            time.sleep(0.02)
+            order.append(name)
+            active.remove(name)
+            return name
+        return fn
+
+    threads = []
+    for i, code in enumerate(["PR0018", "PR0022", "PR0001"]):
+        t = threading.Thread(target=lanes.run, args=("P1", request_key({"problem_code": code}), make(code)))
+        t.start()
+        threads.append(t)
+        time.sleep(0.005)
+    for t in threads:
+        t.join(2.0)
+    assert order == ["PR0018", "PR0022", "PR0001"]
+    assert lanes.stats()["P1"] == {"waiting": 0, "in_flight": 0, "joined": 0}
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: таблица джобов спулера (smartpos_daemon.spooler_jobs) поверх симулятора.
+"""
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from smartpos_daemon.handles import HandlePool, Win32HandleBackend
+from smartpos_daemon.spooler_jobs import SpoolerJobTable, WinspoolJobSource, decode_job_status
+from smartpos_daemon.waits import wait_until
+from smartpos_daemon.winspool_sim import SpoolerSimulator
+
+POS = "SAM4S ELLIX40"
+
+
+@pytest.fixture()
+def sim_table():
+    sim = SpoolerSimulator(print_sec=0.02)
+    table = SpoolerJobTable(WinspoolJobSource(api=sim, pool=HandlePool(Win32HandleBackend(sim))),
+                            interval=0.02, deleting_after=0.1)
+    try:
+        yield sim, table
+    finally:
+        table.stop()
+
+
+def _open_doc(sim, doc="R"):
+    h = sim.OpenPrinter(POS)
+    job = sim.StartDocPrinter(h, 1, (doc, None, "RAW"))
+    sim.StartPagePrinter(h)
+    sim.WritePrinter(h, b"12345")
+    return h, job
+
+
+def test_deltas_follow_job_lifecycle(sim_table):
+    sim, table = sim_table
+    sim.set_status(POS, paper_out=True)
+    h, job = _open_doc(sim)
+    assert table.job_ids(POS, max_age=0) == [job]
+    sim.EndPagePrinter(h)
+    sim.EndDocPrinter(h)
+    sim.set_status(POS, paper_out=False)
+    assert wait_until(lambda: not table.jobs(POS), 1.0)
+
+    deltas, reset = table.deltas(0, 0)
+    ops = [d["data"]["op"] for d in deltas]
+    assert not reset and ops[0] == "added" and ops[-1] == "removed"
+    assert all(d["data"]["job"]["job_id"] == job for d in deltas)
+
+
+def test_deleting_job_is_marked_stuck(sim_table):
+    sim, table = sim_table
+    h, job = _open_doc(sim, "SMARTPOS_STUCK")
+    sim.SetJob(sim.OpenPrinter(POS), job, 0, None, sim.JOB_CONTROL_DELETE)
+    assert wait_until(lambda: table.snapshot(POS)["stuck"] == [job], 1.0)
+    row = table.jobs(POS)[0]
+    assert "deleting" in row["status_text"] and row["size"] == 5
+    assert "stuck" in [d["data"]["op"] for d in table.deltas(0, 0)[0]]
+
+    sim.EndDocPrinter(h)
+    assert wait_until(lambda: table.snapshot(POS)["count"] == 0, 1.0)
+
+
+def test_fresh_reads_do_not_enumerate_again():
+    sim = SpoolerSimulator()
+    table = SpoolerJobTable(WinspoolJobSource(api=sim, pool=HandlePool(Win32HandleBackend(sim))), interval=5.0)
+    try:
+        table.refresh(POS)
+        base = sim.calls["EnumJobs"]
+        for _ in range(10):
+            table.jobs(POS)
+            table.snapshot(POS)
+        assert sim.calls["EnumJobs"] == base
+        table.invalidate(POS)
+        table.jobs(POS)
+        assert sim.calls["EnumJobs"] == base + 1
+    finally:
+        table.stop()
+
+
+def test_unavailable_spooler_keeps_rows_and_reports_error(sim_table):
+    sim, table = sim_table
+    sim.set_status(POS, paper_out=True)
+    _open_doc(sim)
+    assert len(table.jobs(POS, max_age=0)) == 1
+    sim.inject("EnumJobs", times=1)
+    assert len(table.refresh(POS)) == 1
+    assert table.snapshot(POS)["jobs"] and decode_job_status(0x0104) == ["deleting", "deleted"]
+    time.sleep(0.05)
+    assert table.snapshot(POS)["error"] is None
+
+
+def _table(sim, **kw):
+    return SpoolerJobTable(WinspoolJobSource(api=sim, pool=HandlePool(Win32HandleBackend(sim))), **kw)
+
+
+def test_unknown_printers_get_no_watcher():
+    sim = SpoolerSimulator()
+    table = _table(sim, interval=0.02)
+    try:
+        for i in range(50):
+            snap = table.snapshot(f"NO SUCH PRINTER {i}")
+            assert snap["error"] and snap["count"] == 0
+        assert table.watched() == [] and not table._queues
+        table.jobs(POS)
+        assert table.watched() == [POS]
+    finally:
+        table.stop(timeout=1.0)
+
+
+def test_watchers_are_capped():
+    names = [f"POS-{i}" for i in range(5)]
+    sim = SpoolerSimulator(printers=names)
+    table = _table(sim, interval=0.02, max_watchers=3)
+    try:
+        for name in names:
+            table.jobs(name)
+        assert table.watched() == names[:3]
+        assert not table.watch(names[4])
+    finally:
+        table.stop(timeout=1.0)
+
+
+def test_idle_watcher_leaves_and_pinned_stays():
+    sim = SpoolerSimulator(printers=(POS, "KITCHEN"))
+    table = _table(sim, interval=0.02, idle_after=0.1)
+    try:
+        table.watch(POS, pinned=True)
+        table.jobs("KITCHEN")
+        assert wait_until(lambda: table.watched() == [POS], 1.0)
+        time.sleep(0.15)
+        assert table.watched() == [POS]
+        table.jobs("KITCHEN")  # новый читатель — наблюдатель возвращается
+        assert sorted(table.watched()) == ["KITCHEN", POS]
+    finally:
+        table.stop(timeout=1.0)
+
+
+def test_watcher_leaves_after_sustained_errors():
+    sim = SpoolerSimulator()
+    table = _table(sim, interval=0.01, max_errors=3)
+    try:
+        table.watch(POS, pinned=True)
+        sim.inject("EnumJobs", times=100)
+        assert wait_until(lambda: table.watched() == [], 1.0)
+        assert table.snapshot(POS)["error"]
+    finally:
+        table.stop(timeout=1.0)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: кэш статуса принтера с наблюдателем (smartpos_daemon.status_cache), FakeBackend.
+"""
+from __future__ import annotations
+
+import time
+
+from smartpos_daemon.status_cache import (
+    PRINTER_STATUS_DOOR_OPEN,
+    PRINTER_STATUS_PAPER_OUT,
+    FakeBackend,
+    PrinterStatusCache,
+)
+
+
+def _wait_for(cond, timeout: float = 2.0) -> None:
+    end = time.time() + timeout
+    while not cond():
+        assert time.time() < end, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_reads_are_served_from_cache():
+    be = FakeBackend({"P1": 0})
+    cache = PrinterStatusCache(be, ttl=60.0, poll_interval=5.0)
+    try:
+        first = cache.get("P1")
+        assert first["detected"] is True and first["paper_out"] is False
+        reads = be.reads
+        for _ in range(100):
+            cache.get("P1")
+        assert be.reads == reads
+        assert cache.get("P1")["age_s"] >= 0.0
+    finally:
+        cache.stop()
+
+
+def test_watcher_picks_up_changes_and_notifies():
+    be = FakeBackend({"P1": 0})
+    cache = PrinterStatusCache(be, ttl=60.0, poll_interval=5.0)
+    seen = []
+    cache.subscribe(lambda name, entry: seen.append((name, entry["paper_out"], entry["door_open"])))
+    try:
+        cache.get("P1")
+        be.set_status("P1", PRINTER_STATUS_PAPER_OUT | PRINTER_STATUS_DOOR_OPEN)
+        _wait_for(lambda: cache.get("P1")["paper_out"] is True)
+        assert cache.get("P1")["door_open"] is True
+        assert seen[-1] == ("P1", True, True)
+
+        be.set_status("P1", None)
+        _wait_for(lambda: cache.get("P1")["detected"] is False)
+        assert "not found" in cache.get("P1")["error"]
+    finally:
+        cache.stop()
+
+
+def test_stale_entry_is_refreshed_on_read():
+    be = FakeBackend({"P1": 0})
+    cache = PrinterStatusCache(be, ttl=60.0, poll_interval=5.0)
+    try:
+        cache.get("P1")
+        reads = be.reads
+        cache.get("P1", max_age=0.0)
+        assert be.reads == reads + 1
+        cache.invalidate("P1")
+        cache.get("P1")
+        assert be.reads == reads + 2
+    finally:
+        cache.stop()
+
+
+def test_unknown_printers_are_not_watched_or_kept():
+    be = FakeBackend({"P1": 0})
+    cache = PrinterStatusCache(be, ttl=60.0, poll_interval=0.05)
+    try:
+        for i in range(50):
+            assert cache.get(f"NO SUCH {i}")["detected"] is False
+        assert cache.watched() == [] and not cache._entries
+        cache.get("P1")
+        assert cache.watched() == ["P1"]
+    finally:
+        cache.stop(timeout=1.0)
+
+
+def test_watchers_are_capped():
+    be = FakeBackend({f"P{i}": 0 for i in range(5)})
+    cache = PrinterStatusCache(be, ttl=60.0, poll_interval=0.05, max_watchers=3)
+    try:
+        for i in range(5):
+            assert cache.get(f"P{i}")["detected"] is True
+        assert cache.watched() == ["P0", "P1", "P2"]
+    finally:
+        cache.stop(timeout=1.0)
+
+
+def test_watcher_leaves_without_readers_or_after_errors():
+    be = FakeBackend({"P1": 0, "P2": 0})
+    cache = PrinterStatusCache(be, ttl=60.0, poll_interval=0.01, idle_after=0.1, max_errors=3)
+    try:
+        cache.get("P1")
+        _wait_for(lambda: cache.watched() == [])
+        cache.get("P1")
+        assert cache.watched() == ["P1"]
+
+        cache.idle_after = 60.0
+        cache.get("P2")
+        be.set_status("P2", None)
+        _wait_for(lambda: "P2" not in cache.watched())
+        assert cache.get("P2")["detected"] is False  # запись наблюдавшегося принтера осталась
+    finally:
+        cache.stop(timeout=1.0)
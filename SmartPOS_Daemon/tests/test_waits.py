@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: ожидание «условие или дедлайн» (smartpos_daemon.waits).
+"""
+from __future__ import annotations
+
+import time
+
+from smartpos_daemon.waits import DEADLINE_KEY, Deadline, clamp, wait_until
+
+
+def test_returns_as_soon_as_condition_holds():
+    ready_at = time.monotonic() + 0.05
+    res = wait_until(lambda: time.monotonic() >= ready_at, timeout=2.0)
+    assert res.ok and res
+    assert 0.04 <= res.waited < 0.5
+    assert res.polls >= 2
+
+
+def test_times_out_and_treats_errors_as_not_ready():
+    calls = []
+
+    def pred():
+        calls.append(1)
+        raise OSError("spooler down")
+
+    res = wait_until(pred, timeout=0.1, initial=0.01, max_interval=0.02)
+    assert not res.ok
+    assert 0.09 <= res.waited < 0.5
+    assert len(calls) == res.polls > 3
+
+
+def test_absolute_deadline_caps_timeout():
+    res = wait_until(lambda: False, timeout=5.0, deadline=time.monotonic() + 0.05)
+    assert not res.ok and res.waited < 0.5
+
+
+def test_value_is_returned():
+    res = wait_until(lambda: {"state": 4}, timeout=0.1)
+    assert res.value == {"state": 4} and res.polls == 1
+
+
+def test_deadline_clamps_request_waits():
+    dl = Deadline(0.2)
+    assert 0.0 < dl.remaining() <= 0.2 and not dl.expired()
+    assert clamp({DEADLINE_KEY: dl}, 5.0) <= 0.2
+    assert clamp({}, 5.0) == 5.0
+    res = wait_until(lambda: False, timeout=5.0, deadline=dl.at)
+    assert not res.ok and dl.expired() and clamp({DEADLINE_KEY: dl}, 5.0) == 0.0
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Unit-тест: симулятор спулера (smartpos_daemon.winspool_sim) и прогон плейбуков
+run_daemon.py целиком поверх него (smartpos_daemon.winapi.use_simulator).
+"""
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from smartpos_daemon.status_cache import PRINTER_STATUS_PAPER_OUT
+from smartpos_daemon.waits import wait_until
+from smartpos_daemon.winspool_sim import JOB_STATUS_DELETING, SimError, SpoolerSimulator
+
+POS = "SAM4S ELLIX40"
+
+
+def _print(sim, doc="R", data=b"x", end=True):
+    h = sim.OpenPrinter(POS)
+    job = sim.StartDocPrinter(h, 1, (doc, None, "RAW"))
+    sim.StartPagePrinter(h)
+    sim.WritePrinter(h, data)
+    sim.EndPagePrinter(h)
+    if end:
+        sim.EndDocPrinter(h)
+    return h, job
+
+
+def test_closed_jobs_print_in_order_unless_paper_is_out():
+    sim = SpoolerSimulator(print_sec=0.02)
+    sim.set_status(POS, paper_out=True)
+    for doc in ("a", "b"):
+        sim.ClosePrinter(_print(sim, doc)[0])
+    time.sleep(0.05)
+    assert [j["pDocument"] for j in sim.jobs(POS)] == ["a", "b"] and not sim.printed[POS]
+    h = sim.OpenPrinter(POS)
+    assert sim.GetPrinter(h, 2)["Status"] & PRINTER_STATUS_PAPER_OUT
+
+    sim.set_status(POS, paper_out=False)
+    assert wait_until(lambda: not sim.jobs(POS), 1.0)
+    assert [d for d, _ in sim.printed[POS]] == ["a", "b"]
+
+
+def test_sticky_job_stays_deleting_until_document_is_closed():
+    sim = SpoolerSimulator()
+    h, job = _print(sim, "SMARTPOS_STUCK", end=False)
+    admin = sim.OpenPrinter(POS)
+    sim.SetJob(admin, job, 0, None, sim.JOB_CONTROL_DELETE)
+    jobs = sim.EnumJobs(admin, 0, 999, 1)
+    assert len(jobs) == 1 and jobs[0]["Status"] & JOB_STATUS_DELETING
+    sim.EndDocPrinter(h)
+    assert sim.EnumJobs(admin, 0, 999, 1) == []
+
+
+def test_spooler_restart_invalidates_handles_and_drops_open_documents():
+    sim = SpoolerSimulator(stop_sec=0.01, start_sec=0.01)
+    h, _ = _print(sim, end=False)
+    sim.win32serviceutil.RestartService("Spooler")
+    with pytest.raises(SimError) as e:  # START_PENDING → RPC недоступен
+        sim.EnumJobs(h, 0, 999, 1)
+    assert e.value.winerror == 1722
+    assert wait_until(lambda: sim.service_state() == sim.win32service.SERVICE_RUNNING, 1.0)
+    with pytest.raises(SimError, match="handle is invalid"):
+        sim.EnumJobs(h, 0, 999, 1)
+    assert sim.jobs(POS) == []
+
+
+def test_latency_and_failure_injection():
+    sim = SpoolerSimulator(latency={"OpenPrinter": 0.03})
+    t0 = time.monotonic()
+    h = sim.OpenPrinter(POS)
+    assert time.monotonic() - t0 >= 0.03
+    sim.inject("EnumJobs", times=2)
+    for _ in range(2):
+        with pytest.raises(SimError):
+            sim.EnumJobs(h, 0, 999, 1)
+    assert sim.EnumJobs(h, 0, 999, 1) == []
+    assert sim.calls["EnumJobs"] == 3
+
+    sim.unplug(POS)
+    with pytest.raises(SimError, match="printer name is invalid"):
+        sim.OpenPrinter(POS)
+    flaky = SpoolerSimulator(fail_rate=1.0, seed=1)
+    with pytest.raises(SimError):
+        flaky.GetDefaultPrinter()
+
+
+@pytest.fixture()
+def daemon_on_sim(spooler_sim):
+    import run_daemon
+    from smartpos_daemon.profiles import ProfileRegistry, Win32ProfileDetector
+
+    # реестр в памяти, без data/printer_profiles.json
+    sim = spooler_sim(registry=ProfileRegistry(detector=Win32ProfileDetector()),
+                      print_sec=0.01, stop_sec=0.01, start_sec=0.01)
+    run_daemon.cfg_update(cancel_delay_sec=0.0)
+    try:
+        yield run_daemon, sim
+    finally:
+        run_daemon.cfg_update(cancel_delay_sec=0.5)
+
+
+def test_playbooks_run_end_to_end_on_simulator(daemon_on_sim):
+    rd, sim = daemon_on_sim
+    assert rd.make_sticky_job()["ok"]
+    assert wait_until(lambda: sim.jobs(POS), 1.0)
+
+    res = rd.run_playbook_serialized({"ticket_id": "t1", "problem_code": "PR0018"})
+    assert res["result_code"] == "FIXED"
+    assert res["actions_done"] == ["sticky_cancel", "print_queue_clear", "spooler_restart", "test_print_layout"]
+    assert res["evidence"]["running"] is True
+    assert wait_until(lambda: not sim.jobs(POS), 1.0)
+    assert [d for d, _ in sim.printed[POS]] == ["SMARTPOS_LAYOUT"]
+
+    sim.unplug(POS)
+    res = rd.run_playbook_serialized({"ticket_id": "t2", "problem_code": "PR0022"})
+    assert res["result_code"] == "NOT_FOUND"
+
+
+_JSON_TYPES = {"string": str, "number": (int, float), "integer": int, "boolean": bool,
+               "array": list, "object": dict, "null": type(None)}
+
+
+def _check_schema(value, schema, path="$"):
+    """Подмножество JSON Schema, которым пользуются schemas/*.json (jsonschema не нужен)."""
+    types = schema.get("type")
+    if types:
+        types = [types] if isinstance(types, str) else types
+        assert any(isinstance(value, _JSON_TYPES[t]) and not (t != "boolean" and isinstance(value, bool))
+                   for t in types), (path, value)
+    if "enum" in schema:
+        assert value in schema["enum"], (path, value)
+    if isinstance(value, dict):
+        props = schema.get("properties", {})
+        assert not set(schema.get("required", ())) - set(value), (path, sorted(value))
+        if schema.get("additionalProperties") is False:
+            assert not set(value) - set(props), (path, sorted(set(value) - set(props)))
+        for key, sub in props.items():
+            if key in value:
+                _check_schema(value[key], sub, f"{path}.{key}")
+    if isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            _check_schema(item, schema["items"], f"{path}[{i}]")
+
+
+def test_playbook_responses_match_schema(daemon_on_sim):
+    import json
+    import os
+
+    from smartpos_daemon.waits import Deadline
+
+    rd, sim = daemon_on_sim
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "schemas", "action_run_response.json")
+    with open(path, encoding="utf-8") as f:
+        schema = json.load(f)
+
+    req = {"ticket_id": "schema-1", "problem_code": "PR0018"}
+    fixed = rd.run_playbook_serialized(dict(req))
+    replayed = rd.run_playbook_serialized(dict(req))
+    timeout = rd.run_playbook_serialized({"ticket_id": "schema-2", "problem_code": "PR0018",
+                                          rd.DEADLINE_KEY: Deadline(0.0)})
+    assert fixed["timings"] and replayed["replayed"] and timeout["result_code"] == "TIMEOUT"
+    for res in (fixed, replayed, timeout):
+        _check_schema(res, schema)